@@ -0,0 +1,77 @@
+"""
+Measure the start-up time of the package (import and first pipeline classification) in fresh interpreters.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5]
+
+Exits with a non-zero status if any scenario exceeds its time budget, so it can guard against heavy module level imports.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scenario name, code to time, budget in seconds
+SCENARIOS = [
+    ('import src', "import src", 0.2),
+    ('import src.utils.utils', "import src.utils.utils", 0.2),
+    ('pipeline classification', "from src.PipelineClassifier import PipelineClassifier\n"
+                                "PipelineClassifier().classify('CREATE TABLE users (id INT PRIMARY KEY, name VARCHAR(50))')\n"
+                                "PipelineClassifier().classify('a relational database for a hospital with patients and visits')", 0.9),
+    ('import DataGenerationPipeline', "from src.DataGenerationPipeline import DataGenerationPipeline", 3.0),
+]
+
+TIMER_TEMPLATE = """
+import sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+heavy_modules = [name for name in ['pandas', 'langchain.chains'] if name in sys.modules]
+print(elapsed, ','.join(heavy_modules))
+"""
+
+
+def time_scenario(code, runs):
+    """
+    Time a code snippet in fresh interpreters.
+
+    Parameters:
+    - code (str): The code to time.
+    - runs (int): Number of runs.
+
+    Returns:
+    tuple: The median time in seconds, and the heavy modules loaded by the code.
+    """
+    times = []
+    heavy_modules = ''
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', TIMER_TEMPLATE.format(code=code)], cwd=REPOSITORY_PATH,
+                                capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+        elapsed, _, heavy_modules = output.partition(' ')
+        times.append(float(elapsed))
+    return statistics.median(times), heavy_modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs per scenario (the median is reported).')
+    args = parser.parse_args()
+
+    exceeded = []
+    print(f"{'scenario':<32}{'median (s)':>12}{'budget (s)':>12}  heavy modules loaded")
+    for name, code, budget in SCENARIOS:
+        median_time, heavy_modules = time_scenario(code, args.runs)
+        print(f"{name:<32}{median_time:>12.3f}{budget:>12.3f}  {heavy_modules or '-'}")
+        if median_time > budget:
+            exceeded.append(name)
+
+    if len(exceeded) > 0:
+        print(f"Exceeded the time budget: {exceeded}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
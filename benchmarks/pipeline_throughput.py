@@ -0,0 +1,143 @@
+"""
+Measure the throughput and scaling of the pipelines against a simulated language model backend (see SimulatedLLM), so
+runs are offline, free and reproducible.
+
+Usage:
+    python benchmarks/pipeline_throughput.py [--sizes 100 1000] [--latency 0.5] [--tokens-per-second 100]
+                                             [--rate-limit-rate 0] [--timeout-rate 0] [--malformed-rate 0] [--seed 0]
+                                             [--backends 1] [--max-concurrent-requests N] [--hedge-percentile P]
+
+Each scenario is run per size, and reports the wall time, the records per second, the number of LLM calls, the
+injected failures and the circuit breaker openings. Use --time-scale 0 to skip the simulated waiting (the simulated LLM
+time is still reported). With --backends N the calls are spread over N simulated backends (see LLMRouter), each
+accepting at most --max-concurrent-requests calls at once, to measure how the throughput scales with the backends.
+With --hedge-percentile the slow requests of the parallel rounds are hedged (see RequestHedger), and the duplicate
+requests and the estimated tail latency they saved are reported.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_PATH)
+
+from src.Pipeline import Pipeline
+from src.SimulatedLLM import SimulatedLLM
+from src.LLMRouter import LLMRouter
+from src.RequestHedger import RequestHedger
+from src.RetryPolicy import RetryPolicy, CircuitBreaker
+
+
+def run_code_pipeline(llm, num_records, retry_policy, request_hedger, enhancement_mode):
+    from src.DataGenerationPipeline import DataGenerationPipeline
+    pipeline = DataGenerationPipeline(llm, pipeline_name=Pipeline.DescriptionToDB, retry_policy=retry_policy, request_hedger=request_hedger)
+    pipeline.extract_sample_data("An online shop database with customers and orders", pipelineName=Pipeline.DescriptionToDB)
+    tables = pipeline.generate_data(tables_size_dict={'customers': max(num_records // 4, 1), 'orders': num_records},
+                                    enhancement_mode=enhancement_mode, seed=0)
+    return sum(len(table) for table in tables.values())
+
+
+def run_specification_pipeline(llm, num_records, retry_policy, request_hedger):
+    from src.DataGenerationPipeline import DataGenerationPipeline
+    pipeline = DataGenerationPipeline(llm, pipeline_name=Pipeline.DescriptionToDB, retry_policy=retry_policy, request_hedger=request_hedger)
+    pipeline.extract_sample_data("An online shop database with customers and orders", pipelineName=Pipeline.DescriptionToDB)
+    tables = pipeline.generate_data(tables_size_dict={'customers': max(num_records // 4, 1), 'orders': num_records},
+                                    enhancement_mode='pool', generation_engine='specification', seed=0)
+    return sum(len(table) for table in tables.values())
+
+
+def run_augmentor(llm, num_records, retry_policy, request_hedger, run_in_parallel):
+    from src.DataGenerationPipeline import DataGenerationPipeline
+    pipeline = DataGenerationPipeline(llm, pipeline_name=Pipeline.DescriptionToMLDataset, retry_policy=retry_policy, request_hedger=request_hedger)
+    pipeline.extract_sample_data("A dataset for predicting customer churn", pipelineName=Pipeline.DescriptionToMLDataset)
+    tables = pipeline.generate_data(num_records=num_records, run_in_parallel=run_in_parallel)
+    return sum(len(table) for table in tables.values())
+
+
+def run_transformer(llm, num_records, retry_policy, request_hedger, run_in_parallel):
+    import pandas as pd
+    from src.DataTransformer import DataTransformer
+    source_data = pd.DataFrame({'id': range(num_records), 'name': [f"name {i}" for i in range(num_records)], 'summary': [''] * num_records})
+    transformer = DataTransformer(llm=llm, retry_policy=retry_policy, request_hedger=request_hedger)
+    transformer.define_transformation(source_data={'people': source_data}, description="Write a short summary of each person")
+    if run_in_parallel:
+        transformed_data = asyncio.run(transformer.transform_in_parallel(source_data=source_data, output_format=2))
+    else:
+        transformed_data = transformer.transform(source_data=source_data, output_format=2)
+    return len(transformed_data)
+
+
+SCENARIOS = [
+    ('code generation + rewrite', lambda llm, size, retry_policy, request_hedger: run_code_pipeline(llm, size, retry_policy, request_hedger, 'rewrite')),
+    ('code generation + pool', lambda llm, size, retry_policy, request_hedger: run_code_pipeline(llm, size, retry_policy, request_hedger, 'pool')),
+    ('specification sampler + pool', run_specification_pipeline),
+    ('augmentor (parallel)', lambda llm, size, retry_policy, request_hedger: run_augmentor(llm, size, retry_policy, request_hedger, True)),
+    ('augmentor (sequential)', lambda llm, size, retry_policy, request_hedger: run_augmentor(llm, size, retry_policy, request_hedger, False)),
+    ('transformer (parallel)', lambda llm, size, retry_policy, request_hedger: run_transformer(llm, size, retry_policy, request_hedger, True)),
+    ('transformer (sequential)', lambda llm, size, retry_policy, request_hedger: run_transformer(llm, size, retry_policy, request_hedger, False)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help='Numbers of records to generate.')
+    parser.add_argument('--scenarios', nargs='+', default=None, help='Names of the scenarios to run (default: all).')
+    parser.add_argument('--latency', type=float, default=0.5, help='Mean time to the first token, in seconds.')
+    parser.add_argument('--latency-std', type=float, default=0.2, help='Standard deviation of the time to the first token.')
+    parser.add_argument('--tokens-per-second', type=float, default=100.0, help='Output token throughput.')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of calls failing with a rate limit error.')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fraction of calls failing with a timeout.')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='Fraction of truncated outputs.')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiplier of the simulated waiting times.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the simulated backend.')
+    parser.add_argument('--backends', type=int, default=1, help='Number of simulated backends the calls are spread over.')
+    parser.add_argument('--max-concurrent-requests', type=int, default=None,
+                        help='Maximum number of concurrent calls per backend (further calls fail with a rate limit error).')
+    parser.add_argument('--hedge-percentile', type=float, default=None,
+                        help='Latency percentile after which a parallel request is hedged (default: no hedging).')
+    args = parser.parse_args()
+
+    print(f"{'scenario':<32}{'records':>9}{'wall (s)':>10}{'records/s':>11}{'LLM calls':>11}{'LLM time (s)':>14}{'failures':>10}{'breaker':>9}{'hedges':>8}{'saved (s)':>11}")
+    for name, run in SCENARIOS:
+        if (args.scenarios is not None) and (name not in args.scenarios):
+            continue
+        for size in args.sizes:
+            backends = [SimulatedLLM(latency_mean_seconds=args.latency, latency_std_seconds=args.latency_std,
+                                     tokens_per_second=args.tokens_per_second, rate_limit_rate=args.rate_limit_rate,
+                                     timeout_rate=args.timeout_rate, malformed_rate=args.malformed_rate,
+                                     max_concurrent_requests=args.max_concurrent_requests, time_scale=args.time_scale,
+                                     seed=args.seed + index)
+                        for index in range(args.backends)]
+            # The router queues the calls beyond the backends' concurrency limit instead of sending them to fail
+            llm = LLMRouter(backends=backends, max_concurrency=args.max_concurrent_requests) \
+                if (len(backends) > 1) or (args.max_concurrent_requests is not None) else backends[0]
+            # The backoff and circuit breaker waits are scaled like the simulated waits
+            retry_policy = RetryPolicy(base_delay_seconds=args.time_scale, seed=args.seed,
+                                       circuit_breaker=CircuitBreaker(cooldown_seconds=30 * args.time_scale, verbose=False))
+            request_hedger = RequestHedger(percentile=args.hedge_percentile) if args.hedge_percentile is not None else None
+            start = time.perf_counter()
+            try:
+                # The components report their progress verbosely, so their output is hidden
+                with contextlib.redirect_stdout(io.StringIO()):
+                    num_records = run(llm, size, retry_policy, request_hedger)
+            except Exception as ex:
+                print(f"{name:<32} failed for size {size}: {ex}")
+                continue
+            elapsed = time.perf_counter() - start
+            hedge_metrics = request_hedger.get_metrics() if request_hedger is not None else {}
+            metrics = {}
+            for backend in backends:
+                for key, value in backend.get_metrics().items():
+                    metrics[key] = metrics.get(key, 0) + value
+            failures = metrics.get('rate_limit_errors', 0) + metrics.get('timeout_errors', 0) + metrics.get('malformed_outputs', 0)
+            print(f"{name:<32}{num_records:>9}{elapsed:>10.2f}{num_records / elapsed:>11.1f}{metrics.get('calls', 0):>11}"
+                  f"{metrics.get('simulated_seconds', 0.0):>14.1f}{failures:>10}{retry_policy.circuit_breaker.metrics['openings']:>9}"
+                  f"{hedge_metrics.get('hedges', 0):>8}{hedge_metrics.get('saved_seconds', 0.0):>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure the extraction of example rows from a large CSV file, as done for the schema extraction prompts.
+
+Usage:
+    python benchmarks/sampling.py [--rows 1000000] [--samples 5] [--runs 3]
+
+The 'before' scenario repeats the previous code path (the whole file read with pandas.read_csv, then sampled), and the
+other scenarios use sampling.sample_csv with each method. The median time and the peak memory allocated by Python are
+reported.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_PATH)
+
+import numpy as np
+import pandas as pd
+from src.utils.sampling import sample_csv
+
+
+def create_csv(file_path, num_rows, seed=0):
+    """
+    Create a CSV file of orders, with numeric, text and datetime fields.
+    """
+    rng = np.random.default_rng(seed)
+    chunk_size = 100000
+    for start in range(0, num_rows, chunk_size):
+        size = min(chunk_size, num_rows - start)
+        pd.DataFrame({'order_id': np.arange(start, start + size), 'customer_id': rng.integers(0, num_rows // 10 + 1, size),
+                      'amount': rng.random(size).round(2), 'status': rng.choice(['new', 'paid', 'shipped'], size),
+                      'created_at': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 7, size), unit='s')}
+                     ).to_csv(file_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def sample_before(file_path, num_samples):
+    return pd.read_csv(file_path).sample(n=num_samples)
+
+
+def measure(function, runs):
+    times = []
+    peak = 0
+    for _ in range(runs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(times), peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of rows of the CSV file.')
+    parser.add_argument('--samples', type=int, default=5, help='Number of rows to sample.')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs per scenario (the median is reported).')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'orders.csv')
+        create_csv(file_path, args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(file_path) / 2 ** 20:.1f} MB")
+        print(f"{'scenario':<12}{'time (s)':>10}{'peak memory (MB)':>18}")
+        scenarios = [('before', lambda: sample_before(file_path, args.samples)),
+                     ('reservoir', lambda: sample_csv(file_path, args.samples, method='reservoir')),
+                     ('seek', lambda: sample_csv(file_path, args.samples, method='seek'))]
+        for name, function in scenarios:
+            elapsed, peak = measure(function, args.runs)
+            print(f"{name:<12}{elapsed:>10.3f}{peak:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Measure the per-batch serialization overhead of the data generation rounds: parsing a language model output into
+DataFrames, and writing the generated tables as a JSON string and as a JSON object.
+
+Usage:
+    python benchmarks/serialization.py [--records 10 100] [--columns 12] [--tables 2] [--runs 200]
+
+The 'before' scenarios repeat the previous code path (the output decoded three times, the DataFrames built record by
+record, and the tables concatenated into a string and parsed again for the JSON output), and the 'after' scenarios use
+the current one with each JSON backend (see json_backend). The median time per batch is reported, in milliseconds.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_PATH)
+
+import pandas as pd
+from src.utils import json_backend
+from src.utils.utils import try_parse_json, sample_str_to_dataframes_dict, dataframes_dict_to_string, dataframes_dict_to_json
+
+
+def create_batch(num_records, num_columns, num_tables, seed=0):
+    """
+    Create the output of a generated batch: a JSON object of tables, with numeric, text and boolean fields.
+    """
+    rng = random.Random(seed)
+    tables = {}
+    for table_index in range(num_tables):
+        records = []
+        for record_index in range(num_records):
+            record = {'id': record_index}
+            for column_index in range(num_columns - 1):
+                kind = column_index % 3
+                value = rng.randint(0, 10 ** 6) if kind == 0 else f"text value {rng.random():.6f}" if kind == 1 else rng.random() < 0.5
+                record[f"field_{column_index}"] = value
+            records.append(record)
+        tables[f"table_{table_index}"] = records
+    return json.dumps(tables)
+
+
+def parse_before(output):
+    # try_parse_json, then sample_str_to_dataframes_dict calling try_parse_json and does_sample_contain_keys
+    sample = try_parse_json(output)
+    json_data = json.loads(try_parse_json(sample))
+    json.loads(try_parse_json(sample))
+    return {key: pd.DataFrame.from_dict(items) for key, items in json_data.items()}
+
+
+def write_string_before(tables):
+    results = ''
+    for key, items in tables.items():
+        results = results + f'{{,"{key}": {items.to_json(orient="records")}}}'[1:-1]
+    return '{' + results[1:] + '}'
+
+
+def write_json_before(tables):
+    return json.loads(write_string_before(tables))
+
+
+def time_function(function, argument, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+', default=[10, 100], help='Numbers of records per table of a batch.')
+    parser.add_argument('--columns', type=int, default=12, help='Number of fields per record.')
+    parser.add_argument('--tables', type=int, default=2, help='Number of tables per batch.')
+    parser.add_argument('--runs', type=int, default=200, help='Number of runs per scenario (the median is reported).')
+    args = parser.parse_args()
+
+    backends = ['json']
+    try:
+        json_backend.set_json_backend('orjson')
+        backends.insert(0, 'orjson')
+    except ImportError:
+        print("orjson is not installed, only the standard library backend is measured.")
+
+    print(f"{'records':>8}  {'scenario':<20}{'parse (ms)':>12}{'string (ms)':>13}{'json (ms)':>11}")
+    for num_records in args.records:
+        output = create_batch(num_records, args.columns, args.tables)
+        tables = parse_before(output)
+        json_backend.set_json_backend('json')
+        results = [('before', time_function(parse_before, output, args.runs), time_function(write_string_before, tables, args.runs),
+                    time_function(write_json_before, tables, args.runs))]
+        for backend in backends:
+            json_backend.set_json_backend(backend)
+            results.append((f'after ({backend})', time_function(sample_str_to_dataframes_dict, output, args.runs),
+                            time_function(dataframes_dict_to_string, tables, args.runs),
+                            time_function(dataframes_dict_to_json, tables, args.runs)))
+        for name, parse_time, string_time, json_time in results:
+            print(f"{num_records:>8}  {name:<20}{parse_time:>12.3f}{string_time:>13.3f}{json_time:>11.3f}")
+    json_backend.set_json_backend()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import json
+import math
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from src.LLMTelemetry import get_token_usage
+from src.utils.utils import with_callback
+
+
+# Approximate number of tokens of the prompt templates of each stage (without the task description and the data)
+PROMPT_OVERHEAD_TOKENS = {'specification': 600, 'structured_specification': 450, 'schema': 550, 'code': 1250,
+                          'augmentation': 170, 'transformation': 150, 'value_pool': 130}
+# Approximate number of output tokens per column of the generated schema, for the code and specification stages
+OUTPUT_TOKENS_PER_COLUMN = {'code': 60, 'structured_specification': 40}
+# Default planning assumptions: the time to the first token of a call, the output token throughput, and the number of
+# tokens of a generated free text value
+DEFAULT_LATENCY_SECONDS = 2.0
+DEFAULT_TOKENS_PER_SECOND = 50
+DEFAULT_FREE_TEXT_TOKENS = 25
+
+
+class BudgetExceededError(Exception):
+    """
+    Raised when a language model call would exceed a budget cap (see BudgetGovernor).
+    """
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text (about 4 characters per token).
+
+    Parameters:
+    - text (str): The text.
+
+    Returns:
+    int: The estimated number of tokens.
+    """
+    return len(str(text)) // 4 + 1
+
+
+def estimate_record_tokens(table, max_records=20):
+    """
+    Estimate the number of tokens of a single record of a table, serialized as JSON.
+
+    Parameters:
+    - table (DataFrame): The table (or a sample of it).
+    - max_records (int, optional): Maximum number of records used for the estimate. Defaults to 20.
+
+    Returns:
+    int: The estimated number of tokens per record.
+    """
+    if len(table) == 0:
+        return estimate_tokens(json.dumps({column: '' for column in table.columns}))
+    sample = table.head(max_records).to_json(orient='records', date_format='iso')
+    return math.ceil(estimate_tokens(sample) / min(len(table), max_records))
+
+
+def guess_free_text_fields(table, min_words=3):
+    """
+    Guess the free text fields of a sample table: textual fields whose values have a few words on average.
+
+    Parameters:
+    - table (DataFrame): The sample table.
+    - min_words (float, optional): The minimal mean number of words of a free text field. Defaults to 3.
+
+    Returns:
+    list: The names of the free text fields.
+    """
+    fields_list = []
+    for field in table.columns:
+        values = table[field].dropna()
+        if (len(values) == 0) or (not all(isinstance(value, str) for value in values)):
+            continue
+        if values.str.split().str.len().mean() >= min_words:
+            fields_list.append(field)
+    return fields_list
+
+
+def create_plan_step(stage, calls, input_tokens, output_tokens, concurrency=1):
+    """
+    Create a step of a generation plan: a group of language model calls of the same stage.
+
+    Parameters:
+    - stage (str): The stage of the calls.
+    - calls (int): The number of calls.
+    - input_tokens (int): The estimated input tokens of a single call.
+    - output_tokens (int): The estimated output tokens of a single call.
+    - concurrency (int, optional): The number of calls sent concurrently. Defaults to 1.
+
+    Returns:
+    dict: The step.
+    """
+    return {'stage': stage, 'calls': int(calls), 'input_tokens': int(calls * input_tokens), 'output_tokens': int(calls * output_tokens),
+            'concurrency': max(int(concurrency), 1)}
+
+
+def plan_enhancement_steps(tables_dict, table_sizes, free_text_fields_dict, description='', enhancement_mode='rewrite', pool_size=50,
+                           run_in_parallel=True, batch_size=10, free_text_tokens=DEFAULT_FREE_TEXT_TOKENS):
+    """
+    Plan the language model calls that generate the free text fields of the tables (see CodeTransformer.enhance_tables_with_transformer).
+
+    Parameters:
+    - tables_dict (dict): Pairs of table name (key) and a sample of the table (value), used for estimating the record sizes.
+    - table_sizes (dict): Pairs of table name (key) and number of records (value).
+    - free_text_fields_dict (dict): Pairs of table name (key) and list of free text fields (value).
+    - description (str, optional): The description of the task, sent with every call. Defaults to ''.
+    - enhancement_mode (str, optional): 'rewrite' or 'pool'. Defaults to 'rewrite'.
+    - pool_size (int, optional): Number of values per pool in 'pool' mode. Defaults to 50.
+    - run_in_parallel (bool, optional): Whether the batches of a table are sent concurrently in 'rewrite' mode. Defaults to True.
+    - batch_size (int, optional): Number of records per call in 'rewrite' mode. Defaults to 10.
+    - free_text_tokens (int, optional): The estimated tokens of a generated free text value. Defaults to DEFAULT_FREE_TEXT_TOKENS.
+
+    Returns:
+    list: The plan steps, one per enhanced table.
+    """
+    description_tokens = estimate_tokens(description)
+    steps = []
+    for table_name, fields_list in free_text_fields_dict.items():
+        num_records = int(table_sizes.get(table_name, 0))
+        if (len(fields_list) == 0) or (num_records == 0):
+            continue
+        if enhancement_mode == 'pool':
+            values = min(pool_size, num_records)
+            steps.append(create_plan_step('enhancement', len(fields_list), PROMPT_OVERHEAD_TOKENS['value_pool'] + description_tokens,
+                                          values * free_text_tokens, concurrency=len(fields_list)))
+            continue
+        # The records are sent with their context fields (the whole sample record is an upper bound)
+        record_tokens = estimate_record_tokens(tables_dict[table_name]) if table_name in tables_dict else 10 * len(fields_list)
+        calls = math.ceil(num_records / batch_size)
+        records_per_call = min(batch_size, num_records)
+        input_tokens = PROMPT_OVERHEAD_TOKENS['transformation'] + 2 * description_tokens + records_per_call * record_tokens
+        output_tokens = records_per_call * (record_tokens + len(fields_list) * free_text_tokens)
+        steps.append(create_plan_step('enhancement', calls, input_tokens, output_tokens, concurrency=calls if run_in_parallel else 1))
+    return steps
+
+
+def summarize_plan(steps, latency_seconds=None, tokens_per_second=None, max_concurrency=None, budget_governor=None):
+    """
+    Summarize the steps of a generation plan. The steps run one after the other, and the calls of a step run in rounds of
+    concurrent calls, each taking the time to the first token and the time to generate the output of a call.
+
+    Parameters:
+    - steps (list): The plan steps (see create_plan_step).
+    - latency_seconds (float, optional): The time to the first token of a call. Defaults to DEFAULT_LATENCY_SECONDS.
+    - tokens_per_second (float, optional): The output token throughput of a call. Defaults to DEFAULT_TOKENS_PER_SECOND.
+    - max_concurrency (int, optional): Maximum number of concurrent calls (e.g. the provider's limit). Defaults to None (unlimited).
+    - budget_governor (BudgetGovernor, optional): A budget governor whose token prices are used for the estimated cost. Defaults to None.
+
+    Returns:
+    dict: The plan: the total number of calls, input, output and total tokens, the estimated wall time in seconds and cost,
+    and the steps.
+    """
+    latency_seconds = DEFAULT_LATENCY_SECONDS if latency_seconds is None else latency_seconds
+    tokens_per_second = DEFAULT_TOKENS_PER_SECOND if tokens_per_second is None else tokens_per_second
+    estimated_seconds = 0.0
+    for step in steps:
+        if step['calls'] == 0:
+            continue
+        concurrency = step['concurrency'] if max_concurrency is None else min(step['concurrency'], max_concurrency)
+        rounds = math.ceil(step['calls'] / concurrency)
+        estimated_seconds += rounds * (latency_seconds + step['output_tokens'] / step['calls'] / tokens_per_second)
+
+    plan = {'calls': sum(step['calls'] for step in steps),
+            'input_tokens': sum(step['input_tokens'] for step in steps),
+            'output_tokens': sum(step['output_tokens'] for step in steps)}
+    plan['total_tokens'] = plan['input_tokens'] + plan['output_tokens']
+    plan['estimated_seconds'] = round(estimated_seconds, 1)
+    plan['estimated_cost'] = budget_governor.get_cost(plan['input_tokens'], plan['output_tokens']) if budget_governor is not None else None
+    plan['steps'] = steps
+    return plan
+
+
+class BudgetGovernor(BaseCallbackHandler):
+    """
+    A callback handler that enforces hard caps on the number of language model requests, the input, output and total
+    tokens, and the cost of a run. A call that would exceed a cap is rejected before it is sent, with a BudgetExceededError,
+    and the components stop gracefully, returning the data generated so far.
+    """
+
+    # Raise the errors of the handler, so a rejected call is not sent
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, max_requests=None, max_input_tokens=None, max_output_tokens=None, max_total_tokens=None, max_cost=None,
+                 input_cost_per_1k_tokens=0.0, output_cost_per_1k_tokens=0.0):
+        """
+        Initializes a new instance of the BudgetGovernor class. All the caps are optional (None means no cap).
+
+        Parameters:
+        - max_requests (int, optional): Maximum number of language model requests.
+        - max_input_tokens (int, optional): Maximum number of input tokens.
+        - max_output_tokens (int, optional): Maximum number of output tokens.
+        - max_total_tokens (int, optional): Maximum number of input and output tokens.
+        - max_cost (float, optional): Maximum cost, in the currency of the token prices.
+        - input_cost_per_1k_tokens (float, optional): The price of 1000 input tokens. Defaults to 0.
+        - output_cost_per_1k_tokens (float, optional): The price of 1000 output tokens. Defaults to 0.
+        """
+        self.max_requests = max_requests
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_total_tokens = max_total_tokens
+        self.max_cost = max_cost
+        self.input_cost_per_1k_tokens = input_cost_per_1k_tokens
+        self.output_cost_per_1k_tokens = output_cost_per_1k_tokens
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the usage, so the caps apply to a new run.
+        """
+        with self.lock:
+            self.usage = {'requests': 0, 'rejected_requests': 0, 'input_tokens': 0, 'output_tokens': 0}
+            self.pending_input_tokens = {}
+
+    def get_cost(self, input_tokens, output_tokens):
+        """
+        Compute the cost of the given tokens.
+
+        Parameters:
+        - input_tokens (int): The number of input tokens.
+        - output_tokens (int): The number of output tokens.
+
+        Returns:
+        float: The cost.
+        """
+        return (input_tokens * self.input_cost_per_1k_tokens + output_tokens * self.output_cost_per_1k_tokens) / 1000
+
+    def get_usage(self):
+        """
+        Get the usage of the run.
+
+        Returns:
+        dict: The numbers of requests (sent and rejected), input, output and total tokens, and the cost.
+        """
+        with self.lock:
+            usage = dict(self.usage)
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        usage['cost'] = self.get_cost(usage['input_tokens'], usage['output_tokens'])
+        return usage
+
+    def get_violations(self, requests, input_tokens, output_tokens):
+        """
+        Get the caps exceeded by the given usage.
+
+        Parameters:
+        - requests (int): The number of requests.
+        - input_tokens (int): The number of input tokens.
+        - output_tokens (int): The number of output tokens.
+
+        Returns:
+        list: Descriptions of the exceeded caps (empty if the usage is within the budget).
+        """
+        cost = self.get_cost(input_tokens, output_tokens)
+        checks = [('requests', requests, self.max_requests), ('input tokens', input_tokens, self.max_input_tokens),
+                  ('output tokens', output_tokens, self.max_output_tokens),
+                  ('total tokens', input_tokens + output_tokens, self.max_total_tokens), ('cost', cost, self.max_cost)]
+        return [f"{name}: {value:g} > {cap:g}" for name, value, cap in checks if (cap is not None) and (value > cap)]
+
+    def check_plan(self, plan):
+        """
+        Check whether a generation plan (see summarize_plan) fits in the remaining budget. The output of the calls is not
+        known before they are sent, so the output caps are checked with the estimated output tokens.
+
+        Parameters:
+        - plan (dict): The plan.
+
+        Returns:
+        list: Descriptions of the caps the plan would exceed (empty if it fits).
+        """
+        usage = self.get_usage()
+        return self.get_violations(usage['requests'] + plan['calls'], usage['input_tokens'] + plan['input_tokens'],
+                                   usage['output_tokens'] + plan['output_tokens'])
+
+    def start_call(self, run_id, prompts):
+        input_tokens = sum(estimate_tokens(prompt) for prompt in prompts)
+        with self.lock:
+            # A call is rejected if the budget is already spent, or if its prompt alone would exceed the input caps
+            violations = self.get_violations(self.usage['requests'] + 1, self.usage['input_tokens'] + input_tokens,
+                                             self.usage['output_tokens'])
+            if len(violations) > 0:
+                self.usage['rejected_requests'] += 1
+                raise BudgetExceededError(f"The language model budget is exhausted ({', '.join(violations)})")
+            self.usage['requests'] += 1
+            self.usage['input_tokens'] += input_tokens
+            self.pending_input_tokens[run_id] = input_tokens
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.start_call(run_id, prompts)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.start_call(run_id, [message.content for message_list in messages for message in message_list])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        input_tokens, output_tokens = get_token_usage(response)
+        if output_tokens is None:
+            output_tokens = sum(estimate_tokens(generation.text) for generations in response.generations for generation in generations)
+        with self.lock:
+            # Replace the estimated input tokens with the reported ones
+            estimated_input_tokens = self.pending_input_tokens.pop(run_id, 0)
+            if input_tokens is not None:
+                self.usage['input_tokens'] += input_tokens - estimated_input_tokens
+            self.usage['output_tokens'] += output_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.pending_input_tokens.pop(run_id, None)
+
+
+def with_budget(llm, budget_governor):
+    """
+    Get a copy of a language model whose calls are governed by a budget governor (the original model is not modified).
+
+    Parameters:
+    - llm: The language model.
+    - budget_governor (BudgetGovernor): The budget governor, or None.
+
+    Returns:
+    The language model copy, or the language model itself if no budget governor is given.
+    """
+    if budget_governor is None:
+        return llm
+    return with_callback(llm, budget_governor)
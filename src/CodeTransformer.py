@@ -1,23 +1,66 @@
 from langchain.prompts import PromptTemplate
 from src.DataTransformer import DataTransformer
+from src.ValuePoolGenerator import ValuePoolGenerator
+from src.DataValidator import DataValidator
+from src.LLMTelemetry import with_telemetry, with_stage, record_event
+from src.BudgetGovernor import plan_enhancement_steps, summarize_plan
+from src.RetryPolicy import RetryPolicy, with_retry_policy
+from src.LLMRouter import get_language_model
 import random
-import json
-import pandas as pd
+import re
+from src.utils.lazy_import import LazyModule
 import asyncio
-from src.utils.utils import replace_param_value, dataframes_dict_to_string
+from src.utils.utils import dataframes_dict_to_string, dataframes_dict_to_json, reformat_fields
+from src.utils.code_utils import normalize_generation_code, compile_generation_code, seed_generation, strip_code_fences
+
+pd = LazyModule('pandas')
 
 class CodeTransformer:
     """
     A class for extracting Python code for generating data based on expert specifications or user description using a language model.
     """
 
-    def __init__(self,llm):
+    def __init__(self,llm, enhancement_llm=None, telemetry=None, retry_policy=None, request_hedger=None, streaming=False,
+                 wire_format='records'):
         """
         Initializes a new instance of the CodeTransformer class, which is designed to extract code for generating
         data and apply this code for data generation. This class uses a language model to generate code based
         on a user's description and applies this code to generate data.
+
+        Parameters:
+        - llm: The language model used for generating code.
+        - enhancement_llm (optional): The language model used for generating the free text fields, or a list of language
+          models (see LLMRouter). Defaults to None (the same language model).
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls and retries (the free text fields
+          are recorded under the 'enhancement' stage). Defaults to None.
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy of the retries, shared with the
+          enhancement components. Defaults to None (a new RetryPolicy).
+        - request_hedger (RequestHedger, optional): Hedges the slow batches of the 'rewrite' enhancement. Defaults to None (no hedging).
+        - streaming (bool, optional): Whether the 'rewrite' enhancement streams the rewritten records. Defaults to False.
+        - wire_format (str, optional): The encoding of the records sent to and received from the 'rewrite' enhancement,
+          'records' or 'columnar' (see DataTransformer). Defaults to 'records'.
+        """
+        llm = get_language_model(llm)
+        self.enhancement_llm = get_language_model(enhancement_llm) if enhancement_llm is not None else llm
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.llm = with_retry_policy(with_telemetry(llm, telemetry), self.retry_policy)
+        self.telemetry = telemetry
+        self.request_hedger = request_hedger
+        self.streaming = streaming
+        self.wire_format = wire_format
+        self.enhancement_telemetry = with_stage(telemetry, 'enhancement')
+        # A single DataTransformer (and its chains) is reused for enhancing all the tables
+        self.data_transformer = None
+        self.data_transformer_llm = None
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the code, the generation function and all the state of previous generations, so the instance (and its prebuilt
+        chains) can be reused for a new task.
         """
         self.code = ''
+        self.generate_function = None
         self.results_dict = None
         self.table_size_param_dict = None
         self.override_fields_dict = None
@@ -26,10 +69,30 @@ class CodeTransformer:
         self.primary_keys_dict = None
         self.parent_tables_dict = None
         self.cross_table_dependencies_dict = None
-        self.llm = llm
+        self.datetime_constraints_list = None
+        self.validation_masks = None
+        self.validation_errors = None
+        self.generated_tables = None
         self.description=None
         self.specifications=None
 
+    def get_data_transformer(self, llm):
+        """
+        Get the DataTransformer used for enhancing tables, building it only once per language model.
+
+        Parameters:
+        - llm: The language model used for the enhancement.
+
+        Returns:
+        DataTransformer: The data transformer.
+        """
+        if (self.data_transformer is None) or (self.data_transformer_llm is not llm):
+            self.data_transformer = DataTransformer(llm=llm, telemetry=self.enhancement_telemetry, retry_policy=self.retry_policy,
+                                                    request_hedger=self.request_hedger, streaming=self.streaming,
+                                                    wire_format=self.wire_format)
+            self.data_transformer_llm = llm
+        return self.data_transformer
+
     def generate_code_from_description(self, description, specifications, max_trials=4, verbose=True):
         """
         Extract Python code based on a user description or detailed specifications.
@@ -52,7 +115,9 @@ class CodeTransformer:
             f"You are a programmer whose job is to write Python code to generate data according to a given set of requirements, "
             f"making sure you don't miss any relevant detail, and handle all specified data characteristics, constraints and table relationships."
             f"1. Write the relevant imports (preferably use pandas, numpy, timestamp, datetime, random, and faker packages that are already installed). "
-            f"2. Write parameters with the number of records to be genertated for each of the tables (initialized to up to 10 records per table, tables can have different sizes)."
+            f"2. Write a function `def generate(table_sizes, seed=None):` that contains all the code of steps 3-7 and returns the results_dict object. "
+            f"At its beginning, write parameters with the number of records to be genertated for each of the tables, read with table_sizes.get('<table name>', <default number of records>) (defaults of up to 10 records per table, tables can have different sizes). "
+            f"If seed is not None, use it to seed random, numpy and faker. "
             f"3. Write the code to generate parent tables (follow the recommended order of table generation if exists in the given data specification). All datetime fields should be set to utc timezone and converted to strings. Use datetime+timedelta(seconds=t) when handling potential negative timestamps. **All freetext fields** (as appears in the override_fields_dict parameter) **should contain empty values.** "
             f"4. Write the code to generate child / dependent tables, making sure you maintain valid keys, values and formats to guarantee referential integrity in the generation code itself and not in postprocessing steps. All datetime fields should be set to utc timezone, and converted to strings. Use datetime+timedelta(seconds=-t) when handling potential negative timestamps. All foreign keys should contain values that exist as primary keys in the parent tables. **All freetext fields** (as appears in the override_fields_dict parameter) **should contain empty values.** "
             f"5. Make sure all the specified formats of the fields are maintained (e.g. int vs. float). Table names should be identical to the names of the object that store them."
@@ -61,6 +126,7 @@ class CodeTransformer:
             f"sales_transactions['transaction_date'] = [fake.date_time_between_dates(datetime_start=pd.to_datetime(books.loc[books['book_id'] == book_id, 'publication_date'].values[0])) for book_id in sales_transactions['book_id']]"
             f"7. Write the code that defines the results_dict object with pairs of key (table name) and value (dataframe with the generated table)."
             "Order this dictionary according to the recommended order of table generation."
+            f"Write the code of steps 8-15 at module level, outside the generate function. "
             f"8. Write the code that defines the table_size_param_dict object with pairs of key (table name) and value (it's number of records parameter name)."
             f"9. Write the code that defines the override_fields_dict dictionary with pairs of key (table name) and value (a list that includes all free text fields or categorical fields without a specified closed set of categories). Do not include tables with an empty list of fields."
             f"10. Write the code that defines the reformat_fields_dict dictionary with pairs of key (table name) and value (a list that includes all numerical and datetime fields except for primary key fields). Do not include tables with an empty list of fields."
@@ -68,6 +134,7 @@ class CodeTransformer:
             f"12. Write the code that defines the primary_keys_dict object with pairs of key (table name) and value (primary key field). Order this dictionary according to the reccomended order of table generation."
             f"13. Write the code that defines the parent_tables_dict dictionary with pairs of key (table name) and value (a pair with (a) list of parent table names and (b) the Python command needed for joining the key table with all its parent tables). Do not include in the dictionary tables with no parent tables."
             f"14. Write the code that defines the cross_table_dependencies_dict dictionary with pairs of key (table name) and value (a TEXTUAL description of its Date/Time Fields dependencies with other fields). Do not include  in the dictionary tables that have no dependencies."    
+            f"15. Write the code that defines the datetime_constraints_list object: a list of tuples (table name, datetime field, reference table name, reference datetime field), each meaning that the field must not be earlier than the reference field (in the same table, or in a parent / child table joined by a foreign key). Use an empty list if there are no such dependencies."
             f"\nThe data specification as described by the expert: {{human_input}};"
             f" You MUST make sure you output a **valid and complete** Python code, just code, no intro and summary or prefix are needed, and don't cut it in the middle. "
             f"\nGenerated Extracted Code:"
@@ -82,30 +149,24 @@ class CodeTransformer:
         trial = 0
         while trial < max_trials:
             try:
+                self.retry_policy.before_attempt()
                 current_code=''
                 output_code = code_extraction_chain.invoke({"human_input":specifications})
-                current_code = output_code.content.replace('```python', '').replace('```', '')
-                loc = {}
-                exec(current_code, globals(), loc)
-                self.code = current_code
-                self.results_dict = loc['results_dict']
-                self.table_size_param_dict = loc['table_size_param_dict']
-                self.override_fields_dict = loc['override_fields_dict']
-                self.reformat_fields_dict = loc['reformat_fields_dict']
-                self.table_names_dict = loc['table_names_dict']
-                self.primary_keys_dict = loc['primary_keys_dict']
-                self.parent_tables_dict = loc['parent_tables_dict']
-                self.cross_table_dependencies_dict = loc['cross_table_dependencies_dict']
-
-                return current_code
+                current_code = strip_code_fences(output_code.content)
+                return self.load_code(current_code)
             except Exception as ex:
                 print(f"Error during code extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                # The autocorrection retries (and backs off) on its own
+                if self.retry_policy.is_fatal(ex):
+                    break
                 current_code = self.autocorrect_code(self.llm, code=current_code, error_message=ex)
                 if current_code is not None:
                     return current_code
 
         print(f"Reached maximum trials for code extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
 
@@ -145,42 +206,144 @@ class CodeTransformer:
         success = False
         while (success is False) and (trial < max_trials):
             try:
+                self.retry_policy.before_attempt()
                 success = True
                 # task_specification = code_extraction_chain.predict(human_input=description)
                 corrected_code = code_correction_chain.invoke({"human_input": current_code,"error_message": current_error})
-                current_code = corrected_code.content
-                loc={}
-                exec(current_code, globals(), loc)
-                self.code = current_code
-                self.results_dict = loc['results_dict']
-                self.table_size_param_dict = loc['table_size_param_dict']
-                self.override_fields_dict = loc['override_fields_dict']
-                self.reformat_fields_dict = loc['reformat_fields_dict']
-                self.table_names_dict = loc['table_names_dict']
-                self.primary_keys_dict = loc['primary_keys_dict']
-                self.parent_tables_dict = loc['parent_tables_dict']
-                self.cross_table_dependencies_dict = loc['cross_table_dependencies_dict']
-
-                return current_code
+                current_code = strip_code_fences(corrected_code.content)
+                return self.load_code(current_code)
             except Exception as ex:
                 print(f"Error during auto correction ( trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
                 current_error = ex
                 success = False
                 if ex.args[0]==22:
                     trial = max_trials
 
         print(f"Reached maximum trials for autocorrection. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
-    def enhance_tables_with_transformer(self, llm, description, max_trials=1, run_in_parallel=True, full_query=None):
+    def load_code(self, code, seed=None):
+        """
+        Normalize the data generation code into a `generate(table_sizes, seed)` function (see normalize_generation_code),
+        compile it once, and run it with the default table sizes to load the generated tables and metadata dictionaries.
+
+        Parameters:
+        - code (str): The data generation code.
+        - seed (int, optional): Seed for the random generators. Defaults to None.
+
+        Returns:
+        str: The normalized code.
+        """
+        normalized_code = normalize_generation_code(code)
+        namespace = compile_generation_code(normalized_code, base_namespace=globals())
+        self.generate_function = namespace['generate']
+        self.results_dict = self.generate_tables(seed=seed)
+        self.table_size_param_dict = namespace['table_size_param_dict']
+        self.override_fields_dict = namespace['override_fields_dict']
+        self.reformat_fields_dict = namespace['reformat_fields_dict']
+        self.table_names_dict = namespace['table_names_dict']
+        self.primary_keys_dict = namespace['primary_keys_dict']
+        self.parent_tables_dict = namespace['parent_tables_dict']
+        self.cross_table_dependencies_dict = namespace['cross_table_dependencies_dict']
+        self.datetime_constraints_list = namespace.get('datetime_constraints_list', [])
+        self.code = normalized_code
+        return normalized_code
+
+    def load_specification_sampler(self, sampler, seed=None):
+        """
+        Use a SpecificationSampler instead of generated code: its `generate` function generates the tables locally from a
+        structured specification, and its metadata dictionaries are used for enhancement and validation.
+
+        Parameters:
+        - sampler (SpecificationSampler): The sampler.
+        - seed (int, optional): Seed for the random generator. Defaults to None.
+        """
+        metadata = sampler.get_metadata()
+        self.generate_function = sampler.generate
+        self.results_dict = self.generate_tables(seed=seed)
+        self.table_size_param_dict = metadata['table_size_param_dict']
+        self.override_fields_dict = metadata['override_fields_dict']
+        self.reformat_fields_dict = metadata['reformat_fields_dict']
+        self.table_names_dict = metadata['table_names_dict']
+        self.primary_keys_dict = metadata['primary_keys_dict']
+        self.parent_tables_dict = metadata['parent_tables_dict']
+        self.cross_table_dependencies_dict = metadata['cross_table_dependencies_dict']
+        self.datetime_constraints_list = metadata['datetime_constraints_list']
+
+    def generate_tables(self, table_size_dict=None, seed=None):
+        """
+        Generate the tables by calling the compiled `generate` function (no LLM calls are involved).
+
+        Parameters:
+        - table_size_dict (dictionary, optional): A dictionary with pairs of table name (key) and number of records to generate (value).
+          Tables that are not listed keep their default size.
+        - seed (int, optional): Seed for the random generators. Defaults to None.
+
+        Returns:
+        A dictionary with key (table name) and value (dataframe).
+        """
+        if table_size_dict is None:
+            table_size_dict = {}
+        seed_generation(seed)
+        return self.generate_function(dict(table_size_dict), seed)
+
+    def generate_tables_batch(self, variants):
+        """
+        Generate several variants of the tables in a single process, reusing the compiled `generate` function.
+
+        Parameters:
+        - variants (list): A list of pairs of (table_size_dict, seed).
+
+        Returns:
+        list: A list with a dictionary of generated tables (key: table name, value: dataframe) per variant.
+        """
+        return [self.generate_tables(table_size_dict=table_size_dict, seed=seed) for table_size_dict, seed in variants]
+
+    def validate_tables(self, tables):
         """
-        Enhance tables created with Python code by utilizing pretrained LLMs to enhance tables (generating texts, improving formats ect.).
+        Validate the primary keys, foreign keys and datetime constraints of the generated tables (see DataValidator).
+
+        Parameters:
+        - tables (dict): Pairs of key (table name) and value (dataframe).
+
+        Returns:
+        dict: Pairs of key (table name) and value (a boolean numpy array, True for records that violate any constraint).
+        """
+        DataValidatorObj = DataValidator(primary_keys_dict=self.primary_keys_dict, parent_tables_dict=self.parent_tables_dict,
+                                         datetime_constraints_list=self.datetime_constraints_list)
+        self.validation_masks = DataValidatorObj.validate(tables)
+        self.validation_errors = DataValidatorObj.errors
+        for table_name, errors in self.validation_errors.items():
+            print(f"Validation errors in the {table_name} table: {errors}")
+        return self.validation_masks
+
+    def enhance_tables_with_transformer(self, llm, description, max_trials=1, run_in_parallel=True, full_query=None, max_context_fields=5,
+                                        enhancement_mode='rewrite', pool_size=50, max_value_reuse=None, pool_bucket_fields_dict=None,
+                                        enhanced_tables_list=None):
+        """
+        Enhance tables created with Python code by utilizing pretrained LLMs to generate the free text fields.
+        Only the free text fields (see override_fields_dict) and a minimal projection of context fields are sent to the LLM,
+        and the returned values are written back into those fields. Numeric and datetime fields (see reformat_fields_dict)
+        are normalized locally.
 
         Parameters:
         - llm: The language model used for extraction.
         - description (str): The description of the task.
         - max_trials (int, optional): Maximum number of trials to attempt extraction. Defaults to 3.
+        - max_context_fields (int, optional): Maximum number of context fields sent to the LLM with the free text fields. Defaults to 5.
+        - enhancement_mode (str, optional): 'rewrite' to generate the free text fields record by record, or 'pool' to generate
+          a reusable pool of values per field (see ValuePoolGenerator) and sample it locally. Defaults to 'rewrite'.
+        - pool_size (int, optional): Number of distinct values per pool in 'pool' mode. Defaults to 50.
+        - max_value_reuse (int, optional): Maximum number of records sharing the same value in 'pool' mode. Defaults to None (unlimited).
+        - pool_bucket_fields_dict (dict, optional): Pairs of key (table name) and value (a categorical field used to generate
+          a dedicated pool per category in 'pool' mode). Defaults to None.
+        - enhanced_tables_list (list, optional): Names of the tables to enhance; the other tables are kept as is (e.g. tables
+          that were enhanced before and did not change). Defaults to None (all tables).
 
         Returns:
         A dictionary with the enhanced data: a dictionary with key (table name) and value (dataframe).
@@ -188,90 +351,219 @@ class CodeTransformer:
         Note:
         - Performs multiple trials to handle extraction failures.
             """
+        if pool_bucket_fields_dict is None:
+            pool_bucket_fields_dict = {}
+        full_description = description
+        if full_query is not None:
+            full_description = full_description + full_query
+
         # Loop over each table according to the extracted order (from independent to dependent tables)
         enriched_data = {}
-        for tab_no in range(len(self.results_dict.keys())):
+        for tab_name in self.results_dict.keys():
+            enriched_data[tab_name] = self.results_dict[tab_name]
+            if (enhanced_tables_list is not None) and (tab_name not in enhanced_tables_list):
+                continue
+
+            # Normalize numeric and datetime fields locally
+            if tab_name in self.reformat_fields_dict.keys():
+                enriched_data[tab_name] = reformat_fields(enriched_data[tab_name], self.reformat_fields_dict[tab_name])
+
             override_fields_list = []
-            restricted_fields_list = []
-            tab_name = list(self.results_dict.keys())[tab_no]
-            if tab_name not in enriched_data.keys():
-                enriched_data[tab_name] = self.results_dict[tab_name]
-            #print(tab_name)
-            if (tab_name in self.override_fields_dict.keys()) and (len(self.override_fields_dict[tab_name])>0):
-                override_fields_list = self.override_fields_dict[tab_name]
-                if (len(override_fields_list)>0):
-                    #enriched_data[tab_name][override_fields_list] = ''
-                    enriched_data[tab_name].loc[:, override_fields_list] = ''
-            if tab_name in self.primary_keys_dict.keys() and (len(self.primary_keys_dict[tab_name])>0):
-                restricted_fields_list = self.primary_keys_dict[tab_name]
-            # Joining dependent tables with their parent tables
+            if tab_name in self.override_fields_dict.keys():
+                override_fields_list = [field for field in self.override_fields_dict[tab_name] if field in enriched_data[tab_name].columns]
+            if len(override_fields_list) == 0:
+                continue
+            # Work on a copy, so the generated tables keep their values if the enhancement fails
+            enriched_data[tab_name] = enriched_data[tab_name].copy()
+            enriched_data[tab_name].loc[:, override_fields_list] = ''
+
+            if enhancement_mode == 'pool':
+                ValuePoolGeneratorObj = ValuePoolGenerator(llm=llm, pool_size=pool_size, max_value_reuse=max_value_reuse,
+                                                           telemetry=self.enhancement_telemetry, retry_policy=self.retry_policy)
+                enriched_data[tab_name] = ValuePoolGeneratorObj.fill_table(enriched_data[tab_name], tab_name, override_fields_list,
+                                                                           full_description, bucket_field=pool_bucket_fields_dict.get(tab_name))
+                continue
+
+            primary_key = self.primary_keys_dict.get(tab_name)
+            if isinstance(primary_key, (list, tuple)):
+                primary_key = primary_key[0] if len(primary_key) == 1 else None
+            if primary_key not in enriched_data[tab_name].columns:
+                primary_key = None
+
+            # Joining dependent tables with their parent tables (the joined fields are only used as context)
+            merged_data = None
             if (tab_name in self.parent_tables_dict.keys()) and (len(self.parent_tables_dict[tab_name][0])>0):
                 merge_command = self.parent_tables_dict[tab_name][1]
                 joined_table_name = self.parent_tables_dict[tab_name][0][0]
                 merge_command = merge_command.replace(self.table_names_dict[tab_name],tab_name)
                 merge_command = merge_command.replace(self.table_names_dict[joined_table_name],joined_table_name)
                 trial = 0
-                #results_df=None
                 while trial < max_trials:
                     current_code = "import pandas as pd \n"
                     current_code =  current_code + 'results_df = ' + merge_command
-                    current_code = current_code.replace(tab_name, 'enriched_data["' + tab_name + '"]')
-                    current_code = current_code.replace(joined_table_name,'enriched_data["' + joined_table_name + '"]')
+                    # Replace the table names (not quoted names or parts of other names, e.g. columns) with the enriched tables
+                    for table_name in [tab_name, joined_table_name]:
+                        current_code = re.sub(rf"(?<![\w'\"]){re.escape(table_name)}(?![\w'\"])", 'enriched_data["' + table_name + '"]', current_code)
                     try:
                         loc = {}
-                        #print(current_code)
                         exec(current_code, {"enriched_data": enriched_data}, loc)
-                        tmp_merged_data = loc['results_df']
-                        enriched_data[tab_name] = tmp_merged_data
-                        restricted_fields_list = list(set([restricted_fields_list] + self.results_dict[joined_table_name].columns.values.tolist()))
-                        trial += 1
+                        merged_data = loc['results_df']
+                        break
                     except Exception as ex:
                         print(f"Error during code extraction (trial {trial + 1}): {ex}")
+                        record_event(self.telemetry, 'retry', error=ex)
                         trial += 1
-                        #CodeTransformerObj = CodeTransformer()
-                        #current_code = CodeTransformerObj.autocorrect_code(code=current_code, error_message=ex, llm=llm)
-
-            # else:
-            # Define the transformation based on a user's description and apply it to the data.
+                if (merged_data is not None) and (len(merged_data) != len(enriched_data[tab_name])):
+                    print(f"Joining the {tab_name} table with its parent tables changed its number of records. Skipping the joined context fields.")
+                    merged_data = None
+
+            # Project the table to the free text fields and a minimal set of context fields
+            excluded_fields_list = override_fields_list + list(self.reformat_fields_dict.get(tab_name, []))
+            context_fields_list = self.select_context_fields(enriched_data[tab_name], excluded_fields_list, primary_key, max_context_fields)
+            projected_data = enriched_data[tab_name][context_fields_list + override_fields_list].reset_index(drop=True)
+            if merged_data is not None:
+                joined_fields_list = self.select_context_fields(merged_data.drop(columns=[column for column in enriched_data[tab_name].columns if column in merged_data.columns]),
+                                                                list(self.reformat_fields_dict.get(joined_table_name, [])), None, max_context_fields - len(context_fields_list))
+                projected_data = pd.concat([projected_data, merged_data[joined_fields_list].reset_index(drop=True)], axis=1)
+                context_fields_list = context_fields_list + joined_fields_list
+
+            # Define the transformation based on a user's description and apply it to the projected data.
             query = "Generate relevant and high quality unique, variable texts for free text fields: " + str(
-                override_fields_list) + " Never override a value in a field from the following list: " + str(
-                restricted_fields_list) + ". Reformat or correct any of the other numeric and datetime fields when needed (only change their values if mandatory for a valid record)."
+                override_fields_list) + " The following fields are given as context only, never override their values: " + str(
+                context_fields_list) + ". Return exactly one output record for each input record, in the same order and with the same fields."
 
-            # If cross table constraint exist
-            if tab_name in self.cross_table_dependencies_dict.keys():
-                constraints_msg = str(self.cross_table_dependencies_dict[tab_name])
-                query = query + " Correct the needed values to make sure these constraints are fulfilled: " + constraints_msg
-
-            DataTransformerObj = DataTransformer(llm=llm)
+            DataTransformerObj = self.get_data_transformer(llm)
             DataTransformerObj.extracted_logic = query
             DataTransformerObj.structure = '' ##
-            full_description = description
-            if full_query is not None:
-                full_description = full_description +  full_query
-            DataTransformerObj.description = full_description + "\n" + "Help me improve the quality and validity of the " + tab_name + " table. Ensure that the generated texts are distinct and varied, without repeating any names from previous requests, even across different sessions.\n" + "Do not return empty values unless you think the original value should be erased."
+            DataTransformerObj.description = full_description + "\n" + "Help me generate the free text fields of the " + tab_name + " table. Ensure that the generated texts are distinct and varied, without repeating any names from previous requests, even across different sessions.\n" + "Do not return empty values."
 
-            ###tmp_result = DataTransformerObj.transform(source_data=enriched_data[tab_name],output_format=2)
             if run_in_parallel:
-                tmp_result = asyncio.run(DataTransformerObj.transform_in_parallel(source_data=enriched_data[tab_name], output_format=2))
+                tmp_result = asyncio.run(DataTransformerObj.transform_in_parallel(source_data=projected_data, output_format=2))
             else:
-                tmp_result = DataTransformerObj.transform(source_data=enriched_data[tab_name], output_format=2)
-            original_cols = self.results_dict[tab_name].columns.values.tolist()
-            print('results:')
-            print(tmp_result)
-            ##enriched_data[tab_name] = pd.DataFrame(tmp_result[tab_name])[original_cols]
-            enriched_data[tab_name] = tmp_result[original_cols]
+                tmp_result = DataTransformerObj.transform(source_data=projected_data, output_format=2)
+            enriched_data[tab_name] = self.write_back_fields(enriched_data[tab_name], tmp_result, override_fields_list, primary_key)
         return enriched_data
 
-    def generate_data(self, table_size_dict=None, max_trials=3, output_format=2, run_in_parallel=True, full_query = None):
+    def select_context_fields(self, table, excluded_fields_list, primary_key=None, max_context_fields=5):
+        """
+        Select a minimal projection of context fields to send to the LLM with the free text fields.
+        The primary key comes first (it is used to align the returned values), followed by textual / categorical fields.
+
+        Parameters:
+        - table (DataFrame): The table to select the context fields from.
+        - excluded_fields_list (list): Fields that should not be used as context (free text and reformatted fields).
+        - primary_key (str, optional): The primary key field of the table.
+        - max_context_fields (int, optional): Maximum number of context fields. Defaults to 5.
+
+        Returns:
+        list: The names of the selected context fields.
+        """
+        context_fields_list = []
+        if primary_key is not None:
+            context_fields_list.append(primary_key)
+        for field in table.columns:
+            if len(context_fields_list) >= max_context_fields:
+                break
+            if (field in excluded_fields_list) or (field in context_fields_list):
+                continue
+            if pd.api.types.is_numeric_dtype(table[field]) or pd.api.types.is_datetime64_any_dtype(table[field]):
+                continue
+            context_fields_list.append(field)
+        return context_fields_list[:max(max_context_fields, 0)]
+
+    def write_back_fields(self, table, transformed_data, fields_list, primary_key=None):
+        """
+        Write the values returned by the LLM back into the given fields of the table.
+        The returned records are aligned by the primary key when possible, and by their position otherwise.
+
+        Parameters:
+        - table (DataFrame): The table to update.
+        - transformed_data (DataFrame): The records returned by the LLM.
+        - fields_list (list): The fields to write back.
+        - primary_key (str, optional): The primary key field of the table.
+
+        Returns:
+        DataFrame: The updated table.
+        """
+        if (not isinstance(transformed_data, pd.DataFrame)) or (len(transformed_data) == 0):
+            print("No values were returned for the free text fields. Keeping them empty.")
+            return table
+
+        if (primary_key is not None) and (primary_key in transformed_data.columns):
+            transformed_data = transformed_data.drop_duplicates(subset=primary_key)
+            transformed_data.index = transformed_data[primary_key].astype(str)
+            aligned_index = table[primary_key].astype(str)
+        elif len(transformed_data) == len(table):
+            transformed_data = transformed_data.reset_index(drop=True)
+            aligned_index = pd.RangeIndex(len(table))
+        else:
+            print(f"Expected {len(table)} records but received {len(transformed_data)}. Keeping the free text fields empty.")
+            return table
+
+        for field in fields_list:
+            if field in transformed_data.columns:
+                table.loc[:, field] = transformed_data[field].reindex(aligned_index).fillna('').to_numpy()
+        return table
+
+    def plan_generation(self, table_size_dict=None, enhancement_mode='rewrite', run_in_parallel=True, full_query=None, pool_size=50,
+                        enhanced_tables_list=None, latency_seconds=None, tokens_per_second=None, max_concurrency=None, budget_governor=None):
+        """
+        Estimate the language model calls, tokens, wall time and cost of generate_data (a dry run: no language model is called).
+        The code (or the specification sampler) must be loaded, and its default tables are used as a sample for the record sizes.
+
+        Parameters:
+        - table_size_dict (dictionary, optional): A dictionary with pairs of table name (key) and number of records to generate (value).
+          Tables that are not listed keep their default size.
+        - enhancement_mode (str, optional): How free text fields are generated, 'rewrite' or 'pool'. Defaults to 'rewrite'.
+        - run_in_parallel (bool, optional): Whether the batches are sent concurrently. Defaults to True.
+        - full_query (str, optional): The query appended to the description. Defaults to None.
+        - pool_size (int, optional): Number of values per pool in 'pool' mode. Defaults to 50.
+        - enhanced_tables_list (list, optional): Names of the tables to enhance. Defaults to None (all tables).
+        - latency_seconds, tokens_per_second, max_concurrency, budget_governor (optional): The planning assumptions (see summarize_plan).
+
+        Returns:
+        dict: The plan (see summarize_plan), or None if no code is loaded.
+        """
+        if self.generate_function is None:
+            if self.code == '':
+                print("Please generate or load the code first")
+                return None
+            self.load_code(self.code)
+        table_sizes = {name: len(table) for name, table in self.results_dict.items()}
+        if table_size_dict is not None:
+            table_sizes.update({name: int(size) for name, size in table_size_dict.items() if name in table_sizes})
+        free_text_fields_dict = {name: [field for field in self.override_fields_dict.get(name, []) if field in table.columns]
+                                 for name, table in self.results_dict.items()
+                                 if (enhanced_tables_list is None) or (name in enhanced_tables_list)}
+        description = (self.description or '') + (full_query or '')
+        steps = plan_enhancement_steps(self.results_dict, table_sizes, free_text_fields_dict, description=description,
+                                       enhancement_mode=enhancement_mode, pool_size=pool_size, run_in_parallel=run_in_parallel)
+        return summarize_plan(steps, latency_seconds=latency_seconds, tokens_per_second=tokens_per_second,
+                              max_concurrency=max_concurrency, budget_governor=budget_governor)
+
+    def generate_data(self, table_size_dict=None, max_trials=3, output_format=2, run_in_parallel=True, full_query = None,
+                      enhancement_mode='rewrite', pool_size=50, max_value_reuse=None, pool_bucket_fields_dict=None, seed=None, validate=True,
+                      tables=None, enhanced_tables_list=None, sink=None, keep_in_memory=True):
         """
         Extract Python code based on a user description or detailed specifications.
 
         Parameters:
         - table_size_dict (dictionary): A dictionary with pairs of table name (key) and number of records to generate (value).
         - max_trials (int, optional): Maximum number of trials to attempt extraction. Defaults to 3.
+        - enhancement_mode (str, optional): How free text fields are generated, 'rewrite' or 'pool' (see enhance_tables_with_transformer). Defaults to 'rewrite'.
+        - seed (int, optional): Seed for the random generators of the generation code. Defaults to None.
+        - validate (bool, optional): Whether to validate the referential integrity and datetime constraints of the generated tables
+          (see DataValidator). The violation masks are stored in the validation_masks attribute. Defaults to True.
+        - tables (dict, optional): Previously generated tables to enhance instead of generating new ones (e.g. tables updated
+          incrementally, see SpecificationSampler.update_tables). Defaults to None.
+        - enhanced_tables_list (list, optional): Names of the tables to enhance (see enhance_tables_with_transformer). Defaults to None (all tables).
+        - sink (OutputSink, optional): An output sink the generated tables are written to. Defaults to None.
+        - keep_in_memory (bool, optional): Whether to keep the generated tables (and the generated_tables attribute) in memory
+          when a sink is given. Defaults to True.
 
         Returns:
-        str: The updated code and the tables generated.
+        The tables generated, in the requested output format (or the summary of the sink, see OutputSink.get_summary, if the
+        tables are not kept in memory).
 
         Note:
         - Performs multiple trials to handle execution failures.
@@ -280,40 +572,44 @@ class CodeTransformer:
         JSON_ = 1
         DATAFRAME_DICT_ = 2
 
-        current_code = self.code
-        if table_size_dict is not None:
-            for param_name, new_param_value in table_size_dict.items():
-                current_code = replace_param_value(current_code, str(self.table_size_param_dict[param_name]), new_param_value)
         trial = 0
         while trial < max_trials:
             try:
-                loc = {}
-                exec(current_code, globals(), loc)
-                self.code = current_code
-                self.results_dict = loc['results_dict']
-                self.table_size_param_dict = loc['table_size_param_dict']
-                self.override_fields_dict = loc['override_fields_dict']
-                self.reformat_fields_dict = loc['reformat_fields_dict']
-                self.table_names_dict = loc['table_names_dict']
-                self.primary_keys_dict = loc['primary_keys_dict']
-                self.parent_tables_dict = loc['parent_tables_dict']
-                self.cross_table_dependencies_dict = loc['cross_table_dependencies_dict']
-
-                results = self.enhance_tables_with_transformer(llm=self.llm,description=self.description, run_in_parallel=run_in_parallel, full_query=full_query)
-
-                if output_format in [JSON_, STRING_]:
+                if self.generate_function is None:
+                    self.load_code(self.code)
+                if tables is not None:
+                    self.results_dict = tables
+                else:
+                    self.results_dict = self.generate_tables(table_size_dict=table_size_dict, seed=seed)
+
+                results = self.enhance_tables_with_transformer(llm=self.enhancement_llm,description=self.description, run_in_parallel=run_in_parallel, full_query=full_query,
+                                                               enhancement_mode=enhancement_mode, pool_size=pool_size, max_value_reuse=max_value_reuse,
+                                                               pool_bucket_fields_dict=pool_bucket_fields_dict, enhanced_tables_list=enhanced_tables_list)
+                self.generated_tables = results
+                if validate:
+                    self.validate_tables(results)
+                if sink is not None:
+                    sink.write_tables(results)
+                    if not keep_in_memory:
+                        self.results_dict = None
+                        self.generated_tables = None
+                        return sink.get_summary()
+
+                if output_format == STRING_:
                     results = dataframes_dict_to_string(results)
                 if output_format == JSON_:
-                    results = json.loads(results)
+                    results = dataframes_dict_to_json(results)
 
                 return results #self.code
             except Exception as ex:
                 print(f"Error during data generation from code (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
                 #current_code = self.autocorrect_code(self.llm, code=current_code, error_message=ex)
                 return None #current_code
 
         print(f"Reached maximum trials for extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
 
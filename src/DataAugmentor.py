@@ -1,29 +1,57 @@
-import json
-
 from langchain.prompts import PromptTemplate
 from src.utils.utils import *
+from src.LLMTelemetry import with_telemetry, record_event, track_parse
+from src.BudgetGovernor import BudgetExceededError
+from src.RetryPolicy import RetryPolicy, with_retry_policy
+from src.LLMRouter import get_language_model
+from src.RequestHedger import run_hedged
+from src.OutputSink import OutputCollector
+from src.TableSchema import TableSchema
+from src.utils.json_stream import astream_records, records_to_json
+from src.utils.wire_format import check_wire_format, convert_wire_format
+from langchain_core.messages import AIMessage
 import random
 import math
 import asyncio
 
 
 class DataAugmentor:
-    def __init__(self, llm, structure='', batch_size=10, verbose=True):
+    def __init__(self, llm, structure='', batch_size=10, verbose=True, telemetry=None, retry_policy=None, request_hedger=None,
+                 streaming=False, wire_format='records', lock_schema=True):
         """                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                             
         Initialize the DataAugmentor with the specified parameters.
 
         Parameters:
-        - llm: The language model used for data generation.
+        - llm: The language model used for data generation, or a list of language models (backends) to spread the batches over (see LLMRouter).
         - structure: The structure of the data to be generated.
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls, retries and parsing outcomes. Defaults to None.
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy of the retries, usually shared by all the
+          components of a pipeline. Defaults to None (a new RetryPolicy).
+        - request_hedger (RequestHedger, optional): Hedges the slow requests of the parallel rounds (see
+          generate_data_in_parallel). Defaults to None (no hedging).
+        - streaming (bool, optional): Whether generate_data_in_parallel streams the outputs and parses their records as they
+          arrive, cancelling the streams once the round has enough records. Defaults to False.
+        - wire_format (str, optional): The encoding of the tables of the required structure (and so of the generated
+          batches), 'records' or 'columnar' (the field names are sent once per table instead of once per record, which
+          shortens the prompts and the outputs). Defaults to 'records'.
+        - lock_schema (bool, optional): Whether the column types are inferred once (from the examples or the structure
+          sample, see TableSchema) and every generated batch is coerced to them, instead of inferring the dtypes of each
+          batch. Defaults to True.
         """
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        llm = with_retry_policy(with_telemetry(get_language_model(llm), telemetry), self.retry_policy)
         self.llm = llm
-        self.structure = structure
+        self.telemetry = telemetry
+        self.request_hedger = request_hedger
+        self.streaming = streaming
+        self.wire_format = check_wire_format(wire_format)
+        self.lock_schema = lock_schema
+        # The records still needed by the current parallel round, and the records streamed so far (see astream_batch)
+        self.round_needed_records = None
+        self.round_streamed_records = 0
         self.batch_size = batch_size
         self.verbose = verbose
-        self.examples_data = None
-        self.leading_key = None
-        self.task_specifications = None
-        self.previous_generated_batch = 'unknown'
+        self.reset(structure=structure)
 
         data_augmentor_template = (
             f"You are a system that specializes in generating synthetic data according to user requests."
@@ -44,6 +72,22 @@ class DataAugmentor:
 
         self.data_augmentor_chain = data_augmentor_prompt | llm
 
+    def reset(self, structure=''):
+        """
+        Set a new structure and clear the examples and the state of previous generations, so the instance (and its prebuilt
+        chain) can be reused for a new task.
+
+        Parameters:
+        - structure: The structure of the data to be generated (re-encoded in the wire format of the instance).
+        """
+        self.structure = convert_wire_format(structure, self.wire_format) if self.wire_format != 'records' else structure
+        self.examples_data = None
+        self.leading_key = None
+        self.schema = None
+        self.task_specifications = None
+        self.previous_generated_batch = 'unknown'
+        self.budget_exceeded = False
+
     # Set a dataframe to be used as example. (Currently supports only a single table structure)
     def set_examples_dataframe(self, dataframe, data_name):
         """
@@ -55,6 +99,41 @@ class DataAugmentor:
         """
         self.examples_data = dataframe
         self.leading_key = data_name
+        self.schema = None
+
+    def get_schema(self):
+        """
+        Get the schema the generated batches are coerced to, inferring it once from the examples or the structure sample
+        (tables missing from them are inferred from their first batch).
+
+        Returns:
+        TableSchema: The schema, or None if the schema is not locked.
+        """
+        if not self.lock_schema:
+            return None
+        if self.schema is None:
+            if self.examples_data is not None:
+                sample_dict = {self.leading_key: self.examples_data}
+            else:
+                try:
+                    sample_dict = sample_str_to_dataframes_dict(self.structure)
+                except Exception:
+                    # E.g. a textual description of the structure
+                    sample_dict = {}
+            self.schema = TableSchema.infer(sample_dict)
+        return self.schema
+
+    def report_nonconforming_values(self, collector):
+        """
+        Record the values of the generated batches that did not conform to the schema (see TableSchema.coerce).
+        """
+        if collector.schema is None:
+            return
+        counts = collector.schema.get_nonconforming_counts()
+        if len(counts) > 0:
+            if self.verbose:
+                print(f"Values that do not conform to the schema were set to missing values: {counts}")
+            record_event(self.telemetry, 'schema', nonconforming=counts)
 
     def preview_output_sample(self, query=None, region=None, language=None,task_specifications=None, num_records=3, leading_key='',
                               max_retries=3,
@@ -78,7 +157,7 @@ class DataAugmentor:
                                 leading_key=leading_key, max_retries=max_retries, total_max_retries=total_max_retries)
 
     def generate_data(self, query=None, region=None, language=None, task_specifications=None, num_records=3, leading_key='', output_format = 2, max_retries=3,
-                    total_max_retries=5):
+                    total_max_retries=5, sink=None, keep_in_memory=True):
         """
         Generate synthetic data using the configured data generation chain.
 
@@ -90,9 +169,13 @@ class DataAugmentor:
         - leading_key (str): The key to identify the leading table in the generated data.
         - max_retries (int, optional): Maximum number of retries for a single iteration. Defaults to 3.
         - total_max_retries (int, optional): Maximum cumulative number of retries across all iterations. Defaults to 10.
+        - sink (OutputSink, optional): An output sink the batches are written to as they are generated. Defaults to None.
+        - keep_in_memory (bool, optional): Whether to keep the generated tables in memory when a sink is given. Defaults to True.
 
         Returns:
-        dict: A dictionary containing the generated synthetic data.
+        dict: A dictionary containing the generated synthetic data (or the summary of the sink, see OutputSink.get_summary,
+        if the tables are not kept in memory). If the language model budget is exhausted (see BudgetGovernor), the records
+        generated so far are returned.
         """
         STRING_ = 0
         JSON_ = 1
@@ -100,60 +183,80 @@ class DataAugmentor:
 
         query_msg = compose_query_message(query, region, language, task_specifications)
 
-        results_dict = {}
+        collector = OutputCollector(sink=sink, keep_in_memory=keep_in_memory, max_records=num_records, schema=self.get_schema())
         n = 0
         total_retries = 0
+        self.budget_exceeded = False
 
         try:
-            while n < num_records:
+            while (n < num_records) and (not self.budget_exceeded):
                 retries = 0
                 while retries < max_retries:
                     try:
+                        self.retry_policy.before_attempt()
                         if self.examples_data is not None:
                             cur_structure = self.examples_data.sample(n=self.batch_size)
-                            cur_structure = dataframe_to_json(cur_structure, self.leading_key)
+                            cur_structure = dataframe_to_json(cur_structure, self.leading_key, wire_format=self.wire_format)
                         else:
                             cur_structure = self.structure
 
                         res = self.data_augmentor_chain.invoke({"structure":cur_structure, "randomness":random.random(),
                                                                "human_input":query_msg,"previous_generated_batch":self.previous_generated_batch}).content
                         self.previous_generated_batch = res
-                        cur_sample = try_parse_json(res)
-                        cur_sample_dict = sample_str_to_dataframes_dict(cur_sample)
-                        if results_dict=={}:
-                            results_dict = cur_sample_dict
-                        else:
-                            for key, items in cur_sample_dict.items():
-                                results_dict[key] = pd.concat([results_dict[key], items], ignore_index=True)
+                        with track_parse(self.telemetry):
+                            cur_sample_dict = sample_str_to_dataframes_dict(res)
+                        if sum(len(items) for items in cur_sample_dict.values()) == 0:
+                            # E.g. an output truncated before its first complete record
+                            raise ValueError("The output contains no complete records")
+                        collector.add(cur_sample_dict)
                         if leading_key == '':
-                            leading_key = list(results_dict.keys())[0]
+                            leading_key = list(collector.counts.keys())[0]
                         self.leading_key = leading_key
-                        n = n + cur_sample_dict[leading_key].shape[0]
+                        n = collector.get_count(leading_key)
                         break  # Break out of the retry loop if successful
+                    except BudgetExceededError as budget_ex:
+                        print(f"{budget_ex}. Returning the {n} records generated so far.")
+                        self.budget_exceeded = True
+                        break
                     except Exception as inner_ex:
                         print(f"Error during generation (number of records {n}, retry {retries + 1}): {inner_ex}")
+                        record_event(self.telemetry, 'retry', error=inner_ex)
                         retries += 1
                         total_retries += 1
 
                         if total_retries >= total_max_retries:
                             print(f"Reached total maximum retries ({total_max_retries}). Exiting.")
-                            return results_dict
-
-            if (n > num_records):
-                for key, items in results_dict.items():
-                    results_dict[key] = items[:num_records]
-
-            if output_format in [JSON_,STRING_]:
+                            record_event(self.telemetry, 'give_up')
+                            return self.get_collected_results(collector)
+                        if not self.retry_policy.wait_before_retry(inner_ex, total_retries, total_max_retries):
+                            print(f"Stopping the generation after a fatal error. Returning the {n} records generated so far.")
+                            record_event(self.telemetry, 'give_up')
+                            return self.get_collected_results(collector)
+
+            self.report_nonconforming_values(collector)
+            results_dict = collector.get_tables()
+            if not collector.keep_in_memory:
+                return self.get_collected_results(collector)
+            if output_format == STRING_:
                 results = dataframes_dict_to_string(results_dict)
             if output_format == JSON_:
-                results = json.loads(results)
+                results = dataframes_dict_to_json(results_dict)
             if output_format == DATAFRAME_DICT_:
                 results = results_dict
 
             return results
         except Exception as ex:
             print(f"Error during generation: {ex}")
-            return results_dict
+            return self.get_collected_results(collector)
+
+    @staticmethod
+    def get_collected_results(collector):
+        """
+        Get the tables collected so far (see OutputCollector), or the summary of the output sink if they are not kept in memory.
+        """
+        if collector.keep_in_memory:
+            return collector.get_tables()
+        return collector.sink.get_summary()
 
     async def async_generate(self, query, unique_id, randomness, max_retries=3):
         """
@@ -171,27 +274,77 @@ class DataAugmentor:
         retries = 0
         while retries < max_retries:
             try:
+                await self.retry_policy.abefore_attempt()
                 if self.examples_data is not None:
                     cur_structure = self.examples_data.sample(n=self.batch_size)
                     leading_key = self.leading_key
-                    cur_structure = dataframe_to_json(cur_structure, leading_key)
+                    cur_structure = dataframe_to_json(cur_structure, leading_key, wire_format=self.wire_format)
                 else:
                     cur_structure = self.structure
 
+                inputs = {"structure": cur_structure, "randomness": randomness, "human_input": query, "previous_generated_batch": 'unknown'}
+                if self.streaming:
+                    return await self.astream_batch(inputs, unique_id)
                 #response = await self.data_augmentor_chain.apredict(structure=cur_structure, randomness=randomness,
                 #                                               human_input=query, previous_generated_batch = 'unknown')
-                response = await self.data_augmentor_chain.ainvoke({"structure": cur_structure, "randomness": randomness,
-                                                        "human_input": query,
-                                                        "previous_generated_batch": 'unknown'})#.content
+                response = await run_hedged(self.request_hedger,
+                                            lambda: self.data_augmentor_chain.ainvoke(inputs), key='generation')#.content
                 return response
+            except BudgetExceededError as ex:
+                print(f"{ex} (task {unique_id}).")
+                self.budget_exceeded = True
+                return None
             except Exception as ex:
                 print(f"Error during async generation (task {unique_id}, retry {retries + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 retries += 1
+                if not await self.retry_policy.await_before_retry(ex, retries, max_retries):
+                    break
 
         print(f"Reached maximum retries for async generation (task {unique_id}). Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
-    async def generate_data_in_parallel(self, num_records, region=None, language=None, task_specifications=None, query='', max_retries=3, leading_key='', output_format = 0):
+    async def astream_batch(self, inputs, unique_id):
+        """
+        Stream a generated batch and parse its records as they arrive. The stream is cancelled if the round has enough
+        records of the leading table (see generate_data_in_parallel) before this batch produced any record (a batch that
+        started is completed, so its other tables match its leading table), and the complete records of a truncated
+        output are kept.
+
+        Parameters:
+        - inputs (dict): The inputs of the data generation chain.
+        - unique_id (int): An identifier for the generation task.
+
+        Returns:
+        AIMessage: The batch (the streamed records as a JSON object of tables), or None if the round had enough records
+        before any record of this batch arrived.
+        """
+        # The leading table is the first table of the batch, unless known from the examples or previous rounds
+        leading_table = {'name': self.leading_key if self.leading_key else None, 'started': False}
+
+        def on_records(new_records):
+            if not leading_table['started']:
+                leading_table['name'] = leading_table['name'] or new_records[0][0]
+                leading_table['started'] = True
+            self.round_streamed_records += sum(1 for table_name, record in new_records if table_name == leading_table['name'])
+
+        def should_stop():
+            return (not leading_table['started']) and (self.round_needed_records is not None) and \
+                (self.round_streamed_records >= self.round_needed_records)
+
+        records, complete, stopped, time_to_first_record = await astream_records(self.data_augmentor_chain, inputs,
+                                                                                 on_records=on_records, should_stop=should_stop)
+        record_event(self.telemetry, 'stream', records=len(records), complete=complete, stopped=stopped,
+                     time_to_first_record=time_to_first_record)
+        if len(records) == 0:
+            if stopped:
+                return None
+            raise ValueError(f"The streamed output of task {unique_id} contains no complete records")
+        return AIMessage(content=records_to_json(records))
+
+    async def generate_data_in_parallel(self, num_records, region=None, language=None, task_specifications=None, query='', max_retries=3, leading_key='', output_format = 0,
+                                        sink=None, keep_in_memory=True):
         """
         Generate synthetic data concurrently using multiple tasks.
 
@@ -201,9 +354,13 @@ class DataAugmentor:
         - language (str, optional): The required language. Defaults to an empty string.
         - query (str, optional): The description of the required content. Defaults to an empty string.
         - max_retries (int, optional): Maximum number of retries for a single generation attempt. Defaults to 3.
+        - sink (OutputSink, optional): An output sink the batches are written to as each round is parsed. Defaults to None.
+        - keep_in_memory (bool, optional): Whether to keep the generated tables in memory when a sink is given. Defaults to True.
 
         Returns:
-        List[str]: List of responses from the concurrent data generation tasks.
+        List[str]: List of responses from the concurrent data generation tasks (or the summary of the sink, see
+        OutputSink.get_summary, if the tables are not kept in memory). If the language model budget is exhausted (see
+        BudgetGovernor), the records generated so far are returned.
 
         Note:
         - This method generates synthetic data concurrently using asyncio tasks.
@@ -219,48 +376,60 @@ class DataAugmentor:
 
         # Calculate the number of parallel tasks to run
         iterations = math.ceil(num_records / self.batch_size)
-        results_dict = {}
+        collector = OutputCollector(sink=sink, keep_in_memory=keep_in_memory, max_records=num_records, schema=self.get_schema())
+        generated_records = 0
+        self.budget_exceeded = False
 
         while iterations > 0:
 
+            self.round_needed_records = num_records - generated_records
+            self.round_streamed_records = 0
             # Create asynchronous tasks for data generation
             tasks = [self.async_generate(query_msg, i, random.random(), max_retries) for i in range(1, iterations + 1)]
 
             # Execute tasks concurrently and gather results
             results = await asyncio.gather(*tasks)
-
+            if all(result is None for result in results):
+                print(f"All the generation tasks failed. Returning the {generated_records} records generated so far.")
+                break
 
             for i in range(len(results)):
-                batch_str = try_parse_json(results[i].content)
+                if results[i] is None:
+                    continue
                 try:
-                    batch_dataframes_dict = sample_str_to_dataframes_dict(batch_str)
-                    if (results_dict == {}):
-                        results_dict = batch_dataframes_dict
-                    else:
-                        for key, items in batch_dataframes_dict.items():
-                            results_dict[key] = pd.concat([results_dict[key], items], ignore_index=True)
+                    with track_parse(self.telemetry):
+                        batch_dataframes_dict = sample_str_to_dataframes_dict(results[i].content)
+                    collector.add(batch_dataframes_dict)
                 except Exception as e:
                     print(f"Error processing batch number {i}: {e}")
-                finally:
-                    if leading_key == '':
-                        leading_key = list(results_dict.keys())[0]
-                    self.leading_key = leading_key
-                    generated_records = results_dict[leading_key].shape[0]
-                    iterations = math.ceil((num_records-generated_records) / self.batch_size)
+
+            previously_generated_records = generated_records
+            if len(collector.counts) > 0:
+                if leading_key == '':
+                    leading_key = list(collector.counts.keys())[0]
+                self.leading_key = leading_key
+                generated_records = collector.get_count(leading_key)
+            if generated_records == previously_generated_records:
+                print(f"No records could be parsed in this round. Returning the {generated_records} records generated so far.")
+                break
+            iterations = math.ceil((num_records-generated_records) / self.batch_size)
+            if self.budget_exceeded:
+                print(f"The language model budget is exhausted. Returning the {generated_records} records generated so far.")
+                break
 
 
         # Parse and aggregate results from concurrent data generation
         ##results = parse_content_generated_concurrently(results)
 
-        # Remove additional records in the last batch
-        if (generated_records > num_records):
-            for key, items in results_dict.items():
-                results_dict[key] = items[:num_records]
-
-        if output_format in [JSON_, STRING_]:
+        # The additional records of the last round were dropped by the collector
+        self.report_nonconforming_values(collector)
+        if not collector.keep_in_memory:
+            return self.get_collected_results(collector)
+        results_dict = collector.get_tables()
+        if output_format == STRING_:
             results = dataframes_dict_to_string(results_dict)
         if output_format == JSON_:
-            results = json.loads(results)
+            results = dataframes_dict_to_json(results_dict)
         if output_format == DATAFRAME_DICT_:
             results = results_dict
 
@@ -1,12 +1,15 @@
 from langchain.prompts import PromptTemplate
 from src.Pipeline import *
+from src.LLMTelemetry import with_telemetry, record_event
+from src.RetryPolicy import RetryPolicy, with_retry_policy
+from src.LLMRouter import get_language_model
 
 class DataDefiner:
     """
     A class for extracting sample data structures based on user queries using a language model chain.
     """
 
-    def __init__(self, llm, pipeline_name=None, batch_size=10, verbose=True):
+    def __init__(self, llm, pipeline_name=None, batch_size=10, verbose=True, telemetry=None, retry_policy=None):
         """
         Initializes the DataDefiner.
 
@@ -15,7 +18,12 @@ class DataDefiner:
         - pipeline_name: x2y description, x describes the type of input and y described the desired output
         - batch_size (int, optional): Number of examples to include in the extraction prompt. Defaults to 3.
         - verbose (bool, optional): Whether to print verbose output during extraction. Defaults to True.
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls and retries. Defaults to None.
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy of the retries, usually shared by all the
+          components of a pipeline. Defaults to None (a new RetryPolicy).
         """
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        llm = with_retry_policy(with_telemetry(get_language_model(llm), telemetry), self.retry_policy)
 
         data_definer_template = (
             f"You are a system that specializes in generating synthetic data according to user requests."
@@ -41,6 +49,7 @@ class DataDefiner:
         self.data_structure_sample = {}
         self.task_specifications = ''
         self.llm = llm
+        self.telemetry = telemetry
 
     def define_schema_from_description(self, description, task_specifications=None, max_trials=3):
         """
@@ -61,13 +70,18 @@ class DataDefiner:
         trial = 0
         while trial < max_trials:
             try:
+                self.retry_policy.before_attempt()
                 #self.data_structure_sample  = self.data_definer_chain.predict(human_input = description, extracted_specification = self.task_specifications)
                 self.data_structure_sample = self.data_definer_chain.invoke({"human_input":description,"extracted_specification":self.task_specifications}).content
 
                 return self.data_structure_sample#.content
             except Exception as ex:
                 print(f"Error during extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
 
         print(f"Reached maximum trials for extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
@@ -1,13 +1,23 @@
 from langchain.prompts import PromptTemplate
 #from langchain.chains import LLMChain#, SequentialChain
 from src.Pipeline import *
+from src.PipelineClassifier import PipelineClassifier
 from src.TaskSpecificationAugmentor import TaskSpecificationAugmentor
 from src.DataDefiner import DataDefiner
 from src.DataAugmentor import DataAugmentor
 from src.CodeTransformer import CodeTransformer
-from src.utils.utils import try_parse_json, sample_str_to_dataframes_dict, compose_query_message
+from src.LLMCache import DEFAULT_CACHED_STAGES, with_llm_cache
+from src.LLMTelemetry import with_telemetry, with_stage, record_event
+from src.RetryPolicy import RetryPolicy, CircuitBreaker, with_retry_policy
+from src.LLMRouter import get_language_model
+from src.SpecificationSampler import SpecificationSampler, diff_structured_specifications, is_empty_diff
+from src.BudgetGovernor import (PROMPT_OVERHEAD_TOKENS, OUTPUT_TOKENS_PER_COLUMN, with_budget, estimate_tokens, guess_free_text_fields,
+                                create_plan_step, plan_enhancement_steps, summarize_plan)
+from src.utils.utils import try_parse_json, parse_json, sample_str_to_dataframes_dict, compose_query_message
 #import pandas as pd
+import copy
 import json
+import math
 import asyncio
 #import nest_asyncio
 
@@ -17,14 +27,41 @@ class DataGenerationPipeline:
     A class for wrapping end-to-end data generation tasks.
     """
 
-    def __init__(self, llm, pipeline_name='', batch_size=10):
+    def __init__(self, llm, pipeline_name='', batch_size=10, specification_cache=None, llm_cache=None, cached_stages=None,
+                 telemetry=None, budget_governor=None, retry_policy=None, stage_llms=None, request_hedger=None,
+                 streaming=False, wire_format='records', lock_schema=True):
         """
         Initializes the DataPipeline.
 
         Parameters:
-        - llm: The language model used for the various tasks.
+        - llm: The language model used for the various tasks, or a list of language models (backends) to spread the calls
+          over (see LLMRouter).
         - pipeline_name: x2y description, x describes the type of input and y described the desired output
         - batch_size (int, optional): Number of examples to include in the extraction prompt. Defaults to 3.
+        - specification_cache (SpecificationCache, optional): A cache of previously generated task specifications. Defaults to None.
+        - llm_cache (BaseCache, optional): A cache of LLM responses (e.g. InMemoryLRUCache or SQLiteLLMCache) used by the
+          cached stages. Defaults to None (no caching).
+        - cached_stages (list, optional): The stages whose LLM calls are cached, out of LLM_STAGES. Defaults to None
+          (DEFAULT_CACHED_STAGES: pipeline routing, specifications, schema and code generation).
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls, retries and parsing outcomes of all
+          the components, per stage. Defaults to None.
+        - budget_governor (BudgetGovernor, optional): A budget governor that caps the requests, tokens and cost of all the
+          language model calls. generate_data is not started when its plan (see plan_generation) exceeds the remaining
+          budget, and stops with the data generated so far when a cap is hit. Defaults to None (no caps).
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy shared by the retries of all the
+          components, so a provider rate limit pauses all the calls at once. Defaults to None (a RetryPolicy with a CircuitBreaker).
+        - stage_llms (dict, optional): Pairs of stage (see LLM_STAGES) and the language model (or list of backends) used for
+          it instead of llm, e.g. a cheap model for the 'generation' and 'enhancement' stages and a strong one for the
+          'specification' and 'code' stages. Defaults to None (llm for all the stages).
+        - request_hedger (RequestHedger, optional): Hedges the slow requests of the parallel generation and enhancement
+          rounds, to cut their tail latency. Defaults to None (no hedging).
+        - streaming (bool, optional): Whether the parallel generation and enhancement rounds stream the outputs and parse
+          their records as they arrive (see DataAugmentor.astream_batch and DataTransformer.astream_batch). Defaults to False.
+        - wire_format (str, optional): The encoding of the tables in the prompts and the outputs of the generation and
+          enhancement rounds, 'records' or 'columnar' (the field names are sent once per table instead of once per record,
+          which cuts the tokens of wide tables). Defaults to 'records'.
+        - lock_schema (bool, optional): Whether the generated batches are coerced to the column types inferred once from
+          the sample data or the examples (see TableSchema), keeping compact dtypes. Defaults to True.
         """
 
 
@@ -45,20 +82,85 @@ class DataGenerationPipeline:
         self.pipeline_name = pipeline_name
         self.description = ''
         self.task_specifications = ''
-        self.llm = llm
-        self.pipeline_extractor_chain = pipeline_extractor_prompt | self.llm
+        self.structured_specifications = None
+        self.budget_governor = budget_governor
+        self.llm = with_budget(get_language_model(llm), budget_governor)
+        self.stage_llms = {stage: with_budget(get_language_model(stage_llm), budget_governor) for stage, stage_llm in (stage_llms or {}).items()}
+        self.llm_cache = llm_cache
+        self.cached_stages = DEFAULT_CACHED_STAGES if cached_stages is None else cached_stages
+        # Cached copies of the language models, by the id of the language model
+        self.cached_llms = {}
+        self.telemetry = telemetry
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(circuit_breaker=CircuitBreaker())
+        self.request_hedger = request_hedger
+        self.streaming = streaming
+        self.wire_format = wire_format
+        self.lock_schema = lock_schema
+        self.pipeline_telemetry = with_stage(telemetry, 'pipeline')
+        self.pipeline_extractor_chain = pipeline_extractor_prompt | with_retry_policy(with_telemetry(self.get_stage_llm('pipeline'), self.pipeline_telemetry), self.retry_policy)
         self.code = ''
+        self.specification_cache = specification_cache
+        self.specification_diff = None
+        self.generated_tables = None
+        self.generated_structured_specifications = None
+        self.pipeline_classifier = None
+        # Prebuilt components (with their prompts and chains), shared by all the calls of this pipeline
+        self.components = {}
 
 
 
 
-    def extract_pipeline_from_description(self, description, max_trials=3):
+    def get_stage_llm(self, stage):
+        """
+        Get the language model of a pipeline stage (its model in stage_llms, or the pipeline's language model): a copy
+        that uses the LLM cache for the cached stages, or the language model itself for the other stages.
+
+        Parameters:
+        - stage (str): The stage (see LLM_STAGES).
+
+        Returns:
+        The language model.
+        """
+        llm = self.stage_llms.get(stage, self.llm)
+        if (self.llm_cache is None) or (stage not in self.cached_stages):
+            return llm
+        if id(llm) not in self.cached_llms:
+            self.cached_llms[id(llm)] = with_llm_cache(llm, self.llm_cache)
+        return self.cached_llms[id(llm)]
+
+    def get_component(self, component_class, stage=None, **kwargs):
+        """
+        Get a component of the pipeline (e.g. DataAugmentor), building it only on first use. Components are built with the
+        pipeline's language model, so they all share its client (and its pool of keep-alive connections).
+
+        Parameters:
+        - component_class: The component class.
+        - stage (str, optional): The stage the component is used for (see get_stage_llm). Defaults to None (not cached).
+        - kwargs: The construction arguments of the component (besides the language model, the telemetry handler of the
+          stage and the retry policy). Components built with different arguments are kept separately.
+
+        Returns:
+        The component.
+        """
+        # Objects (e.g. language models) are identified by their id, as they are not necessarily hashable
+        key = (component_class.__name__, stage) + tuple((name, value if isinstance(value, (str, int, float, bool, type(None))) else id(value))
+                                                         for name, value in sorted(kwargs.items()))
+        if key not in self.components:
+            self.components[key] = component_class(llm=self.get_stage_llm(stage), telemetry=with_stage(self.telemetry, stage),
+                                                     retry_policy=self.retry_policy, **kwargs)
+        return self.components[key]
+
+    def extract_pipeline_from_description(self, description, max_trials=3, use_classifier=True, confidence_threshold=None):
         """
         Extract pipeline name based on a user description of the task.
+        A local classifier (see PipelineClassifier) is tried first, and the language model is only used when its confidence
+        is below the threshold. The language model output is matched to the closest pipeline name.
 
         Parameters:
         - description (str): The user's description of the task.
         - max_trials (int, optional): Maximum number of trials to attempt extraction. Defaults to 3.
+        - use_classifier (bool, optional): Whether to try the local classifier first. Defaults to True.
+        - confidence_threshold (float, optional): The minimal confidence of the local classifier. Defaults to the classifier's threshold.
 
         Returns:
         str: The predicted output containing the name of the extracted pipeline.
@@ -67,21 +169,34 @@ class DataGenerationPipeline:
         - Performs multiple trials to handle extraction failures.
         """
         self.description = description
+        if use_classifier:
+            if self.pipeline_classifier is None:
+                self.pipeline_classifier = PipelineClassifier()
+            pipeline_name = self.pipeline_classifier.classify(description, confidence_threshold=confidence_threshold)
+            if pipeline_name is not None:
+                self.pipeline_name = pipeline_name
+                return self.pipeline_name
+
         trial = 0
         while trial < max_trials:
             try:
+                self.retry_policy.before_attempt()
                 output = self.pipeline_extractor_chain.invoke({"human_input":description})
-                self.pipeline_name = Pipeline.get_pipeline_name(output.content)
+                self.pipeline_name = Pipeline.find_pipeline_name(output.content)
 
                 return self.pipeline_name
             except Exception as ex:
                 print(f"Error during pipeline extraction (trial {trial + 1}): {ex}")
+                record_event(self.pipeline_telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
 
         print(f"Reached maximum trials for pipeline extraction. Returning None.")
+        record_event(self.pipeline_telemetry, 'give_up')
         return None
 
-    def extract_sample_data(self, description, pipelineName=None, outputFormat=0):
+    def extract_sample_data(self, description, pipelineName=None, outputFormat=0, num_specification_candidates=1, specification_score_threshold=100):
         STRING_ = 0
         JSON_ = 1
         DATAFRAME_DICT_ = 2
@@ -99,19 +214,29 @@ class DataGenerationPipeline:
             self.pipeline_name = cur_pipeline
 
         if cur_pipeline in [Pipeline.DescriptionToDB]:
+            # A new description invalidates everything generated before
+            self.code = ''
+            self.structured_specifications = None
+            self.generated_tables = None
+            self.specification_diff = None
             # Generate professional specifications
-            TaskSpecificationAugmentorObj = TaskSpecificationAugmentor(llm=self.llm)
-            task_specifications = TaskSpecificationAugmentorObj.generate_specifications_from_description(
-                description=description)
+            TaskSpecificationAugmentorObj = self.get_component(TaskSpecificationAugmentor, stage='specification', specification_cache=self.specification_cache)
+            if num_specification_candidates > 1:
+                task_specifications = TaskSpecificationAugmentorObj.generate_specifications_best_of_n(
+                    description=description, num_candidates=num_specification_candidates,
+                    score_threshold=specification_score_threshold)
+            else:
+                task_specifications = TaskSpecificationAugmentorObj.generate_specifications_from_description(
+                    description=description, score_threshold=specification_score_threshold)
             self.task_specifications = task_specifications['task_specifications']
 
-            DataDefinerObj = DataDefiner(self.llm, pipeline_name=self.pipeline_name)
+            DataDefinerObj = self.get_component(DataDefiner, stage='schema', pipeline_name=self.pipeline_name)
             self.data_structure_sample = DataDefinerObj.define_schema_from_description(description=description,
                                                                                        task_specifications=self.task_specifications)
         elif cur_pipeline == Pipeline.ExamplesDataframeToTabular:
             self.data_structure_sample = description
         else:
-            DataDefinerObj = DataDefiner(self.llm, pipeline_name=self.pipeline_name)
+            DataDefinerObj = self.get_component(DataDefiner, stage='schema', pipeline_name=self.pipeline_name)
             self.data_structure_sample = DataDefinerObj.define_schema_from_description(description=description)
 
         dataStructureSample = self.data_structure_sample
@@ -137,18 +262,52 @@ class DataGenerationPipeline:
         full_query = compose_query_message(query=query, region=region, language=language)
         self.query = full_query
 
+        refined_tables_list = None
         if cur_pipeline in [Pipeline.DescriptionToDB]:
             if (len(self.task_specifications)==0):
                 print("Please run method '''extract_sample_data''' first")
             # Generate professional specifications
-            TaskSpecificationAugmentorObj = TaskSpecificationAugmentor(llm=self.llm)
+            TaskSpecificationAugmentorObj = self.get_component(TaskSpecificationAugmentor, stage='specification', specification_cache=self.specification_cache)
             TaskSpecificationAugmentorObj.description = self.description
-            self.task_specifications = TaskSpecificationAugmentorObj.refine_specifications_by_description(description = full_query, previous_task_specification=self.task_specifications, max_trials=3, verbose=True)
+            refined_specifications = None
+            if self.structured_specifications is not None:
+                # Refine the structured specifications with a patch, and invalidate only what changed
+                refined_specifications = TaskSpecificationAugmentorObj.refine_structured_specifications(self.structured_specifications, query=full_query)
+            if refined_specifications is not None:
+                self.specification_diff = diff_structured_specifications(self.structured_specifications, refined_specifications)
+                self.structured_specifications = refined_specifications
+                self.task_specifications = self.task_specifications + "\nRefinement: " + full_query
+                print(f"Specification changes: {self.specification_diff}")
+                if not is_empty_diff(self.specification_diff):
+                    self.code = ''
+                refined_tables_list = self.get_refined_tables_list(self.specification_diff)
+            else:
+                self.task_specifications = TaskSpecificationAugmentorObj.refine_specifications_by_description(description = full_query, previous_task_specification=self.task_specifications, max_trials=3, verbose=True)
+                self.code = ''
+                self.structured_specifications = None
+                self.generated_tables = None
             #self.description = self.description + "; " + full_query
 
-        DataAugmentorObj = DataAugmentor(llm=self.llm, structure=self.data_structure_sample)
-        self.data_structure_sample = DataAugmentorObj.generate_data(query=query, region=region, language=language,
-                                                                        task_specifications=self.task_specifications,output_format=0)
+        if refined_tables_list is None:
+            DataAugmentorObj = self.get_component(DataAugmentor, stage='sample')
+            DataAugmentorObj.reset(structure=self.data_structure_sample)
+            self.data_structure_sample = DataAugmentorObj.generate_data(query=query, region=region, language=language,
+                                                                            task_specifications=self.task_specifications,output_format=0)
+        elif len(refined_tables_list) > 0:
+            # Regenerate the sample records of the changed tables only
+            sample_dict = parse_json(self.data_structure_sample)
+            refined_tables_specifications = [table for table in self.structured_specifications['tables'] if table['name'] in refined_tables_list]
+            DataAugmentorObj = self.get_component(DataAugmentor, stage='sample')
+            DataAugmentorObj.reset(structure=json.dumps({name: sample_dict[name] for name in refined_tables_list}))
+            refined_sample = DataAugmentorObj.generate_data(query=query, region=region, language=language,
+                                                            task_specifications=json.dumps(refined_tables_specifications), output_format=1)
+            if isinstance(refined_sample, dict):
+                sample_dict.update({name: records for name, records in refined_sample.items() if name in refined_tables_list})
+                self.data_structure_sample = json.dumps(sample_dict)
+            else:
+                print("Could not regenerate the sample data of the changed tables. Keeping the previous sample data.")
+        else:
+            print("The query did not change the specifications. Keeping the previous sample data.")
 
         dataStructureSample = self.data_structure_sample
         if outputFormat in [DATAFRAME_DICT_, JSON_]:
@@ -160,12 +319,155 @@ class DataGenerationPipeline:
         return dataStructureSample
 
 
-    def generate_data(self, num_records=0, tables_size_dict=None, output_format=2, code = '', run_in_parallel=True, examples_dataframe_dict = None, query=None, region=None, language=None):
+    def get_refined_tables_list(self, specification_diff):
+        """
+        Get the tables of the sample data that must be regenerated after a structured specification change.
+
+        Parameters:
+        - specification_diff (dict): The structured specification diff (see diff_structured_specifications).
+
+        Returns:
+        list: The names of the changed sample tables, or None if the whole sample must be regenerated (new or removed tables).
+        """
+        try:
+            sample_dict = parse_json(self.data_structure_sample)
+        except Exception as ex:
+            print(f"Error during sample data parsing: {ex}")
+            return None
+        if (len(specification_diff['added_tables']) > 0) or (len(specification_diff['removed_tables']) > 0) or (not isinstance(sample_dict, dict)):
+            return None
+        changed_tables = set(specification_diff['changed_tables']) | set(specification_diff['changed_columns']) | set(specification_diff['removed_columns'])
+        if not changed_tables <= set(sample_dict.keys()):
+            return None
+        return [name for name in sample_dict.keys() if name in changed_tables]
+
+    def update_generated_tables(self, sampler, tables_size_dict=None):
+        """
+        Update the tables of the previous generation after a structured specification change: only the invalidated columns
+        (changed columns, columns of changed or resized tables, and the columns that depend on them) are sampled again.
+
+        Parameters:
+        - sampler (SpecificationSampler): The sampler of the current structured specification.
+        - tables_size_dict (dict, optional): Pairs of table name (key) and number of records (value). Defaults to None.
+
+        Returns:
+        tuple: The updated tables and the names of the tables whose free text fields must be generated again,
+        or (None, None) if there is nothing to update incrementally.
+        """
+        if (self.generated_tables is None) or (self.generated_structured_specifications is None) or (self.specification_diff is None):
+            return None, None
+        if tables_size_dict is None:
+            tables_size_dict = {}
+        specification_diff = diff_structured_specifications(self.generated_structured_specifications, self.structured_specifications)
+        resized_tables = [name for name, size in tables_size_dict.items()
+                          if (name in self.generated_tables) and (len(self.generated_tables[name]) != int(size))]
+        invalidated_columns = sampler.get_invalidated_columns(specification_diff, resized_tables=resized_tables)
+        print(f"Regenerating the following columns: {invalidated_columns}")
+        tables = sampler.update_tables(self.generated_tables, invalidated_columns, table_sizes=tables_size_dict)
+        return tables, list(invalidated_columns.keys())
+
+    def plan_generation(self, num_records=0, tables_size_dict=None, run_in_parallel=True, query=None, region=None, language=None,
+                        enhancement_mode='rewrite', pool_size=50, generation_engine='code', latency_seconds=None,
+                        tokens_per_second=None, max_concurrency=None):
+        """
+        Estimate the language model calls, input and output tokens, wall time and cost of generate_data with the same
+        arguments (a dry run: no language model is called). The record sizes are estimated from the sample data, and retries
+        are not included.
+
+        Parameters:
+        - num_records, tables_size_dict, run_in_parallel, query, region, language, enhancement_mode, pool_size, generation_engine:
+          The arguments of generate_data.
+        - latency_seconds (float, optional): The time to the first token of a call. Defaults to DEFAULT_LATENCY_SECONDS.
+        - tokens_per_second (float, optional): The output token throughput of a call. Defaults to DEFAULT_TOKENS_PER_SECOND.
+        - max_concurrency (int, optional): Maximum number of concurrent calls. Defaults to None (unlimited).
+
+        Returns:
+        dict: The plan (see summarize_plan), or None if the sample data was not extracted yet.
+        """
+        cur_pipeline = self.pipeline_name
+        if (cur_pipeline == Pipeline.UNKNOWN) or (self.data_structure_sample == ''):
+            print("Please run method '''extract_sample_data''' first")
+            return None
+        try:
+            sample_dict = sample_str_to_dataframes_dict(self.data_structure_sample)
+        except Exception as ex:
+            print(f"Error during sample data parsing: {ex}")
+            sample_dict = {}
+
+        steps = []
+        if cur_pipeline in [Pipeline.DescriptionToDB]:
+            full_query = compose_query_message(query=query, region=region, language=language)
+            CodeTransformerObj = None
+            if ((generation_engine == 'specification') and (self.structured_specifications is not None)) or \
+                    ((generation_engine == 'code') and (self.code != '')):
+                # The tables and free text fields are known from the loaded code or specification (generated locally)
+                CodeTransformerObj = self.get_component(CodeTransformer, stage='code', enhancement_llm=self.get_stage_llm('enhancement'),
+                                                        request_hedger=self.request_hedger, streaming=self.streaming,
+                                                        wire_format=self.wire_format)
+                CodeTransformerObj.reset()
+                CodeTransformerObj.description = self.description
+                if generation_engine == 'specification':
+                    CodeTransformerObj.load_specification_sampler(SpecificationSampler(self.structured_specifications))
+                else:
+                    CodeTransformerObj.load_code(self.code)
+                steps = CodeTransformerObj.plan_generation(table_size_dict=tables_size_dict, enhancement_mode=enhancement_mode,
+                                                           run_in_parallel=run_in_parallel, full_query=full_query, pool_size=pool_size)['steps']
+            else:
+                # The code or structured specification is generated first, and the free text fields are guessed from the sample
+                stage = 'structured_specification' if generation_engine == 'specification' else 'code'
+                num_columns = sum(len(table.columns) for table in sample_dict.values())
+                steps.append(create_plan_step(stage, 1, PROMPT_OVERHEAD_TOKENS[stage] + estimate_tokens(self.description) + estimate_tokens(self.task_specifications),
+                                              OUTPUT_TOKENS_PER_COLUMN[stage] * num_columns))
+                table_sizes = {name: len(table) for name, table in sample_dict.items()}
+                table_sizes.update(tables_size_dict or {})
+                free_text_fields_dict = {name: guess_free_text_fields(table) for name, table in sample_dict.items()}
+                steps = steps + plan_enhancement_steps(sample_dict, table_sizes, free_text_fields_dict, description=self.description + full_query,
+                                                       enhancement_mode=enhancement_mode, pool_size=pool_size, run_in_parallel=run_in_parallel)
+        else:
+            DataAugmentorObj = self.get_component(DataAugmentor, stage='generation', request_hedger=self.request_hedger, streaming=self.streaming,
+                                                  wire_format=self.wire_format, lock_schema=self.lock_schema)
+            batch_size = DataAugmentorObj.batch_size
+            # Every call returns a batch of records in the structure of the sample data
+            structure_tokens = estimate_tokens(self.data_structure_sample)
+            sample_records = len(next(iter(sample_dict.values()))) if len(sample_dict) > 0 else batch_size
+            output_tokens = math.ceil(structure_tokens * batch_size / max(sample_records, 1))
+            input_tokens = PROMPT_OVERHEAD_TOKENS['augmentation'] + estimate_tokens(compose_query_message(query, region, language)) + structure_tokens
+            if not run_in_parallel:
+                # The sequential calls include the previous batch
+                input_tokens = input_tokens + output_tokens
+            calls = math.ceil(num_records / batch_size)
+            steps.append(create_plan_step('generation', calls, input_tokens, output_tokens, concurrency=calls if run_in_parallel else 1))
+
+        return summarize_plan(steps, latency_seconds=latency_seconds, tokens_per_second=tokens_per_second,
+                              max_concurrency=max_concurrency, budget_governor=self.budget_governor)
+
+    def generate_data(self, num_records=0, tables_size_dict=None, output_format=2, code = '', run_in_parallel=True, examples_dataframe_dict = None, query=None, region=None, language=None,
+                      enhancement_mode='rewrite', pool_size=50, max_value_reuse=None, pool_bucket_fields_dict=None, seed=None,
+                      generation_engine='code', incremental=True, sink=None, keep_in_memory=True):
+        """
+        Generate the data of the pipeline (see extract_sample_data).
+
+        Parameters:
+        - num_records (int, optional): The number of records to generate (for the single table pipelines).
+        - tables_size_dict (dict, optional): Pairs of table name and number of records to generate (for DescriptionToDB).
+        - output_format (int, optional): 0 for a JSON string, 1 for a JSON object, 2 for a dictionary of DataFrames. Defaults to 2.
+        - pool_bucket_fields_dict (dict, optional): Pairs of table name and a categorical field used to generate a dedicated
+          pool of free text values per category in 'pool' enhancement mode (for DescriptionToDB). Defaults to None.
+        - sink (OutputSink, optional): An output sink (e.g. ParquetSink) the tables are written to, batch by batch where the
+          generation is done in batches. The sink is not closed, so several generations can be written to it. Defaults to None.
+        - keep_in_memory (bool, optional): Whether to also keep the tables in memory when a sink is given. When False, the
+          summary of the sink (see OutputSink.get_summary) is returned, and the tables are not kept for incremental
+          regeneration. Defaults to True.
+
+        Returns:
+        The generated tables, in the requested output format.
+        """
         STRING_ = 0
         JSON_ = 1
         DATAFRAME_DICT_ = 2
 
-        self.code = code
+        if code != '':
+            self.code = code
 
         generated_data = None
         cur_pipeline = self.pipeline_name
@@ -178,25 +480,73 @@ class DataGenerationPipeline:
             print("Please insert either num_records or tables_size_dict")
             return()
 
+        # Pre-flight check: do not start a generation that is expected to exceed the budget
+        if self.budget_governor is not None:
+            plan = self.plan_generation(num_records=num_records, tables_size_dict=tables_size_dict, run_in_parallel=run_in_parallel,
+                                        query=query, region=region, language=language, enhancement_mode=enhancement_mode,
+                                        pool_size=pool_size, generation_engine=generation_engine)
+            violations = self.budget_governor.check_plan(plan) if plan is not None else []
+            if len(violations) > 0:
+                print(f"The estimated generation ({plan['calls']} calls, {plan['total_tokens']} tokens) exceeds the language model budget "
+                      f"({', '.join(violations)}). Please reduce the requested sizes or raise the budget.")
+                return()
+
         if cur_pipeline in [Pipeline.DescriptionToDB]:
-            CodeTransformerObj = CodeTransformer(llm=self.llm)
-            if self.code == '':
-                CodeTransformerObj.generate_code_from_description(description=self.description, specifications=self.task_specifications,max_trials=10)
-                self.code = CodeTransformerObj.code
+            tables, enhanced_tables_list = None, None
+            CodeTransformerObj = self.get_component(CodeTransformer, stage='code', enhancement_llm=self.get_stage_llm('enhancement'),
+                                                    request_hedger=self.request_hedger, streaming=self.streaming,
+                                                    wire_format=self.wire_format)
+            CodeTransformerObj.reset()
+            if generation_engine == 'specification':
+                # Generate the non free text fields locally from a structured specification
+                if self.structured_specifications is None:
+                    TaskSpecificationAugmentorObj = self.get_component(TaskSpecificationAugmentor, stage='specification', specification_cache=self.specification_cache)
+                    self.structured_specifications = TaskSpecificationAugmentorObj.generate_structured_specifications(specifications=self.task_specifications)
+                if self.structured_specifications is None:
+                    print("Could not extract structured specifications. Falling back to code generation.")
+                    generation_engine = 'code'
+                else:
+                    CodeTransformerObj.description = self.description
+                    SpecificationSamplerObj = SpecificationSampler(self.structured_specifications, seed=seed)
+                    CodeTransformerObj.load_specification_sampler(SpecificationSamplerObj)
+                    if incremental:
+                        tables, enhanced_tables_list = self.update_generated_tables(SpecificationSamplerObj, tables_size_dict)
+            if generation_engine == 'code':
+                if self.code == '':
+                    CodeTransformerObj.generate_code_from_description(description=self.description, specifications=self.task_specifications,max_trials=10)
+                    self.code = CodeTransformerObj.code
+                else:
+                    CodeTransformerObj.description = self.description
+                    CodeTransformerObj.load_code(self.code)
             #generated_data = CodeTransformerObj.generate_data(table_size_dict=tables_size_dict, max_trials=3, output_format=output_format)
             full_query = compose_query_message(query=query, region=region, language=language)
-            generated_data = CodeTransformerObj.generate_data(table_size_dict=tables_size_dict, max_trials=3, output_format=output_format, run_in_parallel=run_in_parallel, full_query=full_query)
+            generated_data = CodeTransformerObj.generate_data(table_size_dict=tables_size_dict, max_trials=3, output_format=output_format, run_in_parallel=run_in_parallel, full_query=full_query,
+                                                              enhancement_mode=enhancement_mode, pool_size=pool_size, max_value_reuse=max_value_reuse,
+                                                              pool_bucket_fields_dict=pool_bucket_fields_dict, seed=seed, tables=tables,
+                                                              enhanced_tables_list=enhanced_tables_list, sink=sink,
+                                                              keep_in_memory=keep_in_memory)
+            # Keep the generated tables, so a later specification refinement only regenerates what changed
+            if generation_engine == 'specification':
+                self.generated_tables = CodeTransformerObj.generated_tables
+                self.generated_structured_specifications = copy.deepcopy(self.structured_specifications)
+                self.specification_diff = None
+            else:
+                self.generated_tables = None
 
         else:
-            DataAugmentorObj = DataAugmentor(llm=self.llm, structure=self.data_structure_sample)
+            DataAugmentorObj = self.get_component(DataAugmentor, stage='generation', request_hedger=self.request_hedger, streaming=self.streaming,
+                                                  wire_format=self.wire_format, lock_schema=self.lock_schema)
+            DataAugmentorObj.reset(structure=self.data_structure_sample)
             if (examples_dataframe_dict is not None):
                 #Curently supporting a single examples file. Needs to extend to support multi-tables
                 first_key = list(examples_dataframe_dict.keys())[0]
                 DataAugmentorObj.set_examples_dataframe(dataframe = examples_dataframe_dict[first_key],data_name = first_key)
             if run_in_parallel:
-                generated_data = asyncio.run(DataAugmentorObj.generate_data_in_parallel(num_records=num_records, output_format=output_format, query=query, region=region, language=language))
+                generated_data = asyncio.run(DataAugmentorObj.generate_data_in_parallel(num_records=num_records, output_format=output_format, query=query, region=region, language=language,
+                                                                                        sink=sink, keep_in_memory=keep_in_memory))
             else:
-                generated_data = DataAugmentorObj.generate_data(num_records=num_records, output_format=output_format, query=query, region=region, language=language)
+                generated_data = DataAugmentorObj.generate_data(num_records=num_records, output_format=output_format, query=query, region=region, language=language,
+                                                                sink=sink, keep_in_memory=keep_in_memory)
 
         return generated_data
 
@@ -1,20 +1,42 @@
 from langchain.prompts import PromptTemplate
-from langchain.chains import SequentialChain ,LLMChain
 from src.utils.utils import *
+from src.LLMTelemetry import with_telemetry, record_event, track_parse
+from src.RetryPolicy import RetryPolicy, with_retry_policy
+from src.LLMRouter import get_language_model
+from src.RequestHedger import run_hedged
+from src.utils.json_repair import salvage_json
+from src.utils.json_stream import astream_records
+from src.utils.wire_format import check_wire_format, dataframe_to_wire_json, decode_wire_tables
 import asyncio
 
 
 class DataTransformer:
-    def __init__(self, llm, src_data=None, batch_size=10, verbose=True):
+    def __init__(self, llm, src_data=None, batch_size=10, verbose=True, telemetry=None, retry_policy=None, request_hedger=None,
+                 streaming=False, wire_format='records'):
         """
         Initializes a new instance of the DataTransformer class, which is designed to extract rules for transforming
         data and apply these transformations. This class uses a language model to generate transformation logic based
         on a user's description and applies this logic to transform source data.
 
         Parameters:
-        - llm (LLM): The language model used for generating transformation logic.
+        - llm (LLM): The language model used for generating transformation logic, or a list of language models (backends)
+          to spread the batches over (see LLMRouter).
         - src_data (dict of pandas.DataFrame, optional): Initial source data to be transformed. Default is None.
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls, retries and parsing outcomes. Default is None.
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy of the retries, usually shared by all the
+          components of a pipeline. Default is None (a new RetryPolicy).
+        - request_hedger (RequestHedger, optional): Hedges the slow batches of transform_in_parallel. Default is None (no hedging).
+        - streaming (bool, optional): Whether transform_in_parallel streams the outputs and parses their records as they arrive,
+          cancelling outputs longer than their batch. Default is False.
+        - wire_format (str, optional): The encoding of the source records in the prompts (and so of the transformed records),
+          'records' or 'columnar' (the field names are sent once per batch instead of once per record). Default is 'records'.
         """
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        llm = with_retry_policy(with_telemetry(get_language_model(llm), telemetry), self.retry_policy)
+        self.telemetry = telemetry
+        self.request_hedger = request_hedger
+        self.streaming = streaming
+        self.wire_format = check_wire_format(wire_format)
         self.batch_size = batch_size
         self.verbose = verbose
         self.src_data = src_data
@@ -24,6 +46,9 @@ class DataTransformer:
         self.description = ''
         self.results = None
 
+        # The legacy chains are slow to import, so they are only imported when a transformer is built
+        from langchain.chains import SequentialChain, LLMChain
+
         # Template for extracting logic using the language model.
         logic_extraction_template = (
             "You are a system that specializes in enriching given source data with additional attributes "
@@ -69,7 +94,8 @@ class DataTransformer:
             verbose=True,
             output_key="transformed_data"
         )
-        #self.data_transformer_chain = data_transformer_prompt | llm
+        # The same prompt as a runnable, for streaming the transformed records
+        self.data_transformer_stream_chain = data_transformer_prompt | llm
 
 
         # Sequential chain combining logic extraction and data transformation.
@@ -97,7 +123,8 @@ class DataTransformer:
         trial = 0
         while trial < max_trials:
             try:
-                sample_data = create_json_sample_from_dataframes_dictionary(dataframes_dictionary=source_data)
+                self.retry_policy.before_attempt()
+                sample_data = create_json_sample_from_dataframes_dictionary(dataframes_dictionary=source_data, wire_format=self.wire_format)
                 sample_data_transformed = self.overall_chain.invoke({"human_input": description, "src_data": sample_data})
                 self.src_data = source_data
                 self.extracted_logic = sample_data_transformed['extracted_logic']
@@ -106,20 +133,28 @@ class DataTransformer:
                 return sample_data_transformed['transformed_data']
             except Exception as ex:
                 print(f"Error during extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
         print("Reached maximum trials for extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
-    def transform(self, source_data, batch_size=10, output_format = 1):
+    def transform(self, source_data, batch_size=10, output_format = 1, sink=None, table_name='data', keep_in_memory=True):
         """
         Transforms the source data in batches based on previously extracted transformation logic.
 
         Parameters:
         - source_data (dict of pandas.DataFrame): The source data to be transformed.
         - batch_size (int): The number of records to process in each batch.
+        - sink (OutputSink, optional): An output sink the transformed batches are written to as they arrive. Default is None.
+        - table_name (str, optional): The name of the transformed table in the sink. Default is 'data'.
+        - keep_in_memory (bool, optional): Whether to keep the transformed data in memory when a sink is given. Default is True.
 
         Returns:
-        - dict: A dictionary containing the transformed data.
+        - dict: A dictionary containing the transformed data (or the summary of the sink, see OutputSink.get_summary, if the
+          transformed data is not kept in memory).
         """
         STRING_ = 0
         JSON_ = 1
@@ -131,31 +166,41 @@ class DataTransformer:
         output_data = None
         total_records = len(source_data)
 
-        for start_idx in range(0, total_records, batch_size):
+        start_idx = 0
+        while start_idx < total_records:
             end_idx = min((start_idx + batch_size), total_records)
-            sample_data = source_data[start_idx:end_idx].to_json(orient = 'records')
+            sample_data = dataframe_to_wire_json(source_data[start_idx:end_idx], self.wire_format)
+            next_start_idx = end_idx
 
             try:
                 sample_json = json.dumps(sample_data)
+                self.retry_policy.before_attempt()
                 transformed_json_str = self.data_transformer_chain.predict(
                     human_input=self.description, src_data=sample_json, extracted_logic=self.extracted_logic)
-                #transformed_data = json.loads(transformed_json_str)
-                dataStructureSample = try_parse_json(transformed_json_str)
-                transformed_data = json.loads(dataStructureSample)
-                has_key = does_sample_contain_keys(transformed_json_str)
-                if has_key:
-                    key = next(iter(transformed_data.keys()))
-                    transformed_data = transformed_data[key]
+                with track_parse(self.telemetry):
+                    transformed_data, truncated = parse_transformed_records(transformed_json_str)
+                if truncated and (0 < len(transformed_data) < end_idx - start_idx):
+                    # Only the records cut off are requested again
+                    next_start_idx = start_idx + len(transformed_data)
+                    record_event(self.telemetry, 'salvage', recovered=len(transformed_data), missing=end_idx - next_start_idx)
             except Exception as e:
                 print(f"Error processing data from index {start_idx} to {end_idx}: {e}")
+                start_idx = next_start_idx
                 continue
+            start_idx = next_start_idx
 
+            if sink is not None:
+                sink.write(table_name, records_to_dataframe(transformed_data))
+                if not keep_in_memory:
+                    continue
             if output_data is None:
                 output_data = transformed_data
             else:
                 # output_data = pd.concat([output_data, transformed_data],ignore_index=True)
                 output_data = output_data + transformed_data
 
+        if (sink is not None) and (not keep_in_memory):
+            return sink.get_summary()
         if output_format == STRING_:
             output_data = json.dumps(output_data)
         if output_format == DATAFRAME_DICT_:
@@ -164,7 +209,7 @@ class DataTransformer:
         return output_data
 
 
-    async def transform_in_parallel(self, source_data, batch_size=10, output_format = 1):
+    async def transform_in_parallel(self, source_data, batch_size=10, output_format = 1, sink=None, table_name='data', keep_in_memory=True):
         """
         Asynchronously transforms the source data in batches based on previously extracted transformation logic.
         This function uses concurrency to process different chunks of the data in parallel.
@@ -173,9 +218,14 @@ class DataTransformer:
         - source_data (pandas.DataFrame): The source data to be transformed.
         - batch_size (int): The number of records to process in each batch.
         - leading_key (str, optional): The primary key used to align the batches. If not provided, the first key found is used.
+        - sink (OutputSink, optional): An output sink the transformed batches are written to, in order, as soon as they and
+          the batches before them are done. Default is None.
+        - table_name (str, optional): The name of the transformed table in the sink. Default is 'data'.
+        - keep_in_memory (bool, optional): Whether to keep the transformed data in memory when a sink is given. Default is True.
 
         Returns:
-        - A pandas dataframe containing the transformed data.
+        - A pandas dataframe containing the transformed data (or the summary of the sink, see OutputSink.get_summary, if the
+          transformed data is not kept in memory).
         """
         STRING_ = 0
         JSON_ = 1
@@ -191,8 +241,19 @@ class DataTransformer:
         tasks = [self.process_batch(source_data, start_idx, min(start_idx + batch_size, total_records))
                  for start_idx in range(0, total_records, batch_size)]
 
-        # Execute tasks concurrently and gather results
-        results = await asyncio.gather(*tasks)
+        if sink is not None:
+            # The batches run concurrently, and are written in order as they complete
+            results = []
+            for task in [asyncio.ensure_future(task) for task in tasks]:
+                transformed_data = await task
+                sink.write(table_name, records_to_dataframe(transformed_data))
+                if keep_in_memory:
+                    results.append(transformed_data)
+            if not keep_in_memory:
+                return sink.get_summary()
+        else:
+            # Execute tasks concurrently and gather results
+            results = await asyncio.gather(*tasks)
         print(results)
         #for result in results:
         #    output_data[leading_key].extend(result)
@@ -211,6 +272,27 @@ class DataTransformer:
         return output_data
 
 
+    async def astream_batch(self, sample_json, num_records):
+        """
+        Stream the transformation of a batch and parse its records as they arrive; the stream is cancelled once the batch
+        has all its records, so an over-long output is not waited for.
+
+        Parameters:
+        - sample_json (str): The source records of the batch (a JSON string).
+        - num_records (int): The number of source records.
+
+        Returns:
+        tuple: The list of transformed records, and whether the output was truncated.
+        """
+        records, complete, stopped, time_to_first_record = await astream_records(
+            self.data_transformer_stream_chain, {"human_input": self.description, "src_data": sample_json, "extracted_logic": self.extracted_logic},
+            max_records=num_records)
+        record_event(self.telemetry, 'stream', records=len(records), complete=complete, stopped=stopped,
+                     time_to_first_record=time_to_first_record)
+        if len(records) == 0:
+            raise ValueError("The streamed output contains no complete records")
+        return [record for table_name, record in records], not (complete or stopped)
+
     async def process_batch(self, source_data, start_idx, end_idx):
         """
         Process a single batch of data asynchronously. Converts DataFrame to JSON, sends it for processing,
@@ -223,25 +305,54 @@ class DataTransformer:
         - end_idx (int): Ending index of the batch.
 
         Returns:
-        - dict: A dictionary containing the transformed data for the batch.
+        - list: A list with the transformed records of the batch (empty if the batch failed). If an output was truncated,
+          its complete records are kept and only the records cut off are requested again.
         """
-        # Extract batch data and convert to JSON
-        batch_data = source_data.assign(**source_data.select_dtypes(['datetime','datetime64', 'datetimetz']).astype(str).to_dict('list'))[start_idx:end_idx].to_json(orient="records")
-        sample_json = json.dumps(batch_data)
-
-        try:
-            # Assuming predict is an asynchronous function
-            transformed_json_str = await self.data_transformer_chain.apredict(
-                human_input=self.description, src_data=sample_json, extracted_logic=self.extracted_logic)
-            #transformed_json_str = try_parse_json(transformed_json_str)
-            transformed_data = json.loads(transformed_json_str)
-            has_key = does_sample_contain_keys(transformed_json_str)
-            if has_key:
-                key = next(iter(transformed_data.keys()))
-                transformed_data = transformed_data[key]
-
-            return transformed_data
-        except Exception as e:
-            print(f"Error processing data from index {start_idx} to {end_idx}: {e}")
-            return {}
+        records = []
+        while start_idx < end_idx:
+            # Extract batch data and convert to JSON
+            batch_data = dataframe_to_wire_json(source_data.assign(**source_data.select_dtypes(['datetime','datetime64', 'datetimetz']).astype(str).to_dict('list'))[start_idx:end_idx],
+                                                self.wire_format)
+            sample_json = json.dumps(batch_data)
 
+            try:
+                # Assuming predict is an asynchronous function
+                await self.retry_policy.abefore_attempt()
+                if self.streaming:
+                    transformed_data, truncated = await self.astream_batch(sample_json, end_idx - start_idx)
+                else:
+                    transformed_json_str = await run_hedged(self.request_hedger, lambda: self.data_transformer_chain.apredict(
+                        human_input=self.description, src_data=sample_json, extracted_logic=self.extracted_logic), key='transformation')
+                    with track_parse(self.telemetry):
+                        transformed_data, truncated = parse_transformed_records(transformed_json_str)
+            except Exception as e:
+                print(f"Error processing data from index {start_idx} to {end_idx}: {e}")
+                return records
+
+            records = records + transformed_data
+            if (not truncated) or (len(transformed_data) == 0) or (len(transformed_data) >= end_idx - start_idx):
+                break
+            start_idx += len(transformed_data)
+            record_event(self.telemetry, 'salvage', recovered=len(transformed_data), missing=end_idx - start_idx)
+        return records
+
+
+def parse_transformed_records(transformed_json_str):
+    """
+    Parse the transformed records of a batch (a list of records, or a dictionary with a single table of records; the tables
+    may be columnar, see wire_format), repairing a malformed output and recovering the complete records of a truncated one
+    (see salvage_json).
+
+    Parameters:
+    - transformed_json_str (str): The language model output.
+
+    Returns:
+    tuple: The list of transformed records, and whether the output was truncated.
+    """
+    transformed_data, truncated = salvage_json(transformed_json_str)
+    transformed_data = decode_wire_tables(transformed_data)
+    if isinstance(transformed_data, dict):
+        transformed_data = next(iter(transformed_data.values()), [])
+    if not isinstance(transformed_data, list):
+        raise ValueError("The transformed data is not a list of records")
+    return transformed_data, truncated
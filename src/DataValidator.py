@@ -0,0 +1,208 @@
+import re
+from src.utils.lazy_import import LazyModule
+from src.utils.utils import to_utc_datetime
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+class DataValidator:
+    """
+    A class for validating the referential integrity and datetime constraints of generated multi-table data.
+    """
+
+    def __init__(self, primary_keys_dict, parent_tables_dict=None, datetime_constraints_list=None, foreign_keys_dict=None):
+        """
+        Initializes a new instance of the DataValidator class, which checks primary key uniqueness, foreign key containment
+        and ordered datetime constraints using vectorized (hash based) pandas operations, and returns per-table violation masks.
+
+        Parameters:
+        - primary_keys_dict (dict): Pairs of key (table name) and value (primary key field).
+        - parent_tables_dict (dict, optional): Pairs of key (table name) and value (a pair with (a) list of parent table names and
+          (b) the Python command joining the table with its parent tables). Used to resolve the foreign key fields. Defaults to None.
+        - datetime_constraints_list (list, optional): A list of tuples (table name, field, reference table name, reference field),
+          each meaning that the field must not be earlier than the reference field (in the same record, or in the related
+          parent / child record). Defaults to None.
+        - foreign_keys_dict (dict, optional): Explicit foreign keys, as pairs of key (table name) and value (a list of tuples
+          (foreign key field, parent table name, parent key field)). Overrides the foreign keys resolved from parent_tables_dict. Defaults to None.
+        """
+        self.primary_keys_dict = primary_keys_dict if primary_keys_dict is not None else {}
+        self.parent_tables_dict = parent_tables_dict if parent_tables_dict is not None else {}
+        self.datetime_constraints_list = datetime_constraints_list if datetime_constraints_list is not None else []
+        self.foreign_keys_dict = foreign_keys_dict
+        self.errors = {}
+        self.violation_counts = {}
+
+    def get_primary_key(self, table_name):
+        """
+        Get the primary key field of a table (composite keys are not supported).
+
+        Parameters:
+        - table_name (str): The table name.
+
+        Returns:
+        str: The primary key field, or None if unknown.
+        """
+        primary_key = self.primary_keys_dict.get(table_name)
+        if isinstance(primary_key, (list, tuple)):
+            primary_key = primary_key[0] if len(primary_key) == 1 else None
+        return primary_key
+
+    def resolve_foreign_keys(self, tables):
+        """
+        Resolve the foreign key fields of each table. A parent's primary key field that also appears in the child table is
+        used as the foreign key; otherwise the left_on / right_on fields of the join command are used.
+
+        Parameters:
+        - tables (dict): Pairs of key (table name) and value (dataframe).
+
+        Returns:
+        dict: Pairs of key (table name) and value (a list of tuples (foreign key field, parent table name, parent key field)).
+        """
+        if self.foreign_keys_dict is not None:
+            return self.foreign_keys_dict
+
+        foreign_keys_dict = {}
+        for table_name, parent_tables in self.parent_tables_dict.items():
+            if table_name not in tables:
+                continue
+            parent_names, merge_command = parent_tables[0], str(parent_tables[1])
+            join_pairs = [(field, field) for field in re.findall(r"\bon\s*=\s*['\"](\w+)['\"]", merge_command)]
+            join_pairs += re.findall(r"left_on\s*=\s*['\"](\w+)['\"]\s*,\s*right_on\s*=\s*['\"](\w+)['\"]", merge_command)
+            for parent_name in parent_names:
+                parent_key = self.get_primary_key(parent_name)
+                if (parent_name not in tables) or (parent_key not in tables[parent_name].columns):
+                    continue
+                foreign_key = None
+                if parent_key in tables[table_name].columns:
+                    foreign_key = parent_key
+                else:
+                    for left_field, right_field in join_pairs:
+                        if (right_field == parent_key) and (left_field in tables[table_name].columns):
+                            foreign_key = left_field
+                            break
+                if foreign_key is None:
+                    print(f"Could not resolve the foreign key from the {table_name} table to the {parent_name} table.")
+                    continue
+                foreign_keys_dict.setdefault(table_name, []).append((foreign_key, parent_name, parent_key))
+        return foreign_keys_dict
+
+    def validate(self, tables):
+        """
+        Validate the given tables.
+
+        Parameters:
+        - tables (dict): Pairs of key (table name) and value (dataframe).
+
+        Returns:
+        dict: Pairs of key (table name) and value (a boolean numpy array, True for records that violate any constraint).
+        """
+        violation_masks = {table_name: np.zeros(len(table), dtype=bool) for table_name, table in tables.items()}
+        self.errors = {}
+
+        # Primary keys uniqueness (and completeness)
+        for table_name, table in tables.items():
+            primary_key = self.get_primary_key(table_name)
+            if primary_key not in table.columns:
+                continue
+            mask = (table[primary_key].duplicated(keep=False) | table[primary_key].isna()).to_numpy()
+            self.add_violations(violation_masks, table_name, mask, f"duplicated or missing primary key values in '{primary_key}'")
+
+        # Foreign keys containment
+        foreign_keys_dict = self.resolve_foreign_keys(tables)
+        for table_name, foreign_keys in foreign_keys_dict.items():
+            for foreign_key, parent_name, parent_key in foreign_keys:
+                child_values = tables[table_name][foreign_key]
+                mask = (child_values.notna() & ~child_values.isin(tables[parent_name][parent_key])).to_numpy()
+                self.add_violations(violation_masks, table_name, mask,
+                                    f"values of '{foreign_key}' that do not exist in {parent_name}.{parent_key}")
+
+        # Ordered datetime constraints
+        for table_name, field, reference_table_name, reference_field in self.datetime_constraints_list:
+            self.validate_datetime_constraint(tables, foreign_keys_dict, violation_masks, table_name, field, reference_table_name, reference_field)
+
+        self.violation_counts = {table_name: int(mask.sum()) for table_name, mask in violation_masks.items()}
+        return violation_masks
+
+    def validate_datetime_constraint(self, tables, foreign_keys_dict, violation_masks, table_name, field, reference_table_name, reference_field):
+        """
+        Validate that a datetime field is not earlier than a reference datetime field, either in the same table or in a
+        table related by a foreign key. Violations are assigned to the records of the child table.
+
+        Parameters:
+        - tables (dict): Pairs of key (table name) and value (dataframe).
+        - foreign_keys_dict (dict): The resolved foreign keys (see resolve_foreign_keys).
+        - violation_masks (dict): The violation masks to update.
+        - table_name (str): The table of the constrained field.
+        - field (str): The constrained field.
+        - reference_table_name (str): The table of the reference field.
+        - reference_field (str): The reference field.
+        """
+        if (table_name not in tables) or (reference_table_name not in tables) or (field not in tables[table_name].columns) \
+                or (reference_field not in tables[reference_table_name].columns):
+            print(f"Skipping the datetime constraint {table_name}.{field} >= {reference_table_name}.{reference_field}: unknown table or field.")
+            return
+        message = f"values of '{field}' earlier than {reference_table_name}.{reference_field}"
+
+        if table_name == reference_table_name:
+            values = to_utc_datetime(tables[table_name][field])
+            reference_values = to_utc_datetime(tables[table_name][reference_field])
+            self.add_violations(violation_masks, table_name, (values < reference_values).to_numpy(), message)
+            return
+
+        for child_name, parent_name, child_field, parent_field, child_is_later in \
+                [(table_name, reference_table_name, field, reference_field, True),
+                 (reference_table_name, table_name, reference_field, field, False)]:
+            for foreign_key, fk_parent_name, parent_key in foreign_keys_dict.get(child_name, []):
+                if fk_parent_name != parent_name:
+                    continue
+                # Hash join: locate the parent record of each child record (the first one of duplicated primary key
+                # values, which are reported by the primary keys check)
+                parent_keys = tables[parent_name][parent_key]
+                first_positions = np.flatnonzero(~parent_keys.duplicated(keep='first').to_numpy())
+                parent_positions = pd.Index(parent_keys.iloc[first_positions]).get_indexer(tables[child_name][foreign_key])
+                parent_positions = np.where(parent_positions >= 0, first_positions[parent_positions], -1)
+                parent_values = to_utc_datetime(tables[parent_name][parent_field]).dt.tz_localize(None).to_numpy()
+                matched = parent_positions >= 0
+                related_values = np.full(len(parent_positions), np.datetime64('NaT'), dtype=parent_values.dtype)
+                related_values[matched] = parent_values[parent_positions[matched]]
+                child_values = to_utc_datetime(tables[child_name][child_field]).dt.tz_localize(None).to_numpy()
+                if child_is_later:
+                    mask = child_values < related_values
+                else:
+                    mask = child_values > related_values
+                self.add_violations(violation_masks, child_name, mask, message)
+                return
+
+        print(f"Skipping the datetime constraint {table_name}.{field} >= {reference_table_name}.{reference_field}: the tables are not directly related.")
+
+    def add_violations(self, violation_masks, table_name, mask, message):
+        """
+        Add the violations of a single check to the table's violation mask, and record an error message.
+
+        Parameters:
+        - violation_masks (dict): The violation masks to update.
+        - table_name (str): The table name.
+        - mask (numpy.ndarray): A boolean array, True for violating records.
+        - message (str): A description of the violated constraint.
+        """
+        num_violations = int(mask.sum())
+        if num_violations == 0:
+            return
+        violation_masks[table_name] |= mask
+        self.errors.setdefault(table_name, []).append(f"{num_violations} records with {message}")
+
+    def get_violating_records(self, tables, violation_masks=None):
+        """
+        Select the records that violate any constraint, e.g. for regenerating only these records.
+
+        Parameters:
+        - tables (dict): Pairs of key (table name) and value (dataframe).
+        - violation_masks (dict, optional): Masks returned by validate. Computed if not given.
+
+        Returns:
+        dict: Pairs of key (table name) and value (dataframe with the violating records). Tables without violations are omitted.
+        """
+        if violation_masks is None:
+            violation_masks = self.validate(tables)
+        return {table_name: tables[table_name][mask] for table_name, mask in violation_masks.items() if mask.any()}
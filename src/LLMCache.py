@@ -0,0 +1,181 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from src.utils.utils import copy_language_model
+
+
+# Pipeline stages whose LLM calls are cached by default (deterministic stages). The sample, generation and enhancement
+# stages are intentionally random, so they are not cached unless requested.
+LLM_STAGES = ['pipeline', 'specification', 'schema', 'code', 'sample', 'generation', 'enhancement']
+DEFAULT_CACHED_STAGES = ['pipeline', 'specification', 'schema', 'code']
+
+
+def get_cache_key(prompt, llm_string):
+    """
+    Compute the cache key of an LLM call.
+
+    Parameters:
+    - prompt (str): The rendered prompt.
+    - llm_string (str): The serialized model name and invocation parameters (given by langchain).
+
+    Returns:
+    str: The key (a sha256 hex digest).
+    """
+    return hashlib.sha256((llm_string + '\x00' + prompt).encode('utf-8')).hexdigest()
+
+
+class InMemoryLRUCache(BaseCache):
+    """
+    An in-memory LLM response cache with least recently used (LRU) eviction and an optional time to live.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=None):
+        """
+        Initializes a new instance of the InMemoryLRUCache class.
+
+        Parameters:
+        - max_entries (int, optional): Maximum number of cached responses. Defaults to 1000.
+        - ttl_seconds (float, optional): Time to live of a cached response, in seconds. Defaults to None (no expiration).
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def lookup(self, prompt, llm_string):
+        key = get_cache_key(prompt, llm_string)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.metrics['misses'] += 1
+                return None
+            created_at, generations = entry
+            if (self.ttl_seconds is not None) and (time.time() - created_at > self.ttl_seconds):
+                del self.entries[key]
+                self.metrics['expirations'] += 1
+                self.metrics['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.metrics['hits'] += 1
+            return generations
+
+    def update(self, prompt, llm_string, return_val):
+        key = get_cache_key(prompt, llm_string)
+        with self.lock:
+            self.entries[key] = (time.time(), list(return_val))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.metrics['evictions'] += 1
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    An on-disk (SQLite) LLM response cache with least recently used eviction by number of entries and total size, and an
+    optional time to live.
+    """
+
+    def __init__(self, database_path='.llm_cache.db', max_entries=100000, max_size_bytes=500_000_000, ttl_seconds=None):
+        """
+        Initializes a new instance of the SQLiteLLMCache class.
+
+        Parameters:
+        - database_path (str, optional): Path of the SQLite database file. Defaults to '.llm_cache.db'.
+        - max_entries (int, optional): Maximum number of cached responses. Defaults to 100000.
+        - max_size_bytes (int, optional): Maximum total size of the cached responses, in bytes. Defaults to 500MB.
+        - ttl_seconds (float, optional): Time to live of a cached response, in seconds. Defaults to None (no expiration).
+        """
+        self.database_path = database_path
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, llm_string TEXT, response TEXT, "
+                                    "size INTEGER, created_at REAL, last_access REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+
+    def lookup(self, prompt, llm_string):
+        key = get_cache_key(prompt, llm_string)
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.metrics['misses'] += 1
+                return None
+            response, created_at = row
+            if (self.ttl_seconds is not None) and (time.time() - created_at > self.ttl_seconds):
+                self.connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.metrics['expirations'] += 1
+                self.metrics['misses'] += 1
+                return None
+            self.connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                generations = loads(response)
+        except Exception as ex:
+            print(f"Error during cached response loading: {ex}")
+            return None
+        self.metrics['hits'] += 1
+        return generations
+
+    def update(self, prompt, llm_string, return_val):
+        key = get_cache_key(prompt, llm_string)
+        response = dumps(list(return_val))
+        if len(response.encode('utf-8')) > self.max_size_bytes:
+            # A response larger than the whole cache is not stored
+            return
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, llm_string, response, len(response.encode('utf-8')), now, now))
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used responses until the cache is within its limits (called within a transaction).
+        """
+        num_entries, total_size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if (num_entries <= self.max_entries) and (total_size <= self.max_size_bytes):
+            return
+        rows = self.connection.execute("SELECT key, size FROM llm_cache ORDER BY last_access").fetchall()
+        evicted_keys = []
+        for key, size in rows:
+            if (num_entries <= self.max_entries) and (total_size <= self.max_size_bytes):
+                break
+            evicted_keys.append((key,))
+            num_entries -= 1
+            total_size -= size
+        self.connection.executemany("DELETE FROM llm_cache WHERE key = ?", evicted_keys)
+        self.metrics['evictions'] += len(evicted_keys)
+
+    def clear(self, **kwargs):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM llm_cache")
+
+
+def with_llm_cache(llm, cache):
+    """
+    Get a copy of a chat model that uses the given response cache (the original model is not modified, and the copy
+    shares its client).
+
+    Parameters:
+    - llm: The language model.
+    - cache (BaseCache): The cache, or None for an uncached copy.
+
+    Returns:
+    The language model copy.
+    """
+    return copy_language_model(llm, {'cache': cache if cache is not None else False})
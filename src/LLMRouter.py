@@ -0,0 +1,289 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+from src.RetryPolicy import classify_error, get_retry_after
+
+
+def get_remaining_requests(response_metadata):
+    """
+    Get the remaining requests of the provider's rate limit window, from the response headers (e.g.
+    x-ratelimit-remaining-requests or anthropic-ratelimit-requests-remaining), when the provider returns them.
+
+    Parameters:
+    - response_metadata (dict): The response metadata of a message.
+
+    Returns:
+    tuple: The remaining requests and the seconds until the window resets (None if unknown).
+    """
+    headers = (response_metadata or {}).get('headers') or {}
+    remaining, reset_seconds = None, None
+    for name, value in headers.items():
+        name = name.lower()
+        try:
+            if ('remaining-requests' in name) or ('requests-remaining' in name):
+                remaining = int(value)
+            elif ('reset-requests' in name) or ('requests-reset' in name):
+                # Durations like "1s", "6m0s" or "120ms"
+                units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+                reset_seconds = sum(float(number) * units[unit] for number, unit in re.findall(r"([\d.]+)(ms|s|m|h)", str(value)))
+        except (TypeError, ValueError):
+            continue
+    return remaining, reset_seconds
+
+
+class LLMRouter(BaseChatModel):
+    """
+    A chat model that spreads the calls over a pool of language model backends (e.g. several API keys, regions or
+    deployments of a model), so the throughput is not capped by the rate limit of a single backend. Each call is sent to
+    the backend with the lowest expected wait, estimated from its observed latency, error rate, calls in flight and
+    rate limit headroom; rate limited backends cool down (for their Retry-After), and calls that fail with a rate limit
+    or a transient error fail over to another backend.
+
+    Parameters:
+    - backends (list): The language models.
+    - names (list, optional): The names of the backends (used in the statistics). Defaults to None (backend_0, backend_1...).
+    - weights (list, optional): The relative capacities of the backends. Defaults to None (equal weights).
+    - max_concurrency (int, optional): Maximum number of calls in flight per backend; further calls wait for a free
+      backend. Defaults to None (unlimited).
+    - latency_smoothing (float, optional): The weight of the latest call in the moving averages of the latency and the
+      error rate. Defaults to 0.2.
+    - cooldown_seconds (float, optional): How long a rate limited backend is skipped when no Retry-After is given. Defaults to 1.
+    - failover (bool, optional): Whether to retry calls that failed with a rate limit or a transient error on another
+      backend. Defaults to True.
+    """
+
+    backends: List[Any]
+    names: Optional[List[str]] = None
+    weights: Optional[List[float]] = None
+    max_concurrency: Optional[int] = None
+    latency_smoothing: float = 0.2
+    cooldown_seconds: float = 1.0
+    failover: bool = True
+
+    _state = PrivateAttr(default_factory=dict)
+    _condition = PrivateAttr(default_factory=threading.Condition)
+
+    @property
+    def _llm_type(self):
+        return "llm-router"
+
+    @property
+    def _identifying_params(self):
+        # The models and parameters of the backends (not their names), so routers over different models are cached apart
+        return {'backends': [backend._get_llm_string() if hasattr(backend, '_get_llm_string') else repr(backend)
+                             for backend in self.backends]}
+
+    def get_names(self):
+        if self.names is not None:
+            return list(self.names)
+        return [f"backend_{i}" for i in range(len(self.backends))]
+
+    def get_backend_stats(self):
+        """
+        Get the (lazily created) statistics of the backends, shared by the copies of the router.
+        """
+        with self._condition:
+            if 'backends' not in self._state:
+                self._state['backends'] = [{'calls': 0, 'errors': 0, 'rate_limits': 0, 'failovers': 0, 'in_flight': 0, 'latency': None,
+                                'error_rate': 0.0, 'cooling_until': 0.0} for _ in self.backends]
+            return self._state['backends']
+
+    def get_stats(self):
+        """
+        Get the statistics of the backends.
+
+        Returns:
+        dict: Pairs of backend name (key) and its statistics (value): the number of calls, errors, rate limits and failovers,
+        the calls in flight, the moving averages of the latency and the error rate, and whether it is cooling down.
+        """
+        stats = self.get_backend_stats()
+        now = time.monotonic()
+        with self._condition:
+            return {name: {**{key: value for key, value in backend_stats.items() if key != 'cooling_until'},
+                           'cooling': backend_stats['cooling_until'] > now}
+                    for name, backend_stats in zip(self.get_names(), stats)}
+
+    def select_backend(self, excluded):
+        """
+        Select the backend with the lowest expected wait and count the call in flight (called within the lock).
+
+        Parameters:
+        - excluded (list): Indices of backends that already failed the call.
+
+        Returns:
+        tuple: The index of the selected backend (None if all the backends are busy or cooling down), and the time to
+        wait before selecting again.
+        """
+        stats = self._state['backends']
+        now = time.monotonic()
+        weights = self.weights if self.weights is not None else [1.0] * len(self.backends)
+        best_index, best_score, wait_seconds = None, None, None
+        for index, backend_stats in enumerate(stats):
+            if index in excluded:
+                continue
+            if backend_stats['cooling_until'] > now:
+                wait_seconds = min(wait_seconds or float('inf'), backend_stats['cooling_until'] - now)
+                continue
+            if (self.max_concurrency is not None) and (backend_stats['in_flight'] >= self.max_concurrency):
+                continue
+            # Backends without observations are tried first; ties are broken randomly
+            latency = backend_stats['latency'] if backend_stats['latency'] is not None else 0.0
+            score = (latency * (backend_stats['in_flight'] + 1) / max(weights[index], 1e-9) / max(1.0 - backend_stats['error_rate'], 0.05),
+                     backend_stats['in_flight'] / max(weights[index], 1e-9), random.random())
+            if (best_score is None) or (score < best_score):
+                best_index, best_score = index, score
+        if best_index is not None:
+            stats[best_index]['in_flight'] += 1
+            stats[best_index]['calls'] += 1
+        return best_index, (wait_seconds if wait_seconds is not None else 0.01)
+
+    def acquire_backend(self, excluded):
+        """
+        Select a backend, waiting while all the backends are busy or cooling down.
+
+        Returns:
+        int: The index of the backend, or None if all the backends failed the call.
+        """
+        self.get_backend_stats()
+        with self._condition:
+            while True:
+                if len(excluded) >= len(self.backends):
+                    return None
+                index, wait_seconds = self.select_backend(excluded)
+                if index is not None:
+                    return index
+                self._condition.wait(timeout=wait_seconds)
+
+    async def aacquire_backend(self, excluded):
+        """
+        Asynchronously select a backend, waiting while all the backends are busy or cooling down (see acquire_backend).
+        """
+        self.get_backend_stats()
+        while True:
+            with self._condition:
+                if len(excluded) >= len(self.backends):
+                    return None
+                index, wait_seconds = self.select_backend(excluded)
+            if index is not None:
+                return index
+            await asyncio.sleep(min(wait_seconds, 0.05))
+
+    def release_backend(self, index, latency, error=None, message=None):
+        """
+        Update the statistics of a backend after a call.
+
+        Parameters:
+        - index (int): The index of the backend.
+        - latency (float): The latency of the call, in seconds.
+        - error (Exception, optional): The error of the call, if it failed. Defaults to None.
+        - message (AIMessage, optional): The response of the call, if it succeeded (its headers are used for the rate
+          limit headroom). Defaults to None.
+        """
+        with self._condition:
+            backend_stats = self._state['backends'][index]
+            backend_stats['in_flight'] -= 1
+            alpha = self.latency_smoothing
+            failed = (error is not None) and (classify_error(error) in ['rate_limit', 'transient'])
+            backend_stats['error_rate'] = (1 - alpha) * backend_stats['error_rate'] + alpha * (1.0 if failed else 0.0)
+            if error is None:
+                backend_stats['latency'] = latency if backend_stats['latency'] is None else (1 - alpha) * backend_stats['latency'] + alpha * latency
+                remaining, reset_seconds = get_remaining_requests(getattr(message, 'response_metadata', None))
+                if (remaining is not None) and (remaining <= 0):
+                    backend_stats['cooling_until'] = time.monotonic() + (reset_seconds or self.cooldown_seconds)
+            else:
+                backend_stats['errors'] += 1
+                if classify_error(error) == 'rate_limit':
+                    backend_stats['rate_limits'] += 1
+                    retry_after = get_retry_after(error)
+                    backend_stats['cooling_until'] = time.monotonic() + (retry_after if retry_after is not None else self.cooldown_seconds)
+            self._condition.notify_all()
+
+    def should_fail_over(self, error, index):
+        if (not self.failover) or (classify_error(error) not in ['rate_limit', 'transient']):
+            return False
+        with self._condition:
+            self._state['backends'][index]['failovers'] += 1
+        return True
+
+    def create_result(self, message, index):
+        message.response_metadata = {**(message.response_metadata or {}), 'backend': self.get_names()[index]}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        excluded = []
+        while True:
+            index = self.acquire_backend(excluded)
+            start = time.perf_counter()
+            try:
+                message = self.backends[index].invoke(messages, stop=stop, **kwargs)
+            except Exception as ex:
+                self.release_backend(index, time.perf_counter() - start, error=ex)
+                excluded.append(index)
+                if (not self.should_fail_over(ex, index)) or (len(excluded) >= len(self.backends)):
+                    raise
+                continue
+            self.release_backend(index, time.perf_counter() - start, message=message)
+            return self.create_result(message, index)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        excluded = []
+        while True:
+            index = await self.aacquire_backend(excluded)
+            start = time.perf_counter()
+            try:
+                message = await self.backends[index].ainvoke(messages, stop=stop, **kwargs)
+            except Exception as ex:
+                self.release_backend(index, time.perf_counter() - start, error=ex)
+                excluded.append(index)
+                if (not self.should_fail_over(ex, index)) or (len(excluded) >= len(self.backends)):
+                    raise
+                continue
+            self.release_backend(index, time.perf_counter() - start, message=message)
+            return self.create_result(message, index)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        excluded = []
+        while True:
+            index = await self.aacquire_backend(excluded)
+            start = time.perf_counter()
+            received = False
+            try:
+                async for chunk in self.backends[index].astream(messages, stop=stop, **kwargs):
+                    received = True
+                    if run_manager:
+                        await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as ex:
+                self.release_backend(index, time.perf_counter() - start, error=ex)
+                excluded.append(index)
+                # A stream only fails over before its first chunk
+                if received or (not self.should_fail_over(ex, index)) or (len(excluded) >= len(self.backends)):
+                    raise
+                continue
+            except BaseException:
+                # The stream was closed early by the consumer
+                self.release_backend(index, time.perf_counter() - start)
+                raise
+            self.release_backend(index, time.perf_counter() - start)
+            return
+
+
+def get_language_model(llm):
+    """
+    Get the language model of a component: a pool of backends (a list of language models) is wrapped in an LLMRouter.
+
+    Parameters:
+    - llm: A language model, or a list of language models.
+
+    Returns:
+    The language model.
+    """
+    if isinstance(llm, (list, tuple)):
+        return LLMRouter(backends=list(llm))
+    return llm
@@ -0,0 +1,291 @@
+import contextlib
+import copy
+import json
+import threading
+import time
+import uuid
+from langchain_core.callbacks import BaseCallbackHandler
+from src.utils.utils import with_callback
+
+
+class LLMTelemetry(BaseCallbackHandler):
+    """
+    A callback handler that records telemetry of every language model call (stage, wall latency, time to first token,
+    input and output tokens, errors), together with the retry and JSON parsing events reported by the components, and
+    aggregates them per stage.
+    """
+
+    # Handle the callbacks in the calling thread, so the measured latencies are not delayed by an executor
+    run_inline = True
+
+    def __init__(self, stage='default', run_name=None):
+        """
+        Initializes a new instance of the LLMTelemetry class. Stage specific handlers (see with_stage) share the records
+        of the handler they were created from, so a single summary covers the whole run.
+
+        Parameters:
+        - stage (str, optional): The stage of the recorded calls and events. Defaults to 'default'.
+        - run_name (str, optional): The name of the run, included in all the records. Defaults to None (a random identifier).
+        """
+        self.stage = stage
+        # The state shared with the stage specific handlers
+        self.run = {'name': run_name if run_name is not None else uuid.uuid4().hex[:12]}
+        self.records = []
+        self.pending_calls = {}
+        self.lock = threading.Lock()
+
+    @property
+    def run_name(self):
+        """
+        The name of the run, shared with the stage specific handlers.
+        """
+        return self.run['name']
+
+    @run_name.setter
+    def run_name(self, run_name):
+        self.run['name'] = run_name
+
+    def with_stage(self, stage):
+        """
+        Get a handler that records calls and events of another stage into the same records.
+
+        Parameters:
+        - stage (str): The stage.
+
+        Returns:
+        LLMTelemetry: The stage specific handler.
+        """
+        handler = copy.copy(self)
+        handler.stage = stage
+        return handler
+
+    def reset(self, run_name=None):
+        """
+        Clear the records and start a new run (of all the handlers sharing the records).
+
+        Parameters:
+        - run_name (str, optional): The name of the new run. Defaults to None (a random identifier).
+        """
+        with self.lock:
+            self.records.clear()
+            self.pending_calls.clear()
+            self.run_name = run_name if run_name is not None else uuid.uuid4().hex[:12]
+
+    def start_call(self, run_id, serialized):
+        with self.lock:
+            self.pending_calls[run_id] = {'start': time.perf_counter(), 'first_token': None, 'stage': self.stage,
+                                          'model': (serialized or {}).get('name') or (serialized or {}).get('id', [''])[-1]}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.start_call(run_id, serialized)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.start_call(run_id, serialized)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self.lock:
+            call = self.pending_calls.get(run_id)
+            if (call is not None) and (call['first_token'] is None):
+                call['first_token'] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        input_tokens, output_tokens = get_token_usage(response)
+        self.end_call(run_id, input_tokens=input_tokens, output_tokens=output_tokens, success=True)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.end_call(run_id, success=False, error_type=type(error).__name__, error=str(error)[:500])
+
+    def end_call(self, run_id, **fields):
+        end = time.perf_counter()
+        with self.lock:
+            call = self.pending_calls.pop(run_id, None)
+        if call is None:
+            return
+        time_to_first_token = (call['first_token'] - call['start']) if call['first_token'] is not None else None
+        self.append_record({'event': 'llm_call', 'stage': call['stage'], 'model': call['model'], 'latency': end - call['start'],
+                            'time_to_first_token': time_to_first_token, **fields})
+
+    def record_event(self, event, **fields):
+        """
+        Record a component event, e.g. a 'retry' (a failed attempt), a 'give_up' (all the attempts failed) or a 'parse'
+        (the outcome of parsing an output, with a 'success' field).
+
+        Parameters:
+        - event (str): The event name.
+        - fields: Additional fields of the record. Exceptions are recorded by their type and message.
+        """
+        error = fields.pop('error', None)
+        if isinstance(error, BaseException):
+            fields['error_type'] = type(error).__name__
+            error = str(error)
+        if error is not None:
+            fields['error'] = str(error)[:500]
+        self.append_record({'event': event, 'stage': self.stage, **fields})
+
+    def append_record(self, record):
+        with self.lock:
+            self.records.append({'run': self.run_name, 'time': time.time(), **record})
+
+    def get_records(self):
+        """
+        Get a copy of the records.
+
+        Returns:
+        list: The records (dictionaries), in order of recording.
+        """
+        with self.lock:
+            return list(self.records)
+
+    def get_summary(self):
+        """
+        Aggregate the records of the run per stage.
+
+        Returns:
+        dict: Pairs of key (stage) and value (a dictionary with the number of calls and failed calls, the total, mean and
+        95th percentile latency, the mean time to first token, the input and output tokens, the number of retries and
+        give ups, and the number of successful and failed parses).
+        """
+        summary = {}
+        for record in self.get_records():
+            stage_summary = summary.setdefault(record['stage'], {'calls': 0, 'failed_calls': 0, 'latencies': [], 'times_to_first_token': [],
+                                                                 'input_tokens': 0, 'output_tokens': 0, 'retries': 0, 'give_ups': 0,
+                                                                 'parse_successes': 0, 'parse_failures': 0})
+            if record['event'] == 'llm_call':
+                stage_summary['calls'] += 1
+                stage_summary['failed_calls'] += 0 if record['success'] else 1
+                stage_summary['latencies'].append(record['latency'])
+                if record['time_to_first_token'] is not None:
+                    stage_summary['times_to_first_token'].append(record['time_to_first_token'])
+                stage_summary['input_tokens'] += record.get('input_tokens') or 0
+                stage_summary['output_tokens'] += record.get('output_tokens') or 0
+            elif record['event'] == 'retry':
+                stage_summary['retries'] += 1
+            elif record['event'] == 'give_up':
+                stage_summary['give_ups'] += 1
+            elif record['event'] == 'parse':
+                stage_summary['parse_successes' if record.get('success') else 'parse_failures'] += 1
+
+        for stage_summary in summary.values():
+            latencies = sorted(stage_summary.pop('latencies'))
+            times_to_first_token = stage_summary.pop('times_to_first_token')
+            stage_summary['total_latency'] = sum(latencies)
+            stage_summary['mean_latency'] = sum(latencies) / len(latencies) if len(latencies) > 0 else None
+            stage_summary['p95_latency'] = latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] if len(latencies) > 0 else None
+            stage_summary['mean_time_to_first_token'] = sum(times_to_first_token) / len(times_to_first_token) if len(times_to_first_token) > 0 else None
+        return summary
+
+    def to_jsonl(self, file_path, append=True):
+        """
+        Export the records as JSON lines.
+
+        Parameters:
+        - file_path (str): The path of the output file.
+        - append (bool, optional): Whether to append to an existing file. Defaults to True.
+        """
+        with open(file_path, 'a' if append else 'w', encoding='utf-8') as output_file:
+            for record in self.get_records():
+                output_file.write(json.dumps(record, default=str) + '\n')
+
+    def to_prometheus(self, prefix='datawizz'):
+        """
+        Export the summary in the Prometheus text exposition format.
+
+        Parameters:
+        - prefix (str, optional): The prefix of the metric names. Defaults to 'datawizz'.
+
+        Returns:
+        str: The metrics text.
+        """
+        metrics = [
+            ('llm_calls_total', 'counter', 'Number of language model calls.', 'calls'),
+            ('llm_failed_calls_total', 'counter', 'Number of failed language model calls.', 'failed_calls'),
+            ('llm_latency_seconds_sum', 'counter', 'Total wall latency of the language model calls.', 'total_latency'),
+            ('llm_latency_seconds_p95', 'gauge', '95th percentile wall latency of the language model calls.', 'p95_latency'),
+            ('llm_time_to_first_token_seconds', 'gauge', 'Mean time to the first streamed token.', 'mean_time_to_first_token'),
+            ('llm_input_tokens_total', 'counter', 'Number of input tokens.', 'input_tokens'),
+            ('llm_output_tokens_total', 'counter', 'Number of output tokens.', 'output_tokens'),
+            ('llm_retries_total', 'counter', 'Number of failed attempts that were retried.', 'retries'),
+            ('llm_give_ups_total', 'counter', 'Number of operations that failed after all their attempts.', 'give_ups'),
+            ('llm_parse_successes_total', 'counter', 'Number of outputs parsed successfully.', 'parse_successes'),
+            ('llm_parse_failures_total', 'counter', 'Number of outputs that could not be parsed.', 'parse_failures'),
+        ]
+        summary = self.get_summary()
+        lines = []
+        for name, metric_type, description, key in metrics:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for stage, stage_summary in summary.items():
+                if stage_summary[key] is not None:
+                    lines.append(f'{prefix}_{name}{{run="{self.run_name}",stage="{stage}"}} {stage_summary[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def get_token_usage(response):
+    """
+    Get the input and output tokens of a language model response, from the provider's token usage or the messages' usage metadata.
+
+    Parameters:
+    - response (LLMResult): The response.
+
+    Returns:
+    tuple: The numbers of input and output tokens (None if unknown).
+    """
+    token_usage = (response.llm_output or {}).get('token_usage') or {}
+    if 'prompt_tokens' in token_usage:
+        return token_usage.get('prompt_tokens'), token_usage.get('completion_tokens')
+    input_tokens, output_tokens = None, None
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if usage:
+                input_tokens = (input_tokens or 0) + usage.get('input_tokens', 0)
+                output_tokens = (output_tokens or 0) + usage.get('output_tokens', 0)
+    return input_tokens, output_tokens
+
+
+def with_telemetry(llm, telemetry):
+    """
+    Get a copy of a language model that reports its calls to a telemetry handler (the original model is not modified).
+
+    Parameters:
+    - llm: The language model.
+    - telemetry (LLMTelemetry): The telemetry handler, or None.
+
+    Returns:
+    The language model copy, or the language model itself if no telemetry handler is given.
+    """
+    if telemetry is None:
+        return llm
+    return with_callback(llm, telemetry)
+
+
+def with_stage(telemetry, stage):
+    """
+    Get the handler of a stage (see LLMTelemetry.with_stage), or None if no telemetry handler is given.
+    """
+    return telemetry.with_stage(stage) if telemetry is not None else None
+
+
+def record_event(telemetry, event, **fields):
+    """
+    Record a component event (see LLMTelemetry.record_event), if a telemetry handler is given.
+    """
+    if telemetry is not None:
+        telemetry.record_event(event, **fields)
+
+
+@contextlib.contextmanager
+def track_parse(telemetry):
+    """
+    A context manager that records the outcome of parsing a language model output: a successful 'parse' event, or a
+    failed one (with the error) if the block raises an exception, which is then raised again.
+
+    Parameters:
+    - telemetry (LLMTelemetry): The telemetry handler, or None.
+    """
+    try:
+        yield
+    except Exception as ex:
+        record_event(telemetry, 'parse', success=False, error=ex)
+        raise
+    record_event(telemetry, 'parse', success=True)
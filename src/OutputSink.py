@@ -0,0 +1,400 @@
+import gzip
+import os
+import re
+from src.utils.lazy_import import LazyModule
+
+# pandas is imported on first use, and pyarrow (an optional dependency of the Parquet and Arrow sinks) when such a sink is built
+pd = LazyModule('pandas')
+
+
+def get_pyarrow():
+    """
+    Import pyarrow, which the Parquet and Arrow IPC sinks require.
+
+    Returns:
+    module: The pyarrow module.
+
+    Raises:
+    ImportError: If pyarrow is not installed.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ImportError("The Parquet and Arrow output sinks require pyarrow (pip install pyarrow)")
+
+
+def is_missing(value):
+    return (value is None) or (isinstance(value, float) and value != value)
+
+
+def series_to_arrow(series, arrow_type=None):
+    """
+    Convert a column to an Arrow array. A column of mixed types (e.g. numbers and texts in the same free text field) is
+    converted to strings, and a column of missing values only is typed as strings.
+
+    Parameters:
+    - series (Series): The column.
+    - arrow_type (pyarrow.DataType, optional): The type of the column in the sink schema. Values that cannot be converted
+      to it are written as missing values. Defaults to None (inferred).
+
+    Returns:
+    pyarrow.Array: The array.
+    """
+    pa = get_pyarrow()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # The batches of a table have different categories, so the values are written (and dictionary encoded by the file format)
+        series = series.astype(series.cat.categories.dtype)
+    try:
+        array = pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        array = pa.array([None if is_missing(value) else str(value) for value in series], type=pa.string())
+    if pa.types.is_null(array.type):
+        array = array.cast(arrow_type if arrow_type is not None else pa.string())
+    if (arrow_type is None) or (array.type == arrow_type):
+        return array
+    try:
+        return array.cast(arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pass
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pa.array([None if is_missing(value) else str(value) for value in series], type=arrow_type)
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        return pa.array(pd.to_numeric(series, errors='coerce'), from_pandas=True).cast(arrow_type, safe=False)
+    if pa.types.is_timestamp(arrow_type):
+        return pa.array(pd.to_datetime(series, errors='coerce', utc=arrow_type.tz is not None), from_pandas=True).cast(arrow_type, safe=False)
+    return pa.nulls(len(series), type=arrow_type)
+
+
+def dataframe_to_arrow(dataframe, schema=None):
+    """
+    Convert a DataFrame to an Arrow table (without its index).
+
+    Parameters:
+    - dataframe (DataFrame): The DataFrame.
+    - schema (pyarrow.Schema, optional): The schema of the sink: the columns are aligned to it (missing columns are filled
+      with missing values, and extra columns are dropped) and converted to its types. Defaults to None (inferred).
+
+    Returns:
+    pyarrow.Table: The table.
+    """
+    pa = get_pyarrow()
+    columns = {str(name): dataframe.iloc[:, index] for index, name in enumerate(dataframe.columns)}
+    if schema is None:
+        return pa.table({name: series_to_arrow(series) for name, series in columns.items()})
+    arrays = [series_to_arrow(columns[field.name], field.type) if field.name in columns else pa.nulls(len(dataframe), type=field.type)
+              for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class OutputSink:
+    """
+    The base class of the output sinks, which write the generated tables to files batch by batch (see write), so large
+    generations do not have to be kept in memory. Each table is written to its own file (or directory) under the path of
+    the sink; the schema of a table is set by its first non empty batch. A sink is closed (and its files completed) by
+    close, or by leaving its `with` block.
+    """
+
+    file_extension = ''
+
+    def __init__(self, path):
+        """
+        Initializes a new instance of the OutputSink class.
+
+        Parameters:
+        - path (str): The directory the tables are written to (created if needed).
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Pairs of table name and its path, number of rows and number of batches written
+        self.tables = {}
+        # The empty batches of the tables that have no rows yet, written on close so every table has a file
+        self.empty_batches = {}
+        self.closed = False
+
+    def get_table_path(self, table_name):
+        return os.path.join(self.path, re.sub(r'[^\w.\-]', '_', str(table_name)) + self.file_extension)
+
+    def write(self, table_name, dataframe):
+        """
+        Append a batch of records to a table.
+
+        Parameters:
+        - table_name (str): The table name.
+        - dataframe (DataFrame): The batch.
+        """
+        if self.closed:
+            raise ValueError("The output sink is closed")
+        if len(dataframe) == 0:
+            if table_name not in self.tables:
+                self.empty_batches[table_name] = dataframe
+            return
+        self.empty_batches.pop(table_name, None)
+        if table_name not in self.tables:
+            self.tables[table_name] = {'path': self.get_table_path(table_name), 'rows': 0, 'batches': 0}
+        self.write_batch(table_name, dataframe)
+        self.tables[table_name]['rows'] += len(dataframe)
+        self.tables[table_name]['batches'] += 1
+
+    def write_tables(self, dataframes_dict):
+        """
+        Append a batch of each table.
+
+        Parameters:
+        - dataframes_dict (dict): Pairs of table name and batch (DataFrame).
+        """
+        for table_name, dataframe in dataframes_dict.items():
+            self.write(table_name, dataframe)
+
+    def write_batch(self, table_name, dataframe):
+        raise NotImplementedError
+
+    def close_tables(self):
+        pass
+
+    def close(self):
+        """
+        Complete the files of the tables.
+
+        Returns:
+        dict: The summary of the written tables (see get_summary).
+        """
+        if not self.closed:
+            for table_name, dataframe in list(self.empty_batches.items()):
+                self.tables[table_name] = {'path': self.get_table_path(table_name), 'rows': 0, 'batches': 0}
+                self.write_batch(table_name, dataframe)
+            self.empty_batches = {}
+            self.close_tables()
+            self.closed = True
+        return self.get_summary()
+
+    def get_summary(self):
+        """
+        Get the summary of the written tables.
+
+        Returns:
+        dict: Pairs of table name and a dictionary with its path, its number of rows and its number of batches.
+        """
+        return {table_name: dict(info) for table_name, info in self.tables.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class CSVSink(OutputSink):
+    """
+    Writes each table to a CSV file (optionally gzip compressed). The header is written with the first batch, and the
+    columns of the later batches are aligned to it.
+    """
+
+    def __init__(self, path, compression=None, **to_csv_kwargs):
+        """
+        Initializes a new instance of the CSVSink class.
+
+        Parameters:
+        - path (str): The directory the tables are written to.
+        - compression (str, optional): None or 'gzip'. Defaults to None.
+        - to_csv_kwargs: Other arguments of DataFrame.to_csv (e.g. sep).
+        """
+        if compression not in [None, 'gzip']:
+            raise ValueError(f"Unsupported CSV compression {compression!r} (expected None or 'gzip')")
+        self.file_extension = '.csv.gz' if compression == 'gzip' else '.csv'
+        self.compression = compression
+        self.to_csv_kwargs = to_csv_kwargs
+        self.files = {}
+        self.columns = {}
+        super().__init__(path)
+
+    def write_batch(self, table_name, dataframe):
+        if table_name not in self.files:
+            table_path = self.tables[table_name]['path']
+            self.files[table_name] = gzip.open(table_path, 'wt', newline='') if self.compression == 'gzip' else open(table_path, 'w', newline='')
+            self.columns[table_name] = list(dataframe.columns)
+            header = True
+        else:
+            dataframe = dataframe.reindex(columns=self.columns[table_name])
+            header = False
+        dataframe.to_csv(self.files[table_name], header=header, index=False, **self.to_csv_kwargs)
+
+    def close_tables(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+
+class ParquetSink(OutputSink):
+    """
+    Writes each table to a Parquet file, or to a directory of Parquet files partitioned by the values of some columns
+    (requires pyarrow).
+    """
+
+    file_extension = '.parquet'
+
+    def __init__(self, path, compression='snappy', partition_cols=None, row_group_size=None):
+        """
+        Initializes a new instance of the ParquetSink class.
+
+        Parameters:
+        - path (str): The directory the tables are written to.
+        - compression (str, optional): The compression codec ('snappy', 'zstd', 'gzip', 'brotli', 'lz4' or None). Defaults to 'snappy'.
+        - partition_cols (dict or list, optional): The columns each table is partitioned by (a list for all the tables, or
+          pairs of table name and list); a partitioned table is a directory with a sub-directory per value (e.g.
+          orders/country=US/). Defaults to None (a single file per table).
+        - row_group_size (int, optional): Maximal number of rows per row group. Defaults to None (one row group per batch).
+        """
+        self.pyarrow = get_pyarrow()
+        self.compression = compression
+        self.partition_cols = partition_cols
+        self.row_group_size = row_group_size
+        self.writers = {}
+        self.schemas = {}
+        super().__init__(path)
+
+    def get_partition_cols(self, table_name):
+        if isinstance(self.partition_cols, dict):
+            return self.partition_cols.get(table_name)
+        return self.partition_cols
+
+    def get_table_path(self, table_name):
+        table_path = super().get_table_path(table_name)
+        # A partitioned table is a directory
+        return table_path[:-len(self.file_extension)] if self.get_partition_cols(table_name) else table_path
+
+    def write_batch(self, table_name, dataframe):
+        table = dataframe_to_arrow(dataframe, self.schemas.get(table_name))
+        self.schemas.setdefault(table_name, table.schema)
+        partition_cols = self.get_partition_cols(table_name)
+        if partition_cols:
+            batch_index = self.tables[table_name]['batches']
+            self.pyarrow.parquet.write_to_dataset(table, root_path=self.tables[table_name]['path'], partition_cols=partition_cols,
+                                                  compression=self.compression, basename_template=f"part-{batch_index}-{{i}}.parquet",
+                                                  existing_data_behavior='overwrite_or_ignore')
+            return
+        if table_name not in self.writers:
+            self.writers[table_name] = self.pyarrow.parquet.ParquetWriter(self.tables[table_name]['path'], table.schema,
+                                                                          compression=self.compression)
+        self.writers[table_name].write_table(table, row_group_size=self.row_group_size)
+
+    def close_tables(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+class ArrowSink(OutputSink):
+    """
+    Writes each table to an Arrow IPC file (the Feather v2 format), which is read back with memory mapping (requires pyarrow).
+    """
+
+    file_extension = '.arrow'
+
+    def __init__(self, path, compression=None):
+        """
+        Initializes a new instance of the ArrowSink class.
+
+        Parameters:
+        - path (str): The directory the tables are written to.
+        - compression (str, optional): None, 'lz4' or 'zstd'. Defaults to None.
+        """
+        self.pyarrow = get_pyarrow()
+        self.compression = compression
+        self.writers = {}
+        self.schemas = {}
+        super().__init__(path)
+
+    def write_batch(self, table_name, dataframe):
+        table = dataframe_to_arrow(dataframe, self.schemas.get(table_name))
+        if table_name not in self.writers:
+            self.schemas[table_name] = table.schema
+            options = self.pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+            self.writers[table_name] = self.pyarrow.ipc.new_file(self.tables[table_name]['path'], table.schema, options=options)
+        self.writers[table_name].write_table(table)
+
+    def close_tables(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+# The output sinks, by output format
+OUTPUT_SINKS = {'parquet': ParquetSink, 'arrow': ArrowSink, 'csv': CSVSink}
+
+
+def create_output_sink(output_format, path, **kwargs):
+    """
+    Create an output sink.
+
+    Parameters:
+    - output_format (str): 'parquet', 'arrow' or 'csv'.
+    - path (str): The directory the tables are written to.
+    - kwargs: The other arguments of the sink (e.g. compression).
+
+    Returns:
+    OutputSink: The sink.
+    """
+    if output_format not in OUTPUT_SINKS:
+        raise ValueError(f"Unknown output format {output_format!r} (expected one of {list(OUTPUT_SINKS.keys())})")
+    return OUTPUT_SINKS[output_format](path, **kwargs)
+
+
+class OutputCollector:
+    """
+    Collects the batches of generated tables: each batch is coerced to the schema of the tables (if any), written to an
+    output sink (if any) as it arrives, and the tables are kept in memory unless keep_in_memory is False.
+    """
+
+    def __init__(self, sink=None, keep_in_memory=True, max_records=None, schema=None):
+        """
+        Initializes a new instance of the OutputCollector class.
+
+        Parameters:
+        - sink (OutputSink, optional): The sink the batches are written to. Defaults to None.
+        - keep_in_memory (bool, optional): Whether to keep the tables in memory (always True without a sink). Defaults to True.
+        - max_records (int, optional): Maximal number of records per table; the records beyond it are dropped. Defaults to None.
+        - schema (TableSchema, optional): The schema the batches are coerced to. Defaults to None (the dtypes of each batch).
+        """
+        self.schema = schema
+        self.sink = sink
+        self.keep_in_memory = keep_in_memory or (sink is None)
+        self.max_records = max_records
+        self.counts = {}
+        self.batches = {}
+
+    def add(self, dataframes_dict):
+        """
+        Add a batch of each table.
+
+        Parameters:
+        - dataframes_dict (dict): Pairs of table name and batch (DataFrame).
+        """
+        if self.schema is not None:
+            dataframes_dict = self.schema.coerce_tables(dataframes_dict)
+        for table_name, dataframe in dataframes_dict.items():
+            if self.max_records is not None:
+                dataframe = dataframe[:max(self.max_records - self.counts.get(table_name, 0), 0)]
+            if self.sink is not None:
+                self.sink.write(table_name, dataframe)
+            if self.keep_in_memory:
+                self.batches.setdefault(table_name, []).append(dataframe)
+            self.counts[table_name] = self.counts.get(table_name, 0) + len(dataframe)
+
+    def get_count(self, table_name):
+        return self.counts.get(table_name, 0)
+
+    def get_tables(self):
+        """
+        Get the tables kept in memory.
+
+        Returns:
+        dict: Pairs of table name and DataFrame (empty if the tables are not kept in memory).
+        """
+        if self.schema is not None:
+            return {table_name: self.schema.concat(batches) for table_name, batches in self.batches.items()}
+        return {table_name: pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0].reset_index(drop=True)
+                for table_name, batches in self.batches.items()}
@@ -1,3 +1,7 @@
+import difflib
+import re
+
+
 class Pipeline:
     """
     A set of functionalities for mapping the supported pipelines to their respective names.
@@ -77,4 +81,34 @@ class Pipeline:
         if label in pipeline_mapping:
             return pipeline_mapping[label]
         else:
-            raise ValueError("Invalid pipeline name")
\ No newline at end of file
+            raise ValueError("Invalid pipeline name")
+
+
+    def find_pipeline_name(label, cutoff=0.6):
+        """
+        Find the pipeline name that best matches a label (e.g. a language model output), tolerating different casing,
+        punctuation, surrounding text and small spelling mistakes.
+
+        Parameters:
+        - label (str): The label.
+        - cutoff (float, optional): The minimal similarity ratio of a fuzzy match (between 0-1). Defaults to 0.6.
+
+        Returns:
+        str: The pipeline name.
+        """
+        pipeline_names = [name for name in Pipeline.pipelines_dict.keys() if name != Pipeline.UNKNOWN]
+        normalized_names = {re.sub(r"[^a-z]", "", name.lower()): name for name in pipeline_names + [Pipeline.UNKNOWN]}
+        normalized_label = re.sub(r"[^a-z]", "", str(label).lower())
+        if normalized_label in normalized_names:
+            return normalized_names[normalized_label]
+
+        # A pipeline name mentioned within a longer output (the longest one, as names may contain each other)
+        mentioned_names = [name for normalized_name, name in normalized_names.items()
+                           if (name != Pipeline.UNKNOWN) and (normalized_name in normalized_label)]
+        if len(mentioned_names) > 0:
+            return max(mentioned_names, key=len)
+
+        close_matches = difflib.get_close_matches(normalized_label, list(normalized_names.keys()), n=1, cutoff=cutoff)
+        if len(close_matches) > 0:
+            return normalized_names[close_matches[0]]
+        raise ValueError("Invalid pipeline name")
\ No newline at end of file
@@ -0,0 +1,215 @@
+import re
+import zlib
+import numpy as np
+from src.Pipeline import Pipeline
+
+
+# Patterns that identify a pipeline with high confidence (pipeline name, regular expression, confidence). They only match
+# actual SQL statements and API specifications, since prose (e.g. "customers select products from a catalog") is left to
+# the linear model and the language model.
+SQL_IDENTIFIER = r"[\w\"`\[\]]+(\.[\w\"`\[\]]+)?"
+PIPELINE_RULES = [
+    (Pipeline.SQLToTabular, rf"\bcreate\s+(or\s+replace\s+)?table\s+(if\s+not\s+exists\s+)?{SQL_IDENTIFIER}\s*\(|"
+                            rf"\binsert\s+into\s+{SQL_IDENTIFIER}\s*(\(|values\b)|\balter\s+table\s+{SQL_IDENTIFIER}\s+(add|drop|alter|rename)\b|"
+                            rf"^\s*select\s+(\*|{SQL_IDENTIFIER}(\s*,\s*{SQL_IDENTIFIER})*)\s+from\s+{SQL_IDENTIFIER}\s*(;|$|\b(where|join|inner|left|group|order|limit)\b)", 0.99),
+    (Pipeline.SQLToTabular, r"\b(varchar|nvarchar|char|decimal|numeric)\s*\(\s*\d+|\b(primary|foreign)\s+key\s*\(\s*\w+|\breferences\s+\w+\s*\(\s*\w+\s*\)", 0.95),
+    (Pipeline.APISpecificationToData, r"(^|[{,])\s*[\"']?(openapi|swagger)[\"']?\s*:\s*[\"']?\d|^\s*paths\s*:\s*$|[\"']paths[\"']\s*:\s*\{|"
+                                      r"(?-i:\b(GET|POST|PUT|PATCH|DELETE)\s+/[\w{}\-]+)", 0.99),
+]
+
+# Seed examples for the bundled linear model
+PIPELINE_SEED_EXAMPLES = {
+    Pipeline.DescriptionToMLDataset: [
+        "a dataset for training a model to predict customer churn",
+        "training data for a fraud detection classifier",
+        "features and labels for predicting house prices",
+        "a labeled dataset for credit risk classification",
+        "ml dataset to predict employee attrition with a target column",
+        "data for a regression model that estimates delivery time",
+        "a flat table of patient features for predicting readmission",
+        "machine learning data for sentiment classification with labels",
+        "create a dataset to train a recommendation model",
+        "synthetic training set for anomaly detection in sensor readings",
+    ],
+    Pipeline.DescriptionToDB: [
+        "a relational database for an online shop with customers orders and products",
+        "database tables for a hospital with patients doctors and appointments",
+        "a schema for a library system with books members and loans",
+        "generate tables for a crm with accounts contacts and opportunities",
+        "a db for a school with students courses teachers and enrollments",
+        "multiple related tables for a bank: clients, accounts and transactions",
+        "an ecommerce database with a customers table and an orders table linked by customer id",
+        "relational data for a airline with flights passengers and bookings",
+        "a database of employees departments and salaries with foreign keys",
+        "tables for an inventory management system with warehouses and stock",
+    ],
+    Pipeline.SQLToTabular: [
+        "create table users (id int primary key, name varchar(50))",
+        "generate data for this sql schema: create table orders",
+        "fill these sql tables with data",
+        "sql ddl for products and categories tables",
+        "insert into statements for the following table definitions",
+        "data that fits this sql create statement",
+        "populate the tables defined by the following sql",
+        "sample rows for the schema: table customers columns id integer, email text",
+    ],
+    Pipeline.DescriptionToUnstructured: [
+        "customer support emails complaining about late deliveries",
+        "product reviews written by users of a coffee machine",
+        "tweets about a new smartphone launch",
+        "free text medical notes written by doctors",
+        "chat conversations between a user and a travel agent",
+        "news articles about renewable energy",
+        "short stories for children about animals",
+        "resumes of software engineers",
+        "legal contract paragraphs about confidentiality",
+        "texts of restaurant reviews in different tones",
+    ],
+    Pipeline.ExamplesDataframeToTabular: [
+        "generate more records like these examples",
+        "here are some sample rows, produce similar data",
+        "augment the following example dataframe",
+        "create additional rows that follow the given examples",
+        "more data in the same structure as this csv sample",
+        "use the attached examples to generate similar records",
+    ],
+    Pipeline.APISpecificationToData: [
+        "generate requests and responses for the weather api",
+        "synthetic api calls for the payments endpoint",
+        "openapi specification of a pet store, create calls",
+        "sample inputs and outputs of a rest api for user management",
+        "api calls with request body and response for the booking service",
+        "generate payloads for the get /users and post /orders endpoints",
+        "swagger spec for an inventory service, produce api traffic",
+        "json requests and responses for a graphql api",
+    ],
+}
+
+
+class PipelineClassifier:
+    """
+    A class for choosing the pipeline of a user description locally, without calling a language model.
+    """
+
+    _default_weights = None
+
+    def __init__(self, num_features=4096, confidence_threshold=0.6, examples_dict=None, num_epochs=300, learning_rate=0.5):
+        """
+        Initializes a new instance of the PipelineClassifier class, which combines keyword rules (e.g. SQL DDL or API
+        specifications) with a small linear (softmax) model over hashed word and character n-grams, trained on bundled seed
+        examples. Descriptions it cannot classify confidently are left for the language model.
+
+        Parameters:
+        - num_features (int, optional): The number of hashed features. Defaults to 4096.
+        - confidence_threshold (float, optional): The minimal probability of the model's prediction. Defaults to 0.6.
+        - examples_dict (dict, optional): Pairs of key (pipeline name) and value (list of example descriptions) used for
+          training. Defaults to None (the bundled seed examples).
+        - num_epochs (int, optional): Number of training epochs. Defaults to 300.
+        - learning_rate (float, optional): The learning rate of the training. Defaults to 0.5.
+        """
+        self.num_features = num_features
+        self.confidence_threshold = confidence_threshold
+        self.rules = [(pipeline_name, re.compile(pattern, re.IGNORECASE | re.MULTILINE), confidence)
+                      for pipeline_name, pattern, confidence in PIPELINE_RULES]
+        self.labels = list(PIPELINE_SEED_EXAMPLES.keys()) if examples_dict is None else list(examples_dict.keys())
+
+        # The model trained on the bundled examples is shared by all the instances
+        if (examples_dict is None) and (PipelineClassifier._default_weights is not None) and \
+                (PipelineClassifier._default_weights.shape[0] == num_features):
+            self.weights = PipelineClassifier._default_weights
+        else:
+            self.weights = self.train(PIPELINE_SEED_EXAMPLES if examples_dict is None else examples_dict, num_epochs, learning_rate)
+            if examples_dict is None:
+                PipelineClassifier._default_weights = self.weights
+
+    def get_features(self, description):
+        """
+        Compute the hashed n-gram features of a description (word unigrams and bigrams, and character trigrams).
+
+        Parameters:
+        - description (str): The description.
+
+        Returns:
+        numpy.ndarray: The L2 normalized feature vector.
+        """
+        text = " ".join(re.findall(r"\w+", str(description).lower()))
+        words = text.split()
+        ngrams = words + [" ".join(pair) for pair in zip(words, words[1:])]
+        padded_text = f" {text} "
+        ngrams += [padded_text[i:i + 3] for i in range(len(padded_text) - 2)]
+        features = np.zeros(self.num_features)
+        if len(ngrams) == 0:
+            return features
+        indices = np.fromiter((zlib.crc32(ngram.encode('utf-8')) % self.num_features for ngram in ngrams), dtype=np.int64, count=len(ngrams))
+        np.add.at(features, indices, 1.0)
+        return features / np.linalg.norm(features)
+
+    def train(self, examples_dict, num_epochs=300, learning_rate=0.5):
+        """
+        Train the linear model with full batch gradient descent of the softmax (cross entropy) loss.
+
+        Parameters:
+        - examples_dict (dict): Pairs of key (pipeline name) and value (list of example descriptions).
+        - num_epochs (int, optional): Number of training epochs. Defaults to 300.
+        - learning_rate (float, optional): The learning rate. Defaults to 0.5.
+
+        Returns:
+        numpy.ndarray: The weights (num_features x number of labels).
+        """
+        features = np.stack([self.get_features(example) for label in self.labels for example in examples_dict[label]])
+        targets = np.zeros((len(features), len(self.labels)))
+        targets[np.arange(len(features)), [i for i, label in enumerate(self.labels) for _ in examples_dict[label]]] = 1.0
+        # Train only the weights of the features that appear in the examples (the others stay zero)
+        used_features = np.flatnonzero(features.any(axis=0))
+        features = features[:, used_features]
+        used_weights = np.zeros((len(used_features), len(self.labels)))
+        for _ in range(num_epochs):
+            probabilities = self.softmax(features @ used_weights)
+            used_weights -= learning_rate * features.T @ (probabilities - targets) / len(features)
+        weights = np.zeros((self.num_features, len(self.labels)))
+        weights[used_features] = used_weights
+        return weights
+
+    @staticmethod
+    def softmax(scores):
+        """
+        Compute the softmax of scores along the last axis.
+        """
+        scores = scores - scores.max(axis=-1, keepdims=True)
+        exponents = np.exp(scores)
+        return exponents / exponents.sum(axis=-1, keepdims=True)
+
+    def predict(self, description):
+        """
+        Predict the pipeline of a description, with the keyword rules first and the linear model otherwise.
+
+        Parameters:
+        - description (str): The user's description of the task.
+
+        Returns:
+        tuple: The pipeline name and the confidence of the prediction (a probability).
+        """
+        for pipeline_name, pattern, confidence in self.rules:
+            if pattern.search(str(description)):
+                return pipeline_name, confidence
+        probabilities = self.softmax(self.get_features(description) @ self.weights)
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+    def classify(self, description, confidence_threshold=None):
+        """
+        Classify a description if the prediction is confident enough.
+
+        Parameters:
+        - description (str): The user's description of the task.
+        - confidence_threshold (float, optional): The minimal confidence. Defaults to the classifier's threshold.
+
+        Returns:
+        str: The pipeline name, or None if the confidence is below the threshold.
+        """
+        if confidence_threshold is None:
+            confidence_threshold = self.confidence_threshold
+        pipeline_name, confidence = self.predict(description)
+        if confidence >= confidence_threshold:
+            return pipeline_name
+        return None
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import time
+
+
+# How often a request checks whether enough latencies were observed to hedge it
+POLL_SECONDS = 0.1
+
+
+class RequestHedger:
+    """
+    Hedges the slow requests of the parallel rounds (see DataAugmentor.generate_data_in_parallel and
+    DataTransformer.transform_in_parallel): once a request has been running longer than a percentile of the observed
+    latencies, a duplicate request is sent, the first response wins and the other request is cancelled. The duplicates
+    are capped to a fraction of the requests, so hedging cannot multiply the load on the provider.
+    """
+
+    def __init__(self, percentile=0.95, min_observations=10, max_extra_fraction=0.1, min_delay_seconds=0.0, window_size=200):
+        """
+        Initializes a new instance of the RequestHedger class.
+
+        Parameters:
+        - percentile (float, optional): The percentile of the observed latencies after which a duplicate request is sent.
+          Defaults to 0.95.
+        - min_observations (int, optional): Minimal number of observed latencies before requests are hedged. Defaults to 10.
+        - max_extra_fraction (float, optional): Maximum number of duplicate requests, as a fraction of the requests. Defaults to 0.1.
+        - min_delay_seconds (float, optional): Minimal time before a duplicate request is sent. Defaults to 0.
+        - window_size (int, optional): Number of recent latencies (per kind of request) the percentile is computed on. Defaults to 200.
+        """
+        self.percentile = percentile
+        self.min_observations = min_observations
+        self.max_extra_fraction = max_extra_fraction
+        self.min_delay_seconds = min_delay_seconds
+        self.window_size = window_size
+        self.lock = threading.Lock()
+        self.latencies = {}
+        # End-to-end latencies of the hedged requests (from the start of the first request to the winning response)
+        self.request_latencies = []
+        self.metrics = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'skipped_hedges': 0, 'saved_seconds': 0.0}
+
+    def observe(self, key, latency):
+        with self.lock:
+            self.latencies[key] = (self.latencies.get(key, []) + [latency])[-self.window_size:]
+
+    def get_hedge_delay(self, key):
+        """
+        Get the time after which a request is hedged.
+
+        Parameters:
+        - key (str): The kind of request (latencies of different kinds of requests are observed separately).
+
+        Returns:
+        float: The delay in seconds, or None if there are not enough observed latencies yet.
+        """
+        with self.lock:
+            latencies = sorted(self.latencies.get(key, []))
+        if len(latencies) < max(self.min_observations, 1):
+            return None
+        return max(latencies[min(int(self.percentile * len(latencies)), len(latencies) - 1)], self.min_delay_seconds)
+
+    def estimate_remaining_seconds(self, key, elapsed):
+        """
+        Estimate how much longer a request that has been running for the given time would take (the mean of the observed
+        latencies beyond that time, minus the time), which is the time a winning duplicate saved.
+        """
+        with self.lock:
+            longer_latencies = [latency for latency in self.latencies.get(key, []) if latency > elapsed]
+        if len(longer_latencies) == 0:
+            return 0.0
+        return sum(longer_latencies) / len(longer_latencies) - elapsed
+
+    def reserve_hedge(self):
+        with self.lock:
+            if self.metrics['hedges'] + 1 > self.max_extra_fraction * self.metrics['requests']:
+                self.metrics['skipped_hedges'] += 1
+                return False
+            self.metrics['hedges'] += 1
+            return True
+
+    async def run(self, create_request, key='default'):
+        """
+        Run a request, and hedge it if it is slow.
+
+        Parameters:
+        - create_request (callable): A function that returns a new coroutine of the request (called again for the duplicate).
+        - key (str, optional): The kind of request (see get_hedge_delay). Defaults to 'default'.
+
+        Returns:
+        The response of the first request that succeeded. If both requests fail, the error of the last one is raised.
+        """
+        with self.lock:
+            self.metrics['requests'] += 1
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(create_request())
+        hedge = None
+        try:
+            # The requests of a round start together, so the delay is updated while the first latencies are observed
+            while not primary.done():
+                delay = self.get_hedge_delay(key)
+                elapsed = time.perf_counter() - start
+                if (delay is not None) and (elapsed >= delay):
+                    break
+                await asyncio.wait([primary], timeout=(delay - elapsed) if delay is not None else POLL_SECONDS)
+            if primary.done() or (not self.reserve_hedge()):
+                response = await primary
+                self.observe(key, time.perf_counter() - start)
+                self.record_request_latency(time.perf_counter() - start)
+                return response
+
+            hedge_start = time.perf_counter()
+            hedge = asyncio.ensure_future(create_request())
+            pending = {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # The errors of all the finished requests are retrieved; a failed request only loses if the other
+                # request can still succeed
+                errors = {task: (None if task.cancelled() else task.exception()) for task in done}
+                succeeded = [task for task in done if (not task.cancelled()) and (errors[task] is None)]
+                if (len(succeeded) > 0) or (len(pending) == 0):
+                    winner = succeeded[0] if len(succeeded) > 0 else done.pop()
+                    break
+        finally:
+            # The requests left running (e.g. when the caller is cancelled) are cancelled
+            for task in [primary, hedge]:
+                if (task is not None) and (not task.done()):
+                    task.cancel()
+
+        response = winner.result()
+        now = time.perf_counter()
+        if winner is hedge:
+            saved_seconds = self.estimate_remaining_seconds(key, now - start)
+            self.observe(key, now - hedge_start)
+            with self.lock:
+                self.metrics['hedge_wins'] += 1
+                self.metrics['saved_seconds'] += saved_seconds
+        else:
+            self.observe(key, now - start)
+        self.record_request_latency(now - start)
+        return response
+
+    def record_request_latency(self, latency):
+        with self.lock:
+            self.request_latencies = (self.request_latencies + [latency])[-self.window_size * 10:]
+
+    def get_metrics(self):
+        """
+        Get the hedging metrics.
+
+        Returns:
+        dict: The number of requests, duplicate requests, duplicates that won, and hedges skipped because of the cap, the
+        extra load (duplicates per request), the estimated tail latency saved by the winning duplicates, in seconds, and the
+        95th and 99th percentile end-to-end latencies of the requests.
+        """
+        with self.lock:
+            metrics = dict(self.metrics)
+            latencies = sorted(self.request_latencies)
+        metrics['extra_load'] = metrics['hedges'] / metrics['requests'] if metrics['requests'] > 0 else 0.0
+        for name, percentile in [('p95_latency', 0.95), ('p99_latency', 0.99)]:
+            metrics[name] = latencies[min(int(percentile * len(latencies)), len(latencies) - 1)] if len(latencies) > 0 else None
+        return metrics
+
+
+async def run_hedged(request_hedger, create_request, key='default'):
+    """
+    Run a request with a request hedger (see RequestHedger.run), or simply await it if no hedger is given.
+    """
+    if request_hedger is None:
+        return await create_request()
+    return await request_hedger.run(create_request, key=key)
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from src.BudgetGovernor import BudgetExceededError
+from src.utils.utils import with_callback
+
+
+# HTTP status codes of provider errors that are worth retrying, and of errors that will fail again (e.g. an invalid key
+# or a prompt longer than the context window)
+RETRYABLE_STATUS_CODES = [408, 409, 425, 429, 500, 502, 503, 504, 529]
+FATAL_STATUS_CODES = [400, 401, 402, 403, 404, 413, 422]
+FATAL_ERROR_NAMES = ['AuthenticationError', 'PermissionDeniedError', 'BadRequestError', 'NotFoundError', 'UnprocessableEntityError']
+TRANSIENT_ERROR_NAMES = ['Timeout', 'Connection', 'Overloaded', 'ServiceUnavailable', 'InternalServer']
+
+
+def get_status_code(error):
+    """
+    Get the HTTP status code of a provider error (from the error or its response).
+
+    Parameters:
+    - error (Exception): The error.
+
+    Returns:
+    int: The status code, or None if unknown.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def get_retry_after(error):
+    """
+    Get the time the provider asked to wait before retrying (the Retry-After header, or the retry_after of the error).
+
+    Parameters:
+    - error (Exception): The error.
+
+    Returns:
+    float: The time to wait in seconds, or None if not given.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None)
+        if headers is not None:
+            retry_after = headers.get('retry-after', headers.get('Retry-After'))
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """
+    Classify an error raised during a language model call.
+
+    Parameters:
+    - error (Exception): The error.
+
+    Returns:
+    str: 'rate_limit' (the provider's rate limit), 'transient' (timeouts, connection and server errors), 'fatal' (errors
+    that will fail again, e.g. authentication errors, invalid requests or an exhausted budget), or 'output' (any other
+    error, e.g. an output that could not be parsed, which is retried immediately).
+    """
+    if isinstance(error, BudgetExceededError):
+        return 'fatal'
+    status_code = get_status_code(error)
+    error_name = type(error).__name__
+    if (status_code == 429) or ('RateLimit' in error_name):
+        return 'rate_limit'
+    if (status_code in RETRYABLE_STATUS_CODES) or ((status_code is not None) and (status_code >= 500)):
+        return 'transient'
+    if (status_code in FATAL_STATUS_CODES) or (error_name in FATAL_ERROR_NAMES):
+        return 'fatal'
+    if isinstance(error, (TimeoutError, ConnectionError)) or any(name in error_name for name in TRANSIENT_ERROR_NAMES):
+        return 'transient'
+    return 'output'
+
+
+class CircuitBreaker(BaseCallbackHandler):
+    """
+    A callback handler that tracks the provider errors (rate limits and transient errors) of the language model calls,
+    and opens when their rate in a window of recent calls spikes: while it is open, all the calls that share it (see
+    RetryPolicy.before_attempt) pause. After the cooldown a single result decides whether it closes or opens again.
+    """
+
+    run_inline = True
+
+    def __init__(self, failure_rate_threshold=0.5, window_size=20, min_calls=10, cooldown_seconds=30.0, verbose=True):
+        """
+        Initializes a new instance of the CircuitBreaker class.
+
+        Parameters:
+        - failure_rate_threshold (float, optional): The rate of provider errors that opens the circuit. Defaults to 0.5.
+        - window_size (int, optional): Number of recent calls the rate is computed on. Defaults to 20.
+        - min_calls (int, optional): Minimal number of calls in the window before the circuit can open. Defaults to 10.
+        - cooldown_seconds (float, optional): How long the circuit stays open. Defaults to 30.
+        - verbose (bool, optional): Whether to print the state changes. Defaults to True.
+        """
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.cooldown_seconds = cooldown_seconds
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.results = []
+        self.open_until = 0.0
+        self.half_open = False
+        self.metrics = {'openings': 0, 'pauses': 0}
+
+    def get_state(self):
+        """
+        Get the state of the circuit.
+
+        Returns:
+        str: 'open' (calls pause), 'half_open' (the cooldown ended and the next result decides) or 'closed'.
+        """
+        with self.lock:
+            if time.monotonic() < self.open_until:
+                return 'open'
+            return 'half_open' if self.half_open else 'closed'
+
+    def get_wait_seconds(self):
+        """
+        Get the time left until the circuit stops pausing the calls.
+
+        Returns:
+        float: The time in seconds (0 if the calls can proceed).
+        """
+        with self.lock:
+            return max(self.open_until - time.monotonic(), 0.0)
+
+    def pause(self, seconds):
+        """
+        Pause all the calls for the given time (e.g. the Retry-After of a rate limit response), without opening the circuit.
+
+        Parameters:
+        - seconds (float): The time to pause.
+        """
+        with self.lock:
+            if time.monotonic() + seconds > self.open_until:
+                self.open_until = time.monotonic() + seconds
+                self.metrics['pauses'] += 1
+
+    def record(self, success):
+        """
+        Record the result of a call, and open the circuit if the rate of provider errors spiked.
+
+        Parameters:
+        - success (bool): Whether the call succeeded (only provider errors are recorded as failures).
+        """
+        with self.lock:
+            if time.monotonic() < self.open_until:
+                # The results of the calls sent before the circuit opened are ignored
+                return
+            if self.half_open:
+                # The first result after the cooldown decides
+                self.half_open = False
+                self.results = []
+                if success:
+                    return
+                self.open()
+                return
+            self.results = (self.results + [success])[-self.window_size:]
+            failures = self.results.count(False)
+            if (len(self.results) >= self.min_calls) and (failures / len(self.results) >= self.failure_rate_threshold):
+                if self.verbose:
+                    print(f"Too many language model errors ({failures} of the last {len(self.results)} calls). "
+                          f"Pausing all the calls for {self.cooldown_seconds} seconds.")
+                self.results = []
+                self.open()
+
+    def open(self):
+        # Called within the lock
+        self.open_until = time.monotonic() + self.cooldown_seconds
+        self.half_open = True
+        self.metrics['openings'] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.record(True)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if classify_error(error) in ['rate_limit', 'transient']:
+            self.record(False)
+
+
+class RetryPolicy:
+    """
+    A retry policy shared by the components of a pipeline: exponential backoff with jitter for provider errors, the
+    provider's Retry-After for rate limits, no retries for fatal errors, and an optional circuit breaker that pauses all
+    the calls when the error rate spikes.
+    """
+
+    def __init__(self, base_delay_seconds=1.0, max_delay_seconds=60.0, multiplier=2.0, jitter=True, respect_retry_after=True,
+                 circuit_breaker=None, seed=None):
+        """
+        Initializes a new instance of the RetryPolicy class.
+
+        Parameters:
+        - base_delay_seconds (float, optional): The delay before the first retry of a provider error. Defaults to 1.
+        - max_delay_seconds (float, optional): Maximum delay before a retry. Defaults to 60.
+        - multiplier (float, optional): The growth factor of the delay with every attempt. Defaults to 2.
+        - jitter (bool, optional): Whether to randomize the delays ("full jitter"), so concurrent tasks do not retry in
+          lockstep. Defaults to True.
+        - respect_retry_after (bool, optional): Whether to wait at least the provider's Retry-After on rate limits; all the
+          calls sharing the circuit breaker wait with it. Defaults to True.
+        - circuit_breaker (CircuitBreaker, optional): A circuit breaker shared by all the calls. Defaults to None.
+        - seed (int, optional): Seed for the jitter. Defaults to None.
+        """
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.respect_retry_after = respect_retry_after
+        self.circuit_breaker = circuit_breaker
+        self.rng = random.Random(seed)
+
+    def get_delay(self, error, attempt):
+        """
+        Get the delay before retrying a failed attempt.
+
+        Parameters:
+        - error (Exception): The error of the attempt.
+        - attempt (int): The number of failed attempts so far (1 for the first failure).
+
+        Returns:
+        float: The delay in seconds (0 for output errors).
+        """
+        error_class = classify_error(error)
+        if error_class == 'output':
+            return 0.0
+        delay = min(self.base_delay_seconds * self.multiplier ** max(attempt - 1, 0), self.max_delay_seconds)
+        if self.jitter:
+            delay = self.rng.uniform(0, delay)
+        retry_after = get_retry_after(error) if self.respect_retry_after else None
+        if retry_after is not None:
+            delay = max(delay, retry_after + (self.rng.uniform(0, self.base_delay_seconds) if self.jitter else 0.0))
+            if (error_class == 'rate_limit') and (self.circuit_breaker is not None):
+                self.circuit_breaker.pause(retry_after)
+        return delay
+
+    def is_fatal(self, error):
+        """
+        Whether an error will fail again, so it should not be retried (see classify_error).
+        """
+        return classify_error(error) == 'fatal'
+
+    def get_breaker_wait_seconds(self):
+        if self.circuit_breaker is None:
+            return 0.0
+        wait_seconds = self.circuit_breaker.get_wait_seconds()
+        if (wait_seconds > 0) and self.jitter:
+            # Spread the resumed calls
+            wait_seconds = wait_seconds + self.rng.uniform(0, self.base_delay_seconds)
+        return wait_seconds
+
+    def before_attempt(self):
+        """
+        Wait while the circuit breaker is open (call before every attempt).
+        """
+        wait_seconds = self.get_breaker_wait_seconds()
+        while wait_seconds > 0:
+            time.sleep(wait_seconds)
+            wait_seconds = self.get_breaker_wait_seconds()
+
+    async def abefore_attempt(self):
+        """
+        Asynchronously wait while the circuit breaker is open (see before_attempt).
+        """
+        wait_seconds = self.get_breaker_wait_seconds()
+        while wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+            wait_seconds = self.get_breaker_wait_seconds()
+
+    def wait_before_retry(self, error, attempt, max_attempts):
+        """
+        Decide whether to retry a failed attempt, and wait for the backoff delay if so.
+
+        Parameters:
+        - error (Exception): The error of the attempt.
+        - attempt (int): The number of failed attempts so far (1 for the first failure).
+        - max_attempts (int): Maximum number of attempts.
+
+        Returns:
+        bool: Whether to retry (False for fatal errors and when the attempts are exhausted).
+        """
+        if self.is_fatal(error) or (attempt >= max_attempts):
+            return False
+        delay = self.get_delay(error, attempt)
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    async def await_before_retry(self, error, attempt, max_attempts):
+        """
+        Asynchronously decide whether to retry a failed attempt, and wait for the backoff delay if so (see wait_before_retry).
+        """
+        if self.is_fatal(error) or (attempt >= max_attempts):
+            return False
+        delay = self.get_delay(error, attempt)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return True
+
+
+def with_retry_policy(llm, retry_policy):
+    """
+    Get a copy of a language model whose calls are tracked by the circuit breaker of a retry policy (the original model is
+    not modified).
+
+    Parameters:
+    - llm: The language model.
+    - retry_policy (RetryPolicy): The retry policy, or None.
+
+    Returns:
+    The language model copy, or the language model itself if there is no circuit breaker.
+    """
+    if (retry_policy is None) or (retry_policy.circuit_breaker is None):
+        return llm
+    return with_callback(llm, retry_policy.circuit_breaker)
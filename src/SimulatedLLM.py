@@ -0,0 +1,545 @@
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+from src.Pipeline import Pipeline
+from src.utils.wire_format import decode_wire_tables, encode_wire_tables, is_columnar_table
+
+
+# Number of characters of the chunks of a streamed response
+STREAM_CHUNK_CHARACTERS = 32
+
+# The default structured specification (see STRUCTURED_SPECIFICATION_FORMAT) behind the simulated responses
+DEFAULT_SIMULATED_SCHEMA = {
+    "tables": [
+        {"name": "customers", "primary_key": "customer_id", "columns": [
+            {"name": "customer_id", "type": "id", "prefix": "C", "start": 1, "width": 5},
+            {"name": "age", "type": "integer", "distribution": "normal", "mean": 40, "std": 12, "min": 18, "max": 90},
+            {"name": "segment", "type": "categorical", "categories": ["retail", "business", "premium"], "probabilities": [0.6, 0.3, 0.1]},
+            {"name": "signup_date", "type": "datetime", "min": "2020-01-01T00:00:00", "max": "2023-12-31T23:59:59", "format": "%Y-%m-%d %H:%M:%S"},
+            {"name": "bio", "type": "free_text"},
+        ]},
+        {"name": "orders", "primary_key": "order_id", "columns": [
+            {"name": "order_id", "type": "id", "start": 1},
+            {"name": "customer_id", "type": "foreign_key", "references": "customers.customer_id"},
+            {"name": "amount", "type": "float", "distribution": "lognormal", "mean": 80, "std": 40, "min": 1, "max": 1000, "decimals": 2},
+            {"name": "is_gift", "type": "boolean", "probability": 0.1},
+            {"name": "order_date", "type": "datetime", "min": "2020-01-01T00:00:00", "max": "2024-06-30T23:59:59", "format": "%Y-%m-%d %H:%M:%S",
+             "after": "customers.signup_date", "interval_mean_days": 60, "interval_std_days": 30},
+            {"name": "note", "type": "free_text", "null_fraction": 0.2},
+        ]},
+    ],
+    "generation_order": ["customers", "orders"],
+}
+
+# Pairs of prompt type and the markers (in the prompt templates of the components) that identify it, in order of precedence
+PROMPT_MARKERS = [
+    ('pipeline', ["Extracted pipeline:"]),
+    ('validation', ["Generated Validation Output:"]),
+    ('structured_specification', ["Generated Structured Specifications:"]),
+    ('specification_patch', ["Generated Specifications Patch:"]),
+    ('specification', ["Generated Extracted Specifications:", "Generated Your Revised Specifications:", "Generated Extracted Logic:"]),
+    ('code', ["Generated Extracted Code:"]),
+    ('value_pool', ["Generated Values:"]),
+    ('schema', ["Generate an initial synthetic data sample"]),
+    ('augmentation', ["Required Structure:"]),
+    ('transformation', ["The given source data is:"]),
+    ('transformation_logic', ["Extract a set of rules"]),
+]
+
+
+class SimulatedRateLimitError(Exception):
+    """
+    A simulated rate limit (HTTP 429) response.
+    """
+
+    status_code = 429
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SimulatedTimeoutError(TimeoutError):
+    """
+    A simulated request timeout.
+    """
+
+
+class SimulatedLLM(BaseChatModel):
+    """
+    A local chat model that simulates a language model backend, for running and load testing the pipelines offline.
+    It recognizes the prompts of the components by their markers (see PROMPT_MARKERS) and answers them from a structured
+    specification: JSON batches for DataDefiner and DataAugmentor, transformed records for DataTransformer, generation code
+    for CodeTransformer, and scores and specifications for TaskSpecificationAugmentor.
+    Latency, token throughput, rate limit and timeout errors, and malformed (truncated) outputs are simulated with a seeded
+    random generator, so runs are reproducible. Streamed calls yield the output in chunks at the token throughput.
+
+    Parameters:
+    - structured_specifications (dict, optional): The structured specification behind the responses. Defaults to None (DEFAULT_SIMULATED_SCHEMA).
+    - pipeline_name (str, optional): The pipeline returned for pipeline extraction prompts. Defaults to DescriptionToDB.
+    - specification_score (int, optional): The score returned for specification validation prompts. Defaults to 100.
+    - latency_mean_seconds (float, optional): Mean of the (lognormal) time to the first token. Defaults to 0.5.
+    - latency_std_seconds (float, optional): Standard deviation of the time to the first token. Defaults to 0.2.
+    - tokens_per_second (float, optional): Output token throughput (0 for instant outputs). Defaults to 100.
+    - rate_limit_rate (float, optional): Fraction of calls that fail with a SimulatedRateLimitError. Defaults to 0.
+    - retry_after_seconds (float, optional): The retry_after of the rate limit errors (scaled by time_scale). Defaults to 1.
+    - max_concurrent_requests (int, optional): The concurrency limit of the backend: calls beyond it fail with a
+      SimulatedRateLimitError. Defaults to None (unlimited).
+    - timeout_rate (float, optional): Fraction of calls that fail with a SimulatedTimeoutError. Defaults to 0.
+    - timeout_seconds (float, optional): The time a timed out call waits before failing. Defaults to 10.
+    - malformed_rate (float, optional): Fraction of outputs that are cut in the middle. Defaults to 0.
+    - time_scale (float, optional): Multiplier of all the waiting times (0 for no waiting; the simulated time is still
+      reported by get_metrics). Defaults to 1.
+    - seed (int, optional): Seed for the random generator. Defaults to None.
+    """
+
+    structured_specifications: Optional[dict] = None
+    pipeline_name: str = Pipeline.DescriptionToDB
+    specification_score: int = 100
+    latency_mean_seconds: float = 0.5
+    latency_std_seconds: float = 0.2
+    tokens_per_second: float = 100.0
+    rate_limit_rate: float = 0.0
+    retry_after_seconds: float = 1.0
+    max_concurrent_requests: Optional[int] = None
+    timeout_rate: float = 0.0
+    timeout_seconds: float = 10.0
+    malformed_rate: float = 0.0
+    time_scale: float = 1.0
+    seed: Optional[int] = None
+
+    _rng = PrivateAttr(default=None)
+    _lock = PrivateAttr(default_factory=threading.Lock)
+    _metrics = PrivateAttr(default_factory=dict)
+    _in_flight = PrivateAttr(default_factory=lambda: {'calls': 0})
+
+    @property
+    def _llm_type(self):
+        return "simulated"
+
+    def get_schema(self):
+        """
+        Get the structured specification behind the responses.
+
+        Returns:
+        dict: The structured specification.
+        """
+        return self.structured_specifications if self.structured_specifications is not None else DEFAULT_SIMULATED_SCHEMA
+
+    @staticmethod
+    def get_prompt_type(prompt):
+        """
+        Detect the component prompt type by its markers.
+
+        Parameters:
+        - prompt (str): The prompt.
+
+        Returns:
+        str: The prompt type (see PROMPT_MARKERS), or 'unknown'.
+        """
+        for prompt_type, markers in PROMPT_MARKERS:
+            if any(marker in prompt for marker in markers):
+                return prompt_type
+        return 'unknown'
+
+    def get_random(self):
+        """
+        Get the (lazily created) seeded random generator.
+        """
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng
+
+    def simulate(self, prompt):
+        """
+        Simulate a call: draw the latency and the injected failure, and compose the response.
+
+        Parameters:
+        - prompt (str): The prompt.
+
+        Returns:
+        tuple: The response text (None for failures), the waiting time in seconds and the exception to raise (or None).
+        """
+        prompt_type = self.get_prompt_type(prompt)
+        with self._lock:
+            rng = self.get_random()
+            metrics = self._metrics
+            metrics['calls'] = metrics.get('calls', 0) + 1
+            metrics[f"calls_{prompt_type}"] = metrics.get(f"calls_{prompt_type}", 0) + 1
+            draw = rng.random()
+            if draw < self.rate_limit_rate:
+                metrics['rate_limit_errors'] = metrics.get('rate_limit_errors', 0) + 1
+                return None, 0.0, SimulatedRateLimitError("Simulated rate limit exceeded (429)", retry_after=self.retry_after_seconds * self.time_scale)
+            if draw < self.rate_limit_rate + self.timeout_rate:
+                metrics['timeout_errors'] = metrics.get('timeout_errors', 0) + 1
+                metrics['simulated_seconds'] = metrics.get('simulated_seconds', 0.0) + self.timeout_seconds
+                return None, self.timeout_seconds, SimulatedTimeoutError(f"Simulated request timeout after {self.timeout_seconds} seconds")
+
+            text = self.compose_response(prompt_type, prompt, rng)
+            if (self.malformed_rate > 0) and (rng.random() < self.malformed_rate) and (len(text) > 1):
+                text = text[:rng.randint(1, len(text) - 1)]
+                metrics['malformed_outputs'] = metrics.get('malformed_outputs', 0) + 1
+
+            latency = 0.0
+            if self.latency_mean_seconds > 0:
+                sigma = math.sqrt(math.log(1 + (self.latency_std_seconds / self.latency_mean_seconds) ** 2))
+                latency = rng.lognormvariate(math.log(self.latency_mean_seconds) - sigma ** 2 / 2, sigma)
+            output_tokens = self.count_tokens(text)
+            if self.tokens_per_second > 0:
+                latency += output_tokens / self.tokens_per_second
+            metrics['input_tokens'] = metrics.get('input_tokens', 0) + self.count_tokens(prompt)
+            metrics['output_tokens'] = metrics.get('output_tokens', 0) + output_tokens
+            metrics['simulated_seconds'] = metrics.get('simulated_seconds', 0.0) + latency
+        return text, latency, None
+
+    @staticmethod
+    def count_tokens(text):
+        """
+        Estimate the number of tokens of a text (about 4 characters per token).
+        """
+        return len(text) // 4 + 1
+
+    def create_result(self, prompt, text):
+        """
+        Wrap a response text in a chat result, with its (estimated) token usage.
+        """
+        usage = {'input_tokens': self.count_tokens(prompt), 'output_tokens': self.count_tokens(text)}
+        usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+        message = AIMessage(content=text, usage_metadata=usage)
+        token_usage = {'prompt_tokens': usage['input_tokens'], 'completion_tokens': usage['output_tokens'], 'total_tokens': usage['total_tokens']}
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={'token_usage': token_usage, 'model_name': self._llm_type})
+
+    def acquire_slot(self):
+        """
+        Count a call in flight, or reject it with a SimulatedRateLimitError if the backend is at its concurrency limit.
+        """
+        if self.max_concurrent_requests is None:
+            return
+        with self._lock:
+            if self._in_flight['calls'] >= self.max_concurrent_requests:
+                self._metrics['calls'] = self._metrics.get('calls', 0) + 1
+                self._metrics['rate_limit_errors'] = self._metrics.get('rate_limit_errors', 0) + 1
+                raise SimulatedRateLimitError("Simulated concurrency limit exceeded (429)", retry_after=self.retry_after_seconds * self.time_scale)
+            self._in_flight['calls'] += 1
+
+    def release_slot(self):
+        if self.max_concurrent_requests is None:
+            return
+        with self._lock:
+            self._in_flight['calls'] -= 1
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.acquire_slot()
+        try:
+            text, latency, error = self.simulate(prompt)
+            if self.time_scale > 0:
+                time.sleep(latency * self.time_scale)
+            if error is not None:
+                raise error
+            return self.create_result(prompt, text)
+        finally:
+            self.release_slot()
+
+    def split_stream(self, prompt, text, latency):
+        """
+        Split a response into the chunks of a streamed call.
+
+        Returns:
+        list: (waiting time in seconds before the chunk, chunk) tuples; the last chunk carries the token usage.
+        """
+        token_seconds = self.count_tokens(text) / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        pieces = [text[i:i + STREAM_CHUNK_CHARACTERS] for i in range(0, len(text), STREAM_CHUNK_CHARACTERS)] or ['']
+        chunks = []
+        for index, piece in enumerate(pieces):
+            wait_seconds = (latency - token_seconds if index == 0 else 0.0) + token_seconds / len(pieces)
+            usage = None
+            if index == len(pieces) - 1:
+                usage = {'input_tokens': self.count_tokens(prompt), 'output_tokens': self.count_tokens(text)}
+                usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+            chunks.append((wait_seconds * self.time_scale, ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))))
+        return chunks
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.acquire_slot()
+        try:
+            text, latency, error = self.simulate(prompt)
+            if error is not None:
+                if self.time_scale > 0:
+                    time.sleep(latency * self.time_scale)
+                raise error
+            for wait_seconds, chunk in self.split_stream(prompt, text, latency):
+                if wait_seconds > 0:
+                    time.sleep(wait_seconds)
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+                yield chunk
+        finally:
+            self.release_slot()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.acquire_slot()
+        try:
+            text, latency, error = self.simulate(prompt)
+            if error is not None:
+                if self.time_scale > 0:
+                    await asyncio.sleep(latency * self.time_scale)
+                raise error
+            for wait_seconds, chunk in self.split_stream(prompt, text, latency):
+                if wait_seconds > 0:
+                    await asyncio.sleep(wait_seconds)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+                yield chunk
+        finally:
+            self.release_slot()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        self.acquire_slot()
+        try:
+            text, latency, error = self.simulate(prompt)
+            if self.time_scale > 0:
+                await asyncio.sleep(latency * self.time_scale)
+            if error is not None:
+                raise error
+            return self.create_result(prompt, text)
+        finally:
+            self.release_slot()
+
+    def get_metrics(self):
+        """
+        Get the simulation metrics.
+
+        Returns:
+        dict: The number of calls (in total and per prompt type), injected errors and malformed outputs, the estimated
+        input and output tokens, and the total simulated latency in seconds.
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+    def reset_metrics(self):
+        """
+        Clear the simulation metrics.
+        """
+        with self._lock:
+            self._metrics.clear()
+
+    def compose_response(self, prompt_type, prompt, rng):
+        """
+        Compose the response to a prompt.
+
+        Parameters:
+        - prompt_type (str): The prompt type (see PROMPT_MARKERS).
+        - prompt (str): The prompt.
+        - rng (random.Random): The random generator.
+
+        Returns:
+        str: The response text.
+        """
+        schema = self.get_schema()
+        if prompt_type == 'pipeline':
+            return self.pipeline_name
+        if prompt_type == 'validation':
+            errors = [] if self.specification_score >= 100 else ["Simulated gap: missing distribution details"]
+            return json.dumps({'score': self.specification_score, 'errors': errors})
+        if prompt_type == 'structured_specification':
+            return json.dumps(schema)
+        if prompt_type == 'specification_patch':
+            return json.dumps({'tables': []})
+        if prompt_type == 'specification':
+            return self.compose_specifications(schema)
+        if prompt_type == 'code':
+            return self.compose_code(schema)
+        if prompt_type == 'value_pool':
+            return self.compose_value_pool(prompt, rng)
+        if prompt_type == 'schema':
+            num_records = self.find_number(r"Provide a sample with (\d+)", prompt, 10)
+            return json.dumps(self.sample_schema_records(schema, num_records, rng))
+        if prompt_type == 'augmentation':
+            return self.compose_augmentation(prompt, schema, rng)
+        if prompt_type == 'transformation':
+            return self.compose_transformation(prompt, rng)
+        if prompt_type == 'transformation_logic':
+            return "1. Fill the empty free text fields with short, varied texts that fit the other fields of the record."
+        return "{}"
+
+    @staticmethod
+    def find_number(pattern, prompt, default):
+        match = re.search(pattern, prompt)
+        return int(match.group(1)) if match else default
+
+    @staticmethod
+    def find_json(prompt, marker):
+        """
+        Decode the JSON value that follows a marker in a prompt (JSON strings that contain JSON are decoded again).
+
+        Returns:
+        The decoded value, or None if there is no valid JSON after the marker.
+        """
+        position = prompt.find(marker)
+        if position < 0:
+            return None
+        try:
+            value, _ = json.JSONDecoder().raw_decode(prompt[position + len(marker):].lstrip())
+            if isinstance(value, str):
+                value = json.loads(value)
+            return value
+        except ValueError:
+            return None
+
+    @staticmethod
+    def compose_specifications(schema):
+        """
+        Describe a structured specification as textual task specifications.
+        """
+        lines = []
+        for table in schema['tables']:
+            lines.append(f"Table {table['name']} (primary key: {table.get('primary_key')}):")
+            for column in table['columns']:
+                details = ", ".join(f"{key}: {value}" for key, value in column.items() if key not in ['name', 'type'])
+                lines.append(f"  - {column['name']} ({column['type']}){': ' + details if details else ''}")
+        lines.append(f"Recommended order of table generation: {', '.join(schema.get('generation_order', [table['name'] for table in schema['tables']]))}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def compose_code(schema):
+        """
+        Compose data generation code (a `generate(table_sizes, seed=None)` function and the metadata dictionaries) for a
+        structured specification.
+        """
+        return (
+            "from src.SpecificationSampler import SpecificationSampler\n"
+            f"structured_specifications = {schema!r}\n"
+            "def generate(table_sizes, seed=None):\n"
+            "    results_dict = SpecificationSampler(structured_specifications, seed=seed).generate(table_sizes, seed)\n"
+            "    for table_name, fields in override_fields_dict.items():\n"
+            "        for field in fields:\n"
+            "            results_dict[table_name][field] = ''\n"
+            "    return results_dict\n"
+            "metadata = SpecificationSampler(structured_specifications).get_metadata()\n"
+            "table_size_param_dict = metadata['table_size_param_dict']\n"
+            "override_fields_dict = metadata['override_fields_dict']\n"
+            "reformat_fields_dict = metadata['reformat_fields_dict']\n"
+            "table_names_dict = metadata['table_names_dict']\n"
+            "primary_keys_dict = metadata['primary_keys_dict']\n"
+            "parent_tables_dict = metadata['parent_tables_dict']\n"
+            "cross_table_dependencies_dict = metadata['cross_table_dependencies_dict']\n"
+            "datetime_constraints_list = metadata['datetime_constraints_list']\n"
+        )
+
+    def compose_value_pool(self, prompt, rng):
+        """
+        Compose a JSON list of distinct values for a value pool prompt.
+        """
+        num_values = self.find_number(r"Generate (\d+) distinct", prompt, 10)
+        field_match = re.search(r"for the '([^']*)' free text field", prompt)
+        field_name = field_match.group(1) if field_match else 'value'
+        return json.dumps([self.compose_text(field_name, rng) for _ in range(num_values)])
+
+    @staticmethod
+    def compose_text(field_name, rng):
+        """
+        Compose a short random text for a free text field.
+        """
+        words = ['quick', 'reliable', 'friendly', 'late', 'detailed', 'simple', 'new', 'regular', 'special', 'great']
+        return f"{field_name.replace('_', ' ').capitalize()}: {' '.join(rng.sample(words, 3))} #{rng.randint(1000, 9999)}"
+
+    def sample_schema_records(self, schema, num_records, rng):
+        """
+        Sample records of all the tables of a structured specification, with the free text fields filled.
+
+        Returns:
+        dict: Pairs of key (table name) and value (list of records).
+        """
+        from src.SpecificationSampler import SpecificationSampler
+        tables = SpecificationSampler(schema, seed=rng.randint(0, 2 ** 31)).generate({table['name']: num_records for table in schema['tables']})
+        records_dict = {}
+        for table in schema['tables']:
+            records = json.loads(tables[table['name']].to_json(orient='records', date_format='iso'))
+            for column in table['columns']:
+                if column['type'] == 'free_text':
+                    for record in records:
+                        record[column['name']] = self.compose_text(column['name'], rng)
+            records_dict[table['name']] = records
+        return records_dict
+
+    def compose_augmentation(self, prompt, schema, rng):
+        """
+        Compose a batch of records that follows the required structure of a DataAugmentor prompt: the values of each field
+        are drawn from the values of the structure's records (numbers within their range, unique texts made distinct).
+        The batch is in the wire format of the structure (see wire_format).
+        """
+        num_records = self.find_number(r"Generate (\d+) Sample synthetic", prompt, 10)
+        structure = self.find_json(prompt, "Required Structure:")
+        if not isinstance(structure, dict) or len(structure) == 0:
+            return json.dumps(self.sample_schema_records(schema, num_records, rng))
+        wire_format = 'columnar' if any(is_columnar_table(items) for items in structure.values()) else 'records'
+        structure = decode_wire_tables(structure)
+        batch = {}
+        for key, examples in structure.items():
+            examples = examples if isinstance(examples, list) else [examples]
+            records = [example for example in examples if isinstance(example, dict)]
+            if len(records) == 0:
+                batch[key] = [rng.choice(examples) for _ in range(num_records)]
+                continue
+            fields = list(dict.fromkeys(field for record in records for field in record))
+            batch[key] = [{field: self.draw_value([record.get(field) for record in records], rng) for field in fields}
+                          for _ in range(num_records)]
+        return json.dumps(encode_wire_tables(batch, wire_format))
+
+    def draw_value(self, values, rng):
+        """
+        Draw a value similar to the given example values.
+        """
+        present_values = [value for value in values if value is not None]
+        if len(present_values) == 0:
+            return None
+        if all(isinstance(value, bool) for value in present_values):
+            return rng.choice(present_values)
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in present_values):
+            return rng.randint(min(present_values), max(present_values))
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present_values):
+            return round(rng.uniform(min(present_values), max(present_values)), 2)
+        value = rng.choice(present_values)
+        if isinstance(value, str) and (len(set(present_values)) == len(present_values)) and (len(present_values) > 1):
+            return f"{value} {rng.randint(1000, 9999)}"
+        return value
+
+    def compose_transformation(self, prompt, rng):
+        """
+        Compose the transformed records of a DataTransformer prompt: the given records, with their empty fields filled, in
+        the wire format of the given records (see wire_format).
+        """
+        source_data = self.find_json(prompt, "The given source data is:")
+        if source_data is None:
+            return "[]"
+        columnar = is_columnar_table(source_data) or \
+            (isinstance(source_data, dict) and any(is_columnar_table(items) for items in source_data.values()))
+        source_data = decode_wire_tables(source_data)
+
+        def fill(records):
+            for record in records:
+                if isinstance(record, dict):
+                    for field, value in record.items():
+                        if value in ['', None]:
+                            record[field] = self.compose_text(field, rng)
+            return records
+
+        if isinstance(source_data, dict):
+            source_data = {key: fill(records) if isinstance(records, list) else records for key, records in source_data.items()}
+        elif isinstance(source_data, list):
+            source_data = fill(source_data)
+        return json.dumps(encode_wire_tables(source_data, 'columnar' if columnar else 'records'))
@@ -0,0 +1,214 @@
+import json
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from src.utils.lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+
+class SpecificationCache:
+    """
+    A class for storing generated task specifications and looking them up by exact or near-duplicate user descriptions.
+    """
+
+    def __init__(self, file_path=None, max_entries=500, max_size_bytes=50_000_000, reuse_threshold=0.9,
+                 refine_threshold=0.6, shingle_size=5, num_hashes=128):
+        """
+        Initializes a new instance of the SpecificationCache class. Entries are keyed by the normalized description, and a
+        local similarity index (MinHash signatures of character shingles) finds near-duplicate descriptions without any
+        external service. The cache is persisted as a JSON file (when a file path is given), and evicts the least recently
+        used entries when the number of entries or the total size of the specifications exceeds the limits.
+
+        Parameters:
+        - file_path (str, optional): Path of the JSON file used for persisting the cache. Defaults to None (in-memory only).
+        - max_entries (int, optional): Maximum number of entries. Defaults to 500.
+        - max_size_bytes (int, optional): Maximum total size of the stored specifications, in bytes. Defaults to 50MB.
+        - reuse_threshold (float, optional): The minimal similarity for returning a near-duplicate entry as is. Defaults to 0.9.
+        - refine_threshold (float, optional): The minimal similarity for returning an entry as a starting point for refinement. Defaults to 0.6.
+        - shingle_size (int, optional): The length of the character shingles. Defaults to 5.
+        - num_hashes (int, optional): The number of hash functions of the MinHash signatures. Defaults to 128.
+        """
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_bytes
+        self.reuse_threshold = reuse_threshold
+        self.refine_threshold = refine_threshold
+        self.shingle_size = shingle_size
+        self.num_hashes = num_hashes
+
+        # Fixed hash parameters, so signatures are comparable across sessions
+        rng = np.random.default_rng(20240101)
+        self.prime = np.uint64((1 << 61) - 1)
+        self.hash_a = rng.integers(1, (1 << 31) - 1, size=num_hashes, dtype=np.uint64)
+        self.hash_b = rng.integers(0, (1 << 31) - 1, size=num_hashes, dtype=np.uint64)
+
+        self.entries = OrderedDict()
+        self.signatures = {}
+        self.size_bytes = 0
+        self.metrics = {'hits': 0, 'near_hits': 0, 'refine_hits': 0, 'misses': 0, 'evictions': 0}
+
+        if (file_path is not None) and os.path.exists(file_path):
+            self.load()
+
+    @staticmethod
+    def normalize_description(description):
+        """
+        Normalize a description for exact lookup (lower case, no punctuation, single spaces).
+
+        Parameters:
+        - description (str): The description.
+
+        Returns:
+        str: The normalized description.
+        """
+        description = re.sub(r"[^\w\s]", " ", str(description).lower())
+        return " ".join(description.split())
+
+    def get_signature(self, normalized_description):
+        """
+        Compute the MinHash signature of a normalized description's character shingles, using vectorized numpy hashing.
+
+        Parameters:
+        - normalized_description (str): The normalized description.
+
+        Returns:
+        numpy.ndarray: The signature (num_hashes unsigned integers).
+        """
+        text = normalized_description if len(normalized_description) >= self.shingle_size else normalized_description.ljust(self.shingle_size)
+        shingles = {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+        shingle_hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        hashes = (np.outer(self.hash_a, shingle_hashes) + self.hash_b[:, None]) % self.prime
+        return hashes.min(axis=1)
+
+    def get(self, description):
+        """
+        Look up the specifications of a description. An exact match of the normalized description is returned first;
+        otherwise the most similar entry is returned if its estimated (Jaccard) similarity reaches the refine threshold.
+
+        Parameters:
+        - description (str): The user's description of the task.
+
+        Returns:
+        dict: The cached entry ('description', 'task_specifications', 'score', 'errors') with the additional items 'match'
+        ('exact', 'near' or 'refine') and 'similarity', or None if no entry is similar enough.
+        """
+        key = self.normalize_description(description)
+        if key in self.entries:
+            self.metrics['hits'] += 1
+            return self.touch(key, 'exact', 1.0)
+
+        if len(self.entries) > 0:
+            keys = list(self.signatures.keys())
+            signature_matrix = np.stack([self.signatures[entry_key] for entry_key in keys])
+            similarities = (signature_matrix == self.get_signature(key)).mean(axis=1)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity >= self.reuse_threshold:
+                self.metrics['near_hits'] += 1
+                return self.touch(keys[best], 'near', similarity)
+            if similarity >= self.refine_threshold:
+                self.metrics['refine_hits'] += 1
+                return self.touch(keys[best], 'refine', similarity)
+
+        self.metrics['misses'] += 1
+        return None
+
+    def touch(self, key, match, similarity):
+        """
+        Mark an entry as recently used, and return a copy of it with the match details.
+
+        Parameters:
+        - key (str): The normalized description of the entry.
+        - match (str): The match type ('exact', 'near' or 'refine').
+        - similarity (float): The estimated similarity.
+
+        Returns:
+        dict: A copy of the entry with the 'match' and 'similarity' items.
+        """
+        self.entries.move_to_end(key)
+        self.entries[key]['last_access'] = time.time()
+        return {**self.entries[key], 'match': match, 'similarity': similarity}
+
+    def put(self, description, task_specifications, score=None, errors=None):
+        """
+        Store the specifications of a description, evict entries if needed, and persist the cache.
+
+        Parameters:
+        - description (str): The user's description of the task.
+        - task_specifications (str): The generated task specifications.
+        - score (int, optional): The validation score of the specifications. Defaults to None.
+        - errors (list, optional): The gaps and errors detected by the validation. Defaults to None.
+        """
+        key = self.normalize_description(description)
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = {'description': description, 'task_specifications': task_specifications,
+                             'score': score, 'errors': errors, 'last_access': time.time()}
+        self.signatures[key] = self.get_signature(key)
+        self.size_bytes += len(str(task_specifications).encode('utf-8'))
+        self.evict()
+        self.save()
+
+    def remove(self, key):
+        """
+        Remove an entry.
+
+        Parameters:
+        - key (str): The normalized description of the entry.
+        """
+        entry = self.entries.pop(key)
+        self.signatures.pop(key, None)
+        self.size_bytes -= len(str(entry['task_specifications']).encode('utf-8'))
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the cache is within its limits (the newest entry is always kept).
+        """
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.size_bytes > self.max_size_bytes):
+            self.remove(next(iter(self.entries)))
+            self.metrics['evictions'] += 1
+
+    def save(self):
+        """
+        Persist the cache entries to the JSON file (atomically), if a file path was given.
+        """
+        if self.file_path is None:
+            return
+        try:
+            temp_file_path = self.file_path + '.tmp'
+            with open(temp_file_path, 'w', encoding='utf-8') as cache_file:
+                json.dump(list(self.entries.values()), cache_file)
+            os.replace(temp_file_path, self.file_path)
+        except Exception as ex:
+            print(f"Error during specification cache saving: {ex}")
+
+    def load(self):
+        """
+        Load the cache entries from the JSON file, in order of their last access.
+        """
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as cache_file:
+                entries = json.load(cache_file)
+        except Exception as ex:
+            print(f"Error during specification cache loading: {ex}")
+            return
+        for entry in sorted(entries, key=lambda entry: entry.get('last_access', 0)):
+            key = self.normalize_description(entry['description'])
+            self.entries[key] = entry
+            self.signatures[key] = self.get_signature(key)
+            self.size_bytes += len(str(entry['task_specifications']).encode('utf-8'))
+        self.evict()
+
+    def get_metrics(self):
+        """
+        Get the cache metrics.
+
+        Returns:
+        dict: The numbers of hits, near hits, refine hits, misses and evictions, the hit rate, and the current number of entries and size.
+        """
+        num_lookups = sum(self.metrics[name] for name in ['hits', 'near_hits', 'refine_hits', 'misses'])
+        hit_rate = (self.metrics['hits'] + self.metrics['near_hits']) / num_lookups if num_lookups > 0 else 0.0
+        return {**self.metrics, 'hit_rate': hit_rate, 'entries': len(self.entries), 'size_bytes': self.size_bytes}
@@ -0,0 +1,563 @@
+import copy
+from src.utils.lazy_import import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+STRUCTURED_SPECIFICATION_FORMAT = """{"tables": [{"name": "<table name>", "primary_key": "<primary key column>", "columns": [<column>, ...]}, ...], "generation_order": ["<table name>", ...]}
+Each column is a dictionary with a "name", a "type" and the type specific keys:
+- "id": "prefix" (str, optional), "start" (int), "width" (int, zero padding of the number, optional).
+- "integer" / "float": "distribution" (one of normal, uniform, lognormal, exponential, poisson), "mean", "std", "min", "max", "decimals" (float only, optional).
+- "categorical": "categories" (list), "probabilities" (list of numbers between 0-1, in the same order).
+- "boolean": "probability" (of true values).
+- "datetime": "min", "max" (ISO 8601 strings), "format" (strftime format), "sorted" (true for sequential / transactional fields, optional), and optionally "after" ("<column>" or "<table>.<column>", a datetime that must precede this field) with "interval_mean_days" and "interval_std_days".
+- "foreign_key": "references" ("<table>.<column>"), "distribution" (uniform or zipf, optional).
+- "free_text": no additional keys (these fields are generated later by the language model).
+Every column may also have a "null_fraction" (number between 0-1)."""
+
+COLUMN_TYPES = ['id', 'integer', 'float', 'categorical', 'boolean', 'datetime', 'foreign_key', 'free_text']
+DISTRIBUTIONS = ['normal', 'uniform', 'lognormal', 'exponential', 'poisson']
+
+# The numeric keys of each column type (null values mean the defaults), and the keys of all the columns
+NUMERIC_KEYS = {'id': ['start', 'width'], 'integer': ['mean', 'std', 'min', 'max'], 'float': ['mean', 'std', 'min', 'max', 'decimals'],
+                'boolean': ['probability'], 'datetime': ['interval_mean_days', 'interval_std_days'], 'foreign_key': ['skew']}
+COMMON_NUMERIC_KEYS = ['null_fraction']
+
+# The raw value (nanoseconds) of unknown datetimes: the value of NaT, as the datetimes before 1970 are negative
+MISSING_DATETIME = -2 ** 63
+
+
+def get_number(column, key, default=None):
+    """
+    Get a numeric key of a column.
+
+    Parameters:
+    - column (dict): The column definition.
+    - key (str): The key.
+    - default (float, optional): The value of a missing or null key. Defaults to None.
+
+    Returns:
+    float: The value.
+    """
+    value = column.get(key)
+    return float(value) if value is not None else default
+
+
+def validate_structured_specifications(schema):
+    """
+    Validate a structured specification (see STRUCTURED_SPECIFICATION_FORMAT).
+
+    Parameters:
+    - schema (dict): The structured specification.
+
+    Returns:
+    list: A list of strings, each describing an error found in the specification (empty if the specification is valid).
+    """
+    if (not isinstance(schema, dict)) or (not isinstance(schema.get('tables'), list)) or (len(schema['tables']) == 0):
+        return ["The specification must be a dictionary with a non empty 'tables' list"]
+
+    errors = []
+    columns_by_table = {}
+    for table in schema['tables']:
+        if (not isinstance(table, dict)) or ('name' not in table) or (not isinstance(table.get('columns'), list)):
+            errors.append(f"Invalid table definition: {table}")
+            continue
+        columns_by_table[table['name']] = {column.get('name'): column for column in table['columns'] if isinstance(column, dict)}
+        if table.get('primary_key') not in columns_by_table[table['name']]:
+            errors.append(f"{table['name']}: the primary key '{table.get('primary_key')}' is not one of the columns")
+
+    for table in schema['tables']:
+        if table.get('name') not in columns_by_table:
+            continue
+        for column in table['columns']:
+            prefix = f"{table['name']}.{column.get('name')}"
+            column_type = column.get('type')
+            if column_type not in COLUMN_TYPES:
+                errors.append(f"{prefix}: unknown type '{column_type}'")
+                continue
+            for key in NUMERIC_KEYS.get(column_type, []) + COMMON_NUMERIC_KEYS:
+                try:
+                    get_number(column, key)
+                except (TypeError, ValueError):
+                    errors.append(f"{prefix}: '{key}' must be a number")
+            if column_type in ['integer', 'float']:
+                if column.get('distribution', 'normal') not in DISTRIBUTIONS:
+                    errors.append(f"{prefix}: unknown distribution '{column.get('distribution')}'")
+                if (column.get('mean') is None) and ((column.get('min') is None) or (column.get('max') is None)):
+                    errors.append(f"{prefix}: a mean or a min and max values are required")
+            elif column_type == 'categorical':
+                categories = column.get('categories')
+                probabilities = column.get('probabilities')
+                if (not isinstance(categories, list)) or (len(categories) == 0):
+                    errors.append(f"{prefix}: a non empty list of categories is required")
+                elif probabilities is not None and (len(probabilities) != len(categories) or min(probabilities) < 0 or sum(probabilities) <= 0):
+                    errors.append(f"{prefix}: the probabilities must be non negative and match the categories")
+            elif column_type == 'datetime':
+                try:
+                    if pd.Timestamp(column['min']) > pd.Timestamp(column['max']):
+                        errors.append(f"{prefix}: min is greater than max")
+                except Exception:
+                    errors.append(f"{prefix}: valid min and max datetime values are required")
+            elif column_type == 'foreign_key':
+                reference = str(column.get('references', ''))
+                reference_table, _, reference_column = reference.partition('.')
+                if reference_column not in columns_by_table.get(reference_table, {}):
+                    errors.append(f"{prefix}: unknown reference '{reference}'")
+    return errors
+
+
+STRUCTURED_SPECIFICATION_PATCH_FORMAT = """{"tables": [{"name": "<table name>", "columns": [<column>, ...]}, ...]}
+List only the tables and columns that change. Each listed column is a complete column definition that replaces (or adds) the column with the same name.
+To remove a column list {"name": "<column name>", "remove": true}, and to remove a table list {"name": "<table name>", "remove": true}.
+A new table is listed with its "primary_key" and all its columns. An empty "tables" list means nothing changes."""
+
+
+def apply_structured_specification_patch(schema, patch):
+    """
+    Apply a patch (see STRUCTURED_SPECIFICATION_PATCH_FORMAT) to a structured specification.
+
+    Parameters:
+    - schema (dict): The structured specification.
+    - patch (dict): The patch.
+
+    Returns:
+    dict: The patched structured specification (the given specification is not modified).
+    """
+    schema = copy.deepcopy(schema)
+    tables_dict = {table['name']: table for table in schema['tables']}
+    for table_patch in patch.get('tables', []):
+        table_name = table_patch['name']
+        if table_patch.get('remove'):
+            schema['tables'] = [table for table in schema['tables'] if table['name'] != table_name]
+            tables_dict.pop(table_name, None)
+            continue
+        if table_name not in tables_dict:
+            tables_dict[table_name] = {'name': table_name, 'primary_key': table_patch.get('primary_key'), 'columns': []}
+            schema['tables'].append(tables_dict[table_name])
+        table = tables_dict[table_name]
+        for key, value in table_patch.items():
+            if key not in ['name', 'columns', 'remove']:
+                table[key] = value
+        for column_patch in table_patch.get('columns', []):
+            positions = [i for i, column in enumerate(table['columns']) if column['name'] == column_patch['name']]
+            if column_patch.get('remove'):
+                table['columns'] = [column for column in table['columns'] if column['name'] != column_patch['name']]
+            elif len(positions) > 0:
+                table['columns'][positions[0]] = column_patch
+            else:
+                table['columns'].append(column_patch)
+    if 'generation_order' in schema:
+        schema['generation_order'] = [name for name in schema['generation_order'] if name in tables_dict] + \
+                                     [name for name in tables_dict if name not in schema['generation_order']]
+    return schema
+
+
+def diff_structured_specifications(previous_schema, schema):
+    """
+    Compare two structured specifications, table by table and column by column.
+
+    Parameters:
+    - previous_schema (dict): The previous structured specification.
+    - schema (dict): The new structured specification.
+
+    Returns:
+    dict: The 'added_tables' and 'removed_tables' lists, and the 'changed_tables' (a table property such as the primary key
+    changed), 'changed_columns' (added or modified columns) and 'removed_columns' dictionaries, with pairs of key (table name)
+    and value (list of column names).
+    """
+    previous_tables = {table['name']: table for table in previous_schema['tables']}
+    tables = {table['name']: table for table in schema['tables']}
+    diff = {'added_tables': [name for name in tables if name not in previous_tables],
+            'removed_tables': [name for name in previous_tables if name not in tables],
+            'changed_tables': [], 'changed_columns': {}, 'removed_columns': {}}
+    for table_name in [name for name in tables if name in previous_tables]:
+        previous_columns = {column['name']: column for column in previous_tables[table_name]['columns']}
+        columns = {column['name']: column for column in tables[table_name]['columns']}
+        if {key: value for key, value in previous_tables[table_name].items() if key != 'columns'} != \
+                {key: value for key, value in tables[table_name].items() if key != 'columns'}:
+            diff['changed_tables'].append(table_name)
+        changed_columns = [name for name, column in columns.items() if previous_columns.get(name) != column]
+        removed_columns = [name for name in previous_columns if name not in columns]
+        if len(changed_columns) > 0:
+            diff['changed_columns'][table_name] = changed_columns
+        if len(removed_columns) > 0:
+            diff['removed_columns'][table_name] = removed_columns
+    return diff
+
+
+def is_empty_diff(diff):
+    """
+    Check whether a structured specification diff (see diff_structured_specifications) contains no changes.
+
+    Parameters:
+    - diff (dict): The diff.
+
+    Returns:
+    bool: True if nothing changed.
+    """
+    return not any(len(value) > 0 for value in diff.values())
+
+
+class SpecificationSampler:
+    """
+    A class for generating tables locally from a structured specification, using vectorized numpy sampling.
+    """
+
+    def __init__(self, schema, seed=None):
+        """
+        Initializes a new instance of the SpecificationSampler class, which generates all the id, numeric, categorical,
+        boolean, datetime and foreign key columns of a structured specification (see STRUCTURED_SPECIFICATION_FORMAT)
+        without calling a language model. Free text columns are left empty.
+
+        Parameters:
+        - schema (dict): The structured specification.
+        - seed (int, optional): Seed for the random generator. Defaults to None.
+        """
+        errors = validate_structured_specifications(schema)
+        if len(errors) > 0:
+            raise ValueError(f"Invalid structured specification: {errors}")
+        self.schema = schema
+        self.tables_dict = {table['name']: table for table in schema['tables']}
+        self.table_order = self.get_table_order()
+        self.rng = np.random.default_rng(seed)
+        self.datetime_values = {}
+
+    def get_table_order(self):
+        """
+        Get the order of table generation: the given generation order if it is valid, or a topological order of the foreign keys.
+
+        Returns:
+        list: The table names, from independent to dependent tables.
+        """
+        parents = {name: set(self.get_parent_tables(name)) for name in self.tables_dict}
+        order = [name for name in self.schema.get('generation_order', []) if name in self.tables_dict]
+        if (len(order) == len(self.tables_dict)) and all(parents[name] <= set(order[:i]) for i, name in enumerate(order)):
+            return order
+
+        order = []
+        while len(order) < len(self.tables_dict):
+            ready = [name for name in self.tables_dict if (name not in order) and (parents[name] - {name} <= set(order))]
+            if len(ready) == 0:
+                raise ValueError("The foreign keys of the structured specification contain a cycle")
+            order.extend(ready)
+        return order
+
+    def get_parent_tables(self, table_name):
+        """
+        Get the parent tables referenced by the foreign keys of a table.
+
+        Parameters:
+        - table_name (str): The table name.
+
+        Returns:
+        list: The parent table names.
+        """
+        return [column['references'].split('.')[0] for column in self.tables_dict[table_name]['columns'] if column['type'] == 'foreign_key']
+
+    def generate(self, table_sizes, seed=None):
+        """
+        Generate all the tables of the specification (same contract as the `generate` function of generated code).
+
+        Parameters:
+        - table_sizes (dict): Pairs of table name (key) and number of records to generate (value). Tables that are not listed get 10 records.
+        - seed (int, optional): Seed for the random generator. Defaults to None (continue the current random stream).
+
+        Returns:
+        dict: Pairs of key (table name) and value (dataframe), ordered from independent to dependent tables.
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.datetime_values = {}
+        results_dict = {}
+        for table_name in self.table_order:
+            results_dict[table_name] = self.sample_table(table_name, int(table_sizes.get(table_name, 10)), results_dict)
+        return results_dict
+
+    def sample_table(self, table_name, num_records, tables, columns=None, table=None):
+        """
+        Generate the columns of a single table. Datetime columns that depend on other columns are generated last.
+
+        Parameters:
+        - table_name (str): The table name.
+        - num_records (int): Number of records to generate.
+        - tables (dict): The tables generated so far (used for foreign keys and datetime dependencies).
+        - columns (list, optional): Names of the columns to generate. Defaults to None (all columns).
+        - table (DataFrame, optional): An existing table whose other columns are kept. Defaults to None.
+
+        Returns:
+        DataFrame: The generated table.
+        """
+        column_specs = [column for column in self.tables_dict[table_name]['columns'] if (columns is None) or (column['name'] in columns)]
+        column_specs = sorted(column_specs, key=lambda column: (column['type'] == 'datetime') and ('after' in column))
+        data = {} if table is None else {name: table[name].to_numpy() for name in table.columns}
+        for column in column_specs:
+            data[column['name']] = self.sample_column(table_name, column, num_records, data, tables)
+        column_names = [column['name'] for column in self.tables_dict[table_name]['columns']]
+        return pd.DataFrame(data)[[name for name in column_names if name in data]]
+
+    def sample_column(self, table_name, column, num_records, data, tables):
+        """
+        Generate the values of a single column.
+
+        Parameters:
+        - table_name (str): The table name.
+        - column (dict): The column specification.
+        - num_records (int): Number of values to generate.
+        - data (dict): The columns of the table generated so far.
+        - tables (dict): The tables generated so far.
+
+        Returns:
+        The generated values (numpy array or pandas array).
+        """
+        column_type = column['type']
+        if column_type == 'id':
+            values = self.sample_ids(column, num_records)
+        elif column_type in ['integer', 'float']:
+            values = self.sample_numeric(column, num_records)
+        elif column_type == 'categorical':
+            probabilities = column.get('probabilities')
+            if probabilities is not None:
+                probabilities = np.asarray(probabilities, dtype=float) / np.sum(probabilities)
+            values = np.asarray(column['categories'], dtype=object)[self.rng.choice(len(column['categories']), size=num_records, p=probabilities)]
+        elif column_type == 'boolean':
+            values = self.rng.random(num_records) < get_number(column, 'probability', 0.5)
+        elif column_type == 'datetime':
+            values = self.sample_datetimes(table_name, column, num_records, data, tables)
+        elif column_type == 'foreign_key':
+            values = self.sample_foreign_keys(column, num_records, tables)
+        else:
+            values = np.full(num_records, '', dtype=object)
+
+        null_fraction = get_number(column, 'null_fraction', 0)
+        if (null_fraction > 0) and (column_type not in ['id', 'free_text']):
+            values = pd.array(values, dtype='Int64' if column_type == 'integer' else None)
+            values[self.rng.random(num_records) < null_fraction] = None
+        return values
+
+    def sample_ids(self, column, num_records):
+        """
+        Generate unique identifiers, optionally formatted with a prefix and zero padding.
+        """
+        ids = int(get_number(column, 'start', 1)) + np.arange(num_records)
+        if (column.get('prefix') is None) and (column.get('width') is None):
+            return ids
+        ids = pd.Series(ids).astype(str).str.zfill(int(get_number(column, 'width', 0)))
+        return (str(column.get('prefix') or '') + ids).to_numpy(dtype=object)
+
+    def sample_numeric(self, column, num_records):
+        """
+        Generate numeric values following the specified distribution, clipped to the min and max values.
+        """
+        distribution = column.get('distribution', 'normal')
+        minimum, maximum = get_number(column, 'min'), get_number(column, 'max')
+        mean = get_number(column, 'mean')
+        if mean is None:
+            mean = (minimum + maximum) / 2
+        std = get_number(column, 'std') or abs(mean) / 4 or 1
+
+        if distribution == 'uniform':
+            low = minimum if minimum is not None else mean - std * np.sqrt(3)
+            high = maximum if maximum is not None else mean + std * np.sqrt(3)
+            values = self.rng.uniform(low, high, num_records)
+        elif distribution == 'lognormal' and mean > 0:
+            sigma = np.sqrt(np.log(1 + (std / mean) ** 2))
+            values = self.rng.lognormal(np.log(mean) - sigma ** 2 / 2, sigma, num_records)
+        elif distribution == 'exponential':
+            values = self.rng.exponential(abs(mean), num_records)
+        elif distribution == 'poisson':
+            values = self.rng.poisson(max(mean, 0), num_records).astype(float)
+        else:
+            values = self.rng.normal(mean, std, num_records)
+
+        values = np.clip(values, minimum, maximum) \
+            if (minimum is not None) or (maximum is not None) else values
+        if column['type'] == 'integer':
+            return np.round(values).astype(np.int64)
+        return np.round(values, int(get_number(column, 'decimals', 2)))
+
+    def sample_datetimes(self, table_name, column, num_records, data, tables):
+        """
+        Generate datetime values between the min and max values, or after a reference datetime field (in the same table or in
+        a parent table), formatted as strings. The raw values are kept for dependent fields.
+        """
+        minimum = pd.Timestamp(column['min']).value
+        maximum = pd.Timestamp(column['max']).value
+        reference = column.get('after')
+        if reference:
+            reference_values = self.get_reference_datetimes(table_name, reference, data, tables)
+            day = 24 * 3600 * 10 ** 9
+            intervals = np.abs(self.rng.normal(get_number(column, 'interval_mean_days', 30), get_number(column, 'interval_std_days', 10), num_records))
+            values = np.where(reference_values != MISSING_DATETIME, reference_values + (intervals * day).astype(np.int64),
+                              self.rng.integers(minimum, maximum, num_records, endpoint=True))
+        else:
+            values = self.rng.integers(minimum, maximum, num_records, endpoint=True)
+        if column.get('sorted'):
+            values = np.sort(values)
+        self.datetime_values[(table_name, column['name'])] = values
+        datetime_format = column.get('format', '%Y-%m-%d %H:%M:%S')
+        return pd.to_datetime(values).strftime(datetime_format).to_numpy(dtype=object)
+
+    def get_reference_datetimes(self, table_name, reference, data, tables):
+        """
+        Get the raw values (nanoseconds) of a reference datetime field for each record of the table (MISSING_DATETIME when
+        unknown).
+        """
+        reference_table, _, reference_column = reference.rpartition('.')
+        if reference_table in ['', table_name]:
+            return self.datetime_values.get((table_name, reference_column), np.full(len(next(iter(data.values()), [])), MISSING_DATETIME, dtype=np.int64))
+
+        parent_values = self.datetime_values.get((reference_table, reference_column))
+        for column in self.tables_dict[table_name]['columns']:
+            if (column['type'] == 'foreign_key') and (column['references'].split('.')[0] == reference_table) and (column['name'] in data):
+                parent_key = column['references'].split('.')[1]
+                # The first parent record of duplicated key values (e.g. a key that is not an 'id' column)
+                parent_keys = tables[reference_table][parent_key]
+                first_positions = np.flatnonzero(~parent_keys.duplicated(keep='first').to_numpy())
+                positions = pd.Index(parent_keys.iloc[first_positions]).get_indexer(data[column['name']])
+                positions = np.where(positions >= 0, first_positions[positions], -1)
+                if parent_values is None:
+                    break
+                return np.where(positions >= 0, parent_values[positions], MISSING_DATETIME)
+        print(f"Could not resolve the datetime reference '{reference}' of the {table_name} table.")
+        return np.full(len(next(iter(data.values()), [])), MISSING_DATETIME, dtype=np.int64)
+
+    def sample_foreign_keys(self, column, num_records, tables):
+        """
+        Generate foreign key values from the primary keys of the parent table (uniform, or skewed with a zipf distribution).
+        """
+        parent_table, _, parent_key = column['references'].partition('.')
+        parent_values = tables[parent_table][parent_key].to_numpy()
+        if len(parent_values) == 0:
+            return np.full(num_records, None, dtype=object)
+        if column.get('distribution') == 'zipf':
+            weights = 1 / np.arange(1, len(parent_values) + 1) ** get_number(column, 'skew', 1.0)
+            positions = self.rng.choice(len(parent_values), size=num_records, p=weights / weights.sum())
+        else:
+            positions = self.rng.integers(0, len(parent_values), num_records)
+        return parent_values[positions]
+
+    def get_invalidated_columns(self, diff, resized_tables=None):
+        """
+        Get the columns that must be regenerated after a specification change: the changed columns, all the columns of new,
+        changed and resized tables, and (transitively) the foreign keys and dependent datetime columns that reference them.
+
+        Parameters:
+        - diff (dict): The structured specification diff (see diff_structured_specifications).
+        - resized_tables (list, optional): Tables whose number of records changed. Defaults to None.
+
+        Returns:
+        dict: Pairs of key (table name) and value (set of column names to regenerate). Tables without invalidated columns are omitted.
+        """
+        all_columns = {name: {column['name'] for column in table['columns']} for name, table in self.tables_dict.items()}
+        regenerated_tables = set(diff['added_tables']) | set(diff['changed_tables']) | set(resized_tables or [])
+        invalidated = {name: set(all_columns[name]) for name in regenerated_tables if name in all_columns}
+        for table_name, columns in diff['changed_columns'].items():
+            if table_name in all_columns:
+                invalidated.setdefault(table_name, set()).update(column for column in columns if column in all_columns[table_name])
+
+        changed = True
+        while changed:
+            changed = False
+            for table_name in self.table_order:
+                for column in self.tables_dict[table_name]['columns']:
+                    if column['name'] in invalidated.get(table_name, set()):
+                        continue
+                    dependencies = []
+                    if column['type'] == 'foreign_key':
+                        reference_table, _, reference_column = column['references'].partition('.')
+                        dependencies.append((reference_table, reference_column))
+                        # New parent keys can only be referenced if the foreign keys are sampled again
+                        if reference_table in regenerated_tables:
+                            dependencies.append((reference_table, None))
+                    elif (column['type'] == 'datetime') and column.get('after'):
+                        reference_table, _, reference_column = column['after'].rpartition('.')
+                        reference_table = reference_table or table_name
+                        dependencies.append((reference_table, reference_column))
+                        dependencies += [(table_name, foreign_key['name']) for foreign_key in self.tables_dict[table_name]['columns']
+                                         if (foreign_key['type'] == 'foreign_key') and (foreign_key['references'].split('.')[0] == reference_table)
+                                         and (reference_table != table_name)]
+                    if any((dependency_table in invalidated) and ((dependency_column is None) or (dependency_column in invalidated[dependency_table]))
+                           for dependency_table, dependency_column in dependencies):
+                        invalidated.setdefault(table_name, set()).add(column['name'])
+                        changed = True
+        return {name: columns for name, columns in invalidated.items() if len(columns) > 0}
+
+    def update_tables(self, tables, invalidated_columns, table_sizes=None):
+        """
+        Regenerate only the invalidated columns of previously generated tables (see get_invalidated_columns), keeping all the
+        other columns. Tables whose columns are all invalidated (or that are missing) are generated from scratch, and tables
+        and columns that are no longer in the specification are dropped.
+
+        Parameters:
+        - tables (dict): The previously generated tables (key: table name, value: dataframe).
+        - invalidated_columns (dict): Pairs of key (table name) and value (set of column names to regenerate).
+        - table_sizes (dict, optional): Pairs of table name (key) and number of records (value) for regenerated tables. Defaults to None.
+
+        Returns:
+        dict: The updated tables, ordered from independent to dependent tables.
+        """
+        if table_sizes is None:
+            table_sizes = {}
+        self.datetime_values = {}
+        results_dict = {}
+        for table_name in self.table_order:
+            column_names = [column['name'] for column in self.tables_dict[table_name]['columns']]
+            columns = invalidated_columns.get(table_name, set())
+            table = tables.get(table_name)
+            if (table is None) or (set(column_names) <= set(columns)):
+                results_dict[table_name] = self.sample_table(table_name, int(table_sizes.get(table_name, 10 if table is None else len(table))), results_dict)
+                continue
+            table = table[[name for name in table.columns if name in column_names]].reset_index(drop=True)
+            self.load_datetime_values(table_name, table)
+            missing_columns = [name for name in column_names if (name in columns) or (name not in table.columns)]
+            if len(missing_columns) > 0:
+                table = self.sample_table(table_name, len(table), results_dict, columns=missing_columns, table=table)
+            results_dict[table_name] = table
+        return results_dict
+
+    def load_datetime_values(self, table_name, table):
+        """
+        Load the raw values (nanoseconds) of the datetime columns of a previously generated table, so regenerated columns can
+        depend on them.
+
+        Parameters:
+        - table_name (str): The table name.
+        - table (DataFrame): The previously generated table.
+        """
+        for column in self.tables_dict[table_name]['columns']:
+            if (column['type'] != 'datetime') or (column['name'] not in table.columns):
+                continue
+            values = pd.to_datetime(table[column['name']], format=column.get('format', '%Y-%m-%d %H:%M:%S'), errors='coerce')
+            self.datetime_values[(table_name, column['name'])] = np.where(values.notna(), values.to_numpy(dtype='datetime64[ns]').astype(np.int64), MISSING_DATETIME)
+
+    def get_metadata(self):
+        """
+        Get the metadata dictionaries of the specification, in the same format as the ones defined by generated code
+        (see CodeTransformer).
+
+        Returns:
+        dict: The table_size_param_dict, override_fields_dict, reformat_fields_dict, table_names_dict, primary_keys_dict,
+        parent_tables_dict, cross_table_dependencies_dict and datetime_constraints_list objects.
+        """
+        metadata = {'table_size_param_dict': {}, 'override_fields_dict': {}, 'reformat_fields_dict': {}, 'table_names_dict': {},
+                    'primary_keys_dict': {}, 'parent_tables_dict': {}, 'cross_table_dependencies_dict': {}, 'datetime_constraints_list': []}
+        for table_name in self.table_order:
+            table = self.tables_dict[table_name]
+            metadata['table_size_param_dict'][table_name] = table_name
+            metadata['table_names_dict'][table_name] = table_name
+            metadata['primary_keys_dict'][table_name] = table['primary_key']
+            free_text_fields = [column['name'] for column in table['columns'] if column['type'] == 'free_text']
+            if len(free_text_fields) > 0:
+                metadata['override_fields_dict'][table_name] = free_text_fields
+            foreign_keys = [column for column in table['columns'] if column['type'] == 'foreign_key']
+            if len(foreign_keys) > 0:
+                parent_table, _, parent_key = foreign_keys[0]['references'].partition('.')
+                metadata['parent_tables_dict'][table_name] = (
+                    [column['references'].split('.')[0] for column in foreign_keys],
+                    f"pd.merge({table_name}, {parent_table}, left_on='{foreign_keys[0]['name']}', right_on='{parent_key}', how='left')")
+            for column in table['columns']:
+                if (column['type'] == 'datetime') and column.get('after'):
+                    reference_table, _, reference_column = column['after'].rpartition('.')
+                    metadata['datetime_constraints_list'].append((table_name, column['name'], reference_table or table_name, reference_column))
+        return metadata
@@ -0,0 +1,236 @@
+import re
+import threading
+from src.utils.lazy_import import LazyModule
+from src.utils.utils import to_utc_datetime
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+# The column types of a schema, and the pandas dtypes their values are coerced to
+COLUMN_TYPES = {'int': 'Int64', 'float': 'float64', 'bool': 'boolean', 'datetime': 'datetime64[ns]', 'category': 'category',
+                'string': None}
+
+# The texts of boolean values
+BOOLEAN_STRINGS = {'true': True, 'false': False, 'yes': True, 'no': False, 't': True, 'f': False, '1': True, '0': False,
+                   '1.0': True, '0.0': False}
+
+# A date (e.g. 2024-01-31, 31/01/2024) or a time (e.g. 10:30), so words are not parsed as datetimes
+DATETIME_PATTERN = re.compile(r"\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}|\d{1,2}:\d{2}")
+
+
+def get_string_dtype():
+    # The string dtype of pandas 3, or object (the strings dtype of earlier versions)
+    return 'str' if int(pd.__version__.split('.')[0]) >= 3 else object
+
+
+def get_present_mask(series):
+    """
+    Get the mask of the values of a column that are not missing (empty texts are missing).
+    """
+    present = series.notna()
+    if (series.dtype == object) or pd.api.types.is_string_dtype(series):
+        present &= series.astype(str).str.strip() != ''
+    return present
+
+
+def infer_column_type(series, category_ratio=0.5):
+    """
+    Infer the type of a column from sample values.
+
+    Parameters:
+    - series (Series): The sample values.
+    - category_ratio (float, optional): A text column is categorical if its number of distinct values is at most this
+      ratio of its number of values. Defaults to 0.5.
+
+    Returns:
+    str: The column type (see COLUMN_TYPES), or None if it cannot be inferred (e.g. no values).
+    """
+    values = series[get_present_mask(series)]
+    if len(values) == 0:
+        return None
+    inferred_dtype = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred_dtype == 'boolean':
+        return 'bool'
+    if inferred_dtype == 'integer':
+        return 'int'
+    if inferred_dtype in ['floating', 'mixed-integer-float', 'decimal']:
+        # Integers with missing values are read as floats
+        numeric_values = pd.to_numeric(values, errors='coerce')
+        if series.isna().any() and (numeric_values % 1 == 0).all():
+            return 'int'
+        return 'float'
+    if inferred_dtype in ['datetime64', 'datetime', 'date']:
+        return 'datetime'
+    if inferred_dtype != 'string':
+        return 'string'
+    texts = values.astype(str)
+    if texts.str.contains(DATETIME_PATTERN).all() and to_utc_datetime(texts).notna().all():
+        return 'datetime'
+    if (len(values) > 1) and (values.nunique() <= category_ratio * len(values)):
+        return 'category'
+    return 'string'
+
+
+class TableSchema:
+    """
+    The column types of the tables of a generation, inferred once (from the structure sample, the examples, or the first
+    batch of a table) and locked: every batch is coerced to them with vectorized casts, so the accumulated tables keep
+    compact dtypes (nullable integers, floats, booleans, datetimes, categoricals for the low cardinality texts) instead of
+    being widened to object when the language model returns a value of another type. The values that do not conform to
+    their column type are set to missing values, and counted per column.
+    """
+
+    def __init__(self, column_types=None, category_ratio=0.5, max_categories=1000):
+        """
+        Initializes a new instance of the TableSchema class.
+
+        Parameters:
+        - column_types (dict, optional): Pairs of table name and a dictionary of column name and column type (see
+          COLUMN_TYPES). Tables missing from it are inferred from their first batch. Defaults to None.
+        - category_ratio (float, optional): See infer_column_type. Defaults to 0.5.
+        - max_categories (int, optional): A categorical column with more distinct values than this is converted to texts
+          when the batches are concatenated. Defaults to 1000.
+        """
+        self.column_types = column_types if column_types is not None else {}
+        self.category_ratio = category_ratio
+        self.max_categories = max_categories
+        self.nonconforming_counts = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def infer(cls, dataframes_dict, category_ratio=0.5, max_categories=1000):
+        """
+        Infer the schema of sample tables.
+
+        Parameters:
+        - dataframes_dict (dict): Pairs of table name and sample DataFrame (e.g. the structure sample or the examples).
+
+        Returns:
+        TableSchema: The schema.
+        """
+        schema = cls(category_ratio=category_ratio, max_categories=max_categories)
+        for table_name, dataframe in dataframes_dict.items():
+            schema.infer_table(table_name, dataframe)
+        return schema
+
+    def infer_table(self, table_name, dataframe):
+        column_types = {}
+        for index, column in enumerate(dataframe.columns):
+            column_type = infer_column_type(dataframe.iloc[:, index], self.category_ratio)
+            if column_type is not None:
+                column_types[column] = column_type
+        with self.lock:
+            self.column_types.setdefault(table_name, column_types)
+
+    def coerce(self, table_name, dataframe):
+        """
+        Coerce a batch of a table to the schema (the schema of a new table is inferred from the batch). Columns that are
+        not in the schema are kept as they are.
+
+        Parameters:
+        - table_name (str): The table name.
+        - dataframe (DataFrame): The batch.
+
+        Returns:
+        DataFrame: The coerced batch.
+        """
+        if table_name not in self.column_types:
+            self.infer_table(table_name, dataframe)
+        column_types = self.column_types[table_name]
+        columns = {}
+        for column in dataframe.columns:
+            if column in column_types:
+                columns[column], num_nonconforming = coerce_column(dataframe[column], column_types[column])
+                if num_nonconforming > 0:
+                    with self.lock:
+                        table_counts = self.nonconforming_counts.setdefault(table_name, {})
+                        table_counts[column] = table_counts.get(column, 0) + num_nonconforming
+            else:
+                columns[column] = dataframe[column]
+        return pd.DataFrame(columns, index=dataframe.index)
+
+    def coerce_tables(self, dataframes_dict):
+        """
+        Coerce a batch of each table (see coerce).
+
+        Parameters:
+        - dataframes_dict (dict): Pairs of table name and batch.
+
+        Returns:
+        dict: The coerced batches.
+        """
+        return {table_name: self.coerce(table_name, dataframe) for table_name, dataframe in dataframes_dict.items()}
+
+    def get_nonconforming_counts(self):
+        """
+        Get the numbers of values that did not conform to their column type (and were set to missing values).
+
+        Returns:
+        dict: Pairs of table name and a dictionary of column name and count.
+        """
+        with self.lock:
+            return {table_name: dict(counts) for table_name, counts in self.nonconforming_counts.items()}
+
+    def concat(self, batches):
+        """
+        Concatenate the batches of a table, keeping the categorical columns categorical (their categories are united).
+
+        Parameters:
+        - batches (list): The batches (DataFrames).
+
+        Returns:
+        DataFrame: The table.
+        """
+        if len(batches) == 1:
+            return batches[0].reset_index(drop=True)
+        batches = list(batches)
+        categorical_columns = [column for column in batches[0].columns
+                               if all((column in batch.columns) and isinstance(batch[column].dtype, pd.CategoricalDtype) for batch in batches)]
+        for column in categorical_columns:
+            try:
+                categories = pd.api.types.union_categoricals([batch[column] for batch in batches], ignore_order=True).categories
+            except TypeError:
+                # Categories of different dtypes (e.g. the empty categories of an empty batch)
+                categories = None
+            for index, batch in enumerate(batches):
+                if (categories is None) or (len(categories) > self.max_categories):
+                    batches[index] = batch.assign(**{column: batch[column].astype(get_string_dtype())})
+                else:
+                    batches[index] = batch.assign(**{column: batch[column].cat.set_categories(categories)})
+        return pd.concat(batches, ignore_index=True)
+
+
+def coerce_column(series, column_type):
+    """
+    Coerce the values of a column to a column type, with vectorized casts.
+
+    Parameters:
+    - series (Series): The values.
+    - column_type (str): The column type (see COLUMN_TYPES).
+
+    Returns:
+    tuple: The coerced values, and the number of values that did not conform to the type (set to missing values).
+    """
+    present = get_present_mask(series)
+    if column_type in ['string', 'category']:
+        values = series.where(present).map(str, na_action='ignore')
+        return values.astype('category' if column_type == 'category' else get_string_dtype()), 0
+    if column_type in ['int', 'float']:
+        if pd.api.types.is_bool_dtype(series):
+            series = series.astype(float)
+        values = pd.to_numeric(series.where(present), errors='coerce')
+        if column_type == 'int':
+            values = values.where(values % 1 == 0)
+        values = values.astype(COLUMN_TYPES[column_type])
+    elif column_type == 'bool':
+        if pd.api.types.is_bool_dtype(series):
+            values = series.astype('boolean')
+        else:
+            values = series.where(present).map(lambda value: str(value).strip().lower(), na_action='ignore').map(BOOLEAN_STRINGS)
+            values = values.astype('boolean')
+    elif column_type == 'datetime':
+        values = to_utc_datetime(series.where(present)).dt.tz_localize(None).astype(COLUMN_TYPES['datetime'])
+    else:
+        return series, 0
+    return values, int((present & values.isna()).sum())
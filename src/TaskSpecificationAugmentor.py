@@ -1,12 +1,19 @@
 from langchain.prompts import PromptTemplate
+from src.SpecificationSampler import STRUCTURED_SPECIFICATION_FORMAT, STRUCTURED_SPECIFICATION_PATCH_FORMAT, validate_structured_specifications, \
+    apply_structured_specification_patch
+from src.LLMTelemetry import with_telemetry, record_event, track_parse
+from src.RetryPolicy import RetryPolicy, with_retry_policy
+from src.LLMRouter import get_language_model
+from src.utils.utils import parse_json
 import json
+import asyncio
 
 
 class TaskSpecificationAugmentor:
     """
     A class for extracting expert guidelines and specifications based on user description using a language model.
     """
-    def __init__(self, llm, batch_size=10, verbose=True):
+    def __init__(self, llm, batch_size=10, verbose=True, specification_cache=None, telemetry=None, retry_policy=None):
         """
         Initializes a new instance of the TaskSpecificationAugmentor class, which is designed to extract task specification
         for a given task. This class uses a language model to generate specifications based
@@ -14,40 +21,94 @@ class TaskSpecificationAugmentor:
 
         Parameters:
         - llm (LLM): The language model used for generating transformation logic.
+        - specification_cache (SpecificationCache, optional): A cache of previously generated specifications, looked up by
+          exact or near-duplicate descriptions before generating new specifications. Defaults to None.
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls, retries and parsing outcomes. Defaults to None.
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy of the retries, usually shared by all the
+          components of a pipeline. Defaults to None (a new RetryPolicy).
 
         """
         self.batch_size = batch_size
         self.verbose = verbose
-        self.llm = llm
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.llm = with_retry_policy(with_telemetry(get_language_model(llm), telemetry), self.retry_policy)
+        self.telemetry = telemetry
+        self.specification_cache = specification_cache
         self.description = ''
 
+        # The specification requirements are shared by the extraction, validation and correction prompts
+        self.specification_requirements = (
+            "1. Generate the names of the needed tables (one table or more)."
+            "2. For each table, generate the names of a rich set of relevant columns. Use indicative names. "
+            "Assign each column its type - integer, float, categorical, datetime, free text, and it's special role: primary key or foreign key. "
+            "3. Revisit each column on each of the tables and complete the following details:"
+            "  a. For numeric columns - ALWAYS specify its distribution, and its mean, std, min, max values. Also,specify the percentage of empty values"
+            "  b. For categorical columns ALWAYS specify a complete set of categories **AND** its probabilities (numbers between 0-1), and the percentage of empty values. "
+            "  c. For unique identifier columns - ALWAYS specify the format, min and max values, and regEX to follow. "
+            "  d. For Datetime columns - ALWAYS specify min and max values, **and** the time intervals mean and std values. "
+            "  e. For numbers and date/time columns ALSO define the needed format. "
+            "4. FOR EACH TABLE specify the following:"
+            "  a. A comma seperated list of pairs of highly correlated fields (potentially explaining each other) and specify the correlation. "
+            "  b. A comma seperated list of free text fields."
+            "  c. A comma seperated list of date / time fields. "
+            "  d. Indicate if the table has sequential (transactional) nature or not. "
+            "5. Eventually extract some cross table insights:"
+            "  a. Dictate the recommended order of table generation, from less dependent table, to most dependent table. "
+            "  b. State highly correlated fields across tables (state both table and field names). Don't mention correlation with primary key fields in this list. "
+            "  c. Look for dependencies between pairs of datetime fields among the various tables (e.g. transaction_date should be greater than product_creation_date) and specify a list of such dependencies."
+        )
+
         self.specification_extraction_template = (
-            f"You are an analyst whose job is to conduct a deep research for a given task, and specify the needed data to collect or produce, "
-            f"making sure you don't miss any relevant detail, and gain a deep understanding of the data characteristics."
-            f"1. Generate the names of the needed tables (one table or more)."
-            f"2. For each table, generate the names of a rich set of relevant columns. Use indicative names. "
-            f"Assign each column its type - integer, float, categorical, datetime, free text, and it's special role: primary key or foreign key. "
-            f"3. Revisit each column on each of the tables and complete the following details:"
-            f"  a. For numeric columns - ALWAYS specify its distribution, and its mean, std, min, max values. Also,specify the percentage of empty values"
-            f"  b. For categorical columns ALWAYS specify a complete set of categories **AND** its probabilities (numbers between 0-1), and the percentage of empty values. "
-            f"  c. For unique identifier columns - ALWAYS specify the format, min and max values, and regEX to follow. "
-            f"  d. For Datetime columns - ALWAYS specify min and max values, **and** the time intervals mean and std values. "
-            f"  e. For numbers and date/time columns ALSO define the needed format. "
-            f"4. FOR EACH TABLE specify the following:"
-            f"  a. A comma seperated list of pairs of highly correlated fields (potentially explaining each other) and specify the correlation. "
-            f"  b. A comma seperated list of free text fields."
-            f"  c. A comma seperated list of date / time fields. "
-            f"  d. Indicate if the table has sequential (transactional) nature or not. "
-            f"5. Eventually extract some cross table insights:"
-            f"  a. Dictate the recommended order of table generation, from less dependent table, to most dependent table. "
-            f"  b. State highly correlated fields across tables (state both table and field names). Don't mention correlation with primary key fields in this list. "
-            f"  c. Look for dependencies between pairs of datetime fields among the various tables (e.g. transaction_date should be greater than product_creation_date) and specify a list of such dependencies."
-            f"\nThe task as described by the user: {{human_input}};"
-            f"Please make sure you output a valid textual description in English (categories can be in other languages), just guidance, no intro and summary are needed, and don't cut it in the middle."
-            f"\nGenerated Extracted Specifications:"
+            "You are an analyst whose job is to conduct a deep research for a given task, and specify the needed data to collect or produce, "
+            "making sure you don't miss any relevant detail, and gain a deep understanding of the data characteristics."
+            + self.specification_requirements +
+            "\nThe task as described by the user: {human_input};"
+            "Please make sure you output a valid textual description in English (categories can be in other languages), just guidance, no intro and summary are needed, and don't cut it in the middle."
+            "\nGenerated Extracted Specifications:"
+        )
+
+        specification_extraction_prompt = PromptTemplate(
+            input_variables=["human_input"], template=self.specification_extraction_template
+        )
+        self.specification_extraction_chain = specification_extraction_prompt | self.llm
+
+        specification_validation_template = (
+            "You are an analyst aiming to complete your task in the most professional and COMPLETE way. You already gave instructions for the needed data (see 'Your Previous Output') and now you want to check it in order to make it perfect. "
+            "1. Go over the given task (see Your Task below) and the user description of it (see User Description below) and CAREFULLY check your previous output and list any detail you were required to describe and missed or got wrong or partial"
+            "(e.g. missing fields, missing categories, missing distributions, missing values for means, X or dots instead of numbers, etc.). "
+            "2. Score your previous output with an integer between 0 and 100 according to the percentage of detected gaps and errors out of the overall needed details in this task."
+            "\nUser Description: {human_input};"
+            "\nYour Task: "+self.specification_requirements+";"
+            "\nYour Previous Output: {latest_instructions};"
+            "Please make sure you output a valid dictionary with 2 items: 'score' (the numeric score mentioned above), and 'errors' (a list of strings, each describe an error or gap detected within your previous output). "
+            "Make sure you don't cut it in the middle and ALWAYS output a valid dictionary with these exact keys. "
+            "\nGenerated Validation Output:"
+        )
+
+        specification_validation_prompt = PromptTemplate(
+            input_variables=["human_input","latest_instructions"], template=specification_validation_template
+        )
+        self.specification_validation_chain = specification_validation_prompt | self.llm
+
+        specification_correction_template = (
+            "You are an analyst aiming to complete your task in the most professional and COMPLETE way. You already gave instructions for the needed data (see 'Your Previous Specifications'). "
+            "1. Go over the given task (see Your Task below) and the user description of it (see User Description below) and CAREFULLY check the your previous specifications. "
+            "2. Rewrite your previous specifications as follows: Scan the list of detected gaps and errors (see 'Errors' below) and correct/complete all the listed errors and gaps."
+            "(DON'T omit or change any of the valid parts). Group together related details if needed, to better organize the output."
+            "\nUser Description: {human_input};"
+            "\nYour Task: "+self.specification_requirements+";"
+            "\nYour Previous Specifications: {latest_instructions};"
+            "\nDetected Errors: {errors};"
+            "Please make sure you output a valid textual description, just the revised specifications, no intro and summary are needed, and don't cut it in the middle."
+            "\nGenerated Your Revised Specifications:"
+        )
+
+        specification_correction_prompt = PromptTemplate(
+            input_variables=["human_input","latest_instructions","errors"], template=specification_correction_template
         )
+        self.specification_correction_chain = specification_correction_prompt | self.llm
 
-    def generate_specifications_from_description(self, description, max_trials=3):
+    def generate_specifications_from_description(self, description, max_trials=3, score_threshold=100):
         """
         Extract task specifications based on a user description.
 
@@ -55,6 +116,7 @@ class TaskSpecificationAugmentor:
         - llm: The language model used for extraction.
         - description (str): The user's description of the task.
         - max_trials (int, optional): Maximum number of trials to attempt extraction. Defaults to 3.
+        - score_threshold (int, optional): The validation score at which the autocorrection stops. Defaults to 100.
 
         Returns:
         str: The predicted output containing a sample of data in the extracted structure.
@@ -65,51 +127,106 @@ class TaskSpecificationAugmentor:
 
         self.description= description
 
-        specification_extraction_prompt = PromptTemplate(
-            input_variables=["human_input"], template=self.specification_extraction_template
-        )
-
-        #specification_extraction_chain = LLMChain(llm=llm, prompt=specification_extraction_prompt, verbose=verbose)
-        specification_extraction_chain = specification_extraction_prompt | self.llm #| StrOutputParser()
+        cached_specifications = self.get_cached_specifications(description, max_trials=max_trials)
+        if cached_specifications is not None:
+            return cached_specifications
 
         trial = 0
         while trial < max_trials:
             try:
+                self.retry_policy.before_attempt()
                 # Generate task specifications
-                task_specification = specification_extraction_chain.invoke({"human_input":self.description})
+                task_specification = self.specification_extraction_chain.invoke({"human_input":self.description})
 
                 # Score the generated specifications
                 specifications_evaluation = self.validate_task_specifications(
                     specifications=task_specification.content)
-                specifications_evaluation = json.loads(specifications_evaluation.content)
+                with track_parse(self.telemetry):
+                    specifications_evaluation = parse_json(specifications_evaluation.content, allow_truncated=False)
                 # Loop to auto correct the specifications (correct & evaluate in each iteration)
                 score = specifications_evaluation['score']
                 errors = specifications_evaluation['errors']
                 print("Specification's score: %d" % (score))
 
                 internal_trial = 0
-                while score < 100 and internal_trial < max_trials:
+                while score < score_threshold and internal_trial < max_trials:
                     print("Autocorrecting task specifications:")
                     task_specification = self.correct_task_specifications(
                         specifications=task_specification.content, errors=errors)
                     corrected_specifications_evaluation = self.validate_task_specifications(
                         specifications=task_specification.content)
-                    #corrected_specifications_evaluation = try_parse_json(corrected_specifications_evaluation.content)
-                    corrected_specifications_evaluation = json.loads(corrected_specifications_evaluation.content)
+                    with track_parse(self.telemetry):
+                        corrected_specifications_evaluation = parse_json(corrected_specifications_evaluation.content, allow_truncated=False)
                     errors = corrected_specifications_evaluation['errors']
                     score = corrected_specifications_evaluation['score']
                     print(f"Specification's score: {score} ; The following errors were detected:\n {errors} ")
                     #print(str(internal_trial) + ':' + str(score) + ':' + str(errors))
                     internal_trial = internal_trial + 1
 
+                self.cache_specifications(description, task_specification.content, score, errors)
                 return {'task_specifications': task_specification.content, 'score':score, 'errors':errors}
             except Exception as ex:
                 print(f"Error during task specifications extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
 
         print(f"Reached maximum trials for task specifications extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
+    def get_cached_specifications(self, description, max_trials=3):
+        """
+        Look up the specifications of a description in the specification cache. Exact and near-duplicate matches are
+        returned as is; a less similar match is used as the starting point for refine_specifications_by_description,
+        and the refined specifications are validated and cached.
+
+        Parameters:
+        - description (str): The user's description of the task.
+        - max_trials (int, optional): Maximum number of trials to attempt refinement and validation. Defaults to 3.
+
+        Returns:
+        dict: The 'task_specifications', 'score' and 'errors', or None if there is no cache or no similar entry.
+        """
+        if self.specification_cache is None:
+            return None
+        cached_entry = self.specification_cache.get(description)
+        if cached_entry is None:
+            return None
+        if self.verbose:
+            print(f"Found cached specifications ({cached_entry['match']} match, similarity {cached_entry['similarity']:.2f})")
+        if cached_entry['match'] in ['exact', 'near']:
+            return {'task_specifications': cached_entry['task_specifications'], 'score': cached_entry['score'], 'errors': cached_entry['errors']}
+
+        task_specification = self.refine_specifications_by_description(description, cached_entry['task_specifications'], max_trials=max_trials)
+        self.description = description
+        if task_specification is None:
+            return None
+        score, errors = None, []
+        specifications_evaluation = self.validate_task_specifications(specifications=task_specification, max_trials=max_trials)
+        try:
+            with track_parse(self.telemetry):
+                specifications_evaluation = parse_json(specifications_evaluation.content, allow_truncated=False)
+            score, errors = specifications_evaluation['score'], specifications_evaluation['errors']
+        except Exception as ex:
+            print(f"Error during refined task specifications evaluation: {ex}")
+        self.cache_specifications(description, task_specification, score, errors)
+        return {'task_specifications': task_specification, 'score': score, 'errors': errors}
+
+    def cache_specifications(self, description, task_specifications, score=None, errors=None):
+        """
+        Store generated specifications in the specification cache, if there is one.
+
+        Parameters:
+        - description (str): The user's description of the task.
+        - task_specifications (str): The generated task specifications.
+        - score (int, optional): The validation score of the specifications. Defaults to None.
+        - errors (list, optional): The gaps and errors detected by the validation. Defaults to None.
+        """
+        if self.specification_cache is not None:
+            self.specification_cache.put(description, task_specifications, score=score, errors=errors)
+
     def refine_specifications_by_description(self, description, previous_task_specification, max_trials=3, verbose=True):
         """
         Extract task specifications based on a user description.
@@ -148,6 +265,7 @@ class TaskSpecificationAugmentor:
         trial = 0
         while trial < max_trials:
             try:
+                self.retry_policy.before_attempt()
                 #task_specification = specification_extraction_chain.predict(human_input=self.description,
                 #                                                            previous_specifications=previous_task_specification)
                 task_specification = specification_extraction_chain.invoke(
@@ -155,9 +273,13 @@ class TaskSpecificationAugmentor:
                 return task_specification
             except Exception as ex:
                 print(f"Error during extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
 
         print(f"Reached maximum trials for extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
     def validate_task_specifications(self, specifications, max_trials=3):
@@ -176,37 +298,21 @@ class TaskSpecificationAugmentor:
         - Returns None if no gaps were found.
         """
 
-        specification_validation_template = (
-            f"You are an analyst aiming to complete your task in the most professional and COMPLETE way. You already gave instructions for the needed data (see 'Your Previous Output') and now you want to check it in order to make it perfect. "
-            f"1. Go over the given task (see Your Task below) and the user description of it (see User Description below) and CAREFULLY check your previous output and list any detail you were required to describe and missed or got wrong or partial"
-            f"(e.g. missing fields, missing categories, missing distributions, missing values for means, X or dots instead of numbers, etc.). "
-            f"2. Score your previous output with an integer between 0 and 100 according to the percentage of detected gaps and errors out of the overall needed details in this task."
-            f"\nUser Description: {{human_input}};"
-            f"\nYour Task: "+self.specification_extraction_template+";"
-            f"\nYour Previous Output: {{latest_instructions}};"
-            f"Please make sure you output a valid dictionary with 2 items: 'score' (the numeric score mentioned above), and 'errors' (a list of strings, each describe an error or gap detected within your previous output). "
-            f"Make sure you don't cut it in the middle and ALWAYS output a valid dictionary with these exact keys. "
-            f"\nGenerated Validation Output:"
-        )
-
-
-        specification_validation_prompt = PromptTemplate(
-            input_variables=["human_input","latest_instructions"], template=specification_validation_template
-        )
-
-        #specification_extraction_chain = LLMChain(llm=llm, prompt=specification_extraction_prompt, verbose=verbose)
-        specification_validation_chain = specification_validation_prompt | self.llm #| StrOutputParser()
-
         trial = 0
         while trial < max_trials:
             try:
-                task_specification = specification_validation_chain.invoke({"human_input":self.description,"latest_instructions":specifications})
+                self.retry_policy.before_attempt()
+                task_specification = self.specification_validation_chain.invoke({"human_input":self.description,"latest_instructions":specifications})
                 return task_specification
             except Exception as ex:
                 print(f"Error during task specifications evaluation (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
 
         print(f"Reached maximum trials for task specifications evaluation. Returning None.")
+        record_event(self.telemetry, 'give_up')
         return None
 
     def correct_task_specifications(self, specifications, errors, max_trials=3):
@@ -227,34 +333,305 @@ class TaskSpecificationAugmentor:
         """
 
 
-        specification_correction_template = (
-            f"You are an analyst aiming to complete your task in the most professional and COMPLETE way. You already gave instructions for the needed data (see 'Your Previous Specifications'). "
-            f"1. Go over the given task (see Your Task below) and the user description of it (see User Description below) and CAREFULLY check the your previous specifications. "
-            f"2. Rewrite your previous specifications as follows: Scan the list of detected gaps and errors (see 'Errors' below) and correct/complete all the listed errors and gaps."
-            f"(DON'T omit or change any of the valid parts). Group together related details if needed, to better organize the output."            
-            f"\nUser Description: {{human_input}};"
-            f"\nYour Task: "+self.specification_extraction_template+";"
-            f"\nYour Previous Specifications: {{latest_instructions}};"
-            f"\nDetected Errors: {{errors}};"
-            f"Please make sure you output a valid textual description, just the revised specifications, no intro and summary are needed, and don't cut it in the middle."
-            f"\nGenerated Your Revised Specifications:"
-        )
+        trial = 0
+        while trial < max_trials:
+            try:
+                self.retry_policy.before_attempt()
+                task_specification = self.specification_correction_chain.invoke({"human_input":self.description,"latest_instructions":specifications,"errors":errors})
+                return task_specification
+            except Exception as ex:
+                print(f"Error during task specifications correction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
+                trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
 
-        specification_validation_prompt = PromptTemplate(
-            input_variables=["human_input","latest_instructions","errors"], template=specification_correction_template
-        )
+        print(f"Reached maximum trials for task specifications correction. Returning None.")
+        record_event(self.telemetry, 'give_up')
+        return None
+
+    async def avalidate_task_specifications(self, specifications, max_trials=3):
+        """
+        Asynchronously validate task specifications and parse the validation output.
 
-        #specification_extraction_chain = LLMChain(llm=llm, prompt=specification_extraction_prompt, verbose=verbose)
-        specification_validation_chain = specification_validation_prompt | self.llm #| StrOutputParser()
+        Parameters:
+        - specifications (str): The llm's generated task specifications that we wish to validate.
+        - max_trials (int, optional): Maximum number of trials to attempt validation. Defaults to 3.
 
+        Returns:
+        dict: The validation output with the 'score' and 'errors' items, or None if all trials failed.
+        """
         trial = 0
         while trial < max_trials:
             try:
-                task_specification = specification_validation_chain.invoke({"human_input":self.description,"latest_instructions":specifications,"errors":errors})
-                return task_specification
+                await self.retry_policy.abefore_attempt()
+                response = await self.specification_validation_chain.ainvoke({"human_input":self.description,"latest_instructions":specifications})
+                with track_parse(self.telemetry):
+                    specifications_evaluation = parse_json(response.content, allow_truncated=False)
+                return {'score': int(specifications_evaluation['score']), 'errors': specifications_evaluation['errors']}
+            except Exception as ex:
+                print(f"Error during task specifications evaluation (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
+                trial += 1
+                if not await self.retry_policy.await_before_retry(ex, trial, max_trials):
+                    break
+
+        print(f"Reached maximum trials for task specifications evaluation. Returning None.")
+        record_event(self.telemetry, 'give_up')
+        return None
+
+    async def acorrect_task_specifications(self, specifications, errors, max_trials=3):
+        """
+        Asynchronously correct task specifications according to a list of detected gaps and errors.
+
+        Parameters:
+        - specifications (str): The llm's generated task specifications that we wish to correct.
+        - errors (list): The gaps and errors detected by the validation.
+        - max_trials (int, optional): Maximum number of trials to attempt correction. Defaults to 3.
+
+        Returns:
+        str: The corrected task specifications, or None if all trials failed.
+        """
+        trial = 0
+        while trial < max_trials:
+            try:
+                await self.retry_policy.abefore_attempt()
+                response = await self.specification_correction_chain.ainvoke({"human_input":self.description,"latest_instructions":specifications,"errors":errors})
+                return response.content
             except Exception as ex:
                 print(f"Error during task specifications correction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
                 trial += 1
+                if not await self.retry_policy.await_before_retry(ex, trial, max_trials):
+                    break
 
         print(f"Reached maximum trials for task specifications correction. Returning None.")
-        return None
\ No newline at end of file
+        record_event(self.telemetry, 'give_up')
+        return None
+
+    async def agenerate_candidate(self, max_trials=3):
+        """
+        Asynchronously generate a single candidate of task specifications and validate it.
+
+        Parameters:
+        - max_trials (int, optional): Maximum number of trials to attempt extraction and validation. Defaults to 3.
+
+        Returns:
+        dict: The candidate with the 'task_specifications', 'score' and 'errors' items, or None if all trials failed.
+        """
+        trial = 0
+        while trial < max_trials:
+            try:
+                await self.retry_policy.abefore_attempt()
+                response = await self.specification_extraction_chain.ainvoke({"human_input":self.description})
+                specifications_evaluation = await self.avalidate_task_specifications(response.content, max_trials=max_trials)
+                if specifications_evaluation is None:
+                    raise ValueError("The candidate specifications could not be validated")
+                return {'task_specifications': response.content, **specifications_evaluation}
+            except Exception as ex:
+                print(f"Error during task specifications extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
+                trial += 1
+                if not await self.retry_policy.await_before_retry(ex, trial, max_trials):
+                    break
+
+        print(f"Reached maximum trials for task specifications extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
+        return None
+
+    async def agenerate_specifications_best_of_n(self, description, num_candidates=3, score_threshold=100, max_trials=3):
+        """
+        Asynchronously extract task specifications by generating and validating several candidates concurrently.
+        As soon as a candidate reaches the score threshold the remaining candidates are cancelled; otherwise the best
+        scoring candidate is autocorrected (correct & evaluate in each iteration) until it reaches the threshold.
+
+        Parameters:
+        - description (str): The user's description of the task.
+        - num_candidates (int, optional): Number of candidates to generate concurrently. Defaults to 3.
+        - score_threshold (int, optional): The validation score at which the generation stops. Defaults to 100.
+        - max_trials (int, optional): Maximum number of trials for each call, and maximum number of autocorrection iterations. Defaults to 3.
+
+        Returns:
+        dict: The 'task_specifications', 'score' and 'errors' of the selected candidate, or None if all candidates failed.
+        """
+        self.description = description
+
+        cached_specifications = self.get_cached_specifications(description, max_trials=max_trials)
+        if cached_specifications is not None:
+            return cached_specifications
+
+        tasks = [asyncio.create_task(self.agenerate_candidate(max_trials=max_trials)) for _ in range(max(num_candidates, 1))]
+        best_candidate = None
+        try:
+            for next_candidate in asyncio.as_completed(tasks):
+                candidate = await next_candidate
+                if candidate is None:
+                    continue
+                if self.verbose:
+                    print(f"Candidate specification's score: {candidate['score']}")
+                if (best_candidate is None) or (candidate['score'] > best_candidate['score']):
+                    best_candidate = candidate
+                if best_candidate['score'] >= score_threshold:
+                    break
+        finally:
+            # Early stopping: cancel the candidates still in progress
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if best_candidate is None:
+            print("All the task specifications candidates failed. Returning None.")
+            record_event(self.telemetry, 'give_up')
+            return None
+
+        internal_trial = 0
+        while best_candidate['score'] < score_threshold and internal_trial < max_trials:
+            internal_trial += 1
+            print("Autocorrecting task specifications:")
+            corrected_specifications = await self.acorrect_task_specifications(
+                best_candidate['task_specifications'], best_candidate['errors'], max_trials=max_trials)
+            if corrected_specifications is None:
+                break
+            specifications_evaluation = await self.avalidate_task_specifications(corrected_specifications, max_trials=max_trials)
+            if specifications_evaluation is None:
+                break
+            print(f"Specification's score: {specifications_evaluation['score']} ; The following errors were detected:\n {specifications_evaluation['errors']} ")
+            if specifications_evaluation['score'] >= best_candidate['score']:
+                best_candidate = {'task_specifications': corrected_specifications, **specifications_evaluation}
+
+        self.cache_specifications(description, best_candidate['task_specifications'], best_candidate['score'], best_candidate['errors'])
+        return best_candidate
+
+    def generate_specifications_best_of_n(self, description, num_candidates=3, score_threshold=100, max_trials=3):
+        """
+        Extract task specifications by generating and validating several candidates concurrently
+        (see agenerate_specifications_best_of_n).
+
+        Parameters:
+        - description (str): The user's description of the task.
+        - num_candidates (int, optional): Number of candidates to generate concurrently. Defaults to 3.
+        - score_threshold (int, optional): The validation score at which the generation stops. Defaults to 100.
+        - max_trials (int, optional): Maximum number of trials for each call, and maximum number of autocorrection iterations. Defaults to 3.
+
+        Returns:
+        dict: The 'task_specifications', 'score' and 'errors' of the selected candidate, or None if all candidates failed.
+        """
+        return asyncio.run(self.agenerate_specifications_best_of_n(description, num_candidates=num_candidates,
+                                                                   score_threshold=score_threshold, max_trials=max_trials))
+
+    def generate_structured_specifications(self, specifications, max_trials=3):
+        """
+        Convert textual task specifications into a machine readable (JSON) specification of tables, columns, distributions
+        and keys (see STRUCTURED_SPECIFICATION_FORMAT), and validate it locally.
+
+        Parameters:
+        - specifications (str): The textual task specifications.
+        - max_trials (int, optional): Maximum number of trials to attempt extraction. Defaults to 3.
+
+        Returns:
+        dict: The validated structured specification, or None if all trials failed.
+
+        Note:
+        - Performs multiple trials to handle extraction failures; the validation errors of a trial are sent with the next one.
+        """
+        structured_specification_template = (
+            "You are an analyst whose job is to convert data specifications into a machine readable format. "
+            "Convert the given task specifications into a single JSON object with the following format:\n{specification_format}\n"
+            "Keep all the tables, columns, distributions, descriptive statistics, categories and probabilities, formats and keys of the given specifications. "
+            "Use the free_text type for free text fields and for categorical fields without a closed set of categories."
+            "\nThe task specifications: {latest_instructions};"
+            "\nErrors found in your previous output (if any): {errors};"
+            "Please make sure you output a valid and complete JSON object, just the JSON, no intro and summary are needed, and don't cut it in the middle."
+            "\nGenerated Structured Specifications:"
+        )
+
+        structured_specification_prompt = PromptTemplate(
+            input_variables=["specification_format", "latest_instructions", "errors"], template=structured_specification_template
+        )
+
+        structured_specification_chain = structured_specification_prompt | self.llm
+
+        trial = 0
+        errors = []
+        while trial < max_trials:
+            try:
+                self.retry_policy.before_attempt()
+                output = structured_specification_chain.invoke({"specification_format": STRUCTURED_SPECIFICATION_FORMAT,
+                                                                "latest_instructions": specifications, "errors": errors})
+                with track_parse(self.telemetry):
+                    structured_specifications = parse_json(output.content, allow_truncated=False)
+                errors = validate_structured_specifications(structured_specifications)
+                if len(errors) > 0:
+                    raise ValueError(f"Invalid structured specifications: {errors}")
+                return structured_specifications
+            except Exception as ex:
+                print(f"Error during structured specifications extraction (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
+                trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
+
+        print("Reached maximum trials for structured specifications extraction. Returning None.")
+        record_event(self.telemetry, 'give_up')
+        return None
+
+    def refine_structured_specifications(self, structured_specifications, query, max_trials=3):
+        """
+        Refine a structured specification according to a user query. Only a patch with the changed tables and columns
+        (see STRUCTURED_SPECIFICATION_PATCH_FORMAT) is requested from the language model, and it is applied and validated locally.
+
+        Parameters:
+        - structured_specifications (dict): The structured specification to refine.
+        - query (str): The user query.
+        - max_trials (int, optional): Maximum number of trials to attempt refinement. Defaults to 3.
+
+        Returns:
+        dict: The refined and validated structured specification, or None if all trials failed.
+
+        Note:
+        - Performs multiple trials to handle refinement failures; the validation errors of a trial are sent with the next one.
+        """
+        structured_refinement_template = (
+            "You are an analyst whose job is to maintain machine readable data specifications. "
+            "The user asks a content refinement (see User Query) of the current specifications (see Current Specifications). "
+            "Revisit the columns, distributions and descriptive statistics, and output a JSON patch with the following format:\n{patch_format}\n"
+            "Each column definition follows this format:\n{specification_format}\n"
+            "\nThe User Query: {human_input};"
+            "\nCurrent Specifications: {latest_instructions};"
+            "\nErrors found in your previous output (if any): {errors};"
+            "Please make sure you output a valid JSON object, just the JSON, no intro and summary are needed, and don't cut it in the middle."
+            "\nGenerated Specifications Patch:"
+        )
+
+        structured_refinement_prompt = PromptTemplate(
+            input_variables=["patch_format", "specification_format", "human_input", "latest_instructions", "errors"], template=structured_refinement_template
+        )
+
+        structured_refinement_chain = structured_refinement_prompt | self.llm
+
+        trial = 0
+        errors = []
+        while trial < max_trials:
+            try:
+                self.retry_policy.before_attempt()
+                output = structured_refinement_chain.invoke({"patch_format": STRUCTURED_SPECIFICATION_PATCH_FORMAT,
+                                                             "specification_format": STRUCTURED_SPECIFICATION_FORMAT, "human_input": query,
+                                                             "latest_instructions": json.dumps(structured_specifications, separators=(',', ':')),
+                                                             "errors": errors})
+                with track_parse(self.telemetry):
+                    patch = parse_json(output.content, allow_truncated=False)
+                refined_specifications = apply_structured_specification_patch(structured_specifications, patch)
+                errors = validate_structured_specifications(refined_specifications)
+                if len(errors) > 0:
+                    raise ValueError(f"Invalid structured specifications: {errors}")
+                return refined_specifications
+            except Exception as ex:
+                print(f"Error during structured specifications refinement (trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
+                trial += 1
+                if not self.retry_policy.wait_before_retry(ex, trial, max_trials):
+                    break
+
+        print("Reached maximum trials for structured specifications refinement. Returning None.")
+        record_event(self.telemetry, 'give_up')
+        return None
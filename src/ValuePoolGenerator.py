@@ -0,0 +1,234 @@
+from langchain.prompts import PromptTemplate
+import asyncio
+from src.LLMTelemetry import with_telemetry, record_event, track_parse
+from src.BudgetGovernor import BudgetExceededError
+from src.RetryPolicy import RetryPolicy, with_retry_policy
+from src.LLMRouter import get_language_model
+from src.utils.lazy_import import LazyModule
+from src.utils.utils import parse_json
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+class ValuePoolGenerator:
+    """
+    A class for generating reusable pools of free text values using a language model, and assigning them to table records locally.
+    """
+
+    def __init__(self, llm, pool_size=50, max_value_reuse=None, max_buckets=20, seed=None, verbose=True, telemetry=None, retry_policy=None):
+        """
+        Initializes a new instance of the ValuePoolGenerator class, which asks the language model once per field
+        (and optionally per category bucket) for a pool of distinct values, and then samples these values for all the
+        records of a table, so the cost of generating free text fields is nearly independent of the number of records.
+
+        Parameters:
+        - llm: The language model used for generating the value pools.
+        - pool_size (int, optional): Number of distinct values to request for each pool. Defaults to 50.
+        - max_value_reuse (int, optional): Maximum number of records that can share the same value. Defaults to None (unlimited).
+        - max_buckets (int, optional): Maximum number of category buckets with a dedicated pool per field; the remaining
+          categories share a common pool. Defaults to 20.
+        - seed (int, optional): Seed for the local sampler. Defaults to None.
+        - verbose (bool, optional): Whether to print verbose output. Defaults to True.
+        - telemetry (LLMTelemetry, optional): A telemetry handler that records the calls, retries and parsing outcomes. Defaults to None.
+        - retry_policy (RetryPolicy, optional): The backoff and circuit breaker policy of the retries, usually shared by all the
+          components of a pipeline. Defaults to None (a new RetryPolicy).
+        """
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        llm = with_retry_policy(with_telemetry(get_language_model(llm), telemetry), self.retry_policy)
+        self.llm = llm
+        self.telemetry = telemetry
+        self.pool_size = pool_size
+        self.max_value_reuse = max_value_reuse
+        self.max_buckets = max_buckets
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+        self.pools = {}
+
+        value_pool_template = (
+            "You are a system that specializes in generating synthetic data according to user requests."
+            "Generate {pool_size} distinct, realistic and varied values for the '{field_name}' free text field of the '{table_name}' table."
+            "The task as described by the user: {human_input};"
+            "The values should fit records with the following context: {context};"
+            "Ensure that the generated texts are distinct and varied, without repeating any names from previous requests, even across different sessions."
+            "Format the output as a JSON list of strings. Omit any text before or after the JSON list, and don't cut it in the middle."
+            "\nGenerated Values:"
+        )
+
+        value_pool_prompt = PromptTemplate(
+            input_variables=["pool_size", "field_name", "table_name", "human_input", "context"], template=value_pool_template
+        )
+
+        self.value_pool_chain = value_pool_prompt | llm
+
+    async def agenerate_pool(self, description, table_name, field_name, context='', pool_size=None, max_trials=3):
+        """
+        Asynchronously generate a pool of distinct values for a single free text field.
+
+        Parameters:
+        - description (str): The description of the task.
+        - table_name (str): The name of the table.
+        - field_name (str): The name of the free text field.
+        - context (str, optional): Additional context shared by the records that will use this pool (e.g. a category). Defaults to ''.
+        - pool_size (int, optional): Number of values to request. Defaults to the pool size of the generator.
+        - max_trials (int, optional): Maximum number of trials to attempt generation. Defaults to 3.
+
+        Returns:
+        list: The distinct values generated (an empty list if all trials failed).
+        """
+        if pool_size is None:
+            pool_size = self.pool_size
+        trial = 0
+        while trial < max_trials:
+            try:
+                await self.retry_policy.abefore_attempt()
+                response = await self.value_pool_chain.ainvoke({"pool_size": pool_size, "field_name": field_name, "table_name": table_name,
+                                                                "human_input": description, "context": context})
+                with track_parse(self.telemetry):
+                    values = parse_json(response.content)
+                values = [str(value) for value in values if (value is not None) and (str(value).strip() != '')]
+                values = list(dict.fromkeys(values))
+                if len(values) == 0:
+                    raise ValueError("The generated pool is empty")
+                return values
+            except BudgetExceededError as ex:
+                print(f"{ex} ({table_name}.{field_name}). Returning an empty pool.")
+                return []
+            except Exception as ex:
+                print(f"Error during value pool generation ({table_name}.{field_name}, trial {trial + 1}): {ex}")
+                record_event(self.telemetry, 'retry', error=ex)
+                trial += 1
+                if not await self.retry_policy.await_before_retry(ex, trial, max_trials):
+                    break
+
+        print(f"Reached maximum trials for value pool generation ({table_name}.{field_name}). Returning an empty pool.")
+        record_event(self.telemetry, 'give_up')
+        return []
+
+    async def agenerate_pools(self, description, table, table_name, fields_list, bucket_field=None):
+        """
+        Asynchronously generate the value pools needed for the given free text fields of a table.
+        When a bucket field is given, a dedicated pool is generated for each of its most common values.
+        If the pools cannot cover the table under the reuse limit, additional values are requested once.
+
+        Parameters:
+        - description (str): The description of the task.
+        - table (DataFrame): The table to generate the pools for.
+        - table_name (str): The name of the table.
+        - fields_list (list): The free text fields of the table.
+        - bucket_field (str, optional): A categorical field used for bucketing the records. Defaults to None.
+
+        Returns:
+        dict: A dictionary with pairs of key ((field name, bucket value)) and value (list of values). The bucket value is None for the common pool.
+        """
+        buckets = [None]
+        if (bucket_field is not None) and (bucket_field in table.columns):
+            buckets = table[bucket_field].value_counts().index[:self.max_buckets].tolist() + [None]
+        bucket_sizes = self.get_bucket_sizes(table, bucket_field, buckets)
+
+        keys = []
+        tasks = []
+        for field_name in fields_list:
+            for bucket in buckets:
+                if bucket_sizes[bucket] == 0:
+                    continue
+                context = '' if bucket is None else f"{bucket_field} = {bucket}"
+                keys.append((field_name, bucket))
+                tasks.append(self.agenerate_pool(description, table_name, field_name, context=context,
+                                                 pool_size=min(self.pool_size, bucket_sizes[bucket])))
+        results = await asyncio.gather(*tasks)
+        pools = dict(zip(keys, results))
+
+        # Top up pools that cannot cover their records under the reuse limit
+        if self.max_value_reuse is not None:
+            keys = []
+            tasks = []
+            for (field_name, bucket), pool in pools.items():
+                missing_values = int(np.ceil(bucket_sizes[bucket] / self.max_value_reuse)) - len(pool)
+                if missing_values > 0:
+                    context = '' if bucket is None else f"{bucket_field} = {bucket}"
+                    context = context + f" ; Do not repeat any of these values: {pool}"
+                    keys.append((field_name, bucket))
+                    tasks.append(self.agenerate_pool(description, table_name, field_name, context=context, pool_size=missing_values))
+            results = await asyncio.gather(*tasks)
+            for key, values in zip(keys, results):
+                pools[key] = list(dict.fromkeys(pools[key] + values))
+
+        self.pools.update({(table_name,) + key: pool for key, pool in pools.items()})
+        return pools
+
+    def get_bucket_sizes(self, table, bucket_field, buckets):
+        """
+        Count the records assigned to each bucket. Records whose bucket value has no dedicated pool are assigned to the common pool (None).
+
+        Parameters:
+        - table (DataFrame): The table.
+        - bucket_field (str): The categorical field used for bucketing the records (can be None).
+        - buckets (list): The bucket values with a dedicated pool, and None for the common pool.
+
+        Returns:
+        dict: A dictionary with pairs of key (bucket value) and value (number of records).
+        """
+        if buckets == [None]:
+            return {None: len(table)}
+        counts = table[bucket_field].value_counts()
+        bucket_sizes = {bucket: int(counts.get(bucket, 0)) for bucket in buckets if bucket is not None}
+        bucket_sizes[None] = len(table) - sum(bucket_sizes.values())
+        return bucket_sizes
+
+    def sample_values(self, pool, num_records, max_value_reuse=None):
+        """
+        Sample values from a pool for a given number of records using vectorized numpy operations.
+
+        Parameters:
+        - pool (list): The pool of values.
+        - num_records (int): Number of values to sample.
+        - max_value_reuse (int, optional): Maximum number of records that can share the same value. Defaults to None (unlimited).
+
+        Returns:
+        numpy.ndarray: The sampled values (empty strings if the pool is empty).
+        """
+        if len(pool) == 0:
+            return np.full(num_records, '', dtype=object)
+        pool = np.asarray(pool, dtype=object)
+        if (max_value_reuse is None) or (len(pool) * max_value_reuse < num_records):
+            if max_value_reuse is not None:
+                print(f"A pool of {len(pool)} values cannot cover {num_records} records with a reuse limit of {max_value_reuse}. Spreading the values evenly.")
+                slots = np.resize(np.arange(len(pool)), num_records)
+                return pool[self.rng.permutation(slots)]
+            return pool[self.rng.integers(0, len(pool), size=num_records)]
+        slots = np.repeat(np.arange(len(pool)), max_value_reuse)
+        return pool[self.rng.permutation(slots)[:num_records]]
+
+    def fill_table(self, table, table_name, fields_list, description, bucket_field=None):
+        """
+        Fill the free text fields of a table with values sampled from LLM generated pools.
+
+        Parameters:
+        - table (DataFrame): The table to fill.
+        - table_name (str): The name of the table.
+        - fields_list (list): The free text fields to fill.
+        - description (str): The description of the task.
+        - bucket_field (str, optional): A categorical field used for bucketing the records. Defaults to None.
+
+        Returns:
+        DataFrame: The table with the filled free text fields.
+        """
+        pools = asyncio.run(self.agenerate_pools(description, table, table_name, fields_list, bucket_field=bucket_field))
+
+        if (bucket_field is not None) and (bucket_field in table.columns):
+            bucket_values = table[bucket_field].to_numpy()
+        else:
+            bucket_values = np.full(len(table), None, dtype=object)
+        dedicated_buckets = [bucket for (_, bucket) in pools.keys() if bucket is not None]
+        common_mask = ~pd.Series(bucket_values).isin(dedicated_buckets).to_numpy()
+
+        for field_name in fields_list:
+            field_values = np.full(len(table), '', dtype=object)
+            for (pool_field, bucket), pool in pools.items():
+                if pool_field != field_name:
+                    continue
+                mask = common_mask if bucket is None else (bucket_values == bucket)
+                field_values[mask] = self.sample_values(pool, int(mask.sum()), self.max_value_reuse)
+            table.loc[:, field_name] = field_values
+        return table
@@ -1,5 +1,34 @@
 #from src.DataDefiner import DataDefiner
 #from src.DataAugmentor import DataAugmentor
 #from src.DataGenerationPipeline import DataGenerationPipeline
+import importlib
 from src.Pipeline import Pipeline
-from src.utils.utils import parse_output, try_parse_json, create_json_sample_from_csv
+
+# Public names and the modules defining them. The modules (and their heavy dependencies, e.g. langchain and pandas)
+# are imported on first access of a name, e.g. `from src import parse_json`. The classes defined in a module of the same
+# name are imported from their module (e.g. `from src.DataGenerationPipeline import DataGenerationPipeline`), since
+# `src.DataGenerationPipeline` is the module once it is imported.
+_lazy_names = {
+    'ParquetSink': 'src.OutputSink',
+    'ArrowSink': 'src.OutputSink',
+    'CSVSink': 'src.OutputSink',
+    'create_output_sink': 'src.OutputSink',
+    'parse_output': 'src.utils.utils',
+    'try_parse_json': 'src.utils.utils',
+    'parse_json': 'src.utils.utils',
+    'create_json_sample_from_csv': 'src.utils.utils',
+    'create_json_sample_from_csv_files': 'src.utils.utils',
+}
+
+__all__ = ['Pipeline'] + list(_lazy_names.keys())
+
+
+def __getattr__(name):
+    # Only called for missing attributes, so the submodules that were already imported are not shadowed
+    if name not in _lazy_names:
+        raise AttributeError(f"module 'src' has no attribute '{name}'")
+    return getattr(importlib.import_module(_lazy_names[name]), name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,189 @@
+import ast
+import hashlib
+import random
+from collections import OrderedDict
+
+
+GENERATION_FUNCTION_NAME = 'generate'
+GENERATION_METADATA_NAMES = ['results_dict', 'table_size_param_dict', 'override_fields_dict', 'reformat_fields_dict',
+                             'table_names_dict', 'primary_keys_dict', 'parent_tables_dict', 'cross_table_dependencies_dict',
+                             'datetime_constraints_list']
+
+_compiled_code_cache = OrderedDict()
+_compiled_code_cache_size = 32
+
+
+def strip_code_fences(code):
+    """
+    Remove markdown code fences from code generated by a language model.
+
+    Parameters:
+    - code (str): The generated code.
+
+    Returns:
+    str: The code without the markdown fences.
+    """
+    return code.replace('```python', '').replace('```', '')
+
+
+def get_bound_names(statements):
+    """
+    Collect the names bound by a list of module level statements (assignments, loops, imports, definitions etc.),
+    without descending into nested function and class bodies.
+
+    Parameters:
+    - statements (list): A list of ast statements.
+
+    Returns:
+    list: The bound names, in order of appearance.
+    """
+    names = []
+
+    def visit(node):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.append(node.name)
+            return
+        if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            return
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.append(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.extend((alias.asname or alias.name).split('.')[0] for alias in node.names)
+        for child in ast.iter_child_nodes(node):
+            visit(child)
+
+    for statement in statements:
+        visit(statement)
+    return list(dict.fromkeys(names))
+
+
+def get_literal_assignment(tree, name):
+    """
+    Get the literal value assigned to a module level name, if it can be evaluated statically.
+
+    Parameters:
+    - tree (ast.Module): The parsed code.
+    - name (str): The assigned name.
+
+    Returns:
+    The literal value, or None if the name is not assigned a literal value.
+    """
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == name for target in node.targets):
+            try:
+                return ast.literal_eval(node.value)
+            except ValueError:
+                return None
+    return None
+
+
+def normalize_generation_code(code):
+    """
+    Normalize data generation code into a module that defines a `generate(table_sizes, seed=None)` function returning the
+    results_dict object. Code that already defines such a function is kept as is, and its metadata dictionaries
+    (see GENERATION_METADATA_NAMES) are declared global so they are available after the first call.
+    Legacy scripts are wrapped: imports stay at module level, all the other statements move into the function body
+    (with their names declared global, so the script keeps its module level semantics), and each table size parameter
+    listed in table_size_param_dict is read from table_sizes, falling back to its original expression.
+
+    Parameters:
+    - code (str): The data generation code.
+
+    Returns:
+    str: The normalized code.
+    """
+    code = strip_code_fences(code)
+    tree = ast.parse(code)
+
+    generate_nodes = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == GENERATION_FUNCTION_NAME]
+    if len(generate_nodes) > 0:
+        generate_node = generate_nodes[-1]
+        declared_names = [name for node in generate_node.body if isinstance(node, ast.Global) for name in node.names]
+        metadata_names = [name for name in get_bound_names(generate_node.body)
+                          if (name in GENERATION_METADATA_NAMES) and (name not in declared_names)]
+        if len(metadata_names) > 0:
+            generate_node.body.insert(0, ast.Global(names=metadata_names))
+        return ast.unparse(ast.fix_missing_locations(tree))
+
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    body = [node for node in tree.body if not isinstance(node, (ast.Import, ast.ImportFrom))]
+    # Annotated names cannot be declared global, so plain assignments are used instead
+    body = [ast.Assign(targets=[node.target], value=node.value) if isinstance(node, ast.AnnAssign) else node
+            for node in body if not (isinstance(node, ast.AnnAssign) and node.value is None)]
+
+    # Read the table sizes from the function arguments instead of the hard coded parameters
+    table_size_param_dict = get_literal_assignment(tree, 'table_size_param_dict')
+    if isinstance(table_size_param_dict, dict):
+        size_params = {str(param_name): table_name for table_name, param_name in table_size_param_dict.items()}
+        for node in body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+                    and node.targets[0].id in size_params:
+                node.value = ast.Call(func=ast.Attribute(value=ast.Name(id='table_sizes', ctx=ast.Load()), attr='get', ctx=ast.Load()),
+                                      args=[ast.Constant(value=size_params[node.targets[0].id]), node.value], keywords=[])
+    else:
+        print("Could not find a literal table_size_param_dict in the generation code. Table sizes will not be parametrized.")
+
+    function_body = []
+    global_names = [name for name in get_bound_names(body) if name not in ('table_sizes', 'seed')]
+    if len(global_names) > 0:
+        function_body.append(ast.Global(names=global_names))
+    function_body.extend(body)
+    function_body.append(ast.Return(value=ast.Name(id='results_dict', ctx=ast.Load())))
+
+    generate_node = ast.FunctionDef(
+        name=GENERATION_FUNCTION_NAME,
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='table_sizes'), ast.arg(arg='seed')], kwonlyargs=[],
+                           kw_defaults=[], defaults=[ast.Constant(value=None)]),
+        body=function_body, decorator_list=[], returns=None, type_params=[])
+    module = ast.Module(body=imports + [generate_node], type_ignores=[])
+    return ast.unparse(ast.fix_missing_locations(module))
+
+
+def compile_generation_code(code, base_namespace=None):
+    """
+    Compile and execute normalized data generation code once, caching the resulting module namespace by the code's hash.
+
+    Parameters:
+    - code (str): The normalized data generation code (see normalize_generation_code).
+    - base_namespace (dict, optional): Names available to the code without importing them. Defaults to None.
+
+    Returns:
+    dict: The module namespace, including the `generate` function.
+    """
+    code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+    if code_hash in _compiled_code_cache:
+        _compiled_code_cache.move_to_end(code_hash)
+        return _compiled_code_cache[code_hash]
+
+    namespace = dict(base_namespace) if base_namespace is not None else {}
+    namespace['__name__'] = '__generated__'
+    exec(compile(code, '<generated>', 'exec'), namespace)
+    if not callable(namespace.get(GENERATION_FUNCTION_NAME)):
+        raise ValueError(f"The generation code does not define a '{GENERATION_FUNCTION_NAME}' function")
+
+    _compiled_code_cache[code_hash] = namespace
+    if len(_compiled_code_cache) > _compiled_code_cache_size:
+        _compiled_code_cache.popitem(last=False)
+    return namespace
+
+
+def seed_generation(seed):
+    """
+    Seed the random generators commonly used by data generation code (random, numpy and faker, when installed).
+
+    Parameters:
+    - seed (int): The seed. Nothing is seeded when None.
+    """
+    if seed is None:
+        return
+    random.seed(seed)
+    try:
+        import numpy as np
+        np.random.seed(seed)
+    except ImportError:
+        pass
+    try:
+        from faker import Faker
+        Faker.seed(seed)
+    except ImportError:
+        pass
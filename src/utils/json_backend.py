@@ -0,0 +1,93 @@
+import json
+import re
+
+
+# The JSON backends, fastest first: orjson is used when installed, with the standard library as a fallback
+JSON_BACKENDS = ['orjson', 'json']
+
+# A run of digits that may be an integer beyond 64 bits, which orjson parses as a float (losing precision)
+LONG_INTEGER_PATTERN = re.compile(r"\d{19}")
+
+# The selected backend: the orjson module, False for the standard library, or None if not selected yet
+_orjson = None
+
+
+def set_json_backend(name=None):
+    """
+    Select the JSON backend used to parse the language model outputs and write the generated data.
+
+    Parameters:
+    - name (str, optional): 'orjson' or 'json'. Defaults to None (orjson if installed, else json).
+
+    Returns:
+    str: The name of the selected backend.
+
+    Raises:
+    ImportError: If 'orjson' is requested but not installed.
+    """
+    global _orjson
+    if name not in JSON_BACKENDS + [None]:
+        raise ValueError(f"Unknown JSON backend {name!r} (expected one of {JSON_BACKENDS})")
+    if name == 'json':
+        _orjson = False
+        return 'json'
+    try:
+        import orjson
+        _orjson = orjson
+    except ImportError:
+        if name == 'orjson':
+            raise
+        _orjson = False
+    return get_json_backend()
+
+
+def get_json_backend():
+    """
+    Get the name of the JSON backend (selecting the default one on first use).
+    """
+    if _orjson is None:
+        set_json_backend()
+    return 'orjson' if _orjson else 'json'
+
+
+def loads(text):
+    """
+    Parse a JSON string (or bytes) with the selected backend. Values only the standard library accepts (e.g. NaN literals,
+    integers beyond 64 bits) fall back to it.
+
+    Parameters:
+    - text (str): The JSON string.
+
+    Returns:
+    The parsed value.
+
+    Raises:
+    ValueError: If the string is not valid JSON.
+    """
+    if isinstance(text, (bytes, bytearray)):
+        text = text.decode('utf-8')
+    if (get_json_backend() == 'orjson') and (LONG_INTEGER_PATTERN.search(text) is None):
+        try:
+            return _orjson.loads(text)
+        except ValueError:
+            pass
+    return json.loads(text)
+
+
+def dumps(value):
+    """
+    Serialize a value to a compact JSON string with the selected backend (falling back to the standard library for the
+    values orjson does not support, e.g. non string keys).
+
+    Parameters:
+    - value: The value.
+
+    Returns:
+    str: The JSON string.
+    """
+    if get_json_backend() == 'orjson':
+        try:
+            return _orjson.dumps(value).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
@@ -0,0 +1,279 @@
+import re
+from src.utils import json_backend
+
+
+# Literals that language models use instead of the JSON ones
+LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None, 'NaN': None,
+            'nan': None, 'undefined': None}
+
+# The end of the text was reached before a value was complete
+_END = object()
+
+# The start of a JSON value holding records: an array of objects (or rows), or an object with a (possibly unquoted) key.
+# After prose, other bracketed values (e.g. "Here are [10] records:") are skipped.
+RECORDS_START_PATTERN = re.compile(r"\[\s*[\[{]|\{\s*([\"']|[A-Za-z_$][\w$]*\s*:)")
+
+
+def is_records_start(opening, next_char):
+    """
+    Check whether a bracket starts a JSON value holding records, given the next non whitespace character (for streamed
+    outputs, so unlike RECORDS_START_PATTERN an object must start with a quoted key).
+
+    Parameters:
+    - opening (str): The bracket, '{' or '['.
+    - next_char (str): The next non whitespace character.
+
+    Returns:
+    bool: True if the value may hold records.
+    """
+    if opening == '[':
+        return next_char in '{['
+    return next_char in '"\''
+
+
+class JSONRepairError(ValueError):
+    pass
+
+
+def strip_json_wrapping(text):
+    """
+    Remove the markdown code fences and the prose around the JSON value in a language model output.
+
+    Parameters:
+    - text (str): The output.
+
+    Returns:
+    str: The text from the first '{' or '[' on (up to the closing code fence, if any). After prose, the first array of
+    objects or object with keys is used (see RECORDS_START_PATTERN).
+    """
+    return _strip_json_wrapping(text)[0]
+
+
+def _strip_json_wrapping(text):
+    """
+    Strip the JSON value of a language model output (see strip_json_wrapping).
+
+    Returns:
+    tuple: The stripped text, and its parsed value if it is valid JSON (_END otherwise), so it is not parsed again.
+    """
+    fence = re.search(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", text, re.DOTALL)
+    if fence is not None:
+        text = fence.group(1)
+    starts = [index for index in (text.find('{'), text.find('[')) if index >= 0]
+    if len(starts) == 0:
+        return text.strip(), _END
+    start = min(starts)
+    if text[:start].strip() != '':
+        match = RECORDS_START_PATTERN.search(text)
+        if match is not None:
+            start = match.start()
+    text = text[start:]
+    # Drop trailing prose after the last closing bracket of a complete value
+    last_close = max(text.rfind('}'), text.rfind(']'))
+    if last_close >= 0:
+        try:
+            return text[:last_close + 1], json_backend.loads(text[:last_close + 1])
+        except ValueError:
+            pass
+    return text.strip(), _END
+
+
+class _TolerantParser:
+    """
+    A recursive descent JSON parser that accepts single quoted strings (where a doubled quote is an escaped quote), trailing
+    commas, missing commas, comments, Python literals and unquoted keys, and stops at the end of a truncated text: the
+    incomplete elements of arrays (e.g. a record cut off in the middle) are dropped, and the incomplete containers are closed.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.index = 0
+        self.truncated = False
+
+    def skip_whitespace(self):
+        while self.index < len(self.text):
+            char = self.text[self.index]
+            if char in ' \t\r\n':
+                self.index += 1
+            elif self.text.startswith('//', self.index) or (char == '#'):
+                end = self.text.find('\n', self.index)
+                self.index = len(self.text) if end < 0 else end + 1
+            elif self.text.startswith('/*', self.index):
+                end = self.text.find('*/', self.index + 2)
+                self.index = len(self.text) if end < 0 else end + 2
+            else:
+                break
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.text[self.index] if self.index < len(self.text) else None
+
+    def parse_value(self):
+        """
+        Parse a value.
+
+        Returns:
+        tuple: The value, and whether it is complete (an incomplete value is the part parsed before the end of the text,
+        or _END if nothing usable was parsed).
+        """
+        char = self.peek()
+        if char is None:
+            return _END, False
+        if char == '{':
+            return self.parse_object()
+        if char == '[':
+            return self.parse_array()
+        if char in '"\'':
+            return self.parse_string()
+        return self.parse_literal()
+
+    def parse_object(self):
+        self.index += 1
+        result = {}
+        while True:
+            char = self.peek()
+            if char is None:
+                return result, False
+            if char == '}':
+                self.index += 1
+                return result, True
+            if char == ',':
+                self.index += 1
+                continue
+            if char in '"\'':
+                key, complete = self.parse_string()
+            else:
+                key, complete = self.parse_bare_key()
+            if not complete:
+                return result, False
+            if self.peek() == ':':
+                self.index += 1
+            elif self.peek() is None:
+                return result, False
+            value, complete = self.parse_value()
+            if complete:
+                result[key] = value
+            else:
+                # Partial containers (e.g. the records of a table cut off in the middle) are kept
+                if isinstance(value, (list, dict)):
+                    result[key] = value
+                return result, False
+
+    def parse_array(self):
+        self.index += 1
+        result = []
+        while True:
+            char = self.peek()
+            if char is None:
+                return result, False
+            if char == ']':
+                self.index += 1
+                return result, True
+            if char == ',':
+                self.index += 1
+                continue
+            if char == '}':
+                # A mismatched bracket closes the array
+                return result, True
+            value, complete = self.parse_value()
+            if not complete:
+                # The incomplete element (e.g. a truncated record) is dropped
+                return result, False
+            result.append(value)
+
+    def parse_string(self):
+        quote = self.text[self.index]
+        self.index += 1
+        chars = []
+        while self.index < len(self.text):
+            char = self.text[self.index]
+            if char == '\\':
+                if self.index + 1 >= len(self.text):
+                    break
+                escaped = self.text[self.index + 1]
+                if escaped == 'u':
+                    digits = self.text[self.index + 2:self.index + 6]
+                    if len(digits) < 4:
+                        break
+                    try:
+                        chars.append(chr(int(digits, 16)))
+                    except ValueError:
+                        chars.append(digits)
+                    self.index += 6
+                    continue
+                chars.append({'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}.get(escaped, escaped))
+                self.index += 2
+                continue
+            if char == quote:
+                # Adjacent single quoted strings are an escaped quote, as in SQL (e.g. 'it''s')
+                if (quote == "'") and self.text.startswith("'", self.index + 1):
+                    chars.append(quote)
+                    self.index += 2
+                    continue
+                self.index += 1
+                return ''.join(chars), True
+            chars.append(char)
+            self.index += 1
+        self.index = len(self.text)
+        return _END, False
+
+    def parse_bare_key(self):
+        match = re.compile(r"[A-Za-z_$][\w$\- ]*").match(self.text, self.index)
+        if match is None:
+            raise JSONRepairError(f"Unexpected character {self.text[self.index]!r} at position {self.index}")
+        self.index = match.end()
+        if self.index >= len(self.text):
+            return _END, False
+        return match.group(0).strip(), True
+
+    def parse_literal(self):
+        match = re.compile(r"[^\s,\]\}:]+").match(self.text, self.index)
+        if match is None:
+            raise JSONRepairError(f"Unexpected character {self.text[self.index]!r} at position {self.index}")
+        token = match.group(0)
+        self.index = match.end()
+        if self.index >= len(self.text):
+            # A number or literal at the very end may have been cut off
+            return _END, False
+        if token in LITERALS:
+            return LITERALS[token], True
+        try:
+            return int(token), True
+        except ValueError:
+            pass
+        try:
+            return float(token), True
+        except ValueError:
+            raise JSONRepairError(f"Invalid literal {token!r} at position {match.start()}")
+
+
+def salvage_json(text, allow_truncated=True):
+    """
+    Parse a (possibly malformed or truncated) JSON value from a language model output. Code fences and prose are
+    stripped, and common defects (trailing or missing commas, single quotes, comments, Python literals, unquoted keys)
+    are repaired. If the output was cut off, all the complete elements are recovered: the records of a truncated array
+    are kept, except for the incomplete last one.
+
+    Parameters:
+    - text (str): The output.
+    - allow_truncated (bool, optional): Whether to recover the complete part of a truncated output. Defaults to True.
+
+    Returns:
+    tuple: The parsed value, and whether the output was truncated.
+
+    Raises:
+    JSONRepairError: If no JSON value could be recovered.
+    """
+    # Most outputs are valid JSON, and are parsed only once
+    try:
+        return json_backend.loads(text), False
+    except ValueError:
+        pass
+    text, value = _strip_json_wrapping(text)
+    if value is not _END:
+        return value, False
+    parser = _TolerantParser(text)
+    value, complete = parser.parse_value()
+    if (value is _END) or (not complete and not allow_truncated):
+        raise JSONRepairError("The output is not valid JSON and could not be repaired")
+    return value, not complete
@@ -0,0 +1,224 @@
+import json
+import time
+from src.utils.json_repair import salvage_json, is_records_start
+from src.utils.wire_format import row_to_record
+
+
+class StreamingRecordParser:
+    """
+    An incremental parser of the records in a streamed language model output: a JSON array of records, or a JSON object of
+    tables (arrays of records, or columnar tables {"columns": [...], "data": [[...], ...]}). Each record is emitted as soon
+    as its closing bracket arrives, so the records can be used (and the stream cancelled) before the output is complete.
+    Code fences and prose around the JSON are ignored: after prose, a bracket only starts the JSON if it opens an array
+    of objects or an object with keys, so bracketed prose (e.g. "Here are [10] records:") is skipped.
+    """
+
+    def __init__(self):
+        # The open containers ('{' or '['), and the keys they were opened under
+        self.stack = []
+        self.keys = []
+        self.started = False
+        self.finished = False
+        # Whether prose was seen before the JSON, and the bracket waiting for the next character to confirm the start
+        self.prose_seen = False
+        self.pending_start = None
+        self.in_string = False
+        self.escaped = False
+        # The characters of the string being read in an object (a candidate key)
+        self.string_chars = None
+        self.last_string = None
+        # The characters of the record (or of the columns of a columnar table) being read
+        self.record_chars = None
+        self.record_kind = None
+        self.record_depth = None
+        # The columns of the columnar tables
+        self.columns = {}
+        self.num_records = 0
+        self.num_invalid_records = 0
+
+    def is_records_array(self):
+        # A top level array, or an array in the top level object
+        return (self.stack == ['[']) or (self.stack == ['{', '['])
+
+    def is_columnar_table(self):
+        # A top level columnar table, or a columnar table in the top level object
+        return (self.stack == ['{']) or (self.stack == ['{', '{'])
+
+    def is_rows_array(self):
+        return (self.stack in [['{', '['], ['{', '{', '[']]) and (self.keys[-1] == 'data')
+
+    def get_table_name(self, kind='object'):
+        if kind == 'object':
+            # The key of the records array in the top level object
+            return self.keys[1] if len(self.stack) > 1 else None
+        # The key of the columnar table in the top level object
+        return self.keys[1] if (len(self.stack) > 1) and (self.stack[1] == '{') else None
+
+    def start_record(self, char, kind):
+        self.record_chars = [char]
+        self.record_kind = kind
+        self.record_depth = len(self.stack)
+
+    def feed(self, text):
+        """
+        Parse the next chunk of the output.
+
+        Parameters:
+        - text (str): The chunk.
+
+        Returns:
+        list: The records completed in this chunk, as (table name, record) tuples (the table name is None for a top level
+        array or columnar table).
+        """
+        records = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.started:
+                if self.pending_start is not None:
+                    if char.isspace():
+                        continue
+                    opening, self.pending_start = self.pending_start, None
+                    if is_records_start(opening, char):
+                        self.started = True
+                        self.feed_char(opening, records)
+                        self.feed_char(char, records)
+                        continue
+                if char in '{[':
+                    if self.prose_seen:
+                        self.pending_start = char
+                        continue
+                    self.started = True
+                elif not char.isspace():
+                    self.prose_seen = True
+                    continue
+                else:
+                    continue
+            self.feed_char(char, records)
+        return records
+
+    def feed_char(self, char, records):
+        """
+        Parse the next character of the JSON, adding the completed records to the given list.
+        """
+        if self.record_chars is not None:
+            self.record_chars.append(char)
+
+        if self.in_string:
+            if self.string_chars is not None:
+                self.string_chars.append(char)
+            if self.escaped:
+                self.escaped = False
+            elif char == '\\':
+                self.escaped = True
+            elif char == self.in_string:
+                self.in_string = False
+                if self.string_chars is not None:
+                    self.last_string = ''.join(self.string_chars[:-1])
+                    self.string_chars = None
+            return
+
+        if char in '"\'':
+            self.in_string = char
+            if (len(self.stack) > 0) and (self.stack[-1] == '{') and (self.record_chars is None):
+                self.string_chars = []
+        elif char in '{[':
+            key = self.last_string if (len(self.stack) > 0) and (self.stack[-1] == '{') else None
+            if self.record_chars is None:
+                if (char == '{') and self.is_records_array():
+                    self.start_record(char, 'object')
+                elif (char == '[') and self.is_rows_array():
+                    self.start_record(char, 'row')
+                elif (char == '[') and (key == 'columns') and self.is_columnar_table():
+                    self.start_record(char, 'columns')
+            self.stack.append(char)
+            self.keys.append(key)
+        elif char in '}]':
+            if len(self.stack) > 0:
+                self.stack.pop()
+                self.keys.pop()
+            if (self.record_chars is not None) and (len(self.stack) == self.record_depth):
+                record = self.parse_record(''.join(self.record_chars), self.record_kind)
+                if record is not None:
+                    records.append((self.get_table_name(self.record_kind), record))
+                self.record_chars = None
+            if len(self.stack) == 0:
+                self.finished = True
+
+    def parse_record(self, record_str, kind='object'):
+        try:
+            record = json.loads(record_str)
+        except ValueError:
+            try:
+                record, truncated = salvage_json(record_str, allow_truncated=False)
+            except ValueError:
+                record = None
+        if kind == 'columns':
+            if isinstance(record, list):
+                self.columns[self.get_table_name(kind)] = [str(column) for column in record]
+            return None
+        if (kind == 'row') and isinstance(record, list):
+            columns = self.columns.get(self.get_table_name(kind))
+            record = row_to_record(columns, record) if columns is not None else None
+        if not isinstance(record, dict):
+            self.num_invalid_records += 1
+            return None
+        self.num_records += 1
+        return record
+
+
+def records_to_json(records, default_table='data'):
+    """
+    Compose the JSON string of streamed records (see StreamingRecordParser), in the format of a batch.
+
+    Parameters:
+    - records (list): The (table name, record) tuples.
+    - default_table (str, optional): The table of records from a top level array. Defaults to 'data'.
+
+    Returns:
+    str: A JSON object of tables (arrays of records).
+    """
+    tables = {}
+    for table_name, record in records:
+        tables.setdefault(table_name if table_name is not None else default_table, []).append(record)
+    return json.dumps(tables)
+
+
+async def astream_records(runnable, inputs, max_records=None, on_records=None, should_stop=None):
+    """
+    Stream the output of a runnable (e.g. a prompt piped to a chat model) and parse its records as they arrive (see
+    StreamingRecordParser). The stream is closed (cancelling the request) once enough records were received.
+
+    Parameters:
+    - runnable: The runnable.
+    - inputs (dict): The inputs of the runnable.
+    - max_records (int, optional): Stop once this number of records was received. Defaults to None (no limit).
+    - on_records (callable, optional): Called with the list of new records of every chunk. Defaults to None.
+    - should_stop (callable, optional): Called after every chunk; the stream stops when it returns True. Defaults to None.
+
+    Returns:
+    tuple: The (table name, record) tuples, whether the output was complete, whether the stream was stopped early, and the
+    time to the first record in seconds (None if no record was received).
+    """
+    parser = StreamingRecordParser()
+    records = []
+    stopped = False
+    time_to_first_record = None
+    start = time.perf_counter()
+    stream = runnable.astream(inputs)
+    try:
+        async for chunk in stream:
+            text = chunk if isinstance(chunk, str) else getattr(chunk, 'content', '')
+            new_records = parser.feed(text if isinstance(text, str) else '')
+            if len(new_records) > 0:
+                if time_to_first_record is None:
+                    time_to_first_record = time.perf_counter() - start
+                records.extend(new_records)
+                if on_records is not None:
+                    on_records(new_records)
+            if (not parser.finished) and (((max_records is not None) and (len(records) >= max_records)) or ((should_stop is not None) and should_stop())):
+                stopped = True
+                break
+    finally:
+        await stream.aclose()
+    return records, parser.finished, stopped, time_to_first_record
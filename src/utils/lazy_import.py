@@ -0,0 +1,42 @@
+import importlib
+
+
+class LazyModule:
+    """
+    A proxy for a module that is imported on first attribute access, so heavy dependencies (e.g. pandas) do not slow down
+    the import of the modules that use them.
+    """
+
+    def __init__(self, module_name):
+        """
+        Initializes a new instance of the LazyModule class.
+
+        Parameters:
+        - module_name (str): The full name of the module (e.g. 'pandas').
+        """
+        self.__dict__['_module_name'] = module_name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        """
+        Import the module, if it was not imported yet.
+
+        Returns:
+        module: The imported module.
+        """
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._module_name)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        status = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._module_name}' ({status})>"
@@ -0,0 +1,332 @@
+import csv
+import io
+import os
+from src.utils.lazy_import import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+# The CSV sampling methods: a single pass with reservoir sampling, or reading the lines at random byte offsets
+SAMPLING_METHODS = ['auto', 'reservoir', 'seek']
+
+# Files up to this size are sampled with a reservoir by the 'auto' method, larger ones at random byte offsets
+SEEK_MIN_FILE_SIZE = 64 * 1024 * 1024
+
+# Number of random byte offsets tried per requested row, before falling back to a reservoir
+SEEK_MAX_TRIALS_PER_ROW = 20
+
+
+def reservoir_sample(chunks, num_samples, rng, row_filter=None):
+    """
+    Sample rows uniformly without replacement from a sequence of DataFrames, in a single pass with bounded memory: each
+    row gets a random priority, and the rows with the lowest priorities seen so far are kept.
+
+    Parameters:
+    - chunks (iterable): The DataFrames (e.g. the chunks of a CSV file).
+    - num_samples (int): The number of rows to sample.
+    - rng (Generator): The numpy random generator.
+    - row_filter (callable, optional): A function returning the mask of the rows of a chunk that can be sampled. Defaults
+      to None (all the rows).
+
+    Returns:
+    DataFrame: The sampled rows (fewer if there are fewer rows), in their order in the sequence.
+    """
+    reservoir = None
+    priorities = np.empty(0)
+    offset = 0
+    for chunk in chunks:
+        chunk = chunk.set_axis(pd.RangeIndex(offset, offset + len(chunk)))
+        offset += len(chunk)
+        if row_filter is not None:
+            chunk = chunk[np.asarray(row_filter(chunk), dtype=bool)]
+        if len(chunk) == 0:
+            continue
+        chunk_priorities = rng.random(len(chunk))
+        if reservoir is None:
+            reservoir, priorities = chunk.iloc[:0], np.empty(0)
+        if (len(priorities) >= num_samples) and (chunk_priorities.min() >= priorities.max()):
+            continue
+        reservoir = pd.concat([reservoir, chunk])
+        priorities = np.concatenate([priorities, chunk_priorities])
+        if len(priorities) > num_samples:
+            kept = np.argpartition(priorities, num_samples - 1)[:num_samples] if num_samples > 0 else []
+            reservoir, priorities = reservoir.iloc[kept], priorities[kept]
+    if reservoir is None:
+        return None
+    return reservoir.sort_index().reset_index(drop=True)
+
+
+def read_csv_header(full_file_path, encoding='utf-8'):
+    """
+    Read the header line of a CSV file.
+
+    Returns:
+    tuple: The header line (bytes) and the column names.
+    """
+    with open(full_file_path, 'rb') as file:
+        header = file.readline()
+    return header, next(csv.reader([header.decode(encoding)]), [])
+
+
+def seek_sample_csv(full_file_path, num_samples, rng, encoding='utf-8', **read_csv_kwargs):
+    """
+    Sample rows of a CSV file by reading the lines at random byte offsets, without reading the whole file. The sample is
+    approximately uniform (rows following longer rows are more likely). Lines with an unbalanced quote or that do not
+    parse to the header's number of fields (e.g. the parts of a quoted field holding line breaks) are skipped.
+
+    Parameters:
+    - full_file_path (str): The path of the CSV file.
+    - num_samples (int): The number of rows to sample.
+    - rng (Generator): The numpy random generator.
+    - encoding (str, optional): The encoding of the file. Defaults to 'utf-8'.
+    - read_csv_kwargs: Options of pandas.read_csv, for parsing the sampled rows.
+
+    Returns:
+    DataFrame: The sampled rows, or None if not enough distinct rows were found (or they could not be parsed).
+    """
+    header, columns = read_csv_header(full_file_path, encoding)
+    file_size = os.path.getsize(full_file_path)
+    lines = {}
+    with open(full_file_path, 'rb') as file:
+        for _ in range(num_samples * SEEK_MAX_TRIALS_PER_ROW):
+            if len(lines) >= num_samples:
+                break
+            # Start from the last byte of the header at the earliest, so the first row can be sampled
+            file.seek(int(rng.integers(len(header) - 1, file_size)))
+            file.readline()
+            line_offset = file.tell()
+            line = file.readline()
+            if (line.strip() == b'') or (line_offset in lines) or (line.count(b'"') % 2 == 1):
+                continue
+            try:
+                fields = next(csv.reader([line.decode(encoding)]), [])
+            except (UnicodeDecodeError, csv.Error):
+                continue
+            if len(fields) == len(columns):
+                lines[line_offset] = line if line.endswith(b'\n') else line + b'\n'
+    if len(lines) < num_samples:
+        return None
+    text = (header + b''.join(lines[line_offset] for line_offset in sorted(lines))).decode(encoding)
+    try:
+        return pd.read_csv(io.StringIO(text), **read_csv_kwargs)
+    except (ValueError, pd.errors.ParserError):
+        return None
+
+
+def sample_csv(full_file_path, num_samples=5, method='auto', seed=None, row_filter=None, chunksize=100000, **read_csv_kwargs):
+    """
+    Sample rows of a CSV file with bounded memory, without loading the whole file.
+
+    Parameters:
+    - full_file_path (str): The path of the CSV file.
+    - num_samples (int, optional): The number of rows to sample. Defaults to 5.
+    - method (str, optional): 'reservoir' (a single pass over the file, with reservoir sampling), 'seek' (the lines at
+      random byte offsets, falling back to 'reservoir' if the file does not have enough single line rows) or 'auto'
+      ('seek' for files larger than SEEK_MIN_FILE_SIZE). Defaults to 'auto'.
+    - seed (int or Generator, optional): Seed for the random generator. Defaults to None.
+    - row_filter (callable, optional): A function returning the mask of the rows of a DataFrame that can be sampled (the
+      file is then read with a reservoir). Defaults to None.
+    - chunksize (int, optional): The number of rows read at a time by the reservoir. Defaults to 100000.
+    - read_csv_kwargs: Options of pandas.read_csv (e.g. sep, dtype).
+
+    Returns:
+    DataFrame: The sampled rows (all of them if the file has fewer rows), in their order in the file.
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method {method!r} (expected one of {SAMPLING_METHODS})")
+    rng = np.random.default_rng(seed)
+    if method == 'auto':
+        method = 'seek' if os.path.getsize(full_file_path) > SEEK_MIN_FILE_SIZE else 'reservoir'
+    if (method == 'seek') and (row_filter is None) and (num_samples > 0) and ('sep' not in read_csv_kwargs):
+        sample = seek_sample_csv(full_file_path, num_samples, rng, **read_csv_kwargs)
+        if sample is not None:
+            return sample
+    with pd.read_csv(full_file_path, chunksize=chunksize, **read_csv_kwargs) as chunks:
+        sample = reservoir_sample(chunks, num_samples, rng, row_filter)
+    if sample is None:
+        return pd.read_csv(full_file_path, nrows=0, **read_csv_kwargs)
+    return sample
+
+
+def get_key_names(table_name):
+    # The names of the key column of a table, besides 'id': '<table>_id' and '<table without a trailing s>_id' (without
+    # the extension of a file name, e.g. 'customers.csv')
+    table_name = os.path.splitext(str(table_name))[0].lower()
+    return [f"{table_name}_id"] + ([f"{table_name[:-1]}_id"] if table_name.endswith('s') else [])
+
+
+def find_key_column(table_name, columns):
+    # The primary key of a table: a column named 'id', '<table>_id' or '<table without a trailing s>_id'
+    candidates = ['id'] + get_key_names(table_name)
+    lower_columns = {str(column).lower(): column for column in columns}
+    for candidate in candidates:
+        if candidate in lower_columns:
+            return lower_columns[candidate]
+    return None
+
+
+def infer_foreign_keys(columns_dict):
+    """
+    Infer the foreign keys between tables from their column names: a column of a table named as the key column of
+    another table (e.g. 'customer_id' in both tables), or as '<table>_id' when the key column is 'id' (e.g.
+    'orders.customer_id' references 'customers.id').
+
+    Parameters:
+    - columns_dict (dict): Pairs of table name and column names.
+
+    Returns:
+    dict: Pairs of '<table>.<column>' and the '<table>.<column>' it references.
+    """
+    key_columns = {table_name: find_key_column(table_name, columns) for table_name, columns in columns_dict.items()}
+    foreign_keys = {}
+    for table_name, columns in columns_dict.items():
+        lower_columns = {str(column).lower(): column for column in columns}
+        for parent_table, key_column in key_columns.items():
+            if (parent_table == table_name) or (key_column is None):
+                continue
+            names = [str(key_column).lower()]
+            if str(key_column).lower() == 'id':
+                names = get_key_names(parent_table)
+            for name in names:
+                if (name in lower_columns) and (lower_columns[name] != key_columns[table_name]):
+                    foreign_keys[f"{table_name}.{lower_columns[name]}"] = f"{parent_table}.{key_column}"
+                    break
+    return foreign_keys
+
+
+def get_sampling_order(table_names, foreign_keys):
+    """
+    Get the order of sampling of related tables: referenced tables before the tables referencing them (the references
+    closing a cycle are ignored).
+
+    Parameters:
+    - table_names (list): The table names.
+    - foreign_keys (dict): Pairs of '<table>.<column>' and the '<table>.<column>' it references.
+
+    Returns:
+    tuple: The table names, and the foreign keys of each table as a list of (column, parent table, parent column).
+    """
+    references = {table_name: [] for table_name in table_names}
+    for reference, referenced in foreign_keys.items():
+        table_name, _, column = reference.rpartition('.')
+        parent_table, _, parent_column = referenced.rpartition('.')
+        if (table_name in references) and (parent_table in references) and (parent_table != table_name):
+            references[table_name].append((column, parent_table, parent_column))
+    order = []
+    while len(order) < len(table_names):
+        ready = [table_name for table_name in table_names
+                 if (table_name not in order) and all(parent_table in order for _, parent_table, _ in references[table_name])]
+        if len(ready) == 0:
+            # A cycle: its first table is sampled without its unresolved references
+            table_name = next(table_name for table_name in table_names if table_name not in order)
+            references[table_name] = [reference for reference in references[table_name] if reference[1] in order]
+            ready = [table_name]
+        order.extend(ready)
+    return order, references
+
+
+def get_reference_filter(table_references, samples):
+    """
+    Get the filter of the rows referencing only sampled rows of their parent tables (missing references are allowed).
+
+    Returns:
+    callable: The function returning the mask of the rows of a DataFrame, or None if the table has no references.
+    """
+    if len(table_references) == 0:
+        return None
+
+    def row_filter(dataframe):
+        mask = np.ones(len(dataframe), dtype=bool)
+        for column, parent_table, parent_column in table_references:
+            if (column in dataframe.columns) and (parent_column in samples[parent_table].columns):
+                values = dataframe[column]
+                mask &= np.asarray(values.isna() | values.isin(samples[parent_table][parent_column].dropna()), dtype=bool)
+        return mask
+
+    return row_filter
+
+
+def resolve_foreign_keys(foreign_keys, columns_dict):
+    # 'infer' infers them from the column names, None disables the related sampling
+    if foreign_keys == 'infer':
+        return infer_foreign_keys(columns_dict)
+    return foreign_keys if foreign_keys is not None else {}
+
+
+def sample_related_dataframes(dataframes_dict, num_samples=5, foreign_keys='infer', seed=None):
+    """
+    Sample rows of related tables, keeping the foreign keys consistent: the rows of a table referencing other tables are
+    sampled among the rows that reference sampled rows (e.g. the orders of the sampled customers), and the rows of the
+    referenced tables are preferably sampled among the referenced ones.
+
+    Parameters:
+    - dataframes_dict (dict): Pairs of table name and DataFrame.
+    - num_samples (int, optional): The number of rows to sample per table. Defaults to 5.
+    - foreign_keys (dict or str, optional): Pairs of '<table>.<column>' and the '<table>.<column>' it references, 'infer'
+      to infer them from the column names (see infer_foreign_keys), or None to sample the tables independently. Defaults
+      to 'infer'.
+    - seed (int or Generator, optional): Seed for the random generator. Defaults to None.
+
+    Returns:
+    dict: Pairs of table name and sampled DataFrame (all the rows of the tables with fewer rows), in the given order.
+    """
+    rng = np.random.default_rng(seed)
+    foreign_keys = resolve_foreign_keys(foreign_keys, {name: list(df.columns) for name, df in dataframes_dict.items()})
+    order, references = get_sampling_order(list(dataframes_dict.keys()), foreign_keys)
+    referenced_values = {}
+    for table_name, table_references in references.items():
+        for column, parent_table, parent_column in table_references:
+            if column in dataframes_dict[table_name].columns:
+                referenced_values.setdefault((parent_table, parent_column), []).append(dataframes_dict[table_name][column])
+
+    samples = {}
+    for table_name in order:
+        dataframe = dataframes_dict[table_name]
+        row_filter = get_reference_filter(references[table_name], samples)
+        candidates = dataframe[row_filter(dataframe)] if row_filter is not None else dataframe
+        if len(candidates) == 0:
+            # None of the rows reference the sampled rows
+            candidates = dataframe
+        # Prefer the rows referenced by the tables sampled next, so they have related rows
+        for (parent_table, parent_column), values in referenced_values.items():
+            if (parent_table == table_name) and (parent_column in candidates.columns):
+                referenced = candidates[candidates[parent_column].isin(pd.concat(values).dropna())]
+                if len(referenced) > 0:
+                    candidates = referenced
+        samples[table_name] = reservoir_sample([candidates], min(num_samples, len(candidates)), rng)
+        if samples[table_name] is None:
+            samples[table_name] = dataframe.iloc[:0]
+    return {table_name: samples[table_name] for table_name in dataframes_dict}
+
+
+def sample_related_csvs(file_paths_dict, num_samples=5, foreign_keys='infer', method='auto', seed=None, **read_csv_kwargs):
+    """
+    Sample rows of related CSV files with bounded memory, keeping the foreign keys consistent (see
+    sample_related_dataframes). The tables that are not referencing others are sampled with the given method, and the
+    others in a single pass over their file, among the rows referencing sampled rows.
+
+    Parameters:
+    - file_paths_dict (dict): Pairs of table name and path of its CSV file.
+    - num_samples (int, optional): The number of rows to sample per table. Defaults to 5.
+    - foreign_keys (dict or str, optional): See sample_related_dataframes. Defaults to 'infer'.
+    - method (str, optional): See sample_csv. Defaults to 'auto'.
+    - seed (int or Generator, optional): Seed for the random generator. Defaults to None.
+    - read_csv_kwargs: Options of pandas.read_csv.
+
+    Returns:
+    dict: Pairs of table name and sampled DataFrame, in the given order.
+    """
+    rng = np.random.default_rng(seed)
+    encoding = read_csv_kwargs.get('encoding', 'utf-8')
+    foreign_keys = resolve_foreign_keys(foreign_keys, {table_name: read_csv_header(file_path, encoding)[1]
+                                                        for table_name, file_path in file_paths_dict.items()})
+    order, references = get_sampling_order(list(file_paths_dict.keys()), foreign_keys)
+    samples = {}
+    for table_name in order:
+        row_filter = get_reference_filter(references[table_name], samples)
+        samples[table_name] = sample_csv(file_paths_dict[table_name], num_samples, method, rng, row_filter, **read_csv_kwargs)
+        if (row_filter is not None) and (len(samples[table_name]) == 0):
+            # None of the rows reference the sampled rows
+            samples[table_name] = sample_csv(file_paths_dict[table_name], num_samples, method, rng, **read_csv_kwargs)
+    return {table_name: samples[table_name] for table_name in file_paths_dict}
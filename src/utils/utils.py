@@ -1,24 +1,49 @@
+import io
 import json
-import re
+from src.utils.json_repair import salvage_json
+from src.utils.wire_format import dataframe_to_wire_json, decode_wire_tables
 
 
-def try_parse_json(sample_output):
+def parse_json(sample_output, allow_truncated=True):
     """
-    Try to parse a string as JSON.
+    Parse a language model output, repairing it if needed (see salvage_json). Unlike try_parse_json, the parsed value is
+    returned, so the output is decoded only once.
+
+    Parameters:
+    - sample_output (str): The string to parse. Values that were already parsed are returned as they are.
+    - allow_truncated (bool, optional): Whether to recover the complete part of a truncated output. Defaults to True.
+
+    Returns:
+    The parsed value.
+
+    Raises:
+    ValueError: If the output could not be repaired.
+    """
+    if not isinstance(sample_output, str):
+        return sample_output
+    parsed_json, truncated = salvage_json(sample_output, allow_truncated=allow_truncated)
+    return parsed_json
+
+
+def try_parse_json(sample_output, allow_truncated=True):
+    """
+    Try to repair a language model output into a valid JSON string (see salvage_json): code fences and prose are
+    stripped, common defects are repaired, and the complete records of a truncated output are recovered.
 
     Parameters:
     - sample_output (str): The string to parse.
+    - allow_truncated (bool, optional): Whether to recover the complete part of a truncated output. Defaults to True.
 
     Returns:
-    dict or None: The parsed JSON dictionary, or None if parsing fails.
+    str: The repaired JSON string, or the string itself if it could not be repaired (so parsing it raises the original error).
     """
+    if not isinstance(sample_output, str):
+        return sample_output
     try:
-        parsed_json = json.dumps(sample_output)
-        parsed_json = json.loads(parsed_json)
-        return parsed_json
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {e}")
-        return None
+        parsed_json, truncated = salvage_json(sample_output, allow_truncated=allow_truncated)
+    except ValueError:
+        return sample_output
+    return json.dumps(parsed_json)
 
 
 def parse_output(sample_output, results_dict=None):
@@ -36,8 +61,7 @@ def parse_output(sample_output, results_dict=None):
         results_dict = {}
 
     try:
-        #parsed_dict = try_parse_json(sample_output)
-        parsed_dict = json.loads(sample_output)
+        parsed_dict = parse_json(sample_output)
 
         if parsed_dict is not None:
             for key, value in parsed_dict.items():
@@ -70,8 +94,7 @@ def parse_content_generated_concurrently(content, max_trials=3):
         trial = 0
         while trial < max_trials:
             try:
-                #task_res = try_parse_json(task)
-                task_res = json.loads(task)
+                task_res = parse_json(task)
                 for key, value in task_res.items():
                     if key not in output:
                         output[key] = pd.DataFrame(pd.json_normalize(value))
@@ -89,34 +112,42 @@ def parse_content_generated_concurrently(content, max_trials=3):
     return output
 
 
-def dataframe_to_json(input_df, key_name):
+def dataframe_to_json(input_df, key_name, wire_format='records'):
     """
     Convert a DataFrame to a JSON string.
 
     Parameters:
     - input_df (DataFrame): The DataFrame to convert.
     - key_name (str): The key name for the JSON object.
+    - wire_format (str, optional): The encoding of the table, 'records' or 'columnar' (see wire_format). Defaults to 'records'.
 
     Returns:
     str: The JSON string representation of the DataFrame.
     """
-    json_sample = input_df.to_json(orient='records')
+    json_sample = dataframe_to_wire_json(input_df, wire_format)
     results = f'{{"{key_name}": {json_sample}}}'
     return results
 
 
 import os
-import pandas as pd
+from src.utils.lazy_import import LazyModule
+from src.utils.sampling import sample_csv, sample_related_csvs, sample_related_dataframes
+
+# pandas and numpy are imported on first use
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
 
 
-def create_json_sample_from_csv(file_path, file_name, num_samples=5):
+def create_json_sample_from_csv(file_path, file_name, num_samples=5, method='auto', seed=None):
     """
-    Create a JSON sample from a CSV file.
+    Create a JSON sample from a CSV file, without loading the whole file (see sampling.sample_csv).
 
     Parameters:
     - file_path (str): The path to the directory containing the CSV file.
     - file_name (str): The name of the CSV file.
     - num_samples (int, optional): The number of samples to include in the JSON. Defaults to 5.
+    - method (str, optional): The sampling method, 'reservoir', 'seek' or 'auto' (see sampling.sample_csv). Defaults to 'auto'.
+    - seed (int, optional): Seed for the random generator. Defaults to None.
 
     Returns:
     str: A JSON string containing the sampled data.
@@ -124,11 +155,8 @@ def create_json_sample_from_csv(file_path, file_name, num_samples=5):
     # Construct the full file path
     full_file_path = os.path.join(file_path, file_name)
 
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(full_file_path)
-
-    # Sample the DataFrame
-    df_sample = df.sample(n=num_samples)
+    # Sample the CSV file
+    df_sample = sample_csv(full_file_path, num_samples=num_samples, method=method, seed=seed)
 
     # Convert the sampled DataFrame to JSON
     json_sample = df_sample.to_json(orient='records')
@@ -139,33 +167,64 @@ def create_json_sample_from_csv(file_path, file_name, num_samples=5):
     return json_result
 
 
-def create_json_sample_from_dataframes_dictionary(dataframes_dictionary, num_samples=5):
+def create_json_sample_from_csv_files(file_path, file_names, num_samples=5, foreign_keys='infer', method='auto', seed=None,
+                                      wire_format='records'):
+    """
+    Create a JSON sample from related CSV files, keeping the foreign keys consistent and without loading the whole files
+    (see sampling.sample_related_csvs).
+
+    Parameters:
+    - file_path (str): The path to the directory containing the CSV files.
+    - file_names (list): The names of the CSV files.
+    - num_samples (int, optional): The number of samples per file to include in the JSON. Defaults to 5.
+    - foreign_keys (dict or str, optional): Pairs of '<file name>.<column>' and the '<file name>.<column>' it references,
+      'infer' to infer them from the column names, or None to sample the files independently. Defaults to 'infer'.
+    - method (str, optional): The sampling method, 'reservoir', 'seek' or 'auto' (see sampling.sample_csv). Defaults to 'auto'.
+    - seed (int, optional): Seed for the random generator. Defaults to None.
+    - wire_format (str, optional): The encoding of the tables, 'records' or 'columnar' (see wire_format). Defaults to 'records'.
+
+    Returns:
+    str: A JSON string containing the sampled data.
+    """
+    file_paths_dict = {file_name: os.path.join(file_path, file_name) for file_name in file_names}
+    samples = sample_related_csvs(file_paths_dict, num_samples=num_samples, foreign_keys=foreign_keys, method=method, seed=seed)
+    return "{" + ", ".join(f"\"{file_name}\": {dataframe_to_wire_json(df_sample, wire_format)}"
+                           for file_name, df_sample in samples.items()) + "}"
+
+
+def create_json_sample_from_dataframes_dictionary(dataframes_dictionary, num_samples=5, wire_format='records', foreign_keys='infer',
+                                                  seed=None):
     """
-    Create a JSON sample from a CSV file.
+    Create a JSON sample from a dictionary of DataFrames, keeping the foreign keys between them consistent (see
+    sampling.sample_related_dataframes).
 
     Parameters:
     - dataframes_dictionary (a dictionary): A dictionary with pairs of data name (string) and Dataframe object, that holds the input tabular data.
     - num_samples (int, optional): The number of samples to include in the JSON. Defaults to 5.
+    - wire_format (str, optional): The encoding of the tables, 'records' or 'columnar' (see wire_format). Defaults to 'records'.
+    - foreign_keys (dict or str, optional): Pairs of '<data name>.<column>' and the '<data name>.<column>' it references,
+      'infer' to infer them from the column names, or None to sample the DataFrames independently. Defaults to 'infer'.
+    - seed (int, optional): Seed for the random generator. Defaults to None.
 
     Returns:
     str: A JSON string containing the sampled data.
     """
 
-    json_result = ''
+    json_results = []
 
-    # Iterate over each dataframe
-    for df_name, df in dataframes_dictionary.items():
-        # Sample the DataFrame
-        df_sample = df.sample(n=num_samples)
+    # Sample the DataFrames together
+    samples = sample_related_dataframes(dataframes_dictionary, num_samples=num_samples, foreign_keys=foreign_keys, seed=seed)
 
+    # Iterate over each dataframe
+    for df_name, df_sample in samples.items():
         # Convert the sampled DataFrame to JSON
-        json_sample = df_sample.to_json(orient='records')
+        json_sample = dataframe_to_wire_json(df_sample, wire_format)
 
-        # Combine the JSON sample with the file name
-        json_result = f"\"{df_name}\": {json_sample}"
+        # Combine the JSON sample with the data name
+        json_results.append(f"\"{df_name}\": {json_sample}")
 
     # Add {} around
-    json_result = "{" + json_result + "}"
+    json_result = "{" + ", ".join(json_results) + "}"
 
     return json_result
 
@@ -192,28 +251,47 @@ def compose_query_message(query, region=None, language=None, task_specifications
     return query_msg
 
 
-def sample_str_to_dataframes_dict(sample_data):
+def sample_str_to_dataframes_dict(sample_data, schema=None):
     """
     Convert a sample data string to a dictionary with table names as keys and pandas dataframe as items.
 
     Parameters:
-    - sample_data (str): The sample data string to convert (assumed to be a JSON string).
+    - sample_data (str): The sample data string to convert (assumed to be a JSON string, parsed once, see parse_json), or
+      its parsed value. The tables may be lists of records or columnar tables (see wire_format).
+    - schema (TableSchema, optional): The schema the tables are coerced to. Defaults to None (dtypes inferred per table).
 
     Returns:
     Dictionary: A dictionary with table names as keys and pandas dataframes as values.
     """
     dataframes_dict = {}
-    dataStructureSample = try_parse_json(sample_data)
-    json_data = json.loads(dataStructureSample)
-    has_keys = does_sample_contain_keys(dataStructureSample)
+    json_data = decode_wire_tables(parse_json(sample_data))
+    has_keys = isinstance(json_data, dict)
     if (has_keys):
         for key, items in json_data.items():
-            dataframes_dict[key] = pd.DataFrame.from_dict(items)
+            dataframes_dict[key] = records_to_dataframe(items)
     else:
-        dataframes_dict['data'] = pd.DataFrame.from_dict(json_data)
+        dataframes_dict['data'] = records_to_dataframe(json_data)
+    if schema is not None:
+        dataframes_dict = schema.coerce_tables(dataframes_dict)
     #finally:
     return dataframes_dict
 
+
+def records_to_dataframe(records):
+    """
+    Build a DataFrame from parsed records, column by column (which is faster than building it record by record).
+
+    Parameters:
+    - records (list or dict): A list of records, or a dictionary of columns.
+
+    Returns:
+    DataFrame: The DataFrame. A record that lacks a field has a missing value in its column.
+    """
+    if isinstance(records, list) and all(isinstance(record, dict) for record in records):
+        columns = dict.fromkeys(field for record in records for field in record)
+        return pd.DataFrame({column: [record.get(column) for record in records] for column in columns})
+    return pd.DataFrame.from_dict(records)
+
 def does_sample_contain_keys(sample_data):
     """
     Check if a sample data string (in json format) contains any keys.
@@ -224,13 +302,11 @@ def does_sample_contain_keys(sample_data):
     Returns:
     Boolean: Yes or not.
     """
-    dataStructureSample = try_parse_json(sample_data)
-    json_data = json.loads(dataStructureSample)
     try:
-        for key, items in json_data.items():
-            return True
-    except:
+        json_data = parse_json(sample_data)
+    except ValueError:
         return False
+    return isinstance(json_data, dict) and (len(json_data) > 0)
 
 def dataframes_dict_to_string(sample_dict):
     """
@@ -242,25 +318,183 @@ def dataframes_dict_to_string(sample_dict):
     Returns:
     str: The sample data string to convert (assumed to be a JSON string).
     """
-    results = ''
-    for key, items in sample_dict.items():
-        json_sample = items.to_json(orient='records')
-        results = results + f'{{,"{key}": {json_sample}}}'[1:-1]
-    results = '{'+results[1:]+'}'
-    return results
+    results = io.StringIO()
+    write_dataframes_dict(sample_dict, results)
+    return results.getvalue()
+
+
+def write_dataframes_dict(sample_dict, stream):
+    """
+    Write a sample data dictionary of dataframes as a JSON object of tables (lists of records), in a single pass: each table
+    is serialized straight into the stream, without concatenating the tables in memory.
+
+    Parameters:
+    - sample_dict (Dictionary): A dictionary with table names as keys and pandas dataframes as values.
+    - stream: A writable text stream (e.g. an open file, or io.StringIO).
+    """
+    stream.write('{')
+    for index, (key, items) in enumerate(sample_dict.items()):
+        stream.write(f'{"," if index > 0 else ""}{json.dumps(str(key), ensure_ascii=False)}: ')
+        items.to_json(stream, orient='records')
+    stream.write('}')
+
+
+def dataframes_dict_to_json(sample_dict):
+    """
+    Convert a sample data dictionary of dataframes to a JSON object (the parsed value of dataframes_dict_to_string),
+    building the records directly instead of serializing and parsing the tables.
+
+    Parameters:
+    - sample_dict (Dictionary): A dictionary with table names as keys and pandas dataframes as values.
+
+    Returns:
+    dict: Pairs of table name and list of records.
+    """
+    return {key: dataframe_to_records(items) for key, items in sample_dict.items()}
+
+
+def dataframe_to_records(input_df):
+    """
+    Convert a DataFrame to a list of records, column by column, with the values of DataFrame.to_json(orient='records'):
+    missing values are None, and datetimes (in utc) and durations are epoch milliseconds.
+
+    Parameters:
+    - input_df (DataFrame): The DataFrame to convert.
+
+    Returns:
+    list: The records.
+    """
+    columns = []
+    for column, series in input_df.items():
+        dtype = series.dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            if series.dt.tz is not None:
+                series = series.dt.tz_convert(None)
+            series = series - pd.Timestamp(0)
+            dtype = series.dtype
+        if pd.api.types.is_timedelta64_dtype(dtype):
+            values = (series.fillna(pd.Timedelta(0)) // pd.Timedelta(milliseconds=1)).astype('int64').tolist()
+        elif dtype == object:
+            values = [to_json_value(value) for value in series.tolist()]
+        else:
+            values = series.tolist()
+        # Numpy integer and boolean columns have no missing values
+        if (not isinstance(dtype, np.dtype)) or (dtype.kind not in 'iub'):
+            missing = series.isna().to_numpy()
+            if missing.any():
+                values = [None if is_missing else value for value, is_missing in zip(values, missing)]
+        columns.append((str(column), values))
+    if len(columns) == 0:
+        return [{} for _ in range(len(input_df))]
+    names = [name for name, _ in columns]
+    return [dict(zip(names, row)) for row in zip(*[values for _, values in columns])]
+
+
+def to_json_value(value):
+    # The plain Python value of a numpy scalar or a timestamp in a column of objects (as written by DataFrame.to_json)
+    if isinstance(value, pd.Timestamp):
+        return value.value // 10 ** 6
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def to_utc_datetime(values):
+    """
+    Convert a series of datetime values (or their string representations) to utc datetimes, using vectorized pandas parsing.
+    ISO 8601 strings are parsed with the fast path, and other formats fall back to per-value format inference.
+
+    Parameters:
+    - values (Series): The values to convert.
+
+    Returns:
+    Series: The utc datetimes (NaT for values that could not be parsed).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return pd.to_datetime(values, utc=True)
+    datetime_values = pd.to_datetime(values, errors='coerce', utc=True, format='ISO8601')
+    if datetime_values.notna().sum() < values.notna().sum():
+        datetime_values = pd.to_datetime(values, errors='coerce', utc=True, format='mixed')
+    return datetime_values
+
+def reformat_fields(input_df, fields, datetime_format='%Y-%m-%d %H:%M:%S', min_valid_ratio=0.9):
+    """
+    Normalize numeric and datetime fields of a dataframe locally, using vectorized pandas operations.
+    Numeric fields are cast to numbers (integers when all values are whole numbers), and datetime fields are
+    converted to utc and formatted as strings.
 
-def replace_param_value(text, param_name, new_param_value):
-    # Regular expression pattern to match 'param_name = param_value'
-    #pattern = rf'({re.escape(param_name)})\s*=\s*([^\s,]+)'
-    pattern = rf'\b({re.escape(param_name)})\b\s*=\s*(\d+)'
+    Parameters:
+    - input_df (DataFrame): The dataframe to reformat.
+    - fields (list): The names of the numeric and datetime fields to reformat. Fields missing from the dataframe are ignored.
+    - datetime_format (str, optional): The output format of datetime fields. Defaults to '%Y-%m-%d %H:%M:%S'.
+    - min_valid_ratio (float, optional): The minimal ratio of non-empty values that must be parsed successfully for a
+      field to be converted. Defaults to 0.9.
 
-    # Replacement function to insert the new param value
-    def replacement(match):
-        # match.group(1) is the parameter name
-        # match.group(2) is the old parameter value
-        return f"{match.group(1)} = {new_param_value}"
+    Returns:
+    DataFrame: The reformatted dataframe.
+    """
+    output_df = input_df.copy()
+    for field in fields:
+        if field not in output_df.columns:
+            continue
+        column = output_df[field]
+        non_empty = column.notna() & (column.astype(str).str.strip() != '')
+        num_non_empty = max(int(non_empty.sum()), 1)
+
+        if pd.api.types.is_datetime64_any_dtype(column):
+            datetime_values = pd.to_datetime(column, utc=True)
+        elif pd.api.types.is_bool_dtype(column):
+            continue
+        else:
+            numeric_values = pd.to_numeric(column.where(non_empty), errors='coerce')
+            if numeric_values.notna().sum() >= min_valid_ratio * num_non_empty:
+                finite_values = numeric_values[np.isfinite(numeric_values)]
+                if (finite_values % 1 == 0).all():
+                    output_df[field] = numeric_values.round().astype('Int64')
+                else:
+                    output_df[field] = numeric_values.astype('float64')
+                continue
+            datetime_values = to_utc_datetime(column.where(non_empty))
+            if datetime_values.notna().sum() < min_valid_ratio * num_non_empty:
+                print(f"Could not reformat field '{field}'; keeping its original values.")
+                continue
 
-    # Replace matched patterns with the new parameter value
-    new_text = re.sub(pattern, replacement, text)
+        output_df[field] = datetime_values.dt.strftime(datetime_format).astype(object).where(datetime_values.notna(), None)
+    return output_df
+
+
+def copy_language_model(llm, update):
+    """
+    Get a copy of a (pydantic) language model with some of its fields replaced; the original model is not modified, and
+    the copy shares its client.
+
+    Parameters:
+    - llm: The language model.
+    - update (dict): Pairs of field name and new value.
 
-    return new_text
\ No newline at end of file
+    Returns:
+    The language model copy.
+    """
+    if hasattr(llm, 'model_copy'):
+        return llm.model_copy(update=update)
+    # pydantic v1 models drop their excluded fields (e.g. callbacks) on copy(), so the copy is constructed from all the fields,
+    # and shares the private attributes (e.g. clients and counters) of the model
+    llm_copy = llm.__class__.construct(_fields_set=llm.__fields_set__, **{**llm.__dict__, **update})
+    for name in getattr(llm, '__private_attributes__', {}):
+        object.__setattr__(llm_copy, name, getattr(llm, name))
+    return llm_copy
+
+
+def with_callback(llm, handler):
+    """
+    Get a copy of a language model that reports its calls to an additional callback handler (the original model is not modified).
+
+    Parameters:
+    - llm: The language model (or another runnable).
+    - handler (BaseCallbackHandler): The callback handler.
+
+    Returns:
+    The language model copy.
+    """
+    if not hasattr(llm, 'callbacks'):
+        return llm.with_config(callbacks=[handler])
+    return copy_language_model(llm, {'callbacks': list(llm.callbacks or []) + [handler]})
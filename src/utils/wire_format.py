@@ -0,0 +1,139 @@
+import json
+
+
+# The encodings of the tables in the prompts and the responses: 'records' is a JSON array of records (the field names are
+# repeated in every record), and 'columnar' is {"columns": [...], "data": [[...], ...]} (the field names are sent once)
+RECORDS_WIRE_FORMAT = 'records'
+COLUMNAR_WIRE_FORMAT = 'columnar'
+WIRE_FORMATS = [RECORDS_WIRE_FORMAT, COLUMNAR_WIRE_FORMAT]
+
+
+def check_wire_format(wire_format):
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"Unknown wire format {wire_format!r} (expected one of {WIRE_FORMATS})")
+    return wire_format
+
+
+def is_columnar_table(value):
+    """
+    Check if a parsed JSON value is a columnar table ({"columns": [...], "data": [[...], ...]}).
+    """
+    return isinstance(value, dict) and isinstance(value.get('columns'), list) and isinstance(value.get('data'), list)
+
+
+def row_to_record(columns, row):
+    """
+    Convert a row of a columnar table to a record. A row with missing values is padded with None, and the extra values
+    of a row longer than the columns are dropped.
+
+    Parameters:
+    - columns (list): The column names.
+    - row (list): The values.
+
+    Returns:
+    dict: The record.
+    """
+    return {column: (row[index] if index < len(row) else None) for index, column in enumerate(columns)}
+
+
+def columnar_to_records(table):
+    """
+    Convert a columnar table to a list of records (rows that are not lists are skipped).
+
+    Parameters:
+    - table (dict): The columnar table.
+
+    Returns:
+    list: The records.
+    """
+    columns = [str(column) for column in table['columns']]
+    return [row_to_record(columns, row) for row in table['data'] if isinstance(row, list)]
+
+
+def records_to_columnar(records):
+    """
+    Convert a list of records to a columnar table. The columns are the fields of all the records, in order of appearance.
+
+    Parameters:
+    - records (list): The records.
+
+    Returns:
+    dict: The columnar table.
+    """
+    records = [record for record in records if isinstance(record, dict)]
+    columns = list(dict.fromkeys(field for record in records for field in record))
+    return {'columns': columns, 'data': [[record.get(column) for column in columns] for record in records]}
+
+
+def decode_wire_tables(value):
+    """
+    Convert the columnar tables of a parsed sample (a top level columnar table, or a dictionary of tables) to lists of
+    records; the other values are returned as they are.
+
+    Parameters:
+    - value: The parsed JSON value.
+
+    Returns:
+    The value, with lists of records instead of the columnar tables.
+    """
+    if is_columnar_table(value):
+        return columnar_to_records(value)
+    if isinstance(value, dict):
+        return {key: columnar_to_records(items) if is_columnar_table(items) else items for key, items in value.items()}
+    return value
+
+
+def encode_wire_tables(value, wire_format=RECORDS_WIRE_FORMAT):
+    """
+    Encode the tables of a parsed sample (a list of records, or a dictionary of tables) in a wire format.
+
+    Parameters:
+    - value: The parsed JSON value.
+    - wire_format (str, optional): 'records' or 'columnar'. Defaults to 'records'.
+
+    Returns:
+    The value, with its tables in the wire format.
+    """
+    value = decode_wire_tables(value)
+    if check_wire_format(wire_format) == RECORDS_WIRE_FORMAT:
+        return value
+    if isinstance(value, list):
+        return records_to_columnar(value)
+    if isinstance(value, dict):
+        return {key: records_to_columnar(items) if isinstance(items, list) else items for key, items in value.items()}
+    return value
+
+
+def convert_wire_format(sample_data, wire_format=RECORDS_WIRE_FORMAT):
+    """
+    Re-encode a sample data string (e.g. the structure of a DataAugmentor) in a wire format. A string that is not valid
+    JSON (e.g. a textual description of the structure) is returned as it is.
+
+    Parameters:
+    - sample_data (str): The sample data string.
+    - wire_format (str, optional): 'records' or 'columnar'. Defaults to 'records'.
+
+    Returns:
+    str: The sample data string in the wire format.
+    """
+    try:
+        value = json.loads(sample_data)
+    except (TypeError, ValueError):
+        return sample_data
+    return json.dumps(encode_wire_tables(value, wire_format))
+
+
+def dataframe_to_wire_json(input_df, wire_format=RECORDS_WIRE_FORMAT):
+    """
+    Convert a DataFrame to a JSON string in a wire format.
+
+    Parameters:
+    - input_df (DataFrame): The DataFrame to convert.
+    - wire_format (str, optional): 'records' or 'columnar'. Defaults to 'records'.
+
+    Returns:
+    str: A JSON array of records, or a JSON columnar table.
+    """
+    if check_wire_format(wire_format) == COLUMNAR_WIRE_FORMAT:
+        return input_df.to_json(orient='split', index=False)
+    return input_df.to_json(orient='records')
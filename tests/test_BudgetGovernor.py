@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from langchain_core.language_models.fake import FakeListLLM
+from src.BudgetGovernor import BudgetExceededError, BudgetGovernor, create_plan_step, guess_free_text_fields, summarize_plan, with_budget
+
+
+def test_calls_over_the_request_cap_are_rejected_before_they_are_sent():
+    governor = BudgetGovernor(max_requests=2, input_cost_per_1k_tokens=1.0, output_cost_per_1k_tokens=2.0)
+    llm = FakeListLLM(responses=['first output', 'second output', 'third output'])
+    budget_llm = with_budget(llm, governor)
+    assert budget_llm.invoke('a prompt') == 'first output'
+    assert budget_llm.invoke('a prompt') == 'second output'
+    with pytest.raises(BudgetExceededError):
+        budget_llm.invoke('a prompt')
+    usage = governor.get_usage()
+    assert (usage['requests'], usage['rejected_requests']) == (2, 1)
+    assert usage['cost'] == pytest.approx((usage['input_tokens'] + 2 * usage['output_tokens']) / 1000)
+    # The original model is not governed, and the rejected call was not sent
+    assert llm.invoke('a prompt') == 'first output'
+    governor.reset()
+    assert budget_llm.invoke('a prompt') == 'third output'
+
+
+def test_prompts_over_the_input_cap_are_rejected():
+    governor = BudgetGovernor(max_input_tokens=10)
+    with pytest.raises(BudgetExceededError, match='input tokens'):
+        with_budget(FakeListLLM(responses=['output']), governor).invoke('x' * 100)
+    assert governor.get_usage()['input_tokens'] == 0
+
+
+def test_plan_summary_and_check():
+    steps = [create_plan_step('schema', 1, 500, 200), create_plan_step('enhancement', 10, 300, 100, concurrency=5)]
+    plan = summarize_plan(steps, latency_seconds=1.0, tokens_per_second=100, budget_governor=BudgetGovernor(input_cost_per_1k_tokens=1.0))
+    assert (plan['calls'], plan['input_tokens'], plan['output_tokens']) == (11, 3500, 1200)
+    # One schema call, then two rounds of five concurrent enhancement calls
+    assert plan['estimated_seconds'] == pytest.approx(1 + 2 + 2 * (1 + 1))
+    assert plan['estimated_cost'] == pytest.approx(3.5)
+    assert BudgetGovernor(max_requests=20).check_plan(plan) == []
+    assert BudgetGovernor(max_total_tokens=4000).check_plan(plan) == ['total tokens: 4700 > 4000']
+
+
+def test_guess_free_text_fields():
+    table = pd.DataFrame({'id': [1, 2], 'status': ['new', 'paid'], 'review': ['Great product, fast delivery', 'Broke after a week']})
+    assert guess_free_text_fields(table) == ['review']
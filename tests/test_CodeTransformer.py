@@ -0,0 +1,97 @@
+import contextlib
+import io
+import pandas as pd
+import pytest
+from langchain_core.language_models.fake import FakeListLLM
+from src.CodeTransformer import CodeTransformer
+
+
+CODE = """
+import pandas as pd
+
+num_customers = 4
+customers = pd.DataFrame({'customer_id': range(1, num_customers + 1), 'name': 'generated name', 'age': 30,
+                          'segment': ['retail', 'business'] * (num_customers // 2), 'city': 'Paris', 'bio': 'generated bio',
+                          'signup': pd.to_datetime('2024-01-01')})
+results_dict = {'customers': customers}
+table_size_param_dict = {'customers': 'num_customers'}
+override_fields_dict = {'customers': ['name', 'bio']}
+reformat_fields_dict = {'customers': ['age']}
+table_names_dict = {'customers': 'customers'}
+primary_keys_dict = {'customers': 'customer_id'}
+parent_tables_dict = {}
+cross_table_dependencies_dict = {}
+"""
+
+
+class StubTransformer:
+    """
+    Records the projected records sent for enhancement, and returns them with the free text fields filled (or raises an error).
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+        self.source_data = None
+
+    def transform(self, source_data, output_format=1):
+        self.source_data = source_data
+        if self.error is not None:
+            raise self.error
+        transformed_data = source_data.iloc[::-1].copy()
+        transformed_data['name'] = 'name ' + transformed_data['customer_id'].astype(str)
+        transformed_data['bio'] = 'bio ' + transformed_data['customer_id'].astype(str)
+        return transformed_data
+
+
+def create_transformer(stub_transformer):
+    code_transformer = CodeTransformer(FakeListLLM(responses=['']))
+    code_transformer.load_code(CODE)
+    code_transformer.get_data_transformer = lambda llm: stub_transformer
+    return code_transformer
+
+
+def test_only_the_context_projection_is_sent_and_written_back():
+    stub_transformer = StubTransformer()
+    code_transformer = create_transformer(stub_transformer)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tables = code_transformer.enhance_tables_with_transformer(None, "Customers", run_in_parallel=False, max_context_fields=3)
+    # The primary key and the textual context fields (at most 3), followed by the free text fields
+    assert list(stub_transformer.source_data.columns) == ['customer_id', 'segment', 'city', 'name', 'bio']
+    # The records are returned in reverse order, and aligned by the primary key
+    customers = tables['customers']
+    assert customers['name'].tolist() == [f"name {index}" for index in range(1, 5)]
+    assert customers['bio'].tolist() == [f"bio {index}" for index in range(1, 5)]
+    assert customers['age'].tolist() == [30] * 4
+
+
+def test_a_failed_enhancement_keeps_the_generated_tables():
+    code_transformer = create_transformer(StubTransformer(error=RuntimeError("unavailable")))
+    # Without reformatted fields (which are normalized on a copy) the table is overridden directly
+    code_transformer.reformat_fields_dict = {}
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(RuntimeError):
+        code_transformer.enhance_tables_with_transformer(None, "Customers", run_in_parallel=False)
+    assert code_transformer.results_dict['customers']['name'].tolist() == ['generated name'] * 4
+    assert code_transformer.results_dict['customers']['bio'].tolist() == ['generated bio'] * 4
+
+
+def test_select_context_fields():
+    code_transformer = CodeTransformer(FakeListLLM(responses=['']))
+    table = pd.DataFrame({'id': [1], 'amount': [1.5], 'created_at': pd.to_datetime(['2024-01-01']), 'name': ['a'],
+                          'status': ['new'], 'city': ['Paris'], 'note': ['']})
+    assert code_transformer.select_context_fields(table, ['note'], primary_key='id') == ['id', 'name', 'status', 'city']
+    assert code_transformer.select_context_fields(table, ['name'], max_context_fields=2) == ['status', 'city']
+    assert code_transformer.select_context_fields(table, [], primary_key='id', max_context_fields=0) == []
+
+
+def test_write_back_fields_by_primary_key_and_by_position():
+    code_transformer = CodeTransformer(FakeListLLM(responses=['']))
+    table = pd.DataFrame({'id': [1, 2, 3], 'name': ['', '', '']})
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Aligned by the primary key (as strings), ignoring the duplicated and the unknown records
+        transformed_data = pd.DataFrame({'id': ['3', '1', '1', '7'], 'name': ['c', 'a', 'duplicate', 'unknown']})
+        assert code_transformer.write_back_fields(table.copy(), transformed_data, ['name'], 'id')['name'].tolist() == ['a', '', 'c']
+        # Aligned by position without a primary key, when the number of records matches
+        transformed_data = pd.DataFrame({'name': ['a', 'b', 'c']}, index=[5, 6, 7])
+        assert code_transformer.write_back_fields(table.copy(), transformed_data, ['name'])['name'].tolist() == ['a', 'b', 'c']
+        assert code_transformer.write_back_fields(table.copy(), transformed_data.iloc[:2], ['name'])['name'].tolist() == ['', '', '']
+        assert code_transformer.write_back_fields(table.copy(), None, ['name'])['name'].tolist() == ['', '', '']
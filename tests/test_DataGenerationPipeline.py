@@ -0,0 +1,73 @@
+import contextlib
+import io
+import pandas as pd
+from src.CodeTransformer import CodeTransformer
+from src.DataAugmentor import DataAugmentor
+from src.DataGenerationPipeline import DataGenerationPipeline
+from src.SimulatedLLM import SimulatedLLM
+from src.SpecificationSampler import apply_structured_specification_patch
+from src.TaskSpecificationAugmentor import TaskSpecificationAugmentor
+
+
+def test_a_refined_specification_only_regenerates_the_invalidated_columns(monkeypatch):
+    patch = {'tables': [{'name': 'customers', 'columns': [
+        {'name': 'segment', 'type': 'categorical', 'categories': ['startup', 'enterprise'], 'probabilities': [0.5, 0.5]}]}]}
+    monkeypatch.setattr(TaskSpecificationAugmentor, 'refine_structured_specifications',
+                        lambda self, structured_specifications, query, max_trials=3: apply_structured_specification_patch(structured_specifications, patch))
+    pipeline = DataGenerationPipeline(SimulatedLLM(seed=1, time_scale=0))
+    tables_size_dict = {'customers': 10, 'orders': 20}
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline.extract_sample_data("a relational database for an online shop with customers and orders")
+        tables = pipeline.generate_data(tables_size_dict=tables_size_dict, generation_engine='specification', seed=0)
+        pipeline.query_sample_data("Split the customers into startups and enterprises")
+        assert pipeline.specification_diff['changed_columns'] == {'customers': ['segment']}
+        updated_tables = pipeline.generate_data(tables_size_dict=tables_size_dict, generation_engine='specification', seed=0)
+
+    assert set(updated_tables['customers']['segment']) <= {'startup', 'enterprise'}
+    columns = ['customer_id', 'age', 'signup_date']
+    pd.testing.assert_frame_equal(updated_tables['customers'][columns], tables['customers'][columns])
+    # The orders did not change, so their free text fields are not generated again either
+    pd.testing.assert_frame_equal(updated_tables['orders'], tables['orders'])
+
+
+def test_the_components_are_reused_and_reset_between_tasks():
+    pipeline = DataGenerationPipeline(SimulatedLLM(seed=1, time_scale=0))
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline.extract_sample_data("a relational database for an online shop with customers and orders")
+        pipeline.generate_data(tables_size_dict={'customers': 5, 'orders': 5}, run_in_parallel=False)
+        components = dict(pipeline.components)
+        code_transformer = pipeline.get_component(CodeTransformer, stage='code', enhancement_llm=pipeline.get_stage_llm('enhancement'),
+                                                  request_hedger=None, streaming=False, wire_format='records')
+        data_transformer = code_transformer.data_transformer
+        assert code_transformer in components.values() and data_transformer is not None
+
+        # A new task reuses the same components (and their chains), without the state of the previous task
+        code_transformer.generated_tables = {'stale': pd.DataFrame()}
+        pipeline.extract_sample_data("a relational database for a library with members and loans")
+        tables = pipeline.generate_data(tables_size_dict={'customers': 3, 'orders': 4}, run_in_parallel=False)
+    assert pipeline.components == components
+    assert code_transformer.data_transformer is data_transformer
+    assert (len(tables['customers']), len(tables['orders'])) == (3, 4) and 'stale' not in code_transformer.generated_tables
+
+    # Components built with other arguments are kept apart
+    sample_augmentor = pipeline.get_component(DataAugmentor, stage='sample')
+    assert pipeline.get_component(DataAugmentor, stage='sample') is sample_augmentor
+    assert pipeline.get_component(DataAugmentor, stage='generation', lock_schema=False) is not sample_augmentor
+
+
+def test_reset_clears_the_state_of_the_components():
+    pipeline = DataGenerationPipeline(SimulatedLLM(seed=1, time_scale=0))
+    data_augmentor = pipeline.get_component(DataAugmentor, stage='sample')
+    data_augmentor.set_examples_dataframe(pd.DataFrame({'id': [1]}), 'examples')
+    data_augmentor.previous_generated_batch = '[{"id": 1}]'
+    data_augmentor.reset(structure='{"customers": []}')
+    assert (data_augmentor.structure, data_augmentor.examples_data, data_augmentor.leading_key) == ('{"customers": []}', None, None)
+    assert data_augmentor.previous_generated_batch == 'unknown'
+
+    code_transformer = pipeline.get_component(CodeTransformer, stage='code')
+    with contextlib.redirect_stdout(io.StringIO()):
+        code_transformer.load_code(SimulatedLLM.compose_code(SimulatedLLM().get_schema()))
+    assert code_transformer.generate_function is not None
+    code_transformer.reset()
+    assert (code_transformer.code, code_transformer.generate_function, code_transformer.results_dict) == ('', None, None)
+    assert code_transformer.primary_keys_dict is None
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from src.DataValidator import DataValidator
+
+
+def create_tables():
+    customers = pd.DataFrame({'customer_id': [1, 2, 3], 'signup_date': ['2024-01-01', '2024-02-01', '2024-03-01']})
+    orders = pd.DataFrame({'order_id': [10, 11, 12, 13], 'customer_id': [1, 2, 3, 4],
+                           'order_date': ['2024-01-05', '2024-01-15', '2024-03-02', '2024-03-02']})
+    return {'customers': customers, 'orders': orders}
+
+
+def create_validator():
+    return DataValidator(primary_keys_dict={'customers': 'customer_id', 'orders': 'order_id'},
+                         datetime_constraints_list=[('orders', 'order_date', 'customers', 'signup_date')],
+                         foreign_keys_dict={'orders': [('customer_id', 'customers', 'customer_id')]})
+
+
+def test_validate_reports_foreign_key_and_datetime_violations():
+    validator = create_validator()
+    masks = validator.validate(create_tables())
+    # Order 11 is earlier than the signup of its customer, order 13 references an unknown customer
+    assert masks['orders'].tolist() == [False, True, False, True]
+    assert not masks['customers'].any()
+    assert validator.violation_counts == {'customers': 0, 'orders': 2}
+
+
+def test_validate_with_duplicated_parent_keys():
+    tables = create_tables()
+    tables['customers'] = pd.DataFrame({'customer_id': [1, 2, 2, 3],
+                                        'signup_date': ['2024-01-01', '2024-02-01', '2023-01-01', '2024-03-01']})
+    validator = create_validator()
+    masks = validator.validate(tables)
+    # The duplicated primary keys are reported, and the datetime constraint uses the first record of a duplicated key
+    assert masks['customers'].tolist() == [False, True, True, False]
+    assert masks['orders'].tolist() == [False, True, False, True]
+
+
+def test_validate_datetime_constraint_in_the_same_table():
+    validator = DataValidator(primary_keys_dict={'events': 'id'},
+                              datetime_constraints_list=[('events', 'end', 'events', 'start')])
+    events = pd.DataFrame({'id': [1, 2], 'start': ['2024-01-01', '2024-01-02'], 'end': ['2024-01-02', '2024-01-01']})
+    masks = validator.validate({'events': events})
+    assert masks['events'].tolist() == [False, True]
+
+
+def test_get_violating_records():
+    validator = create_validator()
+    tables = create_tables()
+    violating_records = validator.get_violating_records(tables)
+    assert list(violating_records) == ['orders']
+    assert violating_records['orders']['order_id'].tolist() == [11, 13]
+    assert isinstance(validator.validate(tables)['orders'], np.ndarray)
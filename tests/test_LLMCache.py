@@ -0,0 +1,65 @@
+import os
+from langchain_core.outputs import Generation
+from src.LLMCache import InMemoryLRUCache, SQLiteLLMCache, get_cache_key
+
+
+def generations(text):
+    return [Generation(text=text)]
+
+
+def test_in_memory_cache_evicts_the_least_recently_used_responses():
+    cache = InMemoryLRUCache(max_entries=2)
+    cache.update('first', 'model', generations('1'))
+    cache.update('second', 'model', generations('2'))
+    assert cache.lookup('first', 'model') == generations('1')
+    cache.update('third', 'model', generations('3'))
+    assert cache.lookup('second', 'model') is None
+    assert [cache.lookup(prompt, 'model')[0].text for prompt in ['first', 'third']] == ['1', '3']
+    # The responses of another model are not shared
+    assert cache.lookup('first', 'other model') is None
+    assert cache.metrics == {'hits': 3, 'misses': 2, 'evictions': 1, 'expirations': 0}
+
+
+def test_in_memory_cache_expires_the_responses():
+    cache = InMemoryLRUCache(ttl_seconds=60)
+    cache.update('prompt', 'model', generations('output'))
+    assert cache.lookup('prompt', 'model') == generations('output')
+    key = get_cache_key('prompt', 'model')
+    created_at, cached_generations = cache.entries[key]
+    cache.entries[key] = (created_at - 61, cached_generations)
+    assert cache.lookup('prompt', 'model') is None
+    assert cache.metrics['expirations'] == 1 and len(cache.entries) == 0
+
+
+def test_sqlite_cache_persists_and_expires_the_responses(tmp_path):
+    database_path = os.path.join(str(tmp_path), 'llm_cache.db')
+    SQLiteLLMCache(database_path).update('prompt', 'model', generations('output'))
+    cache = SQLiteLLMCache(database_path, ttl_seconds=60)
+    assert cache.lookup('prompt', 'model') == generations('output')
+    with cache.connection:
+        cache.connection.execute("UPDATE llm_cache SET created_at = created_at - 61")
+    assert cache.lookup('prompt', 'model') is None
+    assert cache.metrics['expirations'] == 1
+
+
+def test_sqlite_cache_evicts_by_count_and_size(tmp_path):
+    cache = SQLiteLLMCache(os.path.join(str(tmp_path), 'count.db'), max_entries=2)
+    for index, prompt in enumerate(['first', 'second', 'third']):
+        cache.update(prompt, 'model', generations(str(index)))
+        with cache.connection:
+            # Distinct access times, in order of insertion
+            cache.connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (index, get_cache_key(prompt, 'model')))
+    assert cache.lookup('first', 'model') is None
+    assert cache.lookup('third', 'model') == generations('2')
+    assert cache.metrics['evictions'] == 1
+
+    response_size = cache.connection.execute("SELECT MAX(size) FROM llm_cache").fetchone()[0]
+    cache = SQLiteLLMCache(os.path.join(str(tmp_path), 'size.db'), max_size_bytes=int(1.5 * response_size))
+    cache.update('first', 'model', generations('1'))
+    cache.update('second', 'model', generations('2'))
+    assert cache.connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 1
+    # A response larger than the whole cache is not stored
+    cache.update('large', 'model', generations('x' * 10 * response_size))
+    assert cache.lookup('large', 'model') is None
+    total_size = cache.connection.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    assert total_size <= cache.max_size_bytes
@@ -0,0 +1,31 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from src.LLMCache import InMemoryLRUCache, with_llm_cache
+from src.LLMRouter import LLMRouter
+
+
+def test_routers_over_different_backends_are_cached_apart():
+    first_router = LLMRouter(backends=[FakeListChatModel(responses=['first']), FakeListChatModel(responses=['first'])])
+    second_router = LLMRouter(backends=[FakeListChatModel(responses=['second']), FakeListChatModel(responses=['second'])])
+    assert first_router._get_llm_string() != second_router._get_llm_string()
+
+    cache = InMemoryLRUCache()
+    assert with_llm_cache(first_router, cache).invoke('a prompt').content == 'first'
+    assert with_llm_cache(second_router, cache).invoke('a prompt').content == 'second'
+    assert with_llm_cache(first_router, cache).invoke('a prompt').content == 'first'
+    assert cache.metrics['hits'] == 1
+
+
+def test_rate_limited_backends_fail_over():
+    class RateLimitError(Exception):
+        status_code = 429
+        retry_after = 60
+
+    class RateLimitedModel(FakeListChatModel):
+        def _call(self, *args, **kwargs):
+            raise RateLimitError("Rate limit reached")
+
+    router = LLMRouter(backends=[RateLimitedModel(responses=['unused']), FakeListChatModel(responses=['output'])], names=['limited', 'spare'])
+    assert [router.invoke('a prompt').content for _ in range(3)] == ['output'] * 3
+    stats = router.get_stats()
+    assert (stats['limited']['rate_limits'], stats['limited']['cooling']) == (1, True)
+    assert stats['spare']['calls'] == 3
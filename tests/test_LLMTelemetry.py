@@ -0,0 +1,43 @@
+import uuid
+from langchain_core.outputs import Generation, LLMResult
+from src.LLMTelemetry import LLMTelemetry
+
+
+def record_call(telemetry, success=True):
+    run_id = uuid.uuid4()
+    telemetry.on_llm_start({'name': 'model'}, ['prompt'], run_id=run_id)
+    if success:
+        telemetry.on_llm_end(LLMResult(generations=[[Generation(text='output')]],
+                                       llm_output={'token_usage': {'prompt_tokens': 10, 'completion_tokens': 5}}), run_id=run_id)
+    else:
+        telemetry.on_llm_error(TimeoutError('timed out'), run_id=run_id)
+
+
+def test_stage_handlers_share_the_records_and_the_run():
+    telemetry = LLMTelemetry(run_name='first')
+    stage_telemetry = telemetry.with_stage('extraction')
+    record_call(stage_telemetry)
+    assert [(record['run'], record['stage']) for record in telemetry.get_records()] == [('first', 'extraction')]
+
+    telemetry.reset(run_name='second')
+    assert stage_telemetry.get_records() == []
+    assert stage_telemetry.run_name == 'second'
+    record_call(stage_telemetry)
+    stage_telemetry.record_event('retry', error=ValueError('invalid JSON'))
+    assert [record['run'] for record in telemetry.get_records()] == ['second', 'second']
+    assert 'run="second",stage="extraction"' in telemetry.to_prometheus()
+
+
+def test_summary_per_stage():
+    telemetry = LLMTelemetry()
+    record_call(telemetry.with_stage('generation'))
+    record_call(telemetry.with_stage('generation'), success=False)
+    record_call(telemetry.with_stage('validation'))
+    telemetry.with_stage('generation').record_event('parse', success=False)
+    summary = telemetry.get_summary()
+    assert (summary['generation']['calls'], summary['generation']['failed_calls']) == (2, 1)
+    assert (summary['generation']['input_tokens'], summary['generation']['output_tokens']) == (10, 5)
+    assert summary['generation']['parse_failures'] == 1
+    assert summary['validation']['calls'] == 1
+    failed_call = [record for record in telemetry.get_records() if not record.get('success', True)][0]
+    assert (failed_call['error_type'], failed_call['error']) == ('TimeoutError', 'timed out')
@@ -0,0 +1,55 @@
+import gzip
+import os
+import pandas as pd
+import pytest
+from src.OutputSink import CSVSink, OutputCollector, create_output_sink
+
+
+def test_csv_sink_aligns_the_batches_to_the_header(tmp_path):
+    with CSVSink(str(tmp_path), compression='gzip') as sink:
+        sink.write('orders', pd.DataFrame({'id': [1, 2], 'amount': [9.5, 3.0]}))
+        sink.write('orders', pd.DataFrame({'amount': [1.0], 'id': [3], 'extra': ['x']}))
+        sink.write('customers', pd.DataFrame({'id': pd.Series([], dtype='int64')}))
+    assert sink.get_summary()['orders']['rows'] == 3 and sink.get_summary()['orders']['batches'] == 2
+    with gzip.open(os.path.join(str(tmp_path), 'orders.csv.gz'), 'rt') as file:
+        assert pd.read_csv(file).to_dict('list') == {'id': [1, 2, 3], 'amount': [9.5, 3.0, 1.0]}
+    # A table without records still has a file
+    assert sink.get_summary()['customers']['rows'] == 0
+    assert pd.read_csv(os.path.join(str(tmp_path), 'customers.csv.gz')).columns.tolist() == ['id']
+    with pytest.raises(ValueError):
+        sink.write('orders', pd.DataFrame({'id': [4]}))
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_arrow_sinks_keep_the_schema_of_the_first_batch(tmp_path, output_format):
+    pa = pytest.importorskip('pyarrow')
+    sink = create_output_sink(output_format, str(tmp_path))
+    sink.write('reviews', pd.DataFrame({'id': [1, 2], 'text': ['Great', None]}))
+    # Mixed types and missing columns are converted to the schema
+    sink.write('reviews', pd.DataFrame({'id': ['3', 'x'], 'text': [5, 'Bad']}))
+    sink.write('reviews', pd.DataFrame({'id': [4]}))
+    summary = sink.close()
+    if output_format == 'parquet':
+        table = pa.parquet.read_table(summary['reviews']['path'])
+    else:
+        table = pa.ipc.open_file(summary['reviews']['path']).read_all()
+    assert table.to_pydict() == {'id': [1, 2, 3, None, 4], 'text': ['Great', None, '5', 'Bad', None]}
+
+
+def test_unknown_output_format(tmp_path):
+    with pytest.raises(ValueError):
+        create_output_sink('xlsx', str(tmp_path))
+
+
+def test_output_collector_caps_the_records(tmp_path):
+    sink = CSVSink(str(tmp_path))
+    collector = OutputCollector(sink=sink, keep_in_memory=False, max_records=3)
+    collector.add({'orders': pd.DataFrame({'id': [1, 2]})})
+    collector.add({'orders': pd.DataFrame({'id': [3, 4]})})
+    assert collector.get_count('orders') == 3 and collector.get_tables() == {}
+    assert sink.close()['orders']['rows'] == 3
+
+    collector = OutputCollector()
+    collector.add({'orders': pd.DataFrame({'id': [1, 2]}, index=[5, 6])})
+    collector.add({'orders': pd.DataFrame({'id': [3]})})
+    assert collector.get_tables()['orders'].to_dict('list') == {'id': [1, 2, 3]}
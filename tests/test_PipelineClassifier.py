@@ -0,0 +1,51 @@
+import pytest
+from src.Pipeline import Pipeline
+from src.PipelineClassifier import PipelineClassifier
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    return PipelineClassifier()
+
+
+@pytest.mark.parametrize('description', [
+    "CREATE TABLE users (id INT PRIMARY KEY, name VARCHAR(50))",
+    "Generate data for:\ncreate table if not exists shop.orders (\n  id int\n)",
+    "SELECT id, name FROM customers WHERE age > 30",
+    "INSERT INTO users VALUES (1, 'a')",
+    "price DECIMAL(10,2), customer_id int references customers(id)",
+])
+def test_sql_syntax(classifier, description):
+    assert classifier.predict(description)[0] == Pipeline.SQLToTabular
+    assert classifier.classify(description) == Pipeline.SQLToTabular
+
+
+@pytest.mark.parametrize('description', [
+    "openapi: 3.0.0\ninfo:\n  title: Pet store",
+    '{"openapi": "3.0.0", "paths": {"/pets": {}}}',
+    "swagger: '2.0'\npaths:\n  /users:",
+    "Generate traffic for GET /users/{id} and POST /orders",
+])
+def test_api_specification_syntax(classifier, description):
+    assert classifier.classify(description) == Pipeline.APISpecificationToData
+
+
+@pytest.mark.parametrize('description', [
+    "A dataset of online shop sessions where customers select products from a catalog and join a loyalty program",
+    "Generate user accounts with API keys and support requests",
+    "Employees get / set their preferences and delete old notes",
+])
+def test_prose_is_not_matched_by_the_rules(classifier, description):
+    pipeline_name, confidence = classifier.predict(description)
+    assert confidence < 0.9
+    assert classifier.classify(description, confidence_threshold=0.9) is None
+
+
+def test_linear_model(classifier):
+    assert classifier.classify("a relational database for a hospital with patients, doctors and appointments") == Pipeline.DescriptionToDB
+    assert classifier.classify("xyz", confidence_threshold=1.0) is None
+
+
+def test_custom_examples():
+    classifier = PipelineClassifier(examples_dict={'a': ['apples and pears', 'fruit salad'], 'b': ['cars and trucks', 'vehicle fleet']})
+    assert classifier.predict("a fleet of trucks")[0] == 'b'
@@ -0,0 +1,105 @@
+import asyncio
+import gc
+import pytest
+from src.RequestHedger import RequestHedger, run_hedged
+
+
+def create_requests(delays, errors=None):
+    """
+    Get a function that creates requests taking the given times (and raising the given errors), one after the other.
+    """
+    calls = []
+
+    async def request():
+        index = len(calls)
+        calls.append(index)
+        await asyncio.sleep(delays[index])
+        if (errors is not None) and (errors[index] is not None):
+            raise errors[index]
+        return index
+
+    return request, calls
+
+
+def create_hedger(**kwargs):
+    request_hedger = RequestHedger(min_observations=5, **kwargs)
+    for _ in range(5):
+        request_hedger.observe('default', 0.01)
+    return request_hedger
+
+
+def test_a_slow_request_is_hedged_and_the_duplicate_wins():
+    request_hedger = create_hedger(max_extra_fraction=1.0)
+    request, calls = create_requests([5.0, 0.01])
+    assert asyncio.run(request_hedger.run(request)) == 1
+    metrics = request_hedger.get_metrics()
+    assert (len(calls), metrics['requests'], metrics['hedges'], metrics['hedge_wins']) == (2, 1, 1, 1)
+    assert metrics['p95_latency'] < 1.0
+
+
+def test_the_duplicates_are_capped():
+    request_hedger = create_hedger(max_extra_fraction=0.0)
+    request, calls = create_requests([0.1, 0.01])
+    assert asyncio.run(request_hedger.run(request)) == 0
+    assert len(calls) == 1
+    assert (request_hedger.get_metrics()['hedges'], request_hedger.get_metrics()['skipped_hedges']) == (0, 1)
+
+
+def test_a_failed_request_loses_to_a_successful_one():
+    request_hedger = create_hedger(max_extra_fraction=1.0)
+    request, calls = create_requests([0.05, 0.1], errors=[TimeoutError("timed out"), None])
+    assert asyncio.run(request_hedger.run(request)) == 1
+
+    request, calls = create_requests([0.05, 0.1], errors=[TimeoutError("timed out"), ValueError("invalid")])
+    with pytest.raises((TimeoutError, ValueError)):
+        asyncio.run(create_hedger(max_extra_fraction=1.0).run(request))
+
+
+def test_requests_are_not_hedged_before_enough_latencies_are_observed():
+    request_hedger = RequestHedger(min_observations=5, max_extra_fraction=1.0)
+    assert request_hedger.get_hedge_delay('default') is None
+    request, calls = create_requests([0.05, 0.01])
+    assert asyncio.run(run_hedged(request_hedger, request)) == 0
+    assert len(calls) == 1
+    request, calls = create_requests([0.01])
+    assert asyncio.run(run_hedged(None, request)) == 0
+
+
+def test_the_requests_are_cancelled_with_the_caller():
+    cancelled = []
+
+    async def request():
+        try:
+            await asyncio.sleep(5.0)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def cancel_caller(request_hedger):
+        caller = asyncio.ensure_future(request_hedger.run(request))
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        # Before the loop is closed (which cancels the remaining tasks)
+        return len(cancelled)
+
+    # Before the hedge is sent, and after it
+    assert asyncio.run(cancel_caller(RequestHedger(min_observations=5))) == 1
+    assert asyncio.run(cancel_caller(create_hedger(max_extra_fraction=1.0))) == 3
+
+
+def test_the_errors_of_both_failed_requests_are_retrieved():
+    unretrieved = []
+
+    async def run_requests():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        request, calls = create_requests([0.05, 0.05], errors=[TimeoutError("timed out"), ValueError("invalid")])
+        with pytest.raises((TimeoutError, ValueError)):
+            await create_hedger(max_extra_fraction=1.0).run(request)
+        gc.collect()
+        await asyncio.sleep(0)
+
+    asyncio.run(run_requests())
+    assert unretrieved == []
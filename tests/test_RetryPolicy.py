@@ -0,0 +1,70 @@
+from src.BudgetGovernor import BudgetExceededError
+from src.RetryPolicy import CircuitBreaker, RetryPolicy, classify_error, get_retry_after
+from src.SimulatedLLM import SimulatedRateLimitError, SimulatedTimeoutError
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': headers or {}})()
+
+
+def test_classify_error():
+    assert classify_error(ProviderError(429)) == 'rate_limit'
+    assert classify_error(SimulatedRateLimitError("Rate limit reached")) == 'rate_limit'
+    assert classify_error(ProviderError(503)) == 'transient'
+    assert classify_error(SimulatedTimeoutError("Request timed out")) == 'transient'
+    assert classify_error(ProviderError(401)) == 'fatal'
+    assert classify_error(BudgetExceededError("The language model budget is exhausted")) == 'fatal'
+    assert classify_error(ValueError("Invalid JSON")) == 'output'
+
+
+def test_retry_after():
+    assert get_retry_after(ProviderError(429, headers={'retry-after': '7'})) == 7.0
+    assert get_retry_after(SimulatedRateLimitError("Rate limit reached", retry_after=2)) == 2.0
+    assert get_retry_after(ProviderError(429, headers={'retry-after': 'soon'})) is None
+
+
+def test_delays():
+    retry_policy = RetryPolicy(base_delay_seconds=1.0, max_delay_seconds=5.0, jitter=False)
+    assert [retry_policy.get_delay(ProviderError(503), attempt) for attempt in range(1, 5)] == [1.0, 2.0, 4.0, 5.0]
+    assert retry_policy.get_delay(ValueError("Invalid JSON"), 3) == 0.0
+    assert retry_policy.get_delay(ProviderError(429, headers={'retry-after': '10'}), 1) == 10.0
+    jittered = RetryPolicy(base_delay_seconds=1.0, seed=0)
+    assert all(0 <= jittered.get_delay(ProviderError(503), 3) <= 4.0 for _ in range(20))
+
+
+def test_fatal_errors_and_exhausted_attempts_are_not_retried():
+    retry_policy = RetryPolicy(jitter=False)
+    assert retry_policy.wait_before_retry(ValueError("Invalid JSON"), 1, 3)
+    assert not retry_policy.wait_before_retry(ValueError("Invalid JSON"), 3, 3)
+    assert not retry_policy.wait_before_retry(ProviderError(400), 1, 3)
+
+
+def test_circuit_breaker_opens_on_an_error_spike():
+    circuit_breaker = CircuitBreaker(window_size=4, min_calls=4, cooldown_seconds=60, verbose=False)
+    for success in [True, False, True]:
+        circuit_breaker.record(success)
+    assert circuit_breaker.get_state() == 'closed'
+    circuit_breaker.record(False)
+    assert circuit_breaker.get_state() == 'open'
+    assert circuit_breaker.get_wait_seconds() > 0
+
+    # After the cooldown, the first result decides
+    circuit_breaker.open_until = 0.0
+    assert circuit_breaker.get_state() == 'half_open'
+    circuit_breaker.record(False)
+    assert circuit_breaker.get_state() == 'open'
+    circuit_breaker.open_until = 0.0
+    circuit_breaker.record(True)
+    assert circuit_breaker.get_state() == 'closed'
+    assert circuit_breaker.metrics['openings'] == 2
+
+
+def test_rate_limits_pause_the_shared_circuit_breaker():
+    circuit_breaker = CircuitBreaker(verbose=False)
+    retry_policy = RetryPolicy(jitter=False, circuit_breaker=circuit_breaker)
+    retry_policy.get_delay(ProviderError(429, headers={'retry-after': '30'}), 1)
+    assert 29 < circuit_breaker.get_wait_seconds() <= 30
+    assert circuit_breaker.get_state() == 'open' and circuit_breaker.metrics == {'openings': 0, 'pauses': 1}
@@ -0,0 +1,65 @@
+import asyncio
+from src.SimulatedLLM import SimulatedLLM, SimulatedRateLimitError
+
+
+PROMPTS = ["Extract a set of rules to fill the free text fields", "Extracted pipeline:"]
+
+
+def create_llm(seed):
+    return SimulatedLLM(seed=seed, rate_limit_rate=0.2, timeout_rate=0.2, malformed_rate=0.3, timeout_seconds=5, time_scale=0)
+
+
+def get_outcomes(llm, num_calls=40):
+    """
+    Call the language model, and get the response text or the error type of each call.
+    """
+    outcomes = []
+    for index in range(num_calls):
+        try:
+            outcomes.append(llm.invoke(PROMPTS[index % len(PROMPTS)]).content)
+        except Exception as ex:
+            outcomes.append(type(ex).__name__)
+    return outcomes
+
+
+def test_the_injected_faults_are_reproducible_with_a_seed():
+    first_llm, second_llm = create_llm(seed=7), create_llm(seed=7)
+    outcomes = get_outcomes(first_llm)
+    assert get_outcomes(second_llm) == outcomes
+    assert first_llm.get_metrics() == second_llm.get_metrics()
+    # All the fault types are injected
+    metrics = first_llm.get_metrics()
+    assert metrics['calls'] == 40 and min(metrics['rate_limit_errors'], metrics['timeout_errors'], metrics['malformed_outputs']) > 0
+    assert {'SimulatedRateLimitError', 'SimulatedTimeoutError'} <= set(outcomes)
+    # The timed out calls are counted in the simulated time, without waiting
+    assert metrics['simulated_seconds'] >= 5 * metrics['timeout_errors']
+
+    assert get_outcomes(create_llm(seed=8)) != outcomes
+    # Streamed calls draw the same faults and outputs as the other calls
+    streamed_llm = create_llm(seed=7)
+    streamed_outcomes = []
+    for index in range(40):
+        try:
+            streamed_outcomes.append(''.join(chunk.content for chunk in streamed_llm.stream(PROMPTS[index % len(PROMPTS)])))
+        except Exception as ex:
+            streamed_outcomes.append(type(ex).__name__)
+    assert streamed_outcomes == outcomes
+
+
+def test_calls_beyond_the_concurrency_limit_are_rejected():
+    llm = SimulatedLLM(seed=0, max_concurrent_requests=1, latency_mean_seconds=0.05, tokens_per_second=0)
+
+    async def call(prompt):
+        try:
+            return (await llm.ainvoke(prompt)).content
+        except SimulatedRateLimitError as ex:
+            return ex
+
+    async def call_concurrently():
+        return await asyncio.gather(*[call(PROMPTS[1]) for _ in range(3)])
+
+    results = asyncio.run(call_concurrently())
+    assert sum(isinstance(result, SimulatedRateLimitError) for result in results) == 2
+    assert llm.get_metrics()['rate_limit_errors'] == 2
+    # The slot is released after the call
+    assert asyncio.run(call(PROMPTS[1])) == llm.pipeline_name
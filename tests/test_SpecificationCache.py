@@ -0,0 +1,55 @@
+import subprocess
+import sys
+from src.SpecificationCache import SpecificationCache
+
+DESCRIPTION = "A database for an online shop with customers, orders, products and reviews"
+
+
+def test_exact_and_near_duplicate_lookups():
+    cache = SpecificationCache()
+    cache.put(DESCRIPTION, 'specifications', score=90)
+    exact = cache.get("a database for an ONLINE shop with customers orders products and reviews!")
+    assert (exact['match'], exact['task_specifications'], exact['score']) == ('exact', 'specifications', 90)
+    near = cache.get("A database for an online shop with customers, orders, products, and product reviews")
+    assert near['match'] == 'near' and 0.9 <= near['similarity'] < 1.0
+    refine = cache.get("A database for a shop with customers, orders and products")
+    assert refine['match'] == 'refine' and 0.6 <= refine['similarity'] < 0.9
+    assert cache.get("Tweets about a new smartphone launch") is None
+    metrics = cache.get_metrics()
+    assert (metrics['hits'], metrics['near_hits'], metrics['refine_hits'], metrics['misses']) == (1, 1, 1, 1)
+    assert metrics['hit_rate'] == 0.5
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SpecificationCache(max_entries=2)
+    cache.put("customer support emails", 'a')
+    cache.put("hospital patients and visits", 'b')
+    cache.get("customer support emails")
+    cache.put("tweets about a smartphone launch", 'c')
+    assert [entry['task_specifications'] for entry in cache.entries.values()] == ['a', 'c']
+    assert cache.get_metrics()['evictions'] == 1
+
+
+def test_size_limit():
+    cache = SpecificationCache(max_size_bytes=10)
+    cache.put("first description", 'x' * 8)
+    cache.put("second description", 'y' * 8)
+    assert list(cache.entries) == ['second description']
+    assert cache.size_bytes == 8
+
+
+def test_persistence(tmp_path):
+    file_path = str(tmp_path / 'cache.json')
+    cache = SpecificationCache(file_path=file_path)
+    cache.put(DESCRIPTION, 'specifications', errors=['missing prices'])
+    loaded = SpecificationCache(file_path=file_path)
+    entry = loaded.get(DESCRIPTION)
+    assert (entry['match'], entry['errors']) == ('exact', ['missing prices'])
+    # The signatures use fixed hash parameters, so near duplicates are found across sessions
+    assert loaded.get("A database for an online shop with customers, orders, products, and product reviews")['match'] == 'near'
+
+
+def test_import_does_not_load_numpy():
+    code = "import sys, src.SpecificationCache\nprint('numpy' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == 'False'
@@ -0,0 +1,148 @@
+import pandas as pd
+import pytest
+from src.SpecificationSampler import SpecificationSampler, validate_structured_specifications, apply_structured_specification_patch, \
+    diff_structured_specifications, is_empty_diff
+
+
+def create_schema():
+    return {'tables': [
+        {'name': 'customers', 'primary_key': 'customer_id', 'columns': [
+            {'name': 'customer_id', 'type': 'id', 'start': 1},
+            {'name': 'birth', 'type': 'datetime', 'min': '1950-01-01', 'max': '1959-12-31', 'format': '%Y-%m-%d'},
+            {'name': 'signup', 'type': 'datetime', 'min': '2020-01-01', 'max': '2020-12-31', 'format': '%Y-%m-%d',
+             'after': 'birth', 'interval_mean_days': 10, 'interval_std_days': 1},
+            {'name': 'score', 'type': 'float', 'distribution': 'uniform', 'min': 0, 'max': 1, 'decimals': None},
+            {'name': 'segment', 'type': 'categorical', 'categories': ['a', 'b'], 'probabilities': [0.5, 0.5]}]},
+        {'name': 'orders', 'primary_key': 'order_id', 'columns': [
+            {'name': 'order_id', 'type': 'id', 'prefix': 'O', 'width': 4},
+            {'name': 'customer_id', 'type': 'foreign_key', 'references': 'customers.customer_id'},
+            {'name': 'ordered_at', 'type': 'datetime', 'min': '2021-01-01', 'max': '2021-12-31', 'format': '%Y-%m-%d',
+             'after': 'customers.birth', 'interval_mean_days': 5, 'interval_std_days': 1},
+            {'name': 'quantity', 'type': 'integer', 'mean': 3, 'std': None, 'min': 1, 'max': 10}]}]}
+
+
+def test_generate_tables():
+    tables = SpecificationSampler(create_schema(), seed=0).generate({'customers': 20, 'orders': 50})
+    assert list(tables) == ['customers', 'orders']
+    assert len(tables['customers']) == 20 and len(tables['orders']) == 50
+    assert tables['customers']['customer_id'].tolist() == list(range(1, 21))
+    assert tables['orders']['order_id'].iloc[0] == 'O0001'
+    assert tables['orders']['customer_id'].isin(tables['customers']['customer_id']).all()
+    assert tables['orders']['quantity'].between(1, 10).all()
+    assert tables['customers']['score'].between(0, 1).all()
+
+
+def test_generate_is_reproducible_with_a_seed():
+    first = SpecificationSampler(create_schema()).generate({'customers': 5, 'orders': 5}, seed=1)
+    second = SpecificationSampler(create_schema()).generate({'customers': 5, 'orders': 5}, seed=1)
+    for table_name in first:
+        pd.testing.assert_frame_equal(first[table_name], second[table_name])
+
+
+def test_datetimes_after_a_reference_before_1970():
+    tables = SpecificationSampler(create_schema(), seed=0).generate({'customers': 20, 'orders': 20})
+    customers = tables['customers']
+    birth = pd.to_datetime(customers['birth'])
+    signup = pd.to_datetime(customers['signup'])
+    # The signup follows the birth by about 10 days, instead of being sampled in 2020
+    assert ((signup - birth).dt.days.between(5, 15)).all()
+    ordered_at = pd.to_datetime(tables['orders']['ordered_at'])
+    parent_birth = tables['orders']['customer_id'].map(dict(zip(customers['customer_id'], birth)))
+    assert ((ordered_at - parent_birth).dt.days.between(1, 10)).all()
+
+
+def test_update_tables_with_reference_before_1970():
+    sampler = SpecificationSampler(create_schema(), seed=0)
+    tables = sampler.generate({'customers': 10, 'orders': 10})
+    updated = sampler.update_tables(tables, {'customers': {'signup'}})
+    days = (pd.to_datetime(updated['customers']['signup']) - pd.to_datetime(updated['customers']['birth'])).dt.days
+    assert days.between(5, 15).all()
+    assert updated['customers']['birth'].tolist() == tables['customers']['birth'].tolist()
+
+
+def test_null_numeric_keys_use_the_defaults():
+    schema = create_schema()
+    schema['tables'][0]['columns'].append({'name': 'weight', 'type': 'float', 'mean': 70, 'std': None, 'decimals': None,
+                                           'min': None, 'max': None, 'null_fraction': None})
+    assert validate_structured_specifications(schema) == []
+    weights = SpecificationSampler(schema, seed=0).generate({'customers': 10, 'orders': 1})['customers']['weight']
+    assert weights.notna().all()
+    assert (weights.round(2) == weights).all()
+
+
+def test_validate_reports_invalid_specifications():
+    schema = create_schema()
+    schema['tables'][1]['columns'][1]['references'] = 'clients.id'
+    schema['tables'][1]['columns'][3]['mean'] = 'many'
+    errors = validate_structured_specifications(schema)
+    assert "orders.customer_id: unknown reference 'clients.id'" in errors
+    assert "orders.quantity: 'mean' must be a number" in errors
+    with pytest.raises(ValueError):
+        SpecificationSampler(schema)
+
+
+def test_patch_and_diff():
+    schema = create_schema()
+    patch = {'tables': [{'name': 'orders', 'columns': [{'name': 'quantity', 'type': 'integer', 'min': 1, 'max': 3},
+                                                       {'name': 'ordered_at', 'remove': True}]}]}
+    patched = apply_structured_specification_patch(schema, patch)
+    assert schema == create_schema()
+    diff = diff_structured_specifications(schema, patched)
+    assert diff['changed_columns'] == {'orders': ['quantity']}
+    assert diff['removed_columns'] == {'orders': ['ordered_at']}
+    assert is_empty_diff(diff_structured_specifications(schema, schema))
+
+
+def test_datetime_reference_through_a_duplicated_parent_key():
+    schema = {'tables': [
+        {'name': 'customers', 'primary_key': 'cid', 'columns': [
+            {'name': 'cid', 'type': 'integer', 'min': 1, 'max': 3},
+            {'name': 'signup', 'type': 'datetime', 'min': '2020-01-01', 'max': '2020-12-31', 'format': '%Y-%m-%d'}]},
+        {'name': 'orders', 'primary_key': 'order_id', 'columns': [
+            {'name': 'order_id', 'type': 'id'},
+            {'name': 'customer_id', 'type': 'foreign_key', 'references': 'customers.cid'},
+            {'name': 'ordered_at', 'type': 'datetime', 'min': '2021-01-01', 'max': '2021-12-31', 'format': '%Y-%m-%d',
+             'after': 'customers.signup', 'interval_mean_days': 5, 'interval_std_days': 1}]}]}
+    assert validate_structured_specifications(schema) == []
+    tables = SpecificationSampler(schema, seed=0).generate({'customers': 20, 'orders': 20})
+    customers = tables['customers'].drop_duplicates('cid')
+    parent_signup = tables['orders']['customer_id'].map(dict(zip(customers['cid'], pd.to_datetime(customers['signup']))))
+    assert ((pd.to_datetime(tables['orders']['ordered_at']) - parent_signup).dt.days.between(0, 10)).all()
+
+
+def test_only_the_invalidated_columns_are_regenerated_after_a_patch():
+    schema = create_schema()
+    sampler = SpecificationSampler(schema, seed=0)
+    tables = sampler.generate({'customers': 10, 'orders': 30})
+
+    patched = apply_structured_specification_patch(schema, {'tables': [{'name': 'customers', 'columns': [
+        {'name': 'segment', 'type': 'categorical', 'categories': ['c', 'd'], 'probabilities': [0.5, 0.5]}]}]})
+    sampler = SpecificationSampler(patched, seed=1)
+    invalidated_columns = sampler.get_invalidated_columns(diff_structured_specifications(schema, patched))
+    assert invalidated_columns == {'customers': {'segment'}}
+    updated = sampler.update_tables(tables, invalidated_columns)
+    assert set(updated['customers']['segment']) <= {'c', 'd'}
+    pd.testing.assert_frame_equal(updated['customers'].drop(columns='segment'), tables['customers'].drop(columns='segment'))
+    pd.testing.assert_frame_equal(updated['orders'], tables['orders'])
+
+
+def test_the_dependent_columns_are_invalidated_transitively():
+    schema = create_schema()
+    tables = SpecificationSampler(schema, seed=0).generate({'customers': 10, 'orders': 30})
+    patched = apply_structured_specification_patch(schema, {'tables': [{'name': 'customers', 'columns': [
+        {'name': 'birth', 'type': 'datetime', 'min': '1980-01-01', 'max': '1989-12-31', 'format': '%Y-%m-%d'}]}]})
+    sampler = SpecificationSampler(patched, seed=1)
+    # The datetimes that follow the birth, in the same table and through the foreign key
+    invalidated_columns = sampler.get_invalidated_columns(diff_structured_specifications(schema, patched))
+    assert invalidated_columns == {'customers': {'birth', 'signup'}, 'orders': {'ordered_at'}}
+    updated = sampler.update_tables(tables, invalidated_columns)
+    assert pd.to_datetime(updated['customers']['birth']).dt.year.between(1980, 1989).all()
+    for table_name, columns in [('customers', ['customer_id', 'score', 'segment']), ('orders', ['order_id', 'customer_id', 'quantity'])]:
+        pd.testing.assert_frame_equal(updated[table_name][columns], tables[table_name][columns])
+
+    # A resized parent table is sampled again, with the foreign keys that reference it
+    invalidated_columns = sampler.get_invalidated_columns(diff_structured_specifications(patched, patched), resized_tables=['customers'])
+    assert invalidated_columns == {'customers': {'customer_id', 'birth', 'signup', 'score', 'segment'}, 'orders': {'customer_id', 'ordered_at'}}
+    resized = sampler.update_tables(updated, invalidated_columns, table_sizes={'customers': 5})
+    assert len(resized['customers']) == 5 and resized['orders']['customer_id'].isin(resized['customers']['customer_id']).all()
+    pd.testing.assert_frame_equal(resized['orders'][['order_id', 'quantity']], updated['orders'][['order_id', 'quantity']])
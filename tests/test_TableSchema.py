@@ -0,0 +1,41 @@
+import pandas as pd
+from src.OutputSink import OutputCollector
+from src.TableSchema import TableSchema, infer_column_type
+
+
+def test_infer_column_type():
+    assert infer_column_type(pd.Series([1, 2, None])) == 'int'
+    assert infer_column_type(pd.Series([1.5, 2.0])) == 'float'
+    assert infer_column_type(pd.Series([True, False])) == 'bool'
+    assert infer_column_type(pd.Series(['2024-01-31', '2024-02-01 10:30'])) == 'datetime'
+    assert infer_column_type(pd.Series(['new', 'paid', 'new', 'new'])) == 'category'
+    assert infer_column_type(pd.Series(['May', 'June'])) == 'string'
+    assert infer_column_type(pd.Series([None, ''])) is None
+
+
+def test_batches_are_coerced_to_the_inferred_types():
+    schema = TableSchema.infer({'orders': pd.DataFrame({'id': [1, 2], 'paid': [True, False], 'created_at': ['2024-01-31', '2024-02-01']})})
+    batch = schema.coerce('orders', pd.DataFrame({'id': ['3', 'four', 5.0], 'paid': ['yes', 'no', 'maybe'],
+                                                  'created_at': ['2024-03-01', 'soon', None], 'note': ['a', 'b', 'c']}))
+    assert batch['id'].dtype == 'Int64' and batch['id'].tolist() == [3, pd.NA, 5]
+    assert batch['paid'].dtype == 'boolean' and batch['paid'].tolist() == [True, False, pd.NA]
+    assert str(batch['created_at'].dtype) == 'datetime64[ns]' and batch['created_at'].isna().tolist() == [False, True, True]
+    assert batch['note'].tolist() == ['a', 'b', 'c']
+    # Missing values are not counted as nonconforming
+    assert schema.get_nonconforming_counts() == {'orders': {'id': 1, 'paid': 1, 'created_at': 1}}
+
+
+def test_categorical_columns_stay_categorical_when_concatenated():
+    schema = TableSchema({'orders': {'status': 'category'}})
+    collector = OutputCollector(schema=schema)
+    collector.add({'orders': pd.DataFrame({'status': ['new', 'paid']})})
+    collector.add({'orders': pd.DataFrame({'status': ['shipped', None]})})
+    status = collector.get_tables()['orders']['status']
+    assert isinstance(status.dtype, pd.CategoricalDtype)
+    assert status.tolist()[:3] == ['new', 'paid', 'shipped'] and pd.isna(status.tolist()[3])
+
+    schema = TableSchema({'orders': {'status': 'category'}}, max_categories=2)
+    table = schema.concat([schema.coerce('orders', pd.DataFrame({'status': ['new', 'paid']})),
+                           schema.coerce('orders', pd.DataFrame({'status': ['shipped']}))])
+    assert not isinstance(table['status'].dtype, pd.CategoricalDtype)
+    assert table['status'].tolist() == ['new', 'paid', 'shipped']
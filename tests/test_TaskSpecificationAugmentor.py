@@ -0,0 +1,53 @@
+import asyncio
+import contextlib
+import io
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from src.TaskSpecificationAugmentor import TaskSpecificationAugmentor
+
+
+def create_augmentor(candidates, responses=None):
+    """
+    Get an augmentor whose candidates are given as pairs of (delay, score), a score of None for a failed candidate.
+    The language model (with the given responses) is only used for the autocorrection.
+    """
+    augmentor = TaskSpecificationAugmentor(FakeListChatModel(responses=responses or ['']), verbose=False)
+    cancelled = []
+
+    async def generate_candidate(max_trials=3):
+        index = len(augmentor.started)
+        augmentor.started.append(index)
+        delay, score = candidates[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        if score is None:
+            return None
+        return {'task_specifications': f"candidate {index}", 'score': score, 'errors': [f"gap {index}"]}
+
+    augmentor.started = []
+    augmentor.agenerate_candidate = generate_candidate
+    return augmentor, cancelled
+
+
+def test_the_first_candidate_reaching_the_threshold_wins_and_the_others_are_cancelled():
+    augmentor, cancelled = create_augmentor([(5.0, 100), (0.01, 60), (0.02, 95), (5.0, 100)])
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidate = augmentor.generate_specifications_best_of_n("An online shop", num_candidates=4, score_threshold=90)
+    assert candidate == {'task_specifications': "candidate 2", 'score': 95, 'errors': ["gap 2"]}
+    assert sorted(cancelled) == [0, 3]
+
+
+def test_the_best_candidate_is_autocorrected_below_the_threshold():
+    responses = ["corrected candidate", '{"score": 100, "errors": []}']
+    augmentor, cancelled = create_augmentor([(0.01, 70), (0.02, None), (0.03, 80)], responses=responses)
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidate = augmentor.generate_specifications_best_of_n("An online shop", num_candidates=3, score_threshold=100)
+    # The failed candidate is skipped, and only the best candidate is corrected
+    assert candidate == {'task_specifications': "corrected candidate", 'score': 100, 'errors': []}
+    assert cancelled == []
+
+    augmentor, cancelled = create_augmentor([(0.01, None), (0.01, None)])
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert augmentor.generate_specifications_best_of_n("An online shop", num_candidates=2) is None
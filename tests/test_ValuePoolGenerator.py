@@ -0,0 +1,78 @@
+import contextlib
+import io
+import json
+import re
+import pandas as pd
+from langchain_core.language_models.chat_models import SimpleChatModel
+from src.DataGenerationPipeline import DataGenerationPipeline
+from src.SimulatedLLM import SimulatedLLM
+from src.ValuePoolGenerator import ValuePoolGenerator
+
+
+class PoolModel(SimpleChatModel):
+    """
+    Returns the requested number of values (at most max_values), prefixed with the bucket of the prompt's context.
+    """
+
+    max_values: int = 1000
+    requests: list = []
+
+    @property
+    def _llm_type(self):
+        return "pool-model"
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        pool_size = int(re.search(r"Generate (\d+) distinct", prompt).group(1))
+        bucket = re.search(r"context: (?:\w+ = (\w+))?", prompt).group(1) or 'common'
+        self.requests.append((bucket, pool_size))
+        start = len(self.requests) * 1000
+        return json.dumps([f"{bucket} {start + index}" for index in range(min(pool_size, self.max_values))])
+
+
+def test_pools_are_topped_up_to_respect_the_reuse_limit():
+    llm = PoolModel(max_values=3)
+    generator = ValuePoolGenerator(llm, pool_size=3, max_value_reuse=2, seed=0, verbose=False)
+    table = generator.fill_table(pd.DataFrame({'id': range(10), 'review': ''}), 'reviews', ['review'], "Product reviews")
+    # 3 values cannot cover 10 records used at most twice each, so 2 more values are requested
+    assert llm.requests == [('common', 3), ('common', 2)]
+    counts = table['review'].value_counts()
+    assert len(counts) == 5 and counts.max() <= 2
+
+
+def test_sample_values_reuse_limit():
+    generator = ValuePoolGenerator(PoolModel(), seed=0, verbose=False)
+    values = generator.sample_values(['a', 'b', 'c'], 6, max_value_reuse=2)
+    assert sorted(values) == ['a', 'a', 'b', 'b', 'c', 'c']
+    # A pool too small for the limit is spread evenly
+    assert pd.Series(generator.sample_values(['a', 'b'], 7, max_value_reuse=2)).value_counts().tolist() == [4, 3]
+    assert generator.sample_values([], 2).tolist() == ['', '']
+
+
+def test_dedicated_pools_per_bucket():
+    llm = PoolModel()
+    generator = ValuePoolGenerator(llm, pool_size=4, max_buckets=1, seed=0, verbose=False)
+    table = pd.DataFrame({'segment': ['retail'] * 6 + ['business'] * 3 + ['public'], 'bio': ''})
+    table = generator.fill_table(table, 'customers', ['bio'], "Customers", bucket_field='segment')
+    assert sorted(llm.requests) == [('common', 4), ('retail', 4)]
+    # The most common segment has its own pool, and the other segments share the common pool
+    assert table['bio'][table['segment'] == 'retail'].str.startswith('retail ').all()
+    assert table['bio'][table['segment'] != 'retail'].str.startswith('common ').all()
+
+
+def test_the_pipeline_forwards_the_bucket_fields(monkeypatch):
+    contexts = []
+    agenerate_pool = ValuePoolGenerator.agenerate_pool
+
+    async def record_pool_request(self, description, table_name, field_name, context='', pool_size=None, max_trials=3):
+        contexts.append((table_name, context))
+        return await agenerate_pool(self, description, table_name, field_name, context, pool_size, max_trials)
+
+    monkeypatch.setattr(ValuePoolGenerator, 'agenerate_pool', record_pool_request)
+    pipeline = DataGenerationPipeline(SimulatedLLM(seed=1, time_scale=0))
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline.extract_sample_data("a relational database for an online shop with customers and orders")
+        tables = pipeline.generate_data(tables_size_dict={'customers': 20, 'orders': 20}, enhancement_mode='pool',
+                                        pool_bucket_fields_dict={'customers': 'segment'})
+    segments = set(tables['customers']['segment'])
+    assert {context for table_name, context in contexts if table_name == 'customers'} == {f"segment = {segment}" for segment in segments}
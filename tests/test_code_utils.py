@@ -0,0 +1,85 @@
+import ast
+import numpy as np
+import pandas as pd
+import pytest
+from src.utils.code_utils import compile_generation_code, normalize_generation_code, seed_generation
+
+
+LEGACY_CODE = """```python
+import pandas as pd
+import numpy as np
+
+num_customers = 10
+num_orders = num_customers * 3
+rows = []
+
+def make_customer(i):
+    return {'customer_id': i, 'name': '', 'age': int(np.random.randint(18, 90))}
+
+for i in range(1, num_customers + 1):
+    rows.append(make_customer(i))
+customers = pd.DataFrame(rows)
+orders = pd.DataFrame({'order_id': range(1, num_orders + 1),
+                       'customer_id': np.random.choice(customers['customer_id'], num_orders),
+                       'amount': np.random.rand(num_orders) * 100})
+results_dict = {'customers': customers, 'orders': orders}
+table_size_param_dict = {'customers': 'num_customers', 'orders': 'num_orders'}
+override_fields_dict = {'customers': ['name']}
+primary_keys_dict: dict = {'customers': 'customer_id', 'orders': 'order_id'}
+```"""
+
+
+def generate(code, table_sizes=None, seed=None):
+    namespace = compile_generation_code(normalize_generation_code(code))
+    seed_generation(seed)
+    return namespace, namespace['generate'](dict(table_sizes or {}), seed)
+
+
+def test_a_legacy_script_is_wrapped_into_a_generate_function():
+    normalized_code = normalize_generation_code(LEGACY_CODE)
+    tree = ast.parse(normalized_code)
+    # The imports stay at module level and everything else moves into the function
+    assert [type(node) for node in tree.body] == [ast.Import, ast.Import, ast.FunctionDef]
+    assert tree.body[-1].name == 'generate' and [arg.arg for arg in tree.body[-1].args.args] == ['table_sizes', 'seed']
+    assert "num_customers = table_sizes.get('customers', 10)" in normalized_code
+    assert "num_orders = table_sizes.get('orders', num_customers * 3)" in normalized_code
+    # A code that already defines the function only has its metadata declared global
+    code = "def generate(table_sizes, seed=None):\n    results_dict = {}\n    primary_keys_dict = {}\n    return results_dict"
+    assert "global results_dict, primary_keys_dict" in normalize_generation_code(code)
+
+
+def test_the_requested_table_sizes_are_respected():
+    namespace, tables = generate(LEGACY_CODE)
+    assert (len(tables['customers']), len(tables['orders'])) == (10, 30)
+    # The metadata dictionaries are module level names after the call
+    assert namespace['primary_keys_dict'] == {'customers': 'customer_id', 'orders': 'order_id'}
+
+    tables = generate(LEGACY_CODE, {'customers': 4})[1]
+    assert (len(tables['customers']), len(tables['orders'])) == (4, 12)
+    tables = generate(LEGACY_CODE, {'customers': 5, 'orders': 7})[1]
+    assert (len(tables['customers']), len(tables['orders'])) == (5, 7)
+    assert tables['orders']['customer_id'].isin(tables['customers']['customer_id']).all()
+
+
+def test_the_cached_namespace_does_not_carry_state_between_calls():
+    namespace, first_tables = generate(LEGACY_CODE, seed=3)
+    expected_tables = {table_name: table.copy() for table_name, table in first_tables.items()}
+    # Changes to the returned tables and to the module level names do not leak into the next call
+    first_tables['customers'].loc[:, 'name'] = 'changed'
+    namespace['rows'].append({'customer_id': 0})
+    cached_namespace, second_tables = generate(LEGACY_CODE, seed=3)
+    assert cached_namespace is namespace
+    assert second_tables['customers'] is not first_tables['customers']
+    for table_name, table in expected_tables.items():
+        pd.testing.assert_frame_equal(second_tables[table_name], table)
+
+    # Different seeds and sizes give different tables from the same compiled code
+    third_tables = generate(LEGACY_CODE, {'customers': 3}, seed=4)[1]
+    assert len(third_tables['customers']) == 3
+    assert not np.array_equal(third_tables['orders']['amount'].to_numpy(), expected_tables['orders']['amount'].to_numpy()[:9])
+    pd.testing.assert_frame_equal(generate(LEGACY_CODE, seed=3)[1]['orders'], expected_tables['orders'])
+
+
+def test_code_without_a_generate_function_is_rejected():
+    with pytest.raises(ValueError):
+        compile_generation_code("results_dict = {}")
@@ -0,0 +1,26 @@
+import math
+import pytest
+from src.utils import json_backend
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def backend(request):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    yield json_backend.set_json_backend(request.param)
+    json_backend.set_json_backend()
+
+
+def test_values_only_the_standard_library_accepts(backend):
+    assert json_backend.get_json_backend() == backend
+    assert json_backend.loads('{"a": [1, "é", null]}') == {'a': [1, 'é', None]}
+    assert math.isnan(json_backend.loads('[NaN]')[0])
+    assert json_backend.loads('[123456789012345678901234567890]') == [123456789012345678901234567890]
+    assert json_backend.dumps({1: 'é', 'b': [True, None]}) == '{"1":"é","b":[true,null]}'
+    with pytest.raises(ValueError):
+        json_backend.loads('{"a": ')
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        json_backend.set_json_backend('simplejson')
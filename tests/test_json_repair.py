@@ -0,0 +1,31 @@
+import pytest
+from src.utils.json_repair import JSONRepairError, salvage_json, strip_json_wrapping
+
+
+def test_bracketed_prose_before_the_json_is_skipped():
+    text = 'Here are [10] records:\n[{"id": 1}, {"id": 2}]'
+    assert salvage_json(text) == ([{'id': 1}, {'id': 2}], False)
+    assert strip_json_wrapping(text) == '[{"id": 1}, {"id": 2}]'
+    assert salvage_json('Result {x}: {"orders": [{"id": 1}], }') == ({'orders': [{'id': 1}]}, False)
+
+
+def test_json_without_prose():
+    assert salvage_json('[1, 2]') == ([1, 2], False)
+    assert salvage_json('{"a": [10]}') == ({'a': [10]}, False)
+
+
+def test_common_defects_are_repaired():
+    text = "```json\n[{'id': 1, name: 'A', 'active': True,}, // comment\n {'id': 2 'name': None}]\n```"
+    assert salvage_json(text) == ([{'id': 1, 'name': 'A', 'active': True}, {'id': 2, 'name': None}], False)
+
+
+def test_doubled_single_quotes_are_escaped_quotes():
+    assert salvage_json("{'note': 'it''s', 'empty': ''}") == ({'note': "it's", 'empty': ''}, False)
+
+
+def test_truncated_records_are_dropped():
+    assert salvage_json('[{"id": 1}, {"id": 2}, {"id": 3, "na') == ([{'id': 1}, {'id': 2}], True)
+    with pytest.raises(JSONRepairError):
+        salvage_json('[{"id": 1}, {"id": 2, "na', allow_truncated=False)
+    with pytest.raises(JSONRepairError):
+        salvage_json('No records could be generated.')
@@ -0,0 +1,53 @@
+import json
+from src.utils.json_stream import StreamingRecordParser, records_to_json
+
+
+def feed_in_chunks(text, chunk_size=3):
+    parser = StreamingRecordParser()
+    records = []
+    for start in range(0, len(text), chunk_size):
+        records.extend(parser.feed(text[start:start + chunk_size]))
+    return parser, records
+
+
+def test_records_array_in_chunks():
+    parser, records = feed_in_chunks('[{"id": 1, "name": "a [b]"}, {"id": 2, "name": "c}"}]')
+    assert records == [(None, {'id': 1, 'name': 'a [b]'}), (None, {'id': 2, 'name': 'c}'})]
+    assert parser.finished and parser.num_records == 2
+
+
+def test_object_of_tables():
+    text = '```json\n{"customers": [{"id": 1}], "orders": [{"id": 10, "items": [1, 2]}, {"id": 11}]}\n```'
+    parser, records = feed_in_chunks(text)
+    assert records == [('customers', {'id': 1}), ('orders', {'id': 10, 'items': [1, 2]}), ('orders', {'id': 11})]
+    assert json.loads(records_to_json(records)) == {'customers': [{'id': 1}], 'orders': [{'id': 10, 'items': [1, 2]}, {'id': 11}]}
+
+
+def test_columnar_tables():
+    parser, records = feed_in_chunks('{"orders": {"columns": ["id", "amount"], "data": [[1, 2.5], [2, 3.0]]}}')
+    assert records == [('orders', {'id': 1, 'amount': 2.5}), ('orders', {'id': 2, 'amount': 3.0})]
+
+
+def test_truncated_output_keeps_the_complete_records():
+    parser, records = feed_in_chunks('[{"id": 1}, {"id": 2}, {"id": 3, "na')
+    assert [record['id'] for _, record in records] == [1, 2]
+    assert not parser.finished
+
+
+def test_bracketed_prose_before_the_json_is_skipped():
+    parser, records = feed_in_chunks('Here are [10] records (see {note}):\n[\n  {"id": 1},\n  {"id": 2}\n]', chunk_size=1)
+    assert [record['id'] for _, record in records] == [1, 2]
+    assert parser.finished
+
+
+def test_prose_before_an_object_of_tables():
+    parser, records = feed_in_chunks('Sure! [2 tables]\n{"customers": [{"id": 1}]} Done [ok].')
+    assert records == [('customers', {'id': 1})]
+
+
+def test_invalid_records_are_counted():
+    parser, records = feed_in_chunks('[{"id": 1}, 5, {"id": 2,}]')
+    assert [record['id'] for _, record in records] == [1, 2]
+    assert parser.num_invalid_records == 0
+    parser, records = feed_in_chunks('[[1, 2], {"id": 2}]')
+    assert records == [(None, {'id': 2})]
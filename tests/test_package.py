@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import src
+
+
+def test_imported_submodules_are_not_shadowed():
+    import src.DataValidator as module
+    from src.DataValidator import DataValidator
+    assert module.DataValidator is DataValidator
+    assert src.DataValidator is module
+
+
+def test_lazy_names():
+    from src import parse_json, create_output_sink
+    from src.utils.utils import parse_json as utils_parse_json
+    assert parse_json is utils_parse_json
+    assert callable(create_output_sink)
+    assert src.Pipeline.SQLToTabular == 'SQLToTabular'
+    assert set(src.__all__) <= set(dir(src))
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = "import sys, src\nprint(','.join(name for name in ['pandas', 'numpy', 'langchain'] if name in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=src.__path__[0] + '/..').stdout
+    assert output.strip() == ''
@@ -0,0 +1,58 @@
+import json
+import os
+import pandas as pd
+from src.utils.sampling import get_sampling_order, infer_foreign_keys, sample_csv, sample_related_dataframes
+from src.utils.utils import create_json_sample_from_csv_files, create_json_sample_from_dataframes_dictionary
+
+
+def create_tables(num_customers=50, num_orders=200):
+    customers = pd.DataFrame({'id': range(1, num_customers + 1), 'name': [f"Customer {index}" for index in range(1, num_customers + 1)]})
+    orders = pd.DataFrame({'order_id': range(1, num_orders + 1), 'customer_id': [index % num_customers + 1 for index in range(num_orders)],
+                           'amount': [index * 1.5 for index in range(num_orders)]})
+    return customers, orders
+
+
+def test_sample_csv_methods(tmp_path):
+    file_path = os.path.join(str(tmp_path), 'orders.csv')
+    create_tables()[1].to_csv(file_path, index=False)
+    for method in ['reservoir', 'seek']:
+        sample = sample_csv(file_path, num_samples=5, method=method, seed=0)
+        assert len(sample) == 5 and sample['order_id'].is_unique and sample['order_id'].is_monotonic_increasing
+        assert (sample['amount'] == (sample['order_id'] - 1) * 1.5).all()
+    assert len(sample_csv(file_path, num_samples=500, method='reservoir')) == 200
+    assert sample_csv(file_path, num_samples=5, seed=1).equals(sample_csv(file_path, num_samples=5, seed=1))
+
+
+def test_seek_sampling_skips_the_parts_of_multiline_fields(tmp_path):
+    file_path = os.path.join(str(tmp_path), 'reviews.csv')
+    pd.DataFrame({'id': range(100), 'text': [f"First line, {index}\nsecond line, {index}" for index in range(100)],
+                  'rating': [index % 5 for index in range(100)]}).to_csv(file_path, index=False)
+    for seed in range(5):
+        sample = sample_csv(file_path, num_samples=5, method='seek', seed=seed)
+        assert len(sample) == 5
+        assert (sample['text'] == "First line, " + sample['id'].astype(str) + "\nsecond line, " + sample['id'].astype(str)).all()
+        assert (sample['rating'] == sample['id'] % 5).all()
+
+
+def test_infer_foreign_keys():
+    columns_dict = {'customers.csv': ['id', 'name'], 'orders.csv': ['order_id', 'customer_id'], 'items.csv': ['id', 'order_id']}
+    assert infer_foreign_keys(columns_dict) == {'orders.csv.customer_id': 'customers.csv.id', 'items.csv.order_id': 'orders.csv.order_id'}
+    order, references = get_sampling_order(['items.csv', 'orders.csv', 'customers.csv'], infer_foreign_keys(columns_dict))
+    assert order == ['customers.csv', 'orders.csv', 'items.csv']
+    assert references['orders.csv'] == [('customer_id', 'customers.csv', 'id')]
+
+
+def test_related_samples_keep_the_foreign_keys_consistent(tmp_path):
+    customers, orders = create_tables()
+    samples = sample_related_dataframes({'orders': orders, 'customers': customers}, num_samples=5, seed=0)
+    assert list(samples) == ['orders', 'customers']
+    assert samples['orders']['customer_id'].isin(samples['customers']['id']).all()
+
+    independent = json.loads(create_json_sample_from_dataframes_dictionary({'customers': customers, 'orders': orders}, foreign_keys=None))
+    assert (len(independent['customers']), len(independent['orders'])) == (5, 5)
+
+    customers.to_csv(os.path.join(str(tmp_path), 'customers.csv'), index=False)
+    orders.to_csv(os.path.join(str(tmp_path), 'orders.csv'), index=False)
+    sample = json.loads(create_json_sample_from_csv_files(str(tmp_path), ['customers.csv', 'orders.csv'], seed=0))
+    customer_ids = [record['id'] for record in sample['customers.csv']]
+    assert len(sample['orders.csv']) == 5 and all(record['customer_id'] in customer_ids for record in sample['orders.csv'])
@@ -0,0 +1,44 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+from src.utils.utils import dataframes_dict_to_json, dataframes_dict_to_string, records_to_dataframe, sample_str_to_dataframes_dict, \
+    write_dataframes_dict
+
+
+def create_tables():
+    customers = pd.DataFrame({'id': [1, 2, 3], 'score': [1.5, np.nan, 2.25], 'name': ['Ann', None, 'Zoë'], 'active': [True, False, True],
+                              'signup': pd.to_datetime(['2024-01-01 10:00:00', None, '1960-05-01 00:00:00']),
+                              'visits': pd.array([1, None, 3], dtype='Int64'), 'segment': pd.Categorical(['a', None, 'b'])})
+    orders = pd.DataFrame({'order_id': [10], 'paid_at': pd.to_datetime(['2024-01-01 10:00:00+02:00'], utc=True),
+                           'delay': pd.to_timedelta(['2 days']), 'extra': pd.Series([np.int64(5)], dtype=object)})
+    return {'customers': customers, 'orders': orders}
+
+
+def dataframes_dict_to_string_before(sample_dict):
+    # The previous implementation, which concatenated the JSON strings of the tables
+    results = ''
+    for key, items in sample_dict.items():
+        json_sample = items.to_json(orient='records')
+        results = results + f'{{,"{key}": {json_sample}}}'[1:-1]
+    return '{' + results[1:] + '}'
+
+
+def test_records_missing_fields():
+    table = records_to_dataframe([{'id': 1, 'name': 'A'}, {'id': 2, 'note': 'new'}])
+    assert list(table.columns) == ['id', 'name', 'note']
+    assert table['name'].isna().tolist() == [False, True] and table['note'].isna().tolist() == [True, False]
+    tables = sample_str_to_dataframes_dict('{"orders": {"columns": ["id", "amount"], "data": [[1, 9.5], [2]]}}')
+    assert tables['orders']['id'].tolist() == [1, 2] and tables['orders']['amount'].isna().tolist() == [False, True]
+
+
+def test_serialization_matches_the_previous_output():
+    tables = create_tables()
+    expected = dataframes_dict_to_string_before(tables)
+    assert json.loads(dataframes_dict_to_string(tables)) == json.loads(expected)
+    stream = io.StringIO()
+    write_dataframes_dict(tables, stream)
+    assert json.loads(stream.getvalue()) == json.loads(expected)
+    # The records are built directly, with the values of the JSON string
+    assert dataframes_dict_to_json(tables) == json.loads(expected)
+    assert dataframes_dict_to_json({'empty': pd.DataFrame({'id': []})}) == {'empty': []}
@@ -0,0 +1,31 @@
+import json
+import pandas as pd
+import pytest
+from src.utils.wire_format import convert_wire_format, dataframe_to_wire_json, decode_wire_tables, encode_wire_tables
+
+RECORDS = [{'id': 1, 'name': 'A'}, {'id': 2, 'name': 'B', 'note': 'new'}]
+COLUMNAR = {'columns': ['id', 'name', 'note'], 'data': [[1, 'A', None], [2, 'B', 'new']]}
+
+
+def test_records_round_trip():
+    assert encode_wire_tables(RECORDS, 'columnar') == COLUMNAR
+    assert decode_wire_tables(COLUMNAR) == [{'id': 1, 'name': 'A', 'note': None}, {'id': 2, 'name': 'B', 'note': 'new'}]
+    assert encode_wire_tables({'customers': COLUMNAR, 'description': 'x'}, 'records')['customers'][1] == RECORDS[1]
+    with pytest.raises(ValueError):
+        encode_wire_tables(RECORDS, 'csv')
+
+
+def test_malformed_rows_are_repaired():
+    table = {'columns': ['id', 'name'], 'data': [[1], [2, 'B', 'extra'], 'not a row']}
+    assert decode_wire_tables(table) == [{'id': 1, 'name': None}, {'id': 2, 'name': 'B'}]
+
+
+def test_convert_wire_format():
+    assert json.loads(convert_wire_format(json.dumps({'customers': RECORDS}), 'columnar')) == {'customers': COLUMNAR}
+    assert convert_wire_format("A table of customers", 'columnar') == "A table of customers"
+
+
+def test_dataframe_to_wire_json():
+    input_df = pd.DataFrame({'id': [1, 2], 'name': ['A', 'B']})
+    assert json.loads(dataframe_to_wire_json(input_df)) == [{'id': 1, 'name': 'A'}, {'id': 2, 'name': 'B'}]
+    assert json.loads(dataframe_to_wire_json(input_df, 'columnar')) == {'columns': ['id', 'name'], 'data': [[1, 'A'], [2, 'B']]}